@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+from Driver import ELEVATED_STATUSES
+
+ALERT_COLLECTION = "alerts"
+POLL_SECONDS = 2                # how often streams look for alerts published by other processes
+TAIL_PAGE_SIZE = 100            # alerts read per query by a stream
+HEARTBEAT_SECONDS = 15          # keeps idle streams open through proxies
+
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def is_escalation(old_status: str, new_status: str) -> bool:
+    """True when a driver moves into an elevated status from a non-elevated one."""
+    return new_status in ELEVATED_STATUSES and old_status not in ELEVATED_STATUSES
+
+
+class AlertFeed:
+    """
+    Records status transitions into elevated states and streams them to live subscribers.
+    Alerts are persisted to the alerts collection, which streams tail, so a stream sees the
+    alerts of every process; publishes in this process only wake its streams up early.
+    """
+    def __init__(self, db_handler):
+        self._db = db_handler
+        self._subscribers: Dict[str, List[threading.Event]] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, user_id: str, driver_id: str, driver_name: str, old_status: str, new_status: str) -> Dict[str, Any]:
+        alert_id = uuid.uuid4().hex
+        alert = {
+            "alertId": alert_id,
+            "userId": user_id,
+            "driverId": driver_id,
+            "name": driver_name,
+            "fromStatus": old_status,
+            "toStatus": new_status,
+            "at": datetime.now(timezone.utc),
+        }
+        try:
+            self._db.set_document(ALERT_COLLECTION, alert_id, alert)
+        except Exception as e:
+            print(f"Error persisting alert for driver '{driver_id}': {e}")
+
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, []))
+        for subscriber in subscribers:
+            subscriber.set()
+        return alert
+
+    def recent(self, user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent alerts for a user, newest first."""
+        results = self._db.query_documents(ALERT_COLLECTION, [("userId", "==", user_id)],
+                                           order_by="at", descending=True, limit=limit)
+        return [alert for _, alert in results]
+
+    def subscribe(self, user_id: str) -> threading.Event:
+        """An event set whenever this process publishes an alert for the user."""
+        subscriber = threading.Event()
+        with self._lock:
+            self._subscribers.setdefault(user_id, []).append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user_id: str, subscriber: threading.Event):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id, [])
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            if not subscribers:
+                self._subscribers.pop(user_id, None)
+
+    def _start(self, user_id: str, last_event_id: Optional[str]) -> Tuple[Optional[datetime], Set[str]]:
+        """
+        Where a stream starts reading: after the alert a reconnecting client last received,
+        or after the newest alert for a new client (or an unknown ID).
+        """
+        alert = self._db.get_document(ALERT_COLLECTION, last_event_id) if last_event_id else {}
+        if alert.get("userId") != user_id:
+            newest = self.recent(user_id, limit=1)
+            alert = newest[0] if newest else {}
+        if not alert:
+            return None, set()
+        return alert["at"], {alert["alertId"]}
+
+    def _since(self, user_id: str, after: Optional[datetime]) -> List[Dict[str, Any]]:
+        filters = [("userId", "==", user_id)]
+        if after is not None:
+            # Inclusive, so alerts sharing the cursor's timestamp are not missed
+            filters.append(("at", ">=", after))
+        results = self._db.query_documents(ALERT_COLLECTION, filters, order_by="at", limit=TAIL_PAGE_SIZE)
+        return [alert for _, alert in results]
+
+    def stream(self, user_id: str, last_event_id: str = None):
+        """
+        Generator of Server-Sent Events for a user's alerts, with periodic heartbeats.
+        Each event's ID is the alert's, so a client that reconnects with it (EventSource
+        sends it as Last-Event-ID) resumes where it left off.
+        """
+        subscriber = self.subscribe(user_id)
+        try:
+            cursor, delivered = self._start(user_id, last_event_id)
+            yield ": connected\n\n"
+            last_sent = time.monotonic()
+            while True:
+                subscriber.clear()
+                alerts = [alert for alert in self._since(user_id, cursor) if alert["alertId"] not in delivered]
+                for alert in alerts:
+                    if alert["at"] != cursor:
+                        cursor, delivered = alert["at"], set()
+                    delivered.add(alert["alertId"])
+                    yield f"id: {alert['alertId']}\nevent: alert\ndata: {json.dumps(alert, default=_json_default)}\n\n"
+                    last_sent = time.monotonic()
+                if alerts:
+                    continue
+                subscriber.wait(POLL_SECONDS)
+                if time.monotonic() - last_sent >= HEARTBEAT_SECONDS:
+                    yield ": heartbeat\n\n"
+                    last_sent = time.monotonic()
+        finally:
+            self.unsubscribe(user_id, subscriber)
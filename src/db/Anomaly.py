@@ -0,0 +1,210 @@
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from Metrics import registry
+
+# Statuses the detector manages, least to most severe. Idle and LockedIn are only ever set by hand.
+SEVERITY = ["Stable", "Mild", "Unstable", "Severe", "Critical"]
+
+# Per vitals field, the status its smoothed value calls for, most severe first:
+# (status, low, high) matches when the value is below low or above high (None = no bound).
+VITALS_RULES: Dict[str, List[Tuple[str, Optional[float], Optional[float]]]] = {
+    "heartRate": [("Critical", 40, 160), ("Severe", 45, 140), ("Unstable", 50, 120), ("Mild", 55, 100)],
+    "bloodOxygenLevel": [("Critical", 85, None), ("Severe", 88, None), ("Unstable", 92, None), ("Mild", 95, None)],
+    "vehicleSpeed": [("Severe", None, 160), ("Unstable", None, 130), ("Mild", None, 110)],      # km/h
+}
+# Heart rate and SpO2 of 0 mean "no reading" (a new driver's defaults), so they are ignored
+REQUIRE_POSITIVE = {"heartRate", "bloodOxygenLevel"}
+
+WINDOW = 30                 # samples in each field's rolling window
+EWMA_ALPHA = 0.3            # weight of the newest sample in the smoothed value
+# Per field, (rolling standard deviation, status): erratic readings call for that status
+# even while their average is normal, once the window holds at least MIN_SAMPLES
+VARIABILITY_RULES = {"heartRate": (15.0, "Unstable"), "bloodOxygenLevel": (3.0, "Unstable")}
+MIN_SAMPLES = 10
+ESCALATE_DWELL = 5.0        # seconds a more severe status must persist before it is applied
+RECOVER_DWELL = 30.0        # seconds a less severe status must persist, so recoveries don't flap
+MAX_DRIVERS = 50000         # drivers tracked per process (least recently updated evicted)
+
+anomaly_transitions = registry.counter(
+    "drivesense_anomaly_transitions_total",
+    "Status changes made by the vitals anomaly detector, by previous and new status.",
+    ("from_status", "to_status"))
+
+
+class RollingStats:
+    """
+    Statistics of one vitals field for one driver: an EWMA plus the mean and variance of
+    the last `window` samples, kept in a fixed ring buffer with running sums, so an update
+    is O(1) and memory does not grow with the number of samples.
+    """
+    __slots__ = ("ewma", "_ring", "_next", "_count", "_sum", "_sum_sq")
+
+    def __init__(self, window: int = WINDOW):
+        self.ewma = None
+        self._ring = array("d", bytes(8 * window))
+        self._next = 0
+        self._count = 0
+        self._sum = 0.0
+        self._sum_sq = 0.0
+
+    def add(self, value: float, alpha: float = EWMA_ALPHA):
+        self.ewma = value if self.ewma is None else alpha * value + (1 - alpha) * self.ewma
+        if self._count == len(self._ring):
+            old = self._ring[self._next]
+            self._sum -= old
+            self._sum_sq -= old * old
+        else:
+            self._count += 1
+        self._ring[self._next] = value
+        self._next = (self._next + 1) % len(self._ring)
+        self._sum += value
+        self._sum_sq += value * value
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def mean(self) -> float:
+        return self._sum / self._count if self._count else 0.0
+
+    @property
+    def variance(self) -> float:
+        if self._count < 2:
+            return 0.0
+        # Running sums can drift slightly negative through rounding
+        return max(0.0, (self._sum_sq - self._sum * self._sum / self._count) / (self._count - 1))
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+
+class _DriverState:
+    __slots__ = ("stats", "candidate", "candidate_since")
+
+    def __init__(self):
+        self.stats: Dict[str, RollingStats] = {}
+        self.candidate = None
+        self.candidate_since = 0.0
+
+
+def _rule_status(field: str, value: float) -> Optional[str]:
+    for status, low, high in VITALS_RULES[field]:
+        if (low is not None and value < low) or (high is not None and value > high):
+            return status
+    return None
+
+
+class AnomalyDetector:
+    """
+    Turns a stream of vitals readings into driver status changes.
+
+    Every reading updates the driver's rolling statistics. The status a driver should be in
+    is the most severe one called for by the smoothed (EWMA) value of any field, or by how
+    much a field varies over its rolling window, with Stable as the baseline. A change is only
+    emitted once the new status has persisted for its dwell time (Critical is applied at
+    once), and drivers in statuses outside SEVERITY (Idle, LockedIn) are never changed.
+
+    State lives in this process, so all readings for a driver should reach the same process.
+    """
+    def __init__(self, max_drivers: int = MAX_DRIVERS, escalate_dwell: float = ESCALATE_DWELL,
+                 recover_dwell: float = RECOVER_DWELL):
+        self._drivers: "OrderedDict[str, _DriverState]" = OrderedDict()
+        self._max_drivers = max_drivers
+        self._escalate_dwell = escalate_dwell
+        self._recover_dwell = recover_dwell
+        self._lock = threading.Lock()
+        _detectors.append(self)
+
+    def __len__(self) -> int:
+        return len(self._drivers)
+
+    def observe(self, driver_id: str, readings: Dict[str, Any], current_status: str,
+                now: float = None) -> Optional[Dict[str, Any]]:
+        """
+        Feeds one set of readings for a driver.
+
+        :param readings: Any of heartRate, bloodOxygenLevel and vehicleSpeed; other keys and
+                         non-numeric values are ignored.
+        :param current_status: The driver's status as stored.
+        :return: The transition to apply ({'fromStatus', 'toStatus', 'reasons'}), or None.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            state = self._drivers.pop(driver_id, None) or _DriverState()
+            self._drivers[driver_id] = state
+            if len(self._drivers) > self._max_drivers:
+                self._drivers.popitem(last=False)
+
+            reasons = []
+            for field, value in readings.items():
+                if field not in VITALS_RULES or isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if field in REQUIRE_POSITIVE and value <= 0:
+                    continue
+                stats = state.stats.get(field)
+                if stats is None:
+                    stats = state.stats[field] = RollingStats()
+                stats.add(float(value))
+
+            if current_status not in SEVERITY:
+                state.candidate = None
+                return None
+
+            for field, stats in state.stats.items():
+                status = _rule_status(field, stats.ewma)
+                if status:
+                    reasons.append((status, f"{field} averaging {stats.ewma:.1f}"))
+                if field in VARIABILITY_RULES and stats.count >= MIN_SAMPLES:
+                    limit, status = VARIABILITY_RULES[field]
+                    if stats.std > limit:
+                        reasons.append((status, f"{field} varying by {stats.std:.1f} around {stats.mean:.1f}"))
+            target = max((status for status, _ in reasons), key=SEVERITY.index, default="Stable")
+
+            if target == current_status:
+                state.candidate = None
+                return None
+            if state.candidate != target:
+                state.candidate, state.candidate_since = target, now
+            escalating = SEVERITY.index(target) > SEVERITY.index(current_status)
+            dwell = 0.0 if target == "Critical" else self._escalate_dwell if escalating else self._recover_dwell
+            if now - state.candidate_since < dwell:
+                return None
+            state.candidate = None
+
+        anomaly_transitions.inc(current_status, target)
+        return {
+            "fromStatus": current_status,
+            "toStatus": target,
+            "reasons": [reason for status, reason in reasons if status == target],
+        }
+
+    def smoothed(self, driver_id: str) -> Dict[str, float]:
+        """The current EWMA of each field seen for a driver."""
+        with self._lock:
+            state = self._drivers.get(driver_id)
+            return {field: stats.ewma for field, stats in state.stats.items()} if state else {}
+
+    def forget(self, driver_id: str):
+        """Drops a driver's state (e.g. when the driver is deleted)."""
+        with self._lock:
+            self._drivers.pop(driver_id, None)
+
+
+_detectors: List[AnomalyDetector] = []
+
+
+def _collect_tracked_drivers():
+    if not _detectors:
+        return []
+    name = "drivesense_anomaly_tracked_drivers"
+    return [f"# HELP {name} Drivers whose vitals statistics are held by the anomaly detector.",
+            f"# TYPE {name} gauge", f"{name} {sum(len(detector) for detector in _detectors)}"]
+
+
+registry.add_collector(_collect_tracked_drivers)
@@ -0,0 +1,398 @@
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Tuple
+
+# Every collection the services keep. id_aliases comes last, so a single user's restore
+# has seen the documents their aliases point to by the time it gets there.
+COLLECTIONS = ["users", "drivers", "events", "event_archives", "event_rollups", "dashboards", "alerts",
+               "outbox", "outbox_dead_letters", "id_aliases"]
+MANIFEST_FILE = "manifest.json"
+BLOBS_DIR = "blobs"         # profile pictures and thumbnails, under the backup directory
+FORMAT_VERSION = 1
+
+PAGE_SIZE = 1000            # documents per Firestore round trip
+PREFETCH_PAGES = 2          # pages read ahead of the compressor
+PART_SIZE = 100000          # documents per compressed file; restore loads parts in parallel
+BATCH_SIZE = 500            # Firestore's limit on writes per batch
+DEFAULT_PARALLELISM = 4     # batches committed concurrently during a restore
+MAX_ATTEMPTS = 4            # tries per batch before it counts as failed
+
+# Blob files are named after a hash of their content (see Blobs.BLOB_NAME)
+_BLOB_FILE = re.compile(r"^[0-9a-f]{64}(?:-\d+)?\.(?:png|jpg|gif|webp)$")
+_DATETIME_TAG = "__datetime__"
+_BYTES_TAG = "__bytes__"
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {_DATETIME_TAG: value.isoformat()}
+    if isinstance(value, bytes):
+        return {_BYTES_TAG: base64.b64encode(value).decode("ascii")}
+    if isinstance(value, dict):
+        return {key: _encode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_encode_value(item) for item in value]
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        if len(value) == 1 and _DATETIME_TAG in value:
+            return datetime.fromisoformat(value[_DATETIME_TAG])
+        if len(value) == 1 and _BYTES_TAG in value:
+            return base64.b64decode(value[_BYTES_TAG])
+        return {key: _decode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode_value(item) for item in value]
+    return value
+
+
+def encode_document(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Makes a document JSON-safe; timestamps and bytes are tagged so they come back as they were."""
+    return _encode_value(data)
+
+
+def decode_document(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Reverses encode_document."""
+    return _decode_value(data)
+
+
+def _prefetched(iterator: Iterator, depth: int) -> Iterator:
+    """Runs an iterator in a background thread so its next page is fetched while this one is written."""
+    buffer: "queue.Queue" = queue.Queue(maxsize=depth)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterator:
+                buffer.put(item)
+            buffer.put(done)
+        except Exception as e:
+            buffer.put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = buffer.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def _pages(db_handler, collection: str) -> Iterator[List[Tuple[str, Dict[str, Any]]]]:
+    page = []
+    for doc in db_handler.iter_documents(collection, [], page_size=PAGE_SIZE):
+        page.append(doc)
+        if len(page) == PAGE_SIZE:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def _backup_collection(db_handler, collection: str, out_dir: str) -> Dict[str, Any]:
+    """Streams one collection into gzip-compressed NDJSON parts of at most PART_SIZE documents."""
+    files = []
+    part = None
+
+    def close_part():
+        part["handle"].close()
+        files.append({"name": part["name"], "documents": part["documents"], "sha256": part["hash"].hexdigest()})
+
+    for page in _prefetched(_pages(db_handler, collection), PREFETCH_PAGES):
+        for doc_id, data in page:
+            if part is None or part["documents"] == PART_SIZE:
+                if part is not None:
+                    close_part()
+                name = f"{collection}-{len(files):05d}.ndjson.gz"
+                part = {"name": name, "documents": 0, "hash": hashlib.sha256(),
+                        "handle": gzip.open(os.path.join(out_dir, name), "wb", compresslevel=6)}
+            line = (json.dumps({"id": doc_id, "data": encode_document(data)}) + "\n").encode("utf-8")
+            part["handle"].write(line)
+            part["hash"].update(line)
+            part["documents"] += 1
+    if part is not None:
+        close_part()
+
+    documents = sum(f["documents"] for f in files)
+    print(f"Backed up {documents} document(s) from '{collection}' into {len(files)} file(s).")
+    return {"documents": documents, "files": files}
+
+
+def _blob_files(blob_dir: str) -> Iterator[str]:
+    """The names of the blobs in a blob store directory."""
+    if not os.path.isdir(blob_dir):
+        return
+    for shard in sorted(os.listdir(blob_dir)):
+        shard_dir = os.path.join(blob_dir, shard)
+        if os.path.isdir(shard_dir):
+            yield from sorted(name for name in os.listdir(shard_dir) if _BLOB_FILE.match(name))
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _backup_blobs(blob_dir: str, out_dir: str) -> Dict[str, Any]:
+    """Copies the blob store's files (pictures and thumbnails) under out_dir/BLOBS_DIR."""
+    if not os.path.isdir(blob_dir):
+        print(f"No blob directory at '{blob_dir}'; the backup holds no pictures, so restored "
+              f"drivers' picture URLs won't resolve.")
+    files = []
+    for name in _blob_files(blob_dir):
+        target = os.path.join(out_dir, BLOBS_DIR, name[:2], name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(os.path.join(blob_dir, name[:2], name), target)
+        files.append({"name": name, "sha256": _file_hash(target)})
+    print(f"Backed up {len(files)} blob(s) from '{blob_dir}'.")
+    return {"files": files}
+
+
+def _default_blob_dir() -> str:
+    from Blobs import BLOB_DIR
+    return BLOB_DIR
+
+
+def backup(db_handler, out_dir: str, collections: List[str] = None, blob_dir: str = None) -> Dict[str, Any]:
+    """
+    Takes a snapshot of the given collections into out_dir: one or more compressed NDJSON files
+    per collection, written concurrently, plus a manifest listing every file, its document count
+    and checksum. Documents are read page by page, so memory stays constant. When the drivers
+    are included, so are the files of the blob store (profile pictures), which their documents
+    only refer to by URL; run it where blob_dir (Blobs.BLOB_DIR by default) is mounted.
+
+    The snapshot is not a point-in-time copy across collections: writes made while it runs may
+    or may not be included.
+
+    :return: The manifest.
+    """
+    collections = collections or COLLECTIONS
+    os.makedirs(out_dir, exist_ok=True)
+    started_at = datetime.now(timezone.utc)
+    with ThreadPoolExecutor(max_workers=len(collections) + 1, thread_name_prefix="backup") as pool:
+        futures = {collection: pool.submit(_backup_collection, db_handler, collection, out_dir)
+                   for collection in collections}
+        blobs = pool.submit(_backup_blobs, blob_dir or _default_blob_dir(), out_dir) if "drivers" in collections else None
+        results = {collection: future.result() for collection, future in futures.items()}
+
+    manifest = {
+        "version": FORMAT_VERSION,
+        "startedAt": started_at.isoformat(),
+        "finishedAt": datetime.now(timezone.utc).isoformat(),
+        "collections": results,
+    }
+    if blobs is not None:
+        manifest["blobs"] = blobs.result()
+    # The manifest is written last, so a directory without one is an incomplete backup
+    with open(os.path.join(out_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_manifest(in_dir: str) -> Dict[str, Any]:
+    path = os.path.join(in_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        raise Exception(f"No {MANIFEST_FILE} in '{in_dir}'; the backup is missing or incomplete")
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != FORMAT_VERSION:
+        raise Exception(f"Unsupported backup version {manifest.get('version')}")
+    return manifest
+
+
+def _verify_part(in_dir: str, entry: Dict[str, Any]):
+    """Checks one part against its document count and checksum in the manifest."""
+    digest = hashlib.sha256()
+    count = 0
+    with gzip.open(os.path.join(in_dir, entry["name"]), "rb") as f:
+        for line in f:
+            digest.update(line)
+            count += 1
+    if count != entry["documents"] or digest.hexdigest() != entry["sha256"]:
+        raise Exception(f"Backup file '{entry['name']}' does not match the manifest")
+
+
+def _read_part(in_dir: str, entry: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yields the documents of one part (checked with _verify_part beforehand)."""
+    with gzip.open(os.path.join(in_dir, entry["name"]), "rb") as f:
+        for line in f:
+            record = json.loads(line)
+            yield record["id"], decode_document(record["data"])
+
+
+def _verify_blob(in_dir: str, entry: Dict[str, Any]):
+    if _file_hash(os.path.join(in_dir, BLOBS_DIR, entry["name"][:2], entry["name"])) != entry["sha256"]:
+        raise Exception(f"Backup blob '{entry['name']}' does not match the manifest")
+
+
+def _restore_blobs(in_dir: str, blob_dir: str, names: List[str]) -> int:
+    """Copies blobs the blob store lacks into it, each written whole before it appears."""
+    restored = 0
+    for name in names:
+        path = os.path.join(blob_dir, name[:2], name)
+        if os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.restore.tmp"
+        shutil.copyfile(os.path.join(in_dir, BLOBS_DIR, name[:2], name), temp_path)
+        os.replace(temp_path, path)
+        restored += 1
+    return restored
+
+
+def _referenced_blobs(driver_data: Dict[str, Any]) -> set:
+    """The names of the blobs a driver document's picture URLs point to."""
+    return {value.rsplit("/", 1)[-1] for value in (driver_data.get("profilePic"), driver_data.get("profilePicThumbnail"))
+            if isinstance(value, str) and value}
+
+
+def _belongs_to(collection: str, doc_id: str, data: Dict[str, Any], user_id: str, selected: set) -> bool:
+    """Whether a document is part of a user's data; selected holds the IDs of those picked so far."""
+    if collection in ("users", "dashboards"):
+        return doc_id == user_id
+    if collection in ("outbox", "outbox_dead_letters"):
+        return data.get("driverId") in selected
+    if collection == "id_aliases":
+        return data.get("id") in selected
+    return data.get("userId") == user_id
+
+
+class _RestoreProgress:
+    def __init__(self):
+        self.restored: Dict[str, int] = {}
+        self.failed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, collection: str, restored: int = 0, failed: int = 0):
+        with self._lock:
+            self.restored[collection] = self.restored.get(collection, 0) + restored
+            self.failed[collection] = self.failed.get(collection, 0) + failed
+
+
+def _write_batch(db_handler, collection: str, documents: List[Tuple[str, Dict[str, Any]]], progress: _RestoreProgress):
+    """Writes one batch atomically, retrying with jittered exponential backoff."""
+    operations = [("set", collection, doc_id, data) for doc_id, data in documents]
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            db_handler.batch_write(operations)
+            progress.add(collection, restored=len(documents))
+            return
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS:
+                print(f"Giving up on restoring {len(documents)} document(s) into '{collection}': {e}")
+                progress.add(collection, failed=len(documents))
+                return
+            time.sleep((2 ** attempt) * 0.1 * random.uniform(0.5, 1.5))
+
+
+def restore(db_handler, in_dir: str, collections: List[str] = None, parallelism: int = DEFAULT_PARALLELISM,
+            user_id: str = None, blob_dir: str = None) -> Dict[str, Dict[str, int]]:
+    """
+    Loads a backup into db_handler (Firestore or a LocalDatabase) with batches of BATCH_SIZE
+    documents, `parallelism` of them in flight at a time. Existing documents with the same
+    IDs are overwritten; nothing else is deleted. Every file is checked against the manifest
+    first, so a damaged backup writes nothing. When the drivers are restored, the backup's
+    blobs (profile pictures) are copied into blob_dir (Blobs.BLOB_DIR by default).
+
+    :param collections: Collections to restore; every collection in the backup if omitted.
+    :param user_id: Only restore this user's documents (their user, drivers, events,
+                    dashboard... and the aliases and outbox records of those), and the
+                    blobs their drivers refer to.
+    :return: Documents (and blobs) restored and failed, per collection.
+    """
+    manifest = read_manifest(in_dir)
+    collections = collections or list(manifest["collections"])
+    for collection in collections:
+        if collection not in manifest["collections"]:
+            raise Exception(f"Collection '{collection}' is not in the backup")
+    entries = [entry for collection in collections for entry in manifest["collections"][collection]["files"]]
+    blobs = manifest.get("blobs", {}).get("files", []) if "drivers" in collections else []
+    with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="verify") as pool:
+        futures = [pool.submit(_verify_part, in_dir, entry) for entry in entries]
+        futures += [pool.submit(_verify_blob, in_dir, entry) for entry in blobs]
+        for future in futures:
+            future.result()
+
+    progress = _RestoreProgress()
+    selected = set()
+    referenced = set()
+    # Bounds the batches read ahead of the writers, so memory stays constant
+    in_flight = threading.BoundedSemaphore(parallelism * 2)
+
+    def submit(pool, collection, documents):
+        in_flight.acquire()
+        future = pool.submit(_write_batch, db_handler, collection, documents, progress)
+        future.add_done_callback(lambda _: in_flight.release())
+
+    with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="restore") as pool:
+        for collection in collections:
+            for entry in manifest["collections"][collection]["files"]:
+                documents = []
+                for doc_id, data in _read_part(in_dir, entry):
+                    if user_id:
+                        if not _belongs_to(collection, doc_id, data, user_id, selected):
+                            continue
+                        selected.add(doc_id)
+                        if collection == "drivers":
+                            referenced |= _referenced_blobs(data)
+                    documents.append((doc_id, data))
+                    if len(documents) == BATCH_SIZE:
+                        submit(pool, collection, documents)
+                        documents = []
+                if documents:
+                    submit(pool, collection, documents)
+
+    if hasattr(db_handler, "flush"):
+        db_handler.flush()
+    summary = {collection: {"restored": progress.restored.get(collection, 0), "failed": progress.failed.get(collection, 0)}
+               for collection in collections}
+    if blobs:
+        names = [entry["name"] for entry in blobs if not user_id or entry["name"] in referenced]
+        summary["blobs"] = {"restored": _restore_blobs(in_dir, blob_dir or _default_blob_dir(), names), "failed": 0}
+    print(f"Restore finished: {summary}")
+    return summary
+
+
+if __name__ == "__main__":
+    # Usage: python Backup.py backup backups/2024-01-31
+    #        python Backup.py restore backups/2024-01-31 --local dev.json --parallelism 8
+    parser = argparse.ArgumentParser(description="Snapshot and restore the services' collections.")
+    parser.add_argument("command", choices=["backup", "restore"])
+    parser.add_argument("directory", help="backup directory")
+    parser.add_argument("--collections", nargs="+", help=f"collections to include (default: {' '.join(COLLECTIONS)})")
+    parser.add_argument("--local", metavar="PATH", help="use a LocalDatabase file instead of Firestore")
+    parser.add_argument("--parallelism", type=int, default=DEFAULT_PARALLELISM, help="batches written concurrently")
+    parser.add_argument("--user", help="restore only this user's data")
+    parser.add_argument("--blob-dir", help="blob store directory to back up or restore pictures (default: Blobs.BLOB_DIR)")
+    args = parser.parse_args()
+
+    if args.local:
+        from LocalDatabase import LocalDatabase
+        db_handler = LocalDatabase(args.local)
+    else:
+        from Driver_rest import db_handler
+
+    if args.command == "backup":
+        backup(db_handler, args.directory, args.collections, args.blob_dir)
+    else:
+        summary = restore(db_handler, args.directory, args.collections, args.parallelism, args.user, args.blob_dir)
+        if any(counts["failed"] for counts in summary.values()):
+            sys.exit(1)
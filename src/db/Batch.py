@@ -0,0 +1,272 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from flask import Flask, jsonify, request
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.routing import Map, RequestRedirect, Rule
+from werkzeug.test import EnvironBuilder
+from Database import DocumentCache, use_document_cache
+from Metrics import registry
+
+# Where each service runs, so a batch sent to one service can forward to another's routes
+SERVICE_URLS = {
+    "users": os.environ.get("DRIVESENSE_USERS_URL", "http://localhost:5000"),
+    "drivers": os.environ.get("DRIVESENSE_DRIVERS_URL", "http://localhost:5001"),
+    "events": os.environ.get("DRIVESENSE_EVENTS_URL", "http://localhost:5002"),
+}
+MAX_SUB_REQUESTS = 50       # sub-requests accepted in one batch
+BATCH_WORKERS = 8           # sub-requests of one batch run concurrently
+FORWARD_TIMEOUT = 30        # seconds to wait for another service to answer a forwarded sub-request
+READ_METHODS = {"GET", "HEAD"}
+# Routes that can't be batched: batches themselves, streams and bulk exports
+EXCLUDED_ROUTES = {
+    ("POST", "/batch"),
+    ("GET", "/batch/routes"),
+    ("GET", "/alerts/<user_id>/stream"),
+    ("GET", "/export/drivers"),
+    ("GET", "/export/events"),
+}
+# Headers of the batch request not passed on to its sub-requests (an Idempotency-Key
+# names a single request, so sub-requests that need one carry their own)
+HOP_HEADERS = {"content-length", "content-type", "transfer-encoding", "connection", "host", "idempotency-key",
+               "accept-encoding"}
+# Response headers not worth returning per sub-request
+DROPPED_RESPONSE_HEADERS = {"content-length", "content-type", "vary", "connection", "date", "server", "transfer-encoding"}
+
+batch_sub_requests = registry.counter(
+    "drivesense_batch_sub_requests_total",
+    "Sub-requests run through POST /batch, by serving service and status class (2xx, 4xx...).",
+    ("service", "status"))
+
+# Route tables of the other services, fetched from their GET /batch/routes on first use
+_remote_maps: Dict[str, Map] = {}
+_remote_maps_lock = threading.Lock()
+
+
+class _SubRequest:
+    """One entry of a batch, validated and matched to the app that serves it."""
+    def __init__(self, index: int, spec: Dict[str, Any]):
+        self.index = index
+        self.method = str(spec.get("method", "GET")).upper()
+        self.path = spec.get("path")
+        self.body = spec.get("body")
+        self.headers = spec.get("headers") or {}
+        self.service = None
+        self.app = None         # set when this process serves the sub-request, else it is forwarded
+        self.error = None
+
+    @property
+    def is_read(self) -> bool:
+        return self.method in READ_METHODS
+
+
+def _remote_map(service: str) -> Optional[Map]:
+    """Another service's routes, or None if it can't be reached (tried again next time)."""
+    with _remote_maps_lock:
+        if service in _remote_maps:
+            return _remote_maps[service]
+    try:
+        with urllib.request.urlopen(SERVICE_URLS[service].rstrip("/") + "/batch/routes", timeout=FORWARD_TIMEOUT) as response:
+            routes = json.loads(response.read().decode("utf-8"))["routes"]
+    except (urllib.error.URLError, OSError, ValueError, KeyError) as e:
+        print(f"Couldn't fetch the routes of the {service} service: {e}")
+        return None
+    url_map = Map([Rule(route["rule"], methods=route["methods"], endpoint=route["rule"]) for route in routes])
+    with _remote_maps_lock:
+        _remote_maps[service] = url_map
+    return url_map
+
+
+def _match(sub: _SubRequest, service: str, app: Flask):
+    """
+    Finds the service serving a sub-request, or sets its error: this app's own routes first,
+    then the other services'.
+    """
+    path = sub.path.split("?", 1)[0]
+    method_allowed = False
+    unreachable = []
+    for name in [service] + [name for name in SERVICE_URLS if name != service]:
+        url_map = app.url_map if name == service else _remote_map(name)
+        if url_map is None:
+            unreachable.append(name)
+            continue
+        try:
+            rule, _ = url_map.bind("localhost").match(path, sub.method, return_rule=True)
+        except RequestRedirect:
+            sub.service, sub.app = name, app if name == service else None
+            return
+        except MethodNotAllowed:
+            method_allowed = True
+            continue
+        except NotFound:
+            continue
+        if (sub.method, rule.rule) in EXCLUDED_ROUTES:
+            sub.error = (400, f"{sub.method} {rule.rule} can't be part of a batch")
+        else:
+            sub.service, sub.app = name, app if name == service else None
+        return
+    if method_allowed:
+        sub.error = (405, "Method not allowed")
+    elif unreachable:
+        sub.error = (502, f"No such route here, and the {', '.join(unreachable)} service couldn't be reached")
+    else:
+        sub.error = (404, "No such route")
+
+
+def _response_body(data: str, is_json: bool) -> Any:
+    if is_json:
+        try:
+            return json.loads(data)
+        except ValueError:
+            pass
+    return data
+
+
+def _response_headers(headers) -> Dict[str, str]:
+    return {key: value for key, value in headers.items()
+            if key.lower() not in DROPPED_RESPONSE_HEADERS and not key.lower().startswith("access-control-")}
+
+
+def _forward(sub: _SubRequest, headers: Dict[str, str], remote_addr: str) -> Dict[str, Any]:
+    """Sends a sub-request to the service that owns its route, so it runs against that process's state."""
+    data = json.dumps(sub.body).encode("utf-8") if sub.body is not None else None
+    forwarded_headers = {**headers, **sub.headers, "X-Forwarded-For": remote_addr or ""}
+    if data is not None:
+        forwarded_headers["Content-Type"] = "application/json"
+    req = urllib.request.Request(SERVICE_URLS[sub.service].rstrip("/") + sub.path, data=data,
+                                 method=sub.method, headers=forwarded_headers)
+    try:
+        try:
+            response = urllib.request.urlopen(req, timeout=FORWARD_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            response = e
+        with response:
+            status, response_headers, body = response.status, response.headers, response.read()
+    except (urllib.error.URLError, OSError) as e:
+        batch_sub_requests.inc(sub.service, "5xx")
+        return {"status": 502, "headers": {}, "body": {"error": f"Couldn't reach the {sub.service} service: {e}"}}
+
+    batch_sub_requests.inc(sub.service, f"{status // 100}xx")
+    content_type = response_headers.get("Content-Type", "")
+    return {
+        "status": status,
+        "headers": _response_headers(response_headers),
+        "body": _response_body(body.decode("utf-8", errors="replace"), "json" in content_type),
+    }
+
+
+def _run(sub: _SubRequest, headers: Dict[str, str], remote_addr: str, cache: DocumentCache) -> Dict[str, Any]:
+    """
+    Runs a sub-request through the full WSGI stack of this app, or forwards it to the service
+    that owns it, so hooks and limits still apply.
+    """
+    if sub.error:
+        status, message = sub.error
+        return {"status": status, "headers": {}, "body": {"error": message}}
+    if sub.app is None:
+        return _forward(sub, headers, remote_addr)
+
+    builder = EnvironBuilder(path=sub.path, method=sub.method, headers={**headers, **sub.headers},
+                             json=sub.body, environ_base={"REMOTE_ADDR": remote_addr})
+    try:
+        with use_document_cache(cache):
+            response = sub.app.response_class.from_app(sub.app.wsgi_app, builder.get_environ(), buffered=True)
+    except Exception as e:
+        # Only reached when the app propagates exceptions (debug or testing mode)
+        batch_sub_requests.inc(sub.service, "5xx")
+        return {"status": 500, "headers": {}, "body": {"error": str(e)}}
+    finally:
+        builder.close()
+
+    batch_sub_requests.inc(sub.service, f"{response.status_code // 100}xx")
+    return {
+        "status": response.status_code,
+        "headers": _response_headers(response.headers),
+        "body": _response_body(response.get_data(as_text=True), response.is_json),
+    }
+
+
+def _validate(specs: Any) -> Optional[str]:
+    if not isinstance(specs, list) or not specs:
+        return "requests must be a non-empty list"
+    if len(specs) > MAX_SUB_REQUESTS:
+        return f"A batch holds at most {MAX_SUB_REQUESTS} requests"
+    for i, spec in enumerate(specs):
+        if not isinstance(spec, dict) or not isinstance(spec.get("path"), str) or not spec["path"].startswith("/"):
+            return f"requests[{i}] needs a path starting with '/'"
+        if not isinstance(spec.get("headers", {}), dict):
+            return f"requests[{i}].headers must be an object"
+    return None
+
+
+def register_batch(app: Flask, service: str, workers: int = BATCH_WORKERS):
+    """
+    Adds POST /batch, which runs an ordered list of sub-requests against the routes of the
+    users, drivers and events services and returns all their responses at once:
+
+        {"requests": [{"method": "GET", "path": "/drivers/d1?userId=u1"},
+                      {"method": "PUT", "path": "/drivers/d1", "body": {...}}]}
+        -> {"responses": [{"status": 200, "headers": {...}, "body": {...}}, ...]}
+
+    Consecutive reads run concurrently; a write waits for everything before it and runs on
+    its own, so sub-requests observe each other in the order given. A failed sub-request
+    doesn't stop the rest. The reads between two writes share a DocumentCache, so a document
+    several of them read is fetched once; every write starts a new one. They carry the batch
+    request's headers plus their own.
+
+    Sub-requests for this service's routes run in this process; those for another service's
+    routes are forwarded to it over HTTP (see SERVICE_URLS), so they run against the state
+    that service keeps in memory (live fields, the vitals detector, search indexes...) and
+    don't share the batch's document cache. Also adds GET /batch/routes, which tells other
+    services what to forward here.
+
+    :param service: This app's service name (a key of SERVICE_URLS).
+    """
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"batch-{service}")
+
+    @app.route('/batch/routes', methods=['GET'])
+    def batch_routes():
+        routes = [{'rule': rule.rule, 'methods': sorted(rule.methods)}
+                  for rule in app.url_map.iter_rules() if rule.endpoint != 'static']
+        return jsonify({'service': service, 'routes': routes}), 200
+
+    @app.route('/batch', methods=['POST'])
+    def run_batch():
+        try:
+            data = request.get_json(silent=True)
+            specs = data.get('requests') if isinstance(data, dict) else None
+            error = _validate(specs)
+            if error:
+                return jsonify({'error': error}), 400
+
+            subs = [_SubRequest(i, spec) for i, spec in enumerate(specs)]
+            for sub in subs:
+                _match(sub, service, app)
+
+            headers = {key: value for key, value in request.headers.items() if key.lower() not in HOP_HEADERS}
+            cache = DocumentCache()
+            responses: List[Dict[str, Any]] = [None] * len(subs)
+            start = 0
+            while start < len(subs):
+                # A run of reads goes out together; a write goes out alone
+                end = start + 1
+                if subs[start].is_read:
+                    while end < len(subs) and subs[end].is_read:
+                        end += 1
+                futures = [(sub.index, pool.submit(_run, sub, headers, request.remote_addr, cache))
+                           for sub in subs[start:end]]
+                for index, future in futures:
+                    responses[index] = future.result()
+                if not subs[start].is_read:
+                    # A write can change documents beyond those it evicts: a forwarded one runs in
+                    # another process, and a local one may cascade, so later reads start afresh
+                    cache = DocumentCache()
+                start = end
+
+            return jsonify({'responses': responses, 'count': len(responses)}), 200
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
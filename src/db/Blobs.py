@@ -0,0 +1,212 @@
+import base64
+import binascii
+import hashlib
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict, Optional
+from flask import Flask, jsonify, send_file
+from Metrics import registry
+
+# Blobs are written by whichever instance took the upload and served by any, so once the drivers
+# service runs on more than one host this must be storage they all mount (NFS, a GCS FUSE mount...),
+# not a local disk. Backup.py copies it along with the documents that refer to it.
+BLOB_DIR = os.environ.get("DRIVESENSE_BLOB_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "blobs"))
+# Where clients fetch blobs from: the drivers service's /blobs route unless a CDN sits in front
+BLOB_URL_PREFIX = os.environ.get("DRIVESENSE_BLOB_URL", "http://localhost:5001/blobs/")
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+THUMBNAIL_SIZE = 128        # pixels on the longest side
+THUMBNAIL_WORKERS = 2       # thumbnails generated concurrently
+CACHE_SECONDS = 365 * 24 * 3600     # blob names are content hashes, so they never change
+
+# Leading bytes of each accepted image type; the declared type of a data URL is not trusted
+IMAGE_SIGNATURES = [(b"\x89PNG\r\n\x1a\n", "png"), (b"\xff\xd8\xff", "jpg"), (b"GIF87a", "gif"), (b"GIF89a", "gif")]
+CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg", "gif": "image/gif", "webp": "image/webp"}
+# Pillow format and file extension of the thumbnail of each image type (GIFs get a still PNG)
+THUMBNAIL_FORMATS = {"png": ("PNG", "png"), "gif": ("PNG", "png"), "jpg": ("JPEG", "jpg"), "webp": ("WEBP", "webp")}
+
+DATA_URL = re.compile(r"^data:[\w/+.-]*(?:;[\w=.+-]+)*;base64,", re.IGNORECASE)
+BLOB_NAME = re.compile(r"^(?P<hash>[0-9a-f]{64})(?:-(?P<size>\d+))?\.(?P<ext>png|jpg|gif|webp)$")
+
+blobs_written = registry.counter(
+    "drivesense_blobs_total",
+    "Blobs offered to the blob store, by kind (image or thumbnail) and result (stored or deduplicated).",
+    ("kind", "result"))
+
+
+def _sniff(data: bytes) -> Optional[str]:
+    for signature, ext in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return ext
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def is_data_url(value) -> bool:
+    return isinstance(value, str) and DATA_URL.match(value) is not None
+
+
+class BlobStore:
+    """
+    Content-addressed files on local disk: a blob is named after the SHA-256 of its bytes,
+    so the same image uploaded for many drivers is stored once and a name always refers to
+    the same content. Files are sharded into subdirectories by the first two hex digits.
+
+    Images get a THUMBNAIL_SIZE thumbnail generated in a worker pool. Thumbnails need Pillow,
+    which is optional: without it, the thumbnail URL is the image's own.
+    """
+    def __init__(self, root: str = BLOB_DIR, workers: int = THUMBNAIL_WORKERS, thumbnail_size: int = THUMBNAIL_SIZE):
+        self._root = root
+        self._thumbnail_size = thumbnail_size
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnails")
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._pillow = None
+
+    def path(self, name: str) -> str:
+        return os.path.join(self._root, name[:2], name)
+
+    def url(self, name: str) -> str:
+        return BLOB_URL_PREFIX + name
+
+    def _write(self, name: str, data: bytes, kind: str):
+        path = self.path(name)
+        if os.path.exists(path):
+            blobs_written.inc(kind, "deduplicated")
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a unique name and renamed, so readers never see a partial file
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        blobs_written.inc(kind, "stored")
+
+    def _has_pillow(self) -> bool:
+        if self._pillow is None:
+            try:
+                import PIL.Image  # noqa: F401
+                self._pillow = True
+            except ImportError:
+                print("Pillow is not installed; images are stored without thumbnails (pip install Pillow).")
+                self._pillow = False
+        return self._pillow
+
+    def thumbnail_name(self, name: str) -> str:
+        match = BLOB_NAME.match(name)
+        return f"{match.group('hash')}-{self._thumbnail_size}.{THUMBNAIL_FORMATS[match.group('ext')][1]}"
+
+    def put_image(self, data: bytes) -> str:
+        """
+        Stores an image (PNG, JPEG, GIF or WebP, by its content) and queues its thumbnail.
+
+        :return: The blob name.
+        """
+        if len(data) > MAX_IMAGE_BYTES:
+            raise ValueError(f"Images must be at most {MAX_IMAGE_BYTES // (1024 * 1024)} MB")
+        ext = _sniff(data)
+        if ext is None:
+            raise ValueError("Images must be PNG, JPEG, GIF or WebP")
+        name = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+        self._write(name, data, "image")
+        if self._has_pillow():
+            self._thumbnail_async(name)
+        return name
+
+    def _thumbnail_async(self, name: str) -> Optional[Future]:
+        thumbnail = self.thumbnail_name(name)
+        with self._lock:
+            if thumbnail in self._pending:
+                return self._pending[thumbnail]
+            if os.path.exists(self.path(thumbnail)):
+                return None
+            future = self._pool.submit(self._make_thumbnail, name, thumbnail)
+            self._pending[thumbnail] = future
+        future.add_done_callback(lambda done: self._finished(thumbnail, done))
+        return future
+
+    def _finished(self, thumbnail: str, future: Future):
+        with self._lock:
+            self._pending.pop(thumbnail, None)
+        if future.exception() is not None:
+            print(f"Error generating thumbnail '{thumbnail}': {future.exception()}")
+
+    def _make_thumbnail(self, name: str, thumbnail: str):
+        from PIL import Image, ImageOps
+
+        image_format = THUMBNAIL_FORMATS[BLOB_NAME.match(name).group("ext")][0]
+        with Image.open(self.path(name)) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((self._thumbnail_size, self._thumbnail_size))
+            if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            out = BytesIO()
+            image.save(out, image_format)
+        self._write(thumbnail, out.getvalue(), "thumbnail")
+
+    def open(self, name: str) -> Optional[str]:
+        """
+        The file of a blob, or None if there is no such blob. A thumbnail that is still being
+        generated (or was lost, e.g. by a restart) is waited for.
+        """
+        match = BLOB_NAME.match(name)
+        if not match:
+            return None
+        path = self.path(name)
+        if os.path.exists(path):
+            return path
+        if match.group("size") is None or int(match.group("size")) != self._thumbnail_size:
+            return None
+        candidates = [f"{match.group('hash')}.{ext}" for ext, (_, thumbnail_ext) in THUMBNAIL_FORMATS.items()
+                      if thumbnail_ext == match.group("ext")]
+        original = next((candidate for candidate in candidates if os.path.exists(self.path(candidate))), None)
+        if original is None or not self._has_pillow():
+            return None
+        future = self._thumbnail_async(original)
+        if future is not None:
+            future.result()
+        return path if os.path.exists(path) else None
+
+    def image_fields(self, value, field: str) -> Dict[str, str]:
+        """
+        Document fields for an image sent by a client. A base64 data URL is decoded and stored,
+        and the field holds its URL, with the thumbnail URL in <field>Thumbnail; any other
+        value (a URL, or '' for none) is kept as is and is its own thumbnail.
+        """
+        if not is_data_url(value):
+            return {field: value, f"{field}Thumbnail": value}
+        try:
+            data = base64.b64decode(value.split(",", 1)[1], validate=True)
+        except (binascii.Error, ValueError):
+            raise ValueError(f"{field} is not valid base64")
+        name = self.put_image(data)
+        thumbnail = self.thumbnail_name(name) if self._has_pillow() else name
+        return {field: self.url(name), f"{field}Thumbnail": self.url(thumbnail)}
+
+
+blob_store = BlobStore()
+
+
+def register_blob_routes(app: Flask, store: BlobStore = blob_store):
+    """
+    Adds GET /blobs/<name>, serving blobs with a year-long immutable Cache-Control:
+    a name is the hash of the content, so a cached copy can never be out of date.
+    """
+    @app.route('/blobs/<name>', methods=['GET'])
+    def get_blob(name):
+        try:
+            path = store.open(name)
+        except Exception as e:
+            return jsonify({'error': f'Failed to read blob: {str(e)}'}), 500
+        if path is None:
+            return jsonify({'error': 'Blob not found'}), 404
+
+        response = send_file(path, mimetype=CONTENT_TYPES[BLOB_NAME.match(name).group("ext")],
+                             max_age=CACHE_SECONDS, etag=name, conditional=True)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
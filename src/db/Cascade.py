@@ -0,0 +1,203 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+from Jobs import JobCancelled
+from Dashboard import DASHBOARD_COLLECTION, remove_card_operations
+from Retention import ARCHIVE_COLLECTION, ROLLUP_COLLECTION
+
+USER_COLLECTION = "users"
+DRIVER_COLLECTION = "drivers"
+EVENT_COLLECTION = "events"
+
+BATCH_SIZE = 500        # Firestore's limit on writes per batch
+PARALLEL_BATCHES = 4    # delete batches committed concurrently
+MAX_ATTEMPTS = 4        # tries per batch before it counts as failed
+SYNC_LIMIT = 500        # deletions larger than this should be handed to a background job
+
+
+class CascadeDeletion:
+    """Progress of one cascade delete, optionally mirrored to the background job running it."""
+    def __init__(self, kind: str, target_id: str, job=None):
+        self.kind = kind
+        self.target_id = target_id
+        self.status = "running"
+        self.deleted = 0
+        self.failed = 0
+        self.error = None
+        self._job = job
+        self._lock = threading.Lock()
+
+    def add_progress(self, deleted: int = 0, failed: int = 0):
+        with self._lock:
+            self.deleted += deleted
+            self.failed += failed
+            if self._job:
+                self._job.report(deleted=self.deleted, failed=self.failed)
+
+    def check_cancelled(self):
+        """Raises JobCancelled between batches if the job running this cascade was cancelled."""
+        if self._job:
+            self._job.check_cancelled()
+
+    def finish(self, error: Exception = None):
+        if error is not None:
+            self.status = "failed"
+            self.error = str(error)
+        elif self.failed:
+            self.status = "failed"
+            self.error = f"{self.failed} document(s) could not be deleted"
+        else:
+            self.status = "completed"
+
+    def to_map(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "targetId": self.target_id,
+            "status": self.status,
+            "deleted": self.deleted,
+            "failed": self.failed,
+            "error": self.error,
+        }
+
+
+def _delete_batch(db_handler, collection: str, doc_ids: List[str], progress: CascadeDeletion):
+    """Deletes one batch atomically, retrying with jittered exponential backoff."""
+    operations = [("delete", collection, doc_id, None) for doc_id in doc_ids]
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            db_handler.batch_write(operations)
+            progress.add_progress(deleted=len(doc_ids))
+            return
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS:
+                print(f"Giving up on deleting {len(doc_ids)} document(s) from '{collection}': {e}")
+                progress.add_progress(failed=len(doc_ids))
+                return
+            time.sleep((2 ** attempt) * 0.1 * random.uniform(0.5, 1.5))
+
+
+def delete_where(db_handler, collection: str, field: str, value: Any, progress: CascadeDeletion,
+                 extra_ids: List[str] = None):
+    """
+    Deletes every document of a collection whose field equals value.
+    Matching IDs are fetched page by page through an indexed query (IDs only), and each page
+    is split into batches that are committed concurrently. Deleted documents drop out of the
+    query, so the next page is simply the next query.
+
+    :param extra_ids: Additional document IDs to delete that the query may not find.
+    """
+    page_size = BATCH_SIZE * PARALLEL_BATCHES
+    pending = list(dict.fromkeys(extra_ids or []))
+    with ThreadPoolExecutor(max_workers=PARALLEL_BATCHES, thread_name_prefix="cascade") as pool:
+        while True:
+            progress.check_cancelled()
+            page = db_handler.query_documents(collection, [(field, "==", value)], limit=page_size, fields=[])
+            page_ids = [doc_id for doc_id, _ in page]
+            ids = list(dict.fromkeys(pending + page_ids))
+            pending = []
+            if not ids:
+                return
+
+            futures = [pool.submit(_delete_batch, db_handler, collection, ids[i:i + BATCH_SIZE], progress)
+                       for i in range(0, len(ids), BATCH_SIZE)]
+            for future in futures:
+                future.result()
+
+            # A short page means the query has nothing left; a page of failures would loop forever
+            if len(page_ids) < page_size or progress.failed:
+                return
+
+
+def _count_up_to(db_handler, collection: str, field: str, value: Any, limit: int) -> int:
+    """Counts matching documents, stopping once the count exceeds limit."""
+    return len(db_handler.query_documents(collection, [(field, "==", value)], limit=limit + 1, fields=[]))
+
+
+def driver_deletion_is_large(db_handler, driver_id: str) -> bool:
+    """True when deleting the driver means deleting more than SYNC_LIMIT events."""
+    return _count_up_to(db_handler, EVENT_COLLECTION, "driverId", driver_id, SYNC_LIMIT) > SYNC_LIMIT
+
+
+def user_deletion_is_large(db_handler, user_id: str) -> bool:
+    """True when the user's drivers and their events add up to more than SYNC_LIMIT documents."""
+    drivers = db_handler.query_documents(DRIVER_COLLECTION, [("userId", "==", user_id)], limit=SYNC_LIMIT + 1, fields=[])
+    budget = SYNC_LIMIT - len(drivers)
+    if budget < 0:
+        return True
+    if _count_up_to(db_handler, EVENT_COLLECTION, "userId", user_id, budget) > budget:
+        return True
+    # Events are linked to both their user and their driver, except old ones linked only to
+    # their driver; counting per driver too catches those without counting the others twice
+    by_driver = 0
+    for driver_id, _ in drivers:
+        by_driver += _count_up_to(db_handler, EVENT_COLLECTION, "driverId", driver_id, budget - by_driver)
+        if by_driver > budget:
+            return True
+    return False
+
+
+def _cascade_driver(db_handler, driver_id: str, driver_data: Dict[str, Any], progress: CascadeDeletion):
+    # Events mirrored in the driver document are included in case they lack a driverId link
+    embedded_ids = [e.get("eventId") for e in driver_data.get("events", []) if e.get("eventId")]
+    delete_where(db_handler, EVENT_COLLECTION, "driverId", driver_id, progress, extra_ids=embedded_ids)
+    for collection in (ARCHIVE_COLLECTION, ROLLUP_COLLECTION):
+        delete_where(db_handler, collection, "driverId", driver_id, progress)
+    if progress.failed:
+        return
+    # The driver goes last (with its dashboard card), so a failed cascade can simply be retried
+    db_handler.batch_write([("delete", DRIVER_COLLECTION, driver_id, None)]
+                           + remove_card_operations(driver_data.get("userId"), driver_id))
+    progress.add_progress(deleted=1)
+
+
+def _cascade_user(db_handler, user_id: str, progress: CascadeDeletion):
+    while True:
+        drivers = db_handler.query_documents(DRIVER_COLLECTION, [("userId", "==", user_id)], limit=BATCH_SIZE)
+        for driver_id, driver_data in drivers:
+            _cascade_driver(db_handler, driver_id, driver_data, progress)
+            if progress.failed:
+                return
+        if len(drivers) < BATCH_SIZE:
+            break
+    # Events linked to the user directly, e.g. whose driver was already removed
+    for collection in (EVENT_COLLECTION, ARCHIVE_COLLECTION, ROLLUP_COLLECTION):
+        delete_where(db_handler, collection, "userId", user_id, progress)
+    if progress.failed:
+        return
+    db_handler.batch_write([("delete", USER_COLLECTION, user_id, None),
+                            ("delete", DASHBOARD_COLLECTION, user_id, None)])
+    progress.add_progress(deleted=1)
+
+
+def _run(progress: CascadeDeletion, work, *args) -> CascadeDeletion:
+    try:
+        work(*args, progress)
+        progress.finish()
+    except JobCancelled:
+        raise
+    except Exception as e:
+        progress.finish(e)
+    return progress
+
+
+def cascade_delete_driver(db_handler, driver_id: str, driver_data: Dict[str, Any], job=None) -> CascadeDeletion:
+    """
+    Deletes a driver and every event that belongs to it, archived events and rollups included.
+
+    :param job: Optional JobContext when running as a background job; receives progress
+                updates and stops the cascade between batches when cancelled.
+    """
+    progress = CascadeDeletion("driver", driver_id, job)
+    return _run(progress, _cascade_driver, db_handler, driver_id, driver_data)
+
+
+def cascade_delete_user(db_handler, user_id: str, job=None) -> CascadeDeletion:
+    """
+    Deletes a user, all of the user's drivers and all of their events.
+
+    :param job: Optional JobContext (see cascade_delete_driver).
+    """
+    progress = CascadeDeletion("user", user_id, job)
+    return _run(progress, _cascade_user, db_handler, user_id)
@@ -0,0 +1,148 @@
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from Blobs import is_data_url
+from Database import DELETE_FIELD
+
+DASHBOARD_COLLECTION = "dashboards"
+DRIVER_COLLECTION = "drivers"
+USER_COLLECTION = "users"
+
+# Driver fields copied onto its dashboard card. A card is a few hundred bytes, so one
+# dashboard document (Firestore's limit is 1 MiB) holds a few thousand drivers.
+CARD_FIELDS = ("name", "status", "driving", "heartRate", "bloodOxygenLevel", "vehicleSpeed",
+               "timeStamp", "profilePicThumbnail", "statusUpdatedAt")
+# Fields of the driver's most recently recorded event kept on the card as lastEvent
+LAST_EVENT_FIELDS = ("eventId", "status", "timeStamp")
+PAGE_SIZE = 1000            # drivers read per round trip while rebuilding
+
+
+def card_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
+    """The summary of an event shown on a card as its lastEvent."""
+    return {field: event_data.get(field) for field in LAST_EVENT_FIELDS}
+
+
+def driver_card(driver_data: Dict[str, Any]) -> Dict[str, Any]:
+    """The dashboard card of a driver document."""
+    card = {field: driver_data[field] for field in CARD_FIELDS if field in driver_data}
+    if "profilePicThumbnail" not in card and not is_data_url(driver_data.get("profilePic")):
+        # Drivers saved before pictures had thumbnails; inline images are left off the card
+        card["profilePicThumbnail"] = driver_data.get("profilePic", "")
+    events = driver_data.get("events") or []
+    card["lastEvent"] = card_event(events[-1]) if events else None
+    return card
+
+
+def card_operations(user_id: str, driver_id: str, fields: Dict[str, Any]) -> List[Tuple[str, str, str, Dict[str, Any]]]:
+    """
+    Batch operations that copy changed driver fields onto the driver's card in its owner's
+    dashboard, for committing together with the driver write. Fields not shown on cards are
+    ignored, so callers can pass their whole update.
+    """
+    card = {field: value for field, value in fields.items() if field in CARD_FIELDS or field == "lastEvent"}
+    if not user_id or not card:
+        return []
+    # A merge touches only these fields, so writes to different drivers' cards don't conflict
+    return [("merge", DASHBOARD_COLLECTION, user_id,
+             {"userId": user_id, "drivers": {driver_id: card}, "updatedAt": datetime.now(timezone.utc)})]
+
+
+def last_event_operations(user_id: str, driver_id: str, event_data: Dict[str, Any]):
+    """Batch operations that make an event just recorded for a driver its card's lastEvent."""
+    return card_operations(user_id, driver_id, {"lastEvent": card_event(event_data)})
+
+
+def remove_card_operations(user_id: str, driver_id: str):
+    """Batch operations that take a deleted driver's card off its owner's dashboard."""
+    if not user_id:
+        return []
+    return [("merge", DASHBOARD_COLLECTION, user_id,
+             {"drivers": {driver_id: DELETE_FIELD}, "updatedAt": datetime.now(timezone.utc)})]
+
+
+def event_change_operations(db_handler, user_id: str, driver_id: str, event_id: str,
+                            changes: Optional[Dict[str, Any]] = None):
+    """
+    Batch operations for an event that is edited (changes) or removed (changes=None).
+    Only matters when it is the card's lastEvent, which costs one dashboard read to find out;
+    a removed lastEvent is cleared rather than replaced by the event before it.
+    """
+    if not user_id or not driver_id or (changes is not None and not set(changes) & set(LAST_EVENT_FIELDS)):
+        return []
+    dashboard = db_handler.get_document(DASHBOARD_COLLECTION, user_id)
+    last_event = ((dashboard or {}).get("drivers", {}).get(driver_id) or {}).get("lastEvent")
+    if not last_event or last_event.get("eventId") != event_id:
+        return []
+    if changes is None:
+        return card_operations(user_id, driver_id, {"lastEvent": None})
+    return card_operations(user_id, driver_id, {"lastEvent": {**last_event, **card_event({**last_event, **changes})}})
+
+
+def read_dashboard(db_handler, user_id: str, allow_stale: bool = False) -> List[Dict[str, Any]]:
+    """
+    A user's driver cards, read from the dashboard document with a single read.
+    A dashboard that was never built from the drivers (the user's drivers predate
+    dashboards, so it may hold only the cards written since) is not trusted: the cards
+    are made from a drivers query instead, without writing anything. The one-off
+    'dashboards' migration (python Migrations.py dashboards) builds the missing ones.
+
+    :return: Cards with their driverId, ordered by name.
+    """
+    dashboard = db_handler.get_document(DASHBOARD_COLLECTION, user_id, allow_stale=allow_stale)
+    if not dashboard or "rebuiltAt" not in dashboard:
+        drivers = db_handler.query_documents(DRIVER_COLLECTION, [("userId", "==", user_id)], allow_stale=allow_stale)
+        dashboard = new_dashboard(user_id, drivers)
+    cards = [dict(card, driverId=driver_id) for driver_id, card in dashboard.get("drivers", {}).items()]
+    cards.sort(key=lambda card: (str(card.get("name") or ""), card["driverId"]))
+    return cards
+
+
+def new_dashboard(user_id: str, drivers: List[Tuple[str, Dict[str, Any]]] = ()) -> Dict[str, Any]:
+    """A complete dashboard document for a user and (doc_id, data) pairs of all their drivers."""
+    now = datetime.now(timezone.utc)
+    return {"userId": user_id, "drivers": {driver_id: driver_card(data) for driver_id, data in drivers},
+            "updatedAt": now, "rebuiltAt": now}
+
+
+def rebuild_dashboard(db_handler, user_id: str) -> Dict[str, Any]:
+    """
+    Rewrites a user's dashboard from their driver documents. A card write that lands
+    between the query and the rewrite is lost until the next rebuild, so this is a repair
+    tool, not part of the write path.
+
+    :return: The dashboard document written.
+    """
+    drivers = db_handler.query_documents(DRIVER_COLLECTION, [("userId", "==", user_id)])
+    dashboard = new_dashboard(user_id, drivers)
+    db_handler.set_document(DASHBOARD_COLLECTION, user_id, dashboard)
+    return dashboard
+
+
+def rebuild_all(db_handler) -> int:
+    """
+    Rebuilds every user's dashboard from a single pass over the drivers, and empties the
+    dashboards of users who no longer have any drivers.
+
+    :return: The number of dashboards written.
+    """
+    drivers_by_user: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+    for driver_id, driver_data in db_handler.iter_documents(DRIVER_COLLECTION, [], page_size=PAGE_SIZE):
+        if driver_data.get("userId"):
+            drivers_by_user.setdefault(driver_data["userId"], []).append((driver_id, driver_data))
+    for user_id, _ in db_handler.stream_documents(DASHBOARD_COLLECTION):
+        drivers_by_user.setdefault(user_id, [])
+
+    for user_id, drivers in drivers_by_user.items():
+        db_handler.set_document(DASHBOARD_COLLECTION, user_id, new_dashboard(user_id, drivers))
+    print(f"Rebuilt {len(drivers_by_user)} dashboard(s).")
+    return len(drivers_by_user)
+
+
+if __name__ == "__main__":
+    # Usage: python Dashboard.py rebuild [user_id]
+    from Driver_rest import db_handler
+
+    if len(sys.argv) > 2:
+        rebuild_dashboard(db_handler, sys.argv[2])
+    else:
+        rebuild_all(db_handler)
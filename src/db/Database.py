@@ -1,9 +1,83 @@
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import firestore
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple, Callable, Hashable
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+import copy
+import os
+import threading
+import time
+from Metrics import storage_timer, record_cache
+from RateLimit import StorageOverloaded
+from Resilience import (DEADLINES, DEFAULT_DEADLINE, MAX_ATTEMPTS, CircuitBreaker, StaleCache, StorageUnavailable,
+                        backoff, is_retryable, mark_stale, mark_unavailable, storage_rejected, storage_retries, stale_reads)
 
 MapFieldValue = Dict[str, Any]
+# Seconds before a process that failed to create its client tries again
+INIT_RETRY_SECONDS = 30
+# Called after every storage operation with (operation, collection, target, seconds, payload, error)
+OperationHook = Callable[[str, str, str, float, Any, Exception], None]
+
+class _DeleteField:
+    """Marks a field for removal in a 'merge' write; see DELETE_FIELD."""
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return "DELETE_FIELD"
+
+
+# Value that removes a field (or a map entry) in a 'merge' batch write
+DELETE_FIELD = _DeleteField()
+
+
+class DocumentCache:
+    """
+    Documents read while serving a group of related requests (e.g. one POST /batch), so a
+    document read by several of them is fetched once. Writes through any Database evict
+    what they touch. Only in effect inside use_document_cache().
+    """
+    def __init__(self):
+        self._documents: Dict[Tuple[str, str, str], MapFieldValue] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str, str]) -> Tuple[bool, MapFieldValue]:
+        """:return: (found, a copy of the document data; empty if it did not exist)."""
+        with self._lock:
+            if key not in self._documents:
+                return False, None
+            data = self._documents[key]
+        return True, copy.deepcopy(data)
+
+    def put(self, key: Tuple[str, str, str], data: MapFieldValue):
+        data = copy.deepcopy(data)
+        with self._lock:
+            self._documents[key] = data
+
+    def evict(self, key: Tuple[str, str, str]):
+        with self._lock:
+            self._documents.pop(key, None)
+
+
+_document_cache: ContextVar[DocumentCache] = ContextVar("drivesense_document_cache", default=None)
+
+
+@contextmanager
+def use_document_cache(cache: DocumentCache):
+    """Serves document reads made in this context (thread) from cache, filling it as they go."""
+    token = _document_cache.set(cache)
+    try:
+        yield cache
+    finally:
+        _document_cache.reset(token)
+
+
+def _describe(filters: List[Tuple[str, str, Any]]) -> str:
+    """A readable description of a query's filters for metrics and tracing."""
+    return " and ".join(f"{field} {op} {value}" for field, op, value in filters) or "*"
+
+
 class Database:
     """
     Handles connection and synchronous operations with Google Cloud Firestore 
@@ -11,90 +85,548 @@ class Database:
     """
     def __init__(self, project_id: str, credentials_path: str = None):
         """
-        Initializes Firebase App and Firestore client.
+        Stores the connection settings. The Firebase app and Firestore client are created
+        lazily on first use, once per process, so importing a service is cheap and a
+        pre-fork server never shares a client (and its gRPC channel) across processes.
         
         :param project_id: The ID of your Google Cloud project.
         :param credentials_path: Optional path to your service account JSON file.
                                  If None, uses Application Default Credentials.
         """
-        self._db = None
+        self._project_id = project_id
+        self._credentials_path = credentials_path
+        self._client = None
+        self._client_pid = None
+        self._init_error = None
+        self._init_failed_at = 0.0
+        self._init_lock = threading.Lock()
+        self._operation_hooks: List[OperationHook] = []
+        self._limiter = None
+        # Fails storage operations fast while Firestore is unhealthy
+        self._breaker = CircuitBreaker(project_id)
+        # Last results of reads made with allow_stale, served while the circuit is open
+        self._stale = StaleCache()
+
+    @property
+    def _db(self):
+        """The Firestore client of this process, created on first use; None if it could not be created."""
+        if self._client_pid != os.getpid() or self._should_retry():
+            with self._init_lock:
+                if self._client_pid != os.getpid() or self._should_retry():
+                    self._client = self._create_client()
+                    self._client_pid = os.getpid()
+        return self._client
+
+    @_db.setter
+    def _db(self, client):
+        self._client = client
+        self._client_pid = os.getpid()
+
+    def _should_retry(self) -> bool:
+        return self._client is None and time.monotonic() - self._init_failed_at >= INIT_RETRY_SECONDS
+
+    def _create_client(self):
+        """Initializes a Firebase app for this process and returns its Firestore client."""
         try:
+            # Imported here: loading the SDK is the slowest part of starting a service
+            import firebase_admin
+            from firebase_admin import credentials, firestore
+
             # Determine credentials: service account file path or default (gcloud auth)
-            if credentials_path:
-                cred = credentials.Certificate(credentials_path)
+            if self._credentials_path:
+                cred = credentials.Certificate(self._credentials_path)
             else:
                 # This is typically used when running on Google Cloud services
                 # or after running 'gcloud auth application-default login' locally.
                 cred = credentials.ApplicationDefault()
 
-            # Initialize the app if it hasn't been already
-            if not firebase_admin._apps:
-                firebase_admin.initialize_app(cred, {'projectId': project_id})
+            # One app per process: a forked child must not reuse its parent's client
+            app_name = f"drivesense-{os.getpid()}"
+            try:
+                app = firebase_admin.get_app(app_name)
+            except ValueError:
+                app = firebase_admin.initialize_app(cred, {'projectId': self._project_id}, name=app_name)
             
-            self._db = firestore.client()
+            client = firestore.client(app)
+            self._init_error = None
             print("Firebase and Firestore initialized successfully.")
+            return client
         except Exception as e:
             print(f"Error initializing Firebase. Check credentials and project ID. Error: {e}")
-            self._db = None
+            self._init_error = e
+            self._init_failed_at = time.monotonic()
+            return None
+
+    def is_connected(self) -> bool:
+        """True if this process has already created its storage client (without creating it)."""
+        return self._client_pid == os.getpid() and self._client is not None
+
+    def connection_error(self) -> Exception:
+        """The error that prevented this process from creating its storage client, if any."""
+        return self._init_error
+
+    def warm_up(self) -> float:
+        """
+        Creates the storage client and issues one cheap read, so the first real request
+        doesn't pay for credential loading and opening the channel. Errors are re-raised.
+        
+        :return: Seconds taken.
+        """
+        start = time.perf_counter()
+        self._call("_warmup", "read", "ping",
+                   lambda record, timeout: self._db.collection("_warmup").document("ping").get(retry=None, timeout=timeout))
+        return time.perf_counter() - start
+
+    def add_operation_hook(self, hook: OperationHook):
+        """
+        Registers a callback that observes every storage operation (used for tracing).
+        
+        :param hook: Called with (operation, collection, target, seconds, payload, error).
+                     Registering the same hook twice has no effect.
+        """
+        if hook not in self._operation_hooks:
+            self._operation_hooks.append(hook)
+
+    def set_concurrency_limiter(self, limiter):
+        """
+        Bounds the storage operations in flight; each operation holds one of the limiter's slots.
+        
+        :param limiter: An object whose slot() context manager waits for a free slot or raises.
+        """
+        self._limiter = limiter
+
+    def concurrency_limiter(self):
+        """The limiter set with set_concurrency_limiter, if any."""
+        return self._limiter
+
+    @contextmanager
+    def _operation(self, collection: str, operation: str, target: str):
+        """
+        Times a single storage operation for metrics and reports it to the operation hooks.
+        The body may store the data read or written in record['payload'].
+        """
+        with self._limiter.slot() if self._limiter else nullcontext():
+            record = {'payload': None}
+            error = None
+            start = time.perf_counter()
+            try:
+                with storage_timer(collection, operation):
+                    yield record
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                for hook in self._operation_hooks:
+                    try:
+                        hook(operation, collection, target, elapsed, record['payload'], error)
+                    except Exception as e:
+                        print(f"Error in storage operation hook: {e}")
+
+    def _call(self, collection: str, operation: str, target: str, attempt: Callable[[dict, float], Any],
+              stale_key: Hashable = None) -> Any:
+        """
+        Runs one storage operation under its deadline (DEADLINES), retrying transient errors
+        with jittered exponential backoff and failing fast while the circuit is open.
+        Every write made through here is a set, a field update or a delete, so repeating
+        one that may already have been applied is safe.
+        
+        :param attempt: Makes one try, given the operation record and the seconds left before
+                        the deadline (passed to Firestore as the RPC timeout).
+        :param stale_key: If given, successful results are cached under this key and, when
+                          storage is unavailable, the last cached result is returned instead.
+        :return: The result of the first successful attempt.
+        """
+        deadline = time.monotonic() + DEADLINES.get(operation, DEFAULT_DEADLINE)
+        error = None
+        for attempt_number in range(MAX_ATTEMPTS):
+            if not self._db:
+                error = StorageUnavailable(f"Storage client unavailable: {self._init_error}", INIT_RETRY_SECONDS)
+                break
+            if not self._breaker.allow():
+                storage_rejected.inc(collection, operation)
+                error = StorageUnavailable("Storage circuit is open", self._breaker.retry_after())
+                break
+            remaining = deadline - time.monotonic()
+            try:
+                with self._operation(collection, operation, target) as record:
+                    result = attempt(record, remaining)
+            except StorageOverloaded:
+                self._breaker.release()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    self._breaker.record_success()
+                    raise
+                self._breaker.record_failure()
+                error = e
+                pause = backoff(attempt_number)
+                if attempt_number + 1 == MAX_ATTEMPTS or time.monotonic() + pause >= deadline:
+                    break
+                storage_retries.inc(collection, operation)
+                print(f"Retrying {operation} on '{collection}' in {pause:.2f}s after: {e}")
+                time.sleep(pause)
+                continue
+            self._breaker.record_success()
+            if stale_key is not None:
+                self._stale.put(stale_key, result)
+            return result
+
+        if stale_key is not None:
+            found, result = self._stale.get(stale_key)
+            record_cache(f"stale:{collection}", found)
+            if found:
+                print(f"Storage unavailable ({error}); serving a stale {operation} of '{collection}'.")
+                stale_reads.inc(collection)
+                mark_stale()
+                return result
+        if not isinstance(error, StorageUnavailable):
+            error = StorageUnavailable(f"{operation} on '{collection}' failed: {error}", self._breaker.retry_after() or 1)
+        mark_unavailable(error)
+        raise error
 
     def set_document(self, collection: str, doc_id: str, data: MapFieldValue):
         """
-        Sets (creates or completely overwrites) a document.
+        Sets (creates or completely overwrites) a document. Errors are re-raised.
         
         :param collection: The name of the Firestore collection.
         :param doc_id: The ID of the document to set.
         :param data: The dictionary data to write to the document.
         """
-        if not self._db:
-            return
+        def attempt(record, timeout):
+            record['payload'] = data
+            self._db.collection(collection).document(doc_id).set(data, retry=None, timeout=timeout)
 
         try:
-            self._db.collection(collection).document(doc_id).set(data)
+            self._evict_cached(collection, doc_id)
+            self._call(collection, "write", doc_id, attempt)
             print(f"Document '{doc_id}' saved successfully in collection '{collection}'.")
         except Exception as e:
             print(f"Error saving document '{doc_id}': {e}")
+            raise
 
     def update_document(self, collection: str, doc_id: str, updates: MapFieldValue):
         """
         Updates specific fields in an existing document without overwriting the whole document.
+        Errors are re-raised, including updating a document that does not exist.
         
         :param collection: The name of the Firestore collection.
         :param doc_id: The ID of the document to update.
         :param updates: A dictionary of fields to update.
         """
-        if not self._db:
-            return
+        def attempt(record, timeout):
+            record['payload'] = updates
+            self._db.collection(collection).document(doc_id).update(updates, retry=None, timeout=timeout)
 
         try:
-            
-            self._db.collection(collection).document(doc_id).update(updates)
-            #self._db.collection(collection).document(doc_id)
-            
+            self._evict_cached(collection, doc_id)
+            self._call(collection, "update", doc_id, attempt)
             print(f"Document '{doc_id}' updated successfully in collection '{collection}'.")
         except Exception as e:
             print(f"Error updating document '{doc_id}': {e}")
+            raise
+
+    def _evict_cached(self, collection: str, doc_id: str):
+        """Drops a document about to be written from the current DocumentCache, if any."""
+        cache = _document_cache.get()
+        if cache is not None:
+            cache.evict((self._project_id, collection, doc_id))
 
-    def get_document(self, collection: str, doc_id: str) -> MapFieldValue:
+    def get_document(self, collection: str, doc_id: str, allow_stale: bool = False) -> MapFieldValue:
         """
         Retrieves a document and returns its data as a dictionary.
+        Errors are re-raised, so an empty result always means the document does not exist.
+        Inside use_document_cache() the document is read at most once per cache.
         
         :param collection: The name of the Firestore collection.
         :param doc_id: The ID of the document to retrieve.
-        :return: A dictionary containing the document data, or an empty dictionary if not found or on error.
+        :param allow_stale: While storage is unavailable, return the last data read instead of failing.
+        :return: A dictionary containing the document data, or an empty dictionary if not found.
         """
-        if not self._db:
-            return {}
+        def attempt(record, timeout):
+            doc = self._db.collection(collection).document(doc_id).get(retry=None, timeout=timeout)
+            record['payload'] = doc.to_dict() if doc.exists else None
+            return record['payload'] or {}
+
+        cache = _document_cache.get()
+        if cache is not None:
+            found, data = cache.get((self._project_id, collection, doc_id))
+            record_cache("documents.shared", found)
+            if found:
+                return data
 
         try:
-            doc_ref = self._db.collection(collection).document(doc_id)
-            doc = doc_ref.get()
-            
-            if doc.exists:
-                print(f"Document '{doc_id}' read successfully.")
-                return doc.to_dict()
-            else:
-                print(f"Document '{doc_id}' does not exist.")
-                return {}
+            data = self._call(collection, "read", doc_id, attempt,
+                              stale_key=("read", collection, doc_id) if allow_stale else None)
         except Exception as e:
             print(f"Error reading document '{doc_id}': {e}")
-            return {}
\ No newline at end of file
+            raise
+        
+        if cache is not None:
+            cache.put((self._project_id, collection, doc_id), data)
+        if data:
+            print(f"Document '{doc_id}' read successfully.")
+        else:
+            print(f"Document '{doc_id}' does not exist.")
+        return data
+
+    def delete_document(self, collection: str, doc_id: str):
+        """
+        Deletes a document. Errors are re-raised so callers can report a failed delete.
+        
+        :param collection: The name of the Firestore collection.
+        :param doc_id: The ID of the document to delete.
+        """
+        def attempt(record, timeout):
+            self._db.collection(collection).document(doc_id).delete(retry=None, timeout=timeout)
+
+        try:
+            self._evict_cached(collection, doc_id)
+            self._call(collection, "delete", doc_id, attempt)
+            print(f"Document '{doc_id}' deleted successfully from collection '{collection}'.")
+        except Exception as e:
+            print(f"Error deleting document '{doc_id}': {e}")
+            raise
+
+    def _build_query(self, collection: str, filters: List[Tuple[str, str, Any]], order_by: str = None,
+                     descending: bool = False, fields: List[str] = None):
+        """Builds a Firestore query and a readable description of it for metrics and tracing."""
+        query = self._db.collection(collection)
+        for field, op, value in filters:
+            query = query.where(field, op, value)
+        if order_by:
+            direction = "DESCENDING" if descending else "ASCENDING"
+            query = query.order_by(order_by, direction=direction)
+        if fields is not None:
+            query = query.select(fields)
+        return query, _describe(filters)
+
+    def query_documents(self, collection: str, filters: List[Tuple[str, str, Any]], order_by: str = None,
+                        descending: bool = False, limit: int = None, fields: List[str] = None,
+                        allow_stale: bool = False) -> List[Tuple[str, MapFieldValue]]:
+        """
+        Runs a query and returns every matching document as a (doc_id, data) pair.
+        Errors are re-raised so callers can tell "no results" apart from a failed query.
+        
+        :param collection: The name of the Firestore collection.
+        :param filters: A list of (field, operator, value) tuples, e.g. [('userId', '==', 'user123')].
+        :param order_by: Optional field to sort the results by.
+        :param descending: Sort order when order_by is given.
+        :param limit: Optional maximum number of documents to return.
+        :param fields: Optional list of fields to fetch; an empty list fetches document IDs only.
+        :param allow_stale: While storage is unavailable, return the last results of the same query instead of failing.
+        :return: A list of (doc_id, data) tuples.
+        """
+        target = _describe(filters)
+
+        def attempt(record, timeout):
+            query, _ = self._build_query(collection, filters, order_by, descending, fields)
+            if limit:
+                query = query.limit(limit)
+            record['payload'] = [(doc.id, doc.to_dict()) for doc in query.stream(retry=None, timeout=timeout)]
+            return record['payload']
+
+        stale_key = None
+        if allow_stale:
+            stale_key = ("query", collection, target, order_by, descending, limit, tuple(fields) if fields is not None else None)
+        try:
+            return self._call(collection, "query", target, attempt, stale_key)
+        except Exception as e:
+            print(f"Error querying collection '{collection}': {e}")
+            raise
+
+    def count_documents(self, collection: str, filters: List[Tuple[str, str, Any]], allow_stale: bool = False) -> int:
+        """
+        Counts the documents matching a query with a server-side aggregation, without
+        downloading them (billed as one read per 1000 index entries).
+        Errors are re-raised so callers can tell "zero" apart from a failed count.
+        
+        :param collection: The name of the Firestore collection.
+        :param filters: A list of (field, operator, value) tuples.
+        :param allow_stale: While storage is unavailable, return the last count of the same query instead of failing.
+        :return: The number of matching documents.
+        """
+        target = _describe(filters)
+
+        def attempt(record, timeout):
+            query, _ = self._build_query(collection, filters)
+            results = query.count(alias="count").get(retry=None, timeout=timeout)
+            return int(results[0][0].value)
+
+        try:
+            return self._call(collection, "count", target, attempt,
+                              stale_key=("count", collection, target) if allow_stale else None)
+        except Exception as e:
+            print(f"Error counting collection '{collection}': {e}")
+            raise
+
+    def iter_documents(self, collection: str, filters: List[Tuple[str, str, Any]], order_by: str = None,
+                       descending: bool = False, page_size: int = 500, fields: List[str] = None):
+        """
+        Yields every matching document as a (doc_id, data) pair, fetching one page at a time
+        with query cursors, so memory stays constant however many documents match.
+        Each page has its own deadline and retries. Errors are re-raised.
+        
+        :param collection: The name of the Firestore collection.
+        :param filters: A list of (field, operator, value) tuples.
+        :param order_by: Optional field to sort by; documents are otherwise returned in ID order.
+        :param descending: Sort order when order_by is given.
+        :param page_size: Documents fetched per round trip.
+        :param fields: Optional list of fields to fetch.
+        """
+        target = _describe(filters)
+        last_snapshot = None
+
+        def attempt(record, timeout):
+            query, _ = self._build_query(collection, filters, order_by, descending, fields)
+            page_query = query.limit(page_size)
+            if last_snapshot is not None:
+                page_query = page_query.start_after(last_snapshot)
+            snapshots = list(page_query.stream(retry=None, timeout=timeout))
+            record['payload'] = [snapshot.to_dict() for snapshot in snapshots]
+            return snapshots, record['payload']
+
+        try:
+            while True:
+                snapshots, page = self._call(collection, "query", target, attempt)
+                for snapshot, data in zip(snapshots, page):
+                    yield snapshot.id, data
+                if len(snapshots) < page_size:
+                    return
+                last_snapshot = snapshots[-1]
+        except Exception as e:
+            print(f"Error iterating collection '{collection}': {e}")
+            raise
+
+    def stream_documents(self, collection: str) -> List[Tuple[str, MapFieldValue]]:
+        """
+        Reads every document of a collection as a (doc_id, data) pair.
+        
+        :param collection: The name of the Firestore collection.
+        :return: A list of (doc_id, data) tuples.
+        """
+        return self.query_documents(collection, [])
+
+    def batch_write(self, operations: List[Tuple[str, str, str, MapFieldValue]]):
+        """
+        Commits several writes atomically: either all of them are applied or none are.
+        Errors are re-raised so callers know nothing was written.
+        
+        :param operations: A list of (action, collection, doc_id, data) tuples where action is
+                           'set', 'update', 'merge' or 'delete' (data is ignored for deletes).
+                           'merge' creates the document if needed and merges nested maps into it
+                           instead of replacing them; fields set to DELETE_FIELD are removed.
+                           Firestore allows at most 500 operations per batch.
+        """
+        if not operations:
+            return
+
+        collections = ",".join(sorted({collection for _, collection, _, _ in operations}))
+
+        def attempt(record, timeout):
+            batch = self._db.batch()
+            self._stage(batch, operations)
+            record['payload'] = [data for _, _, _, data in operations if data]
+            batch.commit(retry=None, timeout=timeout)
+
+        try:
+            for _, collection, doc_id, _ in operations:
+                self._evict_cached(collection, doc_id)
+            self._call(collections, "batch", f"{len(operations)} ops", attempt)
+            print(f"Batch of {len(operations)} operations committed successfully.")
+        except Exception as e:
+            print(f"Error committing batch of {len(operations)} operations: {e}")
+            raise
+
+    def transact(self, reads: List[Tuple[str, str]],
+                 decide: Callable[[Dict[Tuple[str, str], MapFieldValue]], List[Tuple[str, str, str, MapFieldValue]]]
+                 ) -> List[Tuple[str, str, str, MapFieldValue]]:
+        """
+        Reads documents and commits the writes decided from them in one transaction, so
+        nothing written in between is overwritten: if a document read changes before the
+        commit, it is read again and decide runs again. Use it for read-modify-write.
+        Errors (including those raised by decide) are re-raised and nothing is written.
+        
+        :param reads: (collection, doc_id) pairs of the documents to read.
+        :param decide: Given {(collection, doc_id): data, or None if missing}, returns the
+                       (action, collection, doc_id, data) writes to commit, as for batch_write.
+                       May run several times, so it should only compute.
+        :return: The writes committed.
+        """
+        collections = ",".join(sorted({collection for collection, _ in reads}))
+
+        def attempt(record, timeout):
+            operations = self._run_transaction(reads, decide, timeout)
+            record['payload'] = [data for _, _, _, data in operations if data]
+            return operations
+
+        try:
+            for collection, doc_id in reads:
+                self._evict_cached(collection, doc_id)
+            operations = self._call(collections, "transaction", f"{len(reads)} docs", attempt)
+            for _, collection, doc_id, _ in operations:
+                self._evict_cached(collection, doc_id)
+            print(f"Transaction over {len(reads)} documents committed {len(operations)} writes.")
+            return operations
+        except Exception as e:
+            print(f"Error running transaction over {len(reads)} documents: {e}")
+            raise
+
+    def _run_transaction(self, reads, decide, timeout):
+        """One Firestore transaction, which the SDK retries itself when it contends with another."""
+        from firebase_admin import firestore
+
+        @firestore.transactional
+        def run(transaction):
+            documents = {}
+            for collection, doc_id in reads:
+                snapshot = self._db.collection(collection).document(doc_id).get(transaction=transaction, timeout=timeout)
+                documents[(collection, doc_id)] = snapshot.to_dict() if snapshot.exists else None
+            operations = list(decide(documents))
+            self._stage(transaction, operations)
+            return operations
+
+        return run(self._db.transaction())
+
+    def _stage(self, writer, operations: List[Tuple[str, str, str, MapFieldValue]]):
+        """Adds (action, collection, doc_id, data) writes to a batch or transaction."""
+        for action, collection, doc_id, data in operations:
+            doc_ref = self._db.collection(collection).document(doc_id)
+            if action == "set":
+                writer.set(doc_ref, data)
+            elif action == "update":
+                writer.update(doc_ref, data)
+            elif action == "merge":
+                writer.set(doc_ref, self._merge_data(data), merge=True)
+            elif action == "delete":
+                writer.delete(doc_ref)
+            else:
+                raise ValueError(f"Unknown batch action '{action}'")
+
+
+    def _merge_data(self, data: MapFieldValue) -> MapFieldValue:
+        """Swaps DELETE_FIELD for the SDK's own sentinel (imported here, like the SDK itself)."""
+        from firebase_admin import firestore
+
+        def convert(value):
+            if value is DELETE_FIELD:
+                return firestore.DELETE_FIELD
+            if isinstance(value, dict):
+                return {key: convert(item) for key, item in value.items()}
+            return value
+        return convert(data)
+
+
+def connect(project_id: str, credentials_path: str = None) -> Database:
+    """
+    Returns the Database the services should use: Firestore, or when DRIVESENSE_LOCAL_DB is
+    set (to a file path, or ':memory:'), a LocalDatabase shared by every service in the process.
+    
+    :param project_id: The ID of your Google Cloud project.
+    :param credentials_path: Optional path to your service account JSON file.
+    """
+    local_path = os.environ.get("DRIVESENSE_LOCAL_DB")
+    if local_path:
+        from LocalDatabase import shared_local_database
+        return shared_local_database(local_path)
+    return Database(project_id, credentials_path=credentials_path)
@@ -1,7 +1,11 @@
 from User import EmergencyContact, User 
 from Event import Event
 from typing import Dict, Any, List
+from datetime import datetime, timezone
 
+VALID_STATUSES = ["Unstable", "Severe", "LockedIn", "Idle", "Critical", "Mild", "Stable"]
+# Statuses that need a monitoring staff member's attention
+ELEVATED_STATUSES = ["Severe", "Critical"]
 
 class Driver:
     """Represents a driver, potentially including their safety data."""
@@ -24,6 +28,7 @@ class Driver:
         
         self._driving: bool = False
         self._status: str = "Idle"  #
+        self._status_updated_at: datetime = datetime.now(timezone.utc)
 
     # Getters
     def get_name(self) -> str:
@@ -70,6 +75,9 @@ class Driver:
     
     def get_status(self) -> str:
         return self._status
+    
+    def get_status_updated_at(self) -> datetime:
+        return self._status_updated_at
 
     # Setters
     def set_name(self, n: str):
@@ -116,14 +124,14 @@ class Driver:
     
     def set_status(self, status: str):
         """
-        Sets the driver's status.
-        Valid options: Unstable, Severe, LockedIn, Idle
+        Sets the driver's status and records when it changed.
+        Valid options: see VALID_STATUSES
         """
-        valid_statuses = ["Unstable", "Severe", "LockedIn", "Idle"]
-        if status in valid_statuses:
+        if status in VALID_STATUSES:
             self._status = status
+            self._status_updated_at = datetime.now(timezone.utc)
         else:
-            raise ValueError(f"Invalid status. Must be one of: {', '.join(valid_statuses)}")
+            raise ValueError(f"Invalid status. Must be one of: {', '.join(VALID_STATUSES)}")
 
     def to_map(self) -> Dict[str, Any]:
         """Converts the driver and their lists to a dictionary for Firestore storage."""
@@ -142,5 +150,6 @@ class Driver:
             "vehicleSpeed": self._vehicle_speed,
             "videoLink": self._video_link,
             "driving": self._driving,
-            "status": self._status
+            "status": self._status,
+            "statusUpdatedAt": self._status_updated_at
         }
\ No newline at end of file
@@ -1,28 +1,88 @@
-from flask import Flask, request, jsonify
-from Database import Database
-from Driver import Driver
+from flask import Flask, Response, request, jsonify
+from Database import connect
+from Driver import Driver, VALID_STATUSES
 from User import EmergencyContact
-from Event import Event
+from Event import Event, event_occurred_at
 from flask_cors import CORS
+from Metrics import register_metrics
+from Tracing import register_tracing
+from RateLimit import register_rate_limiting
+from Cascade import cascade_delete_driver, driver_deletion_is_large
+from Jobs import job_runner, register_job_routes, RetryPolicy
+from SingleFlight import SingleFlight
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from Alerts import AlertFeed, is_escalation
+from Export import EXPORT_FORMATS, DRIVER_COLUMNS, driver_rows, export_response
+from Startup import register_readiness
+from Ids import IdAliases, register_id_aliases
+from Outbox import apply_record, outbox_operations, upsert_record
+from Anomaly import AnomalyDetector
+from WriteBehind import WriteBehindBuffer
+from Blobs import blob_store, register_blob_routes
+from Dashboard import card_event, card_operations, driver_card, last_event_operations, read_dashboard, rebuild_dashboard
+from Resilience import register_resilience
+from Idempotency import register_idempotency
+from Batch import register_batch
+from Search import DEFAULT_LIMIT, SearchIndex
+import contextvars
 import json
+import uuid
 
 app = Flask(__name__)
 CORS(app)
+register_metrics(app, "drivers")
 
 PROJECT_ID = "drivesense-c1d4c"
 CREDENTIALS_FILE = "src/db/database_key.json"
 DRIVER_COLLECTION = "drivers"
 EVENT_COLLECTION = "events"
+# Latest-vitals fields reported by the fleet summary
+VITALS_FIELDS = ["heartRate", "bloodOxygenLevel", "vehicleSpeed"]
+# Fields a live driver reports many times a second; buffered and written at most once per interval
+LIVE_FIELDS = VITALS_FIELDS + ["timeStamp", "driving"]
 
-db_handler = Database(PROJECT_ID, credentials_path=CREDENTIALS_FILE)
+db_handler = connect(PROJECT_ID, credentials_path=CREDENTIALS_FILE)
+register_tracing(app, db_handler)
+register_rate_limiting(app, db_handler, "drivers")
+register_resilience(app)
+register_idempotency(app, "drivers")
+register_batch(app, "drivers")
+register_blob_routes(app)
+register_job_routes(app)
+warm_up = register_readiness(app, db_handler)
+# IDs are generated here; the IDs clients used to mint keep working as aliases
+driver_ids = IdAliases(db_handler, DRIVER_COLLECTION)
+event_ids = IdAliases(db_handler, EVENT_COLLECTION)
+register_id_aliases(app, {'driver_id': driver_ids})
+
+# Concurrent dashboard polls for the same user share one Firestore query
+drivers_by_user_flight = SingleFlight("drivers_by_user")
+# Runs the handful of aggregation queries behind a fleet summary side by side
+summary_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fleet-summary")
+# Status transitions into Severe/Critical, persisted and streamed to monitoring staff
+alert_feed = AlertFeed(db_handler)
+# Derives driver statuses from the live vitals readings sent to this process
+vitals_detector = AnomalyDetector()
+# Coalesces live field updates per driver; reads in this process see them before they are flushed
+# (each flush also refreshes the drivers' dashboard cards; the context of a put is the owner's user ID)
+live_writes = WriteBehindBuffer(db_handler, DRIVER_COLLECTION,
+                                related_operations=lambda driver_id, updates, user_id: card_operations(user_id, driver_id, updates))
+# Per-user driver search, kept current by the write paths below
+search_index = SearchIndex(db_handler)
 
 def create_new_driver(driver_id, name, phone_number, user_id, profile_pic="", product_id=0, emergency_contacts=None, events=None, time_stamp="", date="", heart_rate=0, blood_oxygen_level=0, vehicle_speed=0, video_link="", driving=False, status="Idle"):
     """
     Creates a new driver in the database with all driver fields.
     NOW REQUIRES user_id to link driver to user.
     Automatically sets driving based on status.
+    The driver and its events get generated IDs; IDs supplied by the client become aliases.
+    The driver's card is added to the user's dashboard in the same batch.
+    A profile picture sent as a data URL goes to the blob store; the driver keeps its URL.
     """
     try:
+        driver_id, batch_operations = driver_ids.assign(driver_id)
+        
         # Auto-set driving based on status
         if status != "Idle":
             driving = True
@@ -30,7 +90,8 @@ def create_new_driver(driver_id, name, phone_number, user_id, profile_pic="", pr
             driving = False
             
         # Create driver with user_id
-        driver = Driver(name, phone_number, profile_pic, product_id, user_id)
+        pictures = blob_store.image_fields(profile_pic, "profilePic")
+        driver = Driver(name, phone_number, pictures["profilePic"], product_id, user_id)
         
         driver.set_time_stamp(time_stamp)
         driver.set_date(date)
@@ -49,10 +110,13 @@ def create_new_driver(driver_id, name, phone_number, user_id, profile_pic="", pr
                 )
                 driver.add_emergency_contact(contact)
         
+        # Events and the driver are committed together in one atomic batch
         if events:
             for event_data in events:
+                event_id, alias_operations = event_ids.assign(event_data.get('eventId'))
+                batch_operations += alias_operations
                 event = Event(
-                    event_data.get('eventId', ''),
+                    event_id,
                     event_data.get('status', ''),
                     event_data.get('timeStamp', ''),
                     event_data.get('date', ''),
@@ -67,13 +131,22 @@ def create_new_driver(driver_id, name, phone_number, user_id, profile_pic="", pr
                 event_dict = event.to_map()
                 event_dict['driverId'] = driver_id
                 event_dict['userId'] = user_id 
-                db_handler.set_document(EVENT_COLLECTION, event_data.get('eventId'), event_dict)
+                batch_operations.append(("set", EVENT_COLLECTION, event_id, event_dict))
+        
+        driver_data = dict(driver.to_map(), **pictures)
+        batch_operations.append(("set", DRIVER_COLLECTION, driver_id, driver_data))
+        batch_operations += card_operations(user_id, driver_id, driver_card(driver_data))
         
-        driver_data = driver.to_map()
+        db_handler.batch_write(batch_operations)
+        search_index.update(user_id, driver_id, driver_data)
         
-        db_handler.set_document(DRIVER_COLLECTION, driver_id, driver_data)
+        if is_escalation(None, status):
+            alert_feed.publish(user_id, driver_id, name, None, status)
         
-        return driver_data
+        return dict(driver_data, driverId=driver_id)
+    except ValueError:
+        # An unusable profile picture; the caller answers 400
+        raise
     except Exception as e:
         raise Exception(f"Failed to create driver: {str(e)}")
 
@@ -81,7 +154,9 @@ def edit_driver_field(field_to_change, new_value, driver_id, user_id):
     """
     Edits a specific field of a driver.
     NOW VALIDATES that the driver belongs to the user.
-    If status is changed, automatically updates driving field.
+    If status is changed, automatically updates driving field and the status
+    timestamp, and raises an alert when the driver enters an elevated status.
+    A new profile picture sent as a data URL goes to the blob store.
     """
     try:
         existing_driver = db_handler.get_document(DRIVER_COLLECTION, driver_id)
@@ -91,23 +166,100 @@ def edit_driver_field(field_to_change, new_value, driver_id, user_id):
         if existing_driver.get('userId') != user_id:
             raise Exception("Unauthorized: You don't have permission to edit this driver")
         
+        live_writes.overlay(driver_id, existing_driver)
+        if field_to_change in VITALS_FIELDS:
+            return record_vitals(driver_id, user_id, {field_to_change: new_value}, existing_driver)
+        if field_to_change in LIVE_FIELDS:
+            live_writes.put(driver_id, {field_to_change: new_value}, user_id)
+            return {field_to_change: new_value}
+        
         update_fields = {field_to_change: new_value}
+        if field_to_change == "profilePic":
+            # Only the URLs of the stored picture and its thumbnail go into the document
+            update_fields = blob_store.image_fields(new_value, "profilePic")
         
         # If status is being updated, also update driving accordingly
+        old_status = existing_driver.get('status')
         if field_to_change == "status":
             should_be_driving = new_value != "Idle"
             update_fields["driving"] = should_be_driving
+            if new_value != old_status:
+                update_fields["statusUpdatedAt"] = datetime.now(timezone.utc)
+        
+        # A buffered value flushed later would revert the field written here
+        live_writes.discard(driver_id, update_fields.keys())
+        db_handler.batch_write([("update", DRIVER_COLLECTION, driver_id, update_fields)]
+                               + card_operations(user_id, driver_id, update_fields))
+        search_index.update(user_id, driver_id, {**existing_driver, **update_fields}, changed=update_fields)
         
-        db_handler.update_document(DRIVER_COLLECTION, driver_id, update_fields)
+        if field_to_change == "status" and is_escalation(old_status, new_value):
+            alert_feed.publish(user_id, driver_id, existing_driver.get('name'), old_status, new_value)
         
         return update_fields
+    except ValueError:
+        raise
     except Exception as e:
         raise Exception(f"Failed to update driver field: {str(e)}")
 
+def record_vitals(driver_id, user_id, readings, existing_driver=None):
+    """
+    Stores a driver's latest vitals readings and feeds them to the anomaly detector.
+    Readings are buffered by live_writes and flushed in batches. When the detector calls for
+    a new status, the status change, an event recording it and the outbox record that adds
+    the event to the driver's events array are written at once in the same atomic batch as
+    the readings (and any still buffered), and an alert is raised if the status is elevated.
+    Returns the fields updated on the driver.
+    """
+    try:
+        if existing_driver is None:
+            existing_driver = db_handler.get_document(DRIVER_COLLECTION, driver_id)
+            if not existing_driver:
+                raise Exception("Driver not found")
+            if existing_driver.get('userId') != user_id:
+                raise Exception("Unauthorized: You don't have permission to edit this driver")
+            live_writes.overlay(driver_id, existing_driver)
+        
+        old_status = existing_driver.get('status')
+        transition = vitals_detector.observe(driver_id, readings, old_status)
+        if not transition:
+            live_writes.put(driver_id, readings, user_id)
+            return dict(readings)
+        
+        new_status = transition['toStatus']
+        now = datetime.now(timezone.utc)
+        buffered = live_writes.take(driver_id)
+        update_fields = {**buffered, **readings, 'status': new_status, 'driving': True, 'statusUpdatedAt': now}
+        
+        vitals = {field: existing_driver.get(field, 0) for field in VITALS_FIELDS}
+        vitals.update(readings)
+        event = Event(uuid.uuid4().hex, new_status, now.isoformat().replace('+00:00', 'Z'), now.strftime('%Y-%m-%d'),
+                      "", vitals['heartRate'], vitals['bloodOxygenLevel'], vitals['vehicleSpeed']).to_map()
+        event_data = dict(event, driverId=driver_id, userId=user_id, reasons=transition['reasons'])
+        operations = [("set", EVENT_COLLECTION, event['eventId'], event_data)]
+        operations += outbox_operations([upsert_record(driver_id, event)])
+        operations += card_operations(user_id, driver_id, dict(update_fields, lastEvent=card_event(event)))
+        print(f"Driver '{driver_id}' moved from {old_status} to {new_status}: {', '.join(transition['reasons']) or 'vitals normal'}")
+        
+        try:
+            db_handler.batch_write([("update", DRIVER_COLLECTION, driver_id, update_fields)] + operations)
+        except Exception:
+            # The readings buffered earlier were already accepted, so keep them for the next flush
+            live_writes.put(driver_id, buffered, user_id)
+            raise
+        
+        if is_escalation(old_status, new_status):
+            alert_feed.publish(user_id, driver_id, existing_driver.get('name'), old_status, new_status)
+        
+        return update_fields
+    except Exception as e:
+        raise Exception(f"Failed to record vitals: {str(e)}")
+
 def remove_driver(driver_id, user_id):
     """
     Removes a driver from the database AND all their associated events.
     NOW VALIDATES that the driver belongs to the user.
+    Drivers with many events are deleted by a background job, which is
+    returned; otherwise the deletion finishes here and None is returned.
     """
     try:
         existing_driver = db_handler.get_document(DRIVER_COLLECTION, driver_id)
@@ -118,82 +270,198 @@ def remove_driver(driver_id, user_id):
         if existing_driver.get('userId') != user_id:
             raise Exception("Unauthorized: You don't have permission to delete this driver")
         
-        # Delete all events associated with this driver
-        events = existing_driver.get('events', [])
-        for event in events:
-            event_id = event.get('eventId')
-            if event_id:
-                try:
-                    db_handler._db.collection(EVENT_COLLECTION).document(event_id).delete()
-                except:
-                    pass  
+        vitals_detector.forget(driver_id)
+        live_writes.take(driver_id)
+        search_index.remove(user_id, driver_id)
+        if driver_deletion_is_large(db_handler, driver_id):
+            return job_runner.submit("delete_driver", {"driverId": driver_id})
         
-        # Delete the driver
-        db_handler._db.collection(DRIVER_COLLECTION).document(driver_id).delete()
+        # Delete all events associated with this driver, then the driver itself
+        deletion = cascade_delete_driver(db_handler, driver_id, existing_driver)
+        if deletion.status == "failed":
+            raise Exception(deletion.error)
         
-        return True
+        return None
     except Exception as e:
         raise Exception(f"Failed to delete driver: {str(e)}")
 
-def get_driver_by_id(driver_id, user_id):
+def delete_driver_job(job, driverId):
+    """
+    Background job that cascades a driver deletion, reporting progress to the job.
+    """
+    driver_data = db_handler.get_document(DRIVER_COLLECTION, driverId)
+    if not driver_data:
+        return {"deleted": 0}
+    
+    deletion = cascade_delete_driver(db_handler, driverId, driver_data, job)
+    if deletion.status == "failed":
+        raise Exception(deletion.error)
+    return deletion.to_map()
+
+# Cascades are idempotent, so a failed run can safely be retried
+job_runner.register("delete_driver", delete_driver_job, RetryPolicy(max_attempts=3, backoff_seconds=5))
+
+def rebuild_dashboard_job(job, userId):
+    """
+    Background job that rebuilds a user's dashboard from their drivers, e.g. one whose
+    drivers predate dashboards. Clients enqueue it through POST /jobs.
+    """
+    dashboard = rebuild_dashboard(db_handler, userId)
+    return {"drivers": len(dashboard["drivers"])}
+
+def authorize_rebuild_dashboard(params):
+    """Checks the params of a rebuild_dashboard job sent to POST /jobs."""
+    if set(params) != {"userId"} or not isinstance(params["userId"], str) or not params["userId"]:
+        raise ValueError("rebuild_dashboard takes a single param: userId")
+
+# Rebuilds are idempotent too
+job_runner.register("rebuild_dashboard", rebuild_dashboard_job, RetryPolicy(max_attempts=3, backoff_seconds=5),
+                    authorize=authorize_rebuild_dashboard)
+
+def check_driver_owner(driver_data, user_id):
+    """Returns the driver read, raising if it is missing or belongs to someone else."""
+    if not driver_data:
+        raise Exception("Driver not found")
+    
+    if driver_data.get('userId') != user_id:
+        raise Exception("Unauthorized: You don't have permission to view this driver")
+    
+    return driver_data
+
+def get_driver_by_id(driver_id, user_id, allow_stale=False):
     """
     Retrieves a driver from the database.
     NOW VALIDATES that the driver belongs to the user.
+    With allow_stale, the last copy read is returned while storage is unavailable,
+    so only read-only callers should pass it.
     """
     try:
-        driver_data = db_handler.get_document(DRIVER_COLLECTION, driver_id)
+        driver_data = check_driver_owner(
+            db_handler.get_document(DRIVER_COLLECTION, driver_id, allow_stale=allow_stale), user_id)
         
-        if not driver_data:
-            raise Exception("Driver not found")
-        
-        if driver_data.get('userId') != user_id:
-            raise Exception("Unauthorized: You don't have permission to view this driver")
-        
-        return driver_data
+        return live_writes.overlay(driver_id, driver_data)
     except Exception as e:
         raise Exception(f"Failed to retrieve driver: {str(e)}")
 
 def get_drivers_by_user(user_id):
     """
     NEW: Retrieves all drivers belonging to a specific user.
+    Identical concurrent calls are coalesced into a single query, and while storage
+    is unavailable the last results read are returned.
     """
     try:
         # Query Firestore for drivers with matching userId
-        drivers_ref = db_handler._db.collection(DRIVER_COLLECTION)
-        query = drivers_ref.where('userId', '==', user_id)
-        results = query.stream()
+        results = drivers_by_user_flight.do(user_id, lambda: db_handler.query_documents(
+            DRIVER_COLLECTION, [('userId', '==', user_id)], allow_stale=True))
         
         drivers_list = []
-        for doc in results:
-            driver_data = doc.to_dict()
-         
+        for doc_id, driver_data in results:
+            # The query result is shared with coalesced callers, so copy before adding fields
+            driver_data = live_writes.overlay(doc_id, dict(driver_data))
             if 'driverId' not in driver_data:
-                driver_data['driverId'] = doc.id
+                driver_data['driverId'] = doc_id
             drivers_list.append(driver_data)
         
         return drivers_list
     except Exception as e:
         raise Exception(f"Failed to retrieve drivers: {str(e)}")
 
+def get_drivers_by_status(user_id, statuses, limit=50):
+    """
+    Retrieves a user's drivers that are in one of the given statuses, most recently
+    changed first, through the (userId, status, statusUpdatedAt) index. Drivers without
+    statusUpdatedAt aren't in the index; python Migrations.py status-timestamps dates them.
+    """
+    try:
+        results = db_handler.query_documents(
+            DRIVER_COLLECTION,
+            [('userId', '==', user_id), ('status', 'in', statuses)],
+            order_by='statusUpdatedAt', descending=True, limit=limit, allow_stale=True
+        )
+        
+        drivers_list = []
+        for doc_id, driver_data in results:
+            if 'driverId' not in driver_data:
+                driver_data['driverId'] = doc_id
+            drivers_list.append(driver_data)
+        
+        return drivers_list
+    except Exception as e:
+        raise Exception(f"Failed to retrieve drivers by status: {str(e)}")
+
+def _vitals_extreme(user_id, field, descending):
+    """
+    Returns the driving driver with the highest (or lowest) value of a vitals field,
+    reading a single document through the (userId, driving, field) index.
+    """
+    results = db_handler.query_documents(
+        DRIVER_COLLECTION,
+        [('userId', '==', user_id), ('driving', '==', True)],
+        order_by=field, descending=descending, limit=1, fields=[field, 'name'], allow_stale=True
+    )
+    if not results:
+        return None
+    doc_id, driver_data = results[0]
+    return {'driverId': doc_id, 'name': driver_data.get('name'), 'value': driver_data.get(field)}
+
+def get_fleet_summary(user_id):
+    """
+    Summarizes a user's fleet with server-side count aggregations and single-document
+    ordered reads, so the cost stays at a handful of reads however many drivers there are.
+    Vitals extremes only consider drivers that are currently driving, since idle drivers
+    keep their last (stale) readings. Each read falls back to its last result while
+    storage is unavailable.
+    """
+    try:
+        def submit(fn, *args):
+            # Each read runs in a copy of this request's context, so a stale result still
+            # flags the response and the read shows up in the request's trace
+            return summary_pool.submit(contextvars.copy_context().run, fn, *args)
+        
+        user_filter = [('userId', '==', user_id)]
+        count = lambda filters: db_handler.count_documents(DRIVER_COLLECTION, filters, allow_stale=True)
+        total = submit(count, user_filter)
+        driving = submit(count, user_filter + [('driving', '==', True)])
+        statuses = {status: submit(count, user_filter + [('status', '==', status)])
+                    for status in VALID_STATUSES}
+        extremes = {field: (submit(_vitals_extreme, user_id, field, True),
+                            submit(_vitals_extreme, user_id, field, False))
+                    for field in VITALS_FIELDS}
+        
+        total_count = total.result()
+        driving_count = driving.result()
+        return {
+            'total': total_count,
+            'statusCounts': {status: future.result() for status, future in statuses.items()},
+            'driving': driving_count,
+            'notDriving': total_count - driving_count,
+            'vitals': {field: {'max': high.result(), 'min': low.result()}
+                       for field, (high, low) in extremes.items()}
+        }
+    except Exception as e:
+        raise Exception(f"Failed to summarize fleet: {str(e)}")
+
 def add_emergency_contact_to_driver(driver_id, user_id, contact_name, contact_phone):
     """
     Adds an emergency contact to a driver.
     NOW VALIDATES that the driver belongs to the user.
     """
     try:
-        driver_data = get_driver_by_id(driver_id, user_id)
-        
         new_contact = {
             "name": contact_name,
             "phone_number": contact_phone
         }
         
-        if "emergency_contacts" not in driver_data:
-            driver_data["emergency_contacts"] = []
+        written = {}
         
-        driver_data["emergency_contacts"].append(new_contact)
+        def decide(documents):
+            driver_data = check_driver_owner(documents[(DRIVER_COLLECTION, driver_id)], user_id)
+            written["driver"] = dict(driver_data, emergency_contacts=driver_data.get("emergency_contacts", []) + [new_contact])
+            return [("update", DRIVER_COLLECTION, driver_id, {"emergency_contacts": written["driver"]["emergency_contacts"]})]
         
-        db_handler.set_document(DRIVER_COLLECTION, driver_id, driver_data)
+        # Only the contacts are written, in a transaction, so concurrent writes to the driver survive
+        db_handler.transact([(DRIVER_COLLECTION, driver_id)], decide)
+        search_index.update(user_id, driver_id, written["driver"])
         
         return new_contact
     except Exception as e:
@@ -203,32 +471,30 @@ def add_event_to_driver(driver_id, user_id, event_id, status, time_stamp, date,
     """
     Adds an event to a driver AND creates it in the events collection.
     NOW VALIDATES that the driver belongs to the user.
+    The event gets a generated ID; an event_id supplied by the client becomes its alias.
     """
     try:
-        driver_data = get_driver_by_id(driver_id, user_id)
-        
-        new_event = {
-            "eventId": event_id,
-            "status": status,
-            "timeStamp": time_stamp,
-            "date": date,
-            "videoLink": video_link,
-            "heartRate": heart_rate,
-            "bloodOxygenLevel": blood_oxygen_level,
-            "vehicleSpeed": vehicle_speed
-        }
+        event_id, alias_operations = event_ids.assign(event_id)
         
-        if "events" not in driver_data:
-            driver_data["events"] = []
+        new_event = Event(event_id, status, time_stamp, date, video_link, heart_rate, blood_oxygen_level, vehicle_speed).to_map()
         
-        driver_data["events"].append(new_event)        
-        db_handler.set_document(DRIVER_COLLECTION, driver_id, driver_data)
-        
-        # Also create event in events collection
+        # Also create event in events collection, atomically with the driver update
         event_data = new_event.copy()
         event_data['driverId'] = driver_id
         event_data['userId'] = user_id  
-        db_handler.set_document(EVENT_COLLECTION, event_id, event_data)
+        
+        def decide(documents):
+            driver_data = check_driver_owner(documents[(DRIVER_COLLECTION, driver_id)], user_id)
+            # A retried request replaces the entry it added before instead of appending a duplicate
+            events = apply_record(driver_data.get("events", []), upsert_record(driver_id, new_event))
+            return [
+                ("update", DRIVER_COLLECTION, driver_id, {"events": events}),
+                ("set", EVENT_COLLECTION, event_id, event_data)
+            ] + alias_operations + last_event_operations(user_id, driver_id, new_event)
+        
+        # Only the events array is written, in a transaction, so concurrent writes to the
+        # driver (the outbox worker's included) survive
+        db_handler.transact([(DRIVER_COLLECTION, driver_id)], decide)
         
         return new_event
     except Exception as e:
@@ -254,6 +520,147 @@ def get_drivers_by_user_endpoint(user_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/drivers/user/<user_id>/dashboard', methods=['GET'])
+def get_dashboard_endpoint(user_id):
+    """
+    Retrieves the dashboard cards of a user's drivers (name, status, driving, latest vitals,
+    profile picture thumbnail and last event) with a single document read, whatever the fleet size.
+    Live vitals may lag the driver documents by one write-behind interval.
+    Example: GET /drivers/user/user123/dashboard
+    """
+    try:
+        cards = read_dashboard(db_handler, user_id, allow_stale=True)
+        
+        return jsonify({
+            'message': 'Dashboard retrieved successfully',
+            'drivers': cards,
+            'count': len(cards)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/drivers/user/<user_id>/search', methods=['GET'])
+def search_drivers_endpoint(user_id):
+    """
+    Searches a user's drivers by name, phone number, product ID and emergency contact
+    names, in memory. Every term must match, as a whole word, a prefix or (from 3
+    characters) anywhere in a word; results are ranked best first.
+    Example: GET /drivers/user/user123/search?q=jan+do&limit=10
+    """
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'Missing required query parameter: q'}), 400
+        try:
+            limit = int(request.args.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        
+        results = search_index.search(user_id, query, limit)
+        
+        return jsonify({
+            'message': 'Drivers found successfully',
+            'query': query,
+            'drivers': results,
+            'count': len(results)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/drivers/user/<user_id>/status', methods=['GET'])
+def get_drivers_by_status_endpoint(user_id):
+    """
+    Retrieves a user's drivers in the given statuses (default: Severe and Critical),
+    most recently changed first.
+    Example: GET /drivers/user/user123/status?status=Severe,Critical&limit=20
+    """
+    try:
+        statuses = [s for s in request.args.get('status', 'Severe,Critical').split(',') if s]
+        invalid = [s for s in statuses if s not in VALID_STATUSES]
+        if not statuses or invalid:
+            return jsonify({'error': f'Invalid status. Must be one of: {", ".join(VALID_STATUSES)}'}), 400
+        
+        limit = request.args.get('limit', 50, type=int)
+        drivers_list = get_drivers_by_status(user_id, statuses, limit)
+        
+        return jsonify({
+            'message': 'Drivers retrieved successfully',
+            'drivers': drivers_list,
+            'count': len(drivers_list)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/alerts/<user_id>', methods=['GET'])
+def get_alerts(user_id):
+    """
+    Retrieves a user's most recent alerts (drivers entering Severe or Critical), newest first.
+    Example: GET /alerts/user123?limit=20
+    """
+    try:
+        alerts = alert_feed.recent(user_id, request.args.get('limit', 50, type=int))
+        
+        return jsonify({
+            'message': 'Alerts retrieved successfully',
+            'alerts': alerts,
+            'count': len(alerts)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/alerts/<user_id>/stream', methods=['GET'])
+def stream_alerts(user_id):
+    """
+    Streams a user's alerts as they happen, as Server-Sent Events, including those raised by
+    other instances. A reconnecting EventSource sends the Last-Event-ID header and resumes after
+    the last alert it received; lastEventId in the query string does the same for other clients.
+    Example: new EventSource('/alerts/user123/stream')
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    return Response(alert_feed.stream(user_id, last_event_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/fleet/<user_id>/summary', methods=['GET'])
+def get_fleet_summary_endpoint(user_id):
+    """
+    Returns status counts, driving counts and latest-vitals extremes for a user's fleet,
+    computed without downloading the driver documents.
+    Example: GET /fleet/user123/summary
+    """
+    try:
+        summary = get_fleet_summary(user_id)
+        
+        return jsonify({
+            'message': 'Fleet summary retrieved successfully',
+            'summary': summary
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/export/drivers', methods=['GET'])
+def export_drivers():
+    """
+    Streams a user's drivers (without embedded events or pictures) as NDJSON, CSV or Parquet.
+    Example: GET /export/drivers?userId=user123&format=parquet
+    """
+    try:
+        user_id = request.args.get('userId')
+        export_format = request.args.get('format', 'ndjson')
+        if not user_id:
+            return jsonify({'error': 'userId is required'}), 400
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f"Invalid format. Must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+
+        return export_response(driver_rows(db_handler, user_id), DRIVER_COLUMNS, export_format, f"drivers-{user_id}")
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/drivers', methods=['POST'])
 def create_driver():
     """
@@ -261,11 +668,11 @@ def create_driver():
     NOW REQUIRES userId in payload.
     Automatically sets driving based on status.
     Expected JSON payload: {
-        "driverId": "string",
+        "driverId": "string",  <- optional, the response carries the ID the driver was stored under
         "userId": "string",  <- NEW REQUIRED FIELD
         "name": "string", 
         "phoneNumber": "string",
-        "profilePic": "string",
+        "profilePic": "string",  <- a URL, or an image as a base64 data URL
         "productId": 0,
         "status": "string",  <- Driving will be auto-set based on this
         ...
@@ -273,20 +680,20 @@ def create_driver():
     """
     try:
         data = request.get_json()        
-        required_fields = ['driverId', 'name', 'phoneNumber', 'userId']
+        required_fields = ['name', 'phoneNumber', 'userId']
         
         for field in required_fields:
             if field not in data:
                 return jsonify({'error': f'Missing required field: {field}'}), 400
         
         # Validate status if provided
-        valid_statuses = ["Unstable", "Severe", "LockedIn", "Idle", "Critical", "Mild", "Stable"]
+        valid_statuses = VALID_STATUSES
         status = data.get('status', 'Idle')
         if status not in valid_statuses:
             return jsonify({'error': f'Invalid status. Must be one of: {", ".join(valid_statuses)}'}), 400
         
         driver_data = create_new_driver(
-            data['driverId'],
+            data.get('driverId'),
             data['name'],
             data['phoneNumber'],
             data['userId'],
@@ -309,6 +716,8 @@ def create_driver():
             'driver': driver_data
         }), 201
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -335,7 +744,7 @@ def update_driver(driver_id):
         
         # Validate status if updating status field
         if data['fieldToChange'] == 'status':
-            valid_statuses = ["Unstable", "Severe", "LockedIn", "Idle", "Critical", "Mild", "Stable"]
+            valid_statuses = VALID_STATUSES
             if data['newValue'] not in valid_statuses:
                 return jsonify({'error': f'Invalid status. Must be one of: {", ".join(valid_statuses)}'}), 400
         
@@ -351,6 +760,43 @@ def update_driver(driver_id):
             'updatedFields': update_fields
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/drivers/<driver_id>/vitals', methods=['POST'])
+def post_vitals(driver_id):
+    """
+    Records a set of live vitals readings for a driver in one write. The driver's status
+    follows the readings automatically (see record_vitals).
+    Expected JSON payload: {
+        "userId": "string",
+        "heartRate": 0,
+        "bloodOxygenLevel": 0,
+        "vehicleSpeed": 0
+    }
+    At least one reading is required.
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or 'userId' not in data:
+            return jsonify({'error': 'Missing required field: userId'}), 400
+        
+        readings = {field: data[field] for field in VITALS_FIELDS if field in data}
+        if not readings:
+            return jsonify({'error': f'At least one reading is required: {", ".join(VITALS_FIELDS)}'}), 400
+        if any(isinstance(value, bool) or not isinstance(value, (int, float)) for value in readings.values()):
+            return jsonify({'error': 'Readings must be numbers'}), 400
+        
+        update_fields = record_vitals(driver_id, data['userId'], readings)
+        
+        return jsonify({
+            'message': 'Vitals recorded successfully',
+            'updatedFields': update_fields
+        }), 200
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -369,7 +815,14 @@ def delete_driver(driver_id):
         if not data or 'userId' not in data:
             return jsonify({'error': 'Missing required field: userId'}), 400
         
-        remove_driver(driver_id, data['userId'])
+        job = remove_driver(driver_id, data['userId'])
+        
+        if job:
+            return jsonify({
+                'message': 'Driver deletion started',
+                'deletedDriverId': driver_id,
+                'job': job
+            }), 202
         
         return jsonify({
             'message': 'Driver deleted successfully',
@@ -392,7 +845,7 @@ def get_driver(driver_id):
         if not user_id:
             return jsonify({'error': 'Missing required query parameter: userId'}), 400
         
-        driver_data = get_driver_by_id(driver_id, user_id)
+        driver_data = get_driver_by_id(driver_id, user_id, allow_stale=True)
         
         return jsonify({
             'message': 'Driver retrieved successfully',
@@ -443,7 +896,7 @@ def add_event(driver_id):
     NOW REQUIRES userId in payload for authorization.
     Expected JSON payload: {
         "userId": "string",  <- NEW REQUIRED FIELD
-        "eventId": "string",
+        "eventId": "string",  <- optional, the response carries the ID the event was stored under
         "status": "string",
         ...
     }
@@ -451,15 +904,18 @@ def add_event(driver_id):
     try:
         data = request.get_json()
         
-        required_fields = ['eventId', 'status', 'timeStamp', 'date', 'videoLink', 'userId']
+        required_fields = ['status', 'timeStamp', 'date', 'videoLink', 'userId']
         for field in required_fields:
             if field not in data:
                 return jsonify({'error': f'Missing required field: {field}'}), 400
         
+        if event_occurred_at(data['timeStamp'], data['date']) is None:
+            return jsonify({'error': 'timeStamp and date must be ISO-8601 (e.g. 2024-01-15T10:30:00Z) or en-US (e.g. 10:30 AM and January 15, 2024)'}), 400
+        
         new_event = add_event_to_driver(
             driver_id,
             data['userId'], 
-            data['eventId'],
+            data.get('eventId'),
             data['status'],
             data['timeStamp'],
             data['date'],
@@ -477,6 +933,8 @@ def add_event(driver_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-
 if __name__ == '__main__':
+    # Resume jobs interrupted by a previous run before serving requests
+    job_runner.recover()
+    warm_up.start()
     app.run(debug=True, port=5001)
\ No newline at end of file
@@ -1,6 +1,97 @@
-from typing import Dict, Any
+import re
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional
 MapFieldValue = Dict[str, Any]
 
+# Derived from timeStamp and date on every write; stored natively so they can be indexed
+TIME_FIELDS = ("occurredAt", "dateBucket")
+# The en-US strings the dashboard sends (toLocaleDateString / toLocaleTimeString), e.g.
+# 'January 15, 2024' and '10:30 AM'
+LEGACY_DATE_FORMATS = ("%B %d, %Y", "%b %d, %Y", "%m/%d/%Y")
+LEGACY_TIME_FORMATS = ("%I:%M %p", "%I:%M:%S %p", "%H:%M", "%H:%M:%S")
+
+# Browsers put a (narrow) no-break space before AM/PM in toLocaleTimeString
+_WHITESPACE = re.compile(r"[\s\u00a0\u202f]+")
+
+
+def parse_timestamp(value: str) -> datetime:
+    """
+    Parses an ISO-8601 timestamp (e.g. '2024-01-15T10:30:00Z', '2024-01-15T12:30:00+02:00',
+    '2024-01-15 10:30:00' or just '2024-01-15') into an aware UTC datetime.
+    Timestamps without an offset are taken to be UTC.
+
+    :raises ValueError: If the value is not an ISO-8601 date or timestamp.
+    """
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        text = str(value).strip()
+        if text.endswith(("Z", "z")):
+            text = text[:-1] + "+00:00"
+        parsed = datetime.fromisoformat(text)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def parse_legacy_timestamp(date: str, time_stamp: str = "") -> datetime:
+    """
+    Parses the en-US date and time of day the dashboard sends ('January 15, 2024' and
+    '10:30 AM') into an aware UTC datetime. The strings carry no offset, so they are taken
+    to be UTC, like ISO-8601 timestamps without one. Without a time, the day's midnight.
+
+    :raises ValueError: If the date or time is not in one of the en-US formats.
+    """
+    date_text = _WHITESPACE.sub(" ", str(date)).strip()
+    time_text = _WHITESPACE.sub(" ", str(time_stamp or "")).strip().upper()
+    for date_format in LEGACY_DATE_FORMATS:
+        if not time_text:
+            formats = [date_format]
+        else:
+            formats = [f"{date_format} {time_format}" for time_format in LEGACY_TIME_FORMATS]
+        for candidate_format in formats:
+            try:
+                parsed = datetime.strptime(f"{date_text} {time_text}".strip(), candidate_format)
+            except ValueError:
+                continue
+            return parsed.replace(tzinfo=timezone.utc)
+    raise ValueError(f"Unrecognized date/time: {date!r} {time_stamp!r}")
+
+
+def event_occurred_at(time_stamp: str, date: str) -> Optional[datetime]:
+    """
+    Works out when an event happened from its timeStamp and date strings: timeStamp may be a
+    full timestamp or only a time of day (then combined with date), in ISO-8601 or the
+    dashboard's en-US format.
+
+    :return: An aware UTC datetime, or None if neither field can be parsed.
+    """
+    for candidate in (time_stamp, f"{date}T{time_stamp}" if date and time_stamp else None, date):
+        if not candidate:
+            continue
+        try:
+            return parse_timestamp(candidate)
+        except ValueError:
+            continue
+    if not date:
+        return None
+    for legacy_time in ((time_stamp, "") if time_stamp else ("",)):
+        try:
+            return parse_legacy_timestamp(date, legacy_time)
+        except ValueError:
+            continue
+    return None
+
+
+def time_fields(time_stamp: str, date: str) -> MapFieldValue:
+    """The derived occurredAt timestamp and its UTC day ('YYYY-MM-DD') as dateBucket."""
+    occurred_at = event_occurred_at(time_stamp, date)
+    return {
+        "occurredAt": occurred_at,
+        "dateBucket": occurred_at.strftime("%Y-%m-%d") if occurred_at else None,
+    }
+
+
 class Event:
     """Represents a logged event."""
     def __init__(self, event_id: str, status: str, time_stamp: str, date: str, video_link: str, heart_rate: int = 0, blood_oxygen_level: int = 0, vehicle_speed: int = 0):
@@ -26,6 +117,9 @@ class Event:
 
     def get_date(self) -> str:
         return self._date
+
+    def get_occurred_at(self) -> Optional[datetime]:
+        return event_occurred_at(self._time_stamp, self._date)
     
     def get_heart_rate(self) -> int:
         return self._heart_rate
@@ -74,5 +168,6 @@ class Event:
             "heartRate": self._heart_rate,
             "bloodOxygenLevel": self._blood_oxygen_level,
             "vehicleSpeed": self._vehicle_speed,
-            "videoLink": self._video_link
+            "videoLink": self._video_link,
+            **time_fields(self._time_stamp, self._date)
         }
\ No newline at end of file
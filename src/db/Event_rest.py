@@ -1,59 +1,89 @@
 from flask import Flask, request, jsonify
-from Database import Database
-from Event import Event
+from Database import connect
+from Event import Event, TIME_FIELDS, event_occurred_at, parse_timestamp, time_fields
 from flask_cors import CORS
+from Metrics import register_metrics
+from Tracing import register_tracing
+from RateLimit import register_rate_limiting
+from Outbox import OutboxWorker, upsert_record, update_record, remove_record
+from SingleFlight import SingleFlight
+from Export import EXPORT_FORMATS, EVENT_COLUMNS, event_rows, export_response
+from Indexes import FieldIndex
+from Startup import register_readiness
+from Ids import IdAliases, register_id_aliases
+from Resilience import register_resilience
+from Idempotency import register_idempotency
+from Batch import register_batch
+from Dashboard import event_change_operations, last_event_operations
+from Retention import RetentionWorker, get_rollups, with_archived
 import json
+import re
 
 app = Flask(__name__)
 CORS(app)
+register_metrics(app, "events")
 
 PROJECT_ID = "drivesense-c1d4c"
 CREDENTIALS_FILE = "src/db/database_key.json"
 EVENT_COLLECTION = "events"
 DRIVER_COLLECTION = "drivers"
 
-db_handler = Database(PROJECT_ID, credentials_path=CREDENTIALS_FILE)
+db_handler = connect(PROJECT_ID, credentials_path=CREDENTIALS_FILE)
+register_tracing(app, db_handler)
+register_rate_limiting(app, db_handler, "events")
+register_resilience(app)
+register_idempotency(app, "events")
+register_batch(app, "events")
+# Applies the driver-array side of event writes in the background
+outbox_worker = OutboxWorker(db_handler)
+# Compacts events past their retention policy into monthly archives (DRIVESENSE_RETENTION_SECONDS=0 disables it)
+retention_worker = RetentionWorker(db_handler)
+# Concurrent event-log polls for the same driver share one Firestore query
+events_by_driver_flight = SingleFlight("events_by_driver")
+# Driver ID -> owning userId, so logging an event doesn't read the whole driver document
+driver_owners = FieldIndex(db_handler, DRIVER_COLLECTION, "userId")
+warm_up = register_readiness(app, db_handler, [driver_owners])
+# IDs are generated here; the IDs clients used to mint keep working as aliases
+event_ids = IdAliases(db_handler, EVENT_COLLECTION)
+driver_ids = IdAliases(db_handler, DRIVER_COLLECTION)
+register_id_aliases(app, {'event_id': event_ids, 'driver_id': driver_ids})
 
 def create_new_event(event_id, driver_id, status, time_stamp, date, video_link, heart_rate=0, blood_oxygen_level=0, vehicle_speed=0):
     """
     Creates a new event in the database AND links it to the driver.
+    The event, the lastEvent of the driver's dashboard card and an outbox record are written
+    atomically; the driver's events array is updated in the background by the outbox worker.
+    The driver is always read, since the driver_owners index doesn't see deletions made by
+    the drivers service; the index only supplies its owner. An event logged while the driver
+    is being deleted is an orphan, which the outbox worker deletes.
+    The event gets a generated ID; an event_id supplied by the client becomes its alias.
     """
     try:
+        driver_id = driver_ids.resolve(driver_id)
+        driver_data = db_handler.get_document(DRIVER_COLLECTION, driver_id)
+        if not driver_data:
+            driver_owners.remove(driver_id)
+            raise Exception("Driver not found")
+        event_id, alias_operations = event_ids.assign(event_id)
+        user_id = driver_owners.get(driver_id)
+        if user_id is None:
+            user_id = driver_data.get('userId')
+            driver_owners.put(driver_id, user_id)
+        
         # Create event object
         event = Event(event_id, status, time_stamp, date, video_link, heart_rate, blood_oxygen_level, vehicle_speed)
         event_data = event.to_map()
         
-        # Add driver_id to event data
+        # Link the event to its driver and the driver's owner
         event_data['driverId'] = driver_id
+        event_data['userId'] = user_id
         
-        # Save event to events collection
-        db_handler.set_document(EVENT_COLLECTION, event_id, event_data)
-        
-        # Link event to driver's events array
-        driver_data = db_handler.get_document(DRIVER_COLLECTION, driver_id)
-        if driver_data:
-            # Get current events array or create empty list
-            current_events = driver_data.get('events', [])
-            
-            # Add new event object to array
-            event_summary = {
-                "eventId": event_id,
-                "status": status,
-                "timeStamp": time_stamp,
-                "date": date,
-                "videoLink": video_link,
-                "heartRate": heart_rate,
-                "bloodOxygenLevel": blood_oxygen_level,
-                "vehicleSpeed": vehicle_speed
-            }
-            current_events.append(event_summary)
-            
-            # Update driver document with new events array
-            db_handler.update_document(DRIVER_COLLECTION, driver_id, {
-                'events': current_events
-            })
-        else:
-            raise Exception(f"Driver {driver_id} not found")
+        # Save event to events collection and queue the link to the driver's events array
+        outbox_worker.enqueue(
+            [("set", EVENT_COLLECTION, event_id, event_data)] + alias_operations
+            + last_event_operations(user_id, driver_id, event_data),
+            [upsert_record(driver_id, event_data)]
+        )
         
         return event_data
     except Exception as e:
@@ -62,9 +92,12 @@ def create_new_event(event_id, driver_id, status, time_stamp, date, video_link,
 def edit_event_field(field_to_change, new_value, event_id):
     """
     Edits a specific field of an event.
-    Also updates the event in the driver's events array if needed.
+    Also updates the event in the driver's events array (asynchronously, via the outbox).
     """
     try:
+        if field_to_change in TIME_FIELDS:
+            raise Exception(f"{field_to_change} is derived from timeStamp and date; change those instead")
+        
         # Get the event to find driver_id
         event_data = db_handler.get_document(EVENT_COLLECTION, event_id)
         if not event_data:
@@ -72,23 +105,19 @@ def edit_event_field(field_to_change, new_value, event_id):
         
         driver_id = event_data.get('driverId')
         
-        # Update event in events collection
-        update_fields = {field_to_change: new_value}        
-        db_handler.update_document(EVENT_COLLECTION, event_id, update_fields)
-        
-        # Update event in driver's events array
-        if driver_id:
-            driver_data = db_handler.get_document(DRIVER_COLLECTION, driver_id)
-            if driver_data and 'events' in driver_data:
-                events = driver_data['events']
-                for i, event in enumerate(events):
-                    if event.get('eventId') == event_id:
-                        events[i][field_to_change] = new_value
-                        break
-                
-                db_handler.update_document(DRIVER_COLLECTION, driver_id, {
-                    'events': events
-                })
+        update_fields = {field_to_change: new_value}
+        if field_to_change in ('timeStamp', 'date'):
+            # Keep the native timestamp and date bucket in step with the strings they come from
+            changed = {**event_data, field_to_change: new_value}
+            derived = time_fields(changed.get('timeStamp', ''), changed.get('date', ''))
+            if derived['occurredAt'] is None:
+                raise Exception("timeStamp and date must be ISO-8601 (e.g. 2024-01-15T10:30:00Z) or en-US (e.g. 10:30 AM and January 15, 2024)")
+            update_fields.update(derived)
+        
+        # Update event in events collection and queue the same change for the driver's events array
+        records = [update_record(driver_id, event_id, field, value) for field, value in update_fields.items()] if driver_id else []
+        dashboard_operations = event_change_operations(db_handler, event_data.get('userId'), driver_id, event_id, update_fields)
+        outbox_worker.enqueue([("update", EVENT_COLLECTION, event_id, update_fields)] + dashboard_operations, records)
         
         return update_fields
     except Exception as e:
@@ -96,7 +125,8 @@ def edit_event_field(field_to_change, new_value, event_id):
 
 def remove_event(event_id):
     """
-    Removes an event from the database AND from the driver's events array.
+    Removes an event from the database AND from the driver's events array
+    (the latter asynchronously, via the outbox).
     """
     try:
         # Get event to find driver_id
@@ -107,20 +137,10 @@ def remove_event(event_id):
         
         driver_id = existing_event.get('driverId')
         
-        # Delete event from events collection
-        db_handler._db.collection(EVENT_COLLECTION).document(event_id).delete()
-        
-        # Remove event from driver's events array
-        if driver_id:
-            driver_data = db_handler.get_document(DRIVER_COLLECTION, driver_id)
-            if driver_data and 'events' in driver_data:
-                events = driver_data['events']
-                # Filter out the deleted event
-                updated_events = [e for e in events if e.get('eventId') != event_id]
-                
-                db_handler.update_document(DRIVER_COLLECTION, driver_id, {
-                    'events': updated_events
-                })
+        # Delete event from events collection and queue its removal from the driver's events array
+        records = [remove_record(driver_id, event_id)] if driver_id else []
+        dashboard_operations = event_change_operations(db_handler, existing_event.get('userId'), driver_id, event_id)
+        outbox_worker.enqueue([("delete", EVENT_COLLECTION, event_id, None)] + dashboard_operations, records)
         
         return True
     except Exception as e:
@@ -128,10 +148,10 @@ def remove_event(event_id):
 
 def get_event_by_id(event_id):
     """
-    Retrieves an event from the database.
+    Retrieves an event from the database (the last copy read, while storage is unavailable).
     """
     try:
-        event_data = db_handler.get_document(EVENT_COLLECTION, event_id)
+        event_data = db_handler.get_document(EVENT_COLLECTION, event_id, allow_stale=True)
         
         if not event_data:
             raise Exception("Event not found")
@@ -140,30 +160,55 @@ def get_event_by_id(event_id):
     except Exception as e:
         raise Exception(f"Failed to retrieve event: {str(e)}")
 
-def get_events_by_driver(driver_id):
+def get_events_by_driver(driver_id, include_archived=False):
     """
-    Retrieves all events for a specific driver.
+    Retrieves all events for a specific driver that are still hot (see Retention), and
+    archived ones too if asked, which means reading the driver's whole archive.
+    Identical concurrent calls are coalesced into a single query.
     """
     try:
         # Get all events from events collection
-        all_events = db_handler._db.collection(EVENT_COLLECTION).where('driverId', '==', driver_id).stream()
+        all_events = events_by_driver_flight.do(driver_id, lambda: db_handler.query_documents(
+            EVENT_COLLECTION, [('driverId', '==', driver_id)], allow_stale=True))
         
         events_list = []
-        for doc in all_events:
-            event_data = doc.to_dict()
+        for _, event_data in all_events:
             events_list.append(event_data)
         
+        if include_archived:
+            return with_archived(db_handler, events_list, driver_id)
         return events_list
     except Exception as e:
         raise Exception(f"Failed to retrieve driver events: {str(e)}")
 
+def get_events_in_window(driver_id, start=None, end=None, descending=False, limit=None, include_archived=False):
+    """
+    Retrieves a driver's events whose occurredAt falls in [start, end), in time order,
+    as a single indexed range scan, plus archived events when the window starts far enough
+    back. A window without a start only includes archived events if asked.
+    """
+    try:
+        filters = [('driverId', '==', driver_id)]
+        if start:
+            filters.append(('occurredAt', '>=', start))
+        if end:
+            filters.append(('occurredAt', '<', end))
+        results = db_handler.query_documents(EVENT_COLLECTION, filters, order_by='occurredAt',
+                                             descending=descending, limit=limit, allow_stale=True)
+        events = [event_data for _, event_data in results]
+        if start is None and not include_archived:
+            return events
+        return with_archived(db_handler, events, driver_id, start, end, descending, limit)
+    except Exception as e:
+        raise Exception(f"Failed to retrieve driver events: {str(e)}")
+
 # REST API Endpoints
 @app.route('/events', methods=['POST'])
 def create_event():
     """
     Creates a new event in the database and links it to a driver.
     Expected JSON payload: {
-        "eventId": "string",
+        "eventId": "string",  <- optional, the response carries the ID the event was stored under
         "driverId": "string",
         "status": "string",
         "timeStamp": "string",
@@ -173,17 +218,23 @@ def create_event():
         "bloodOxygenLevel": 0,
         "vehicleSpeed": 0
     }
+    timeStamp is an ISO-8601 timestamp (e.g. "2024-01-15T10:30:00Z"), or a time of day
+    that is combined with date ("YYYY-MM-DD"); offsets are converted to UTC. The dashboard's
+    en-US strings ("10:30 AM" and "January 15, 2024") are accepted too, taken as UTC.
     """
     try:
         data = request.get_json()        
-        required_fields = ['eventId', 'driverId', 'status', 'timeStamp', 'date', 'videoLink']
+        required_fields = ['driverId', 'status', 'timeStamp', 'date', 'videoLink']
         
         for field in required_fields:
             if field not in data:
                 return jsonify({'error': f'Missing required field: {field}'}), 400
         
+        if event_occurred_at(data['timeStamp'], data['date']) is None:
+            return jsonify({'error': 'timeStamp and date must be ISO-8601 (e.g. 2024-01-15T10:30:00Z) or en-US (e.g. 10:30 AM and January 15, 2024)'}), 400
+        
         event_data = create_new_event(
-            data['eventId'],
+            data.get('eventId'),
             data['driverId'],
             data['status'],
             data['timeStamp'],
@@ -220,6 +271,9 @@ def update_event(event_id):
         if 'fieldToChange' not in data or 'newValue' not in data:
             return jsonify({'error': 'Missing required fields: fieldToChange and newValue'}), 400
         
+        if data['fieldToChange'] in TIME_FIELDS:
+            return jsonify({'error': f"{data['fieldToChange']} is derived from timeStamp and date; change those instead"}), 400
+        
         update_fields = edit_event_field(
             data['fieldToChange'],
             data['newValue'],
@@ -269,10 +323,25 @@ def get_event(event_id):
 @app.route('/drivers/<driver_id>/events', methods=['GET'])
 def get_driver_events(driver_id):
     """
-    Retrieves all events for a specific driver.
+    Retrieves all events for a specific driver, or only those in a time window.
+    Example: GET /drivers/driver123/events?from=2024-01-15T00:00:00Z&to=2024-01-16&order=desc&limit=100
+    from is inclusive, to is exclusive; both are ISO-8601 dates or timestamps.
+    Events past their retention period are archived: they are included when from reaches
+    back that far, or with archived=true.
     """
     try:
-        events = get_events_by_driver(driver_id)
+        include_archived = request.args.get('archived', '').lower() in ('1', 'true')
+        window = {key: request.args.get(key) for key in ('from', 'to', 'order', 'limit')}
+        if any(window.values()):
+            try:
+                start = parse_timestamp(window['from']) if window['from'] else None
+                end = parse_timestamp(window['to']) if window['to'] else None
+            except ValueError:
+                return jsonify({'error': 'from and to must be ISO-8601 dates or timestamps'}), 400
+            events = get_events_in_window(driver_id, start, end, window['order'] == 'desc',
+                                          request.args.get('limit', type=int), include_archived)
+        else:
+            events = get_events_by_driver(driver_id, include_archived)
         
         return jsonify({
             'message': 'Events retrieved successfully',
@@ -283,5 +352,60 @@ def get_driver_events(driver_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/drivers/<driver_id>/events/rollups', methods=['GET'])
+def get_driver_event_rollups(driver_id):
+    """
+    Retrieves the monthly rollups (event counts per status, time span and min/max/average
+    vitals) of a driver's archived events, oldest month first.
+    Example: GET /drivers/driver123/events/rollups?from=2024-01&to=2024-06
+    """
+    try:
+        months = {key: request.args.get(key) for key in ('from', 'to')}
+        if any(value and not re.match(r'^\d{4}-\d{2}$', value) for value in months.values()):
+            return jsonify({'error': 'from and to must be months (YYYY-MM)'}), 400
+        
+        rollups = get_rollups(db_handler, driver_id, months['from'], months['to'])
+        
+        return jsonify({
+            'message': 'Rollups retrieved successfully',
+            'rollups': rollups,
+            'count': len(rollups)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/export/events', methods=['GET'])
+def export_events():
+    """
+    Streams events as NDJSON, CSV or Parquet, page by page, without loading them all into memory.
+    Example: GET /export/events?driverId=driver123&from=2024-01-01&to=2024-01-31&format=csv
+    (to is inclusive when it is a date)
+    """
+    try:
+        driver_id = driver_ids.resolve(request.args.get('driverId'))
+        user_id = request.args.get('userId')
+        export_format = request.args.get('format', 'ndjson')
+        if not driver_id and not user_id:
+            return jsonify({'error': 'driverId or userId is required'}), 400
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f"Invalid format. Must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+        try:
+            for key in ('from', 'to'):
+                if request.args.get(key):
+                    parse_timestamp(request.args[key])
+        except ValueError:
+            return jsonify({'error': 'from and to must be ISO-8601 dates or timestamps'}), 400
+
+        rows = event_rows(db_handler, driver_id, user_id, request.args.get('from'), request.args.get('to'))
+        return export_response(rows, EVENT_COLUMNS, export_format, f"events-{driver_id or user_id}")
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 if __name__ == '__main__':
+    # Apply anything left pending by a previous run before serving requests
+    outbox_worker.start()
+    retention_worker.start()
+    warm_up.start()
     app.run(debug=True, port=5002)
\ No newline at end of file
@@ -0,0 +1,241 @@
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import datetime, timedelta
+from itertools import chain
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+from flask import Response, stream_with_context
+from Event import parse_timestamp
+from Retention import archived_events, merge_archived_rows, reaches_archive
+
+EVENT_COLLECTION = "events"
+DRIVER_COLLECTION = "drivers"
+
+EXPORT_FORMATS = ("ndjson", "csv", "parquet")
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+PAGE_SIZE = 1000            # documents per Firestore round trip
+PARQUET_ROW_GROUP = 10000   # rows buffered per Parquet row group
+
+# Columns and their Parquet types; the driver export leaves out the embedded events and the picture
+EVENT_COLUMNS: List[Tuple[str, str]] = [
+    ("eventId", "string"), ("driverId", "string"), ("userId", "string"), ("status", "string"),
+    ("occurredAt", "timestamp"), ("dateBucket", "string"), ("timeStamp", "string"), ("date", "string"), ("videoLink", "string"),
+    ("heartRate", "double"), ("bloodOxygenLevel", "double"), ("vehicleSpeed", "double"),
+]
+DRIVER_COLUMNS: List[Tuple[str, str]] = [
+    ("driverId", "string"), ("userId", "string"), ("name", "string"), ("phone_number", "string"),
+    ("productId", "string"), ("status", "string"), ("driving", "bool"), ("timeStamp", "string"),
+    ("date", "string"), ("heartRate", "double"), ("bloodOxygenLevel", "double"),
+    ("vehicleSpeed", "double"), ("emergency_contacts", "string"),
+]
+
+
+def event_rows(db_handler, driver_id: str = None, user_id: str = None, date_from: str = None,
+               date_to: str = None) -> Iterator[Dict[str, Any]]:
+    """
+    Yields events page by page, optionally filtered by driver, user and a time range on
+    occurredAt. date_from and date_to are ISO-8601 dates or timestamps; a date-only
+    date_to includes that whole day. Filtered exports come out in time order.
+    Exports of a driver or user include their archived events when the range reaches back
+    that far.
+
+    :raises ValueError: If date_from or date_to is not ISO-8601.
+    """
+    filters = []
+    if driver_id:
+        filters.append(("driverId", "==", driver_id))
+    if user_id:
+        filters.append(("userId", "==", user_id))
+    start = end = None
+    if date_from:
+        start = parse_timestamp(date_from)
+        filters.append(("occurredAt", ">=", start))
+    if date_to:
+        end = parse_timestamp(date_to)
+        end = end + timedelta(days=1) if len(str(date_to).strip()) == 10 else end
+        filters.append(("occurredAt", "<", end))
+    order_by = "occurredAt" if date_from or date_to else None
+    rows = _hot_event_rows(db_handler, filters, order_by)
+    if (driver_id or user_id) and reaches_archive(start):
+        archived = archived_events(db_handler, driver_id=driver_id, user_id=user_id, start=start, end=end)
+        if driver_id and user_id:
+            archived = (event for event in archived if event.get("userId") == user_id)
+        rows = merge_archived_rows(rows, archived, ordered=order_by is not None)
+    yield from rows
+
+
+def _hot_event_rows(db_handler, filters: List[Tuple[str, str, Any]], order_by: str = None) -> Iterator[Dict[str, Any]]:
+    for doc_id, event in db_handler.iter_documents(EVENT_COLLECTION, filters, order_by=order_by, page_size=PAGE_SIZE):
+        event.setdefault("eventId", doc_id)
+        yield event
+
+
+def driver_rows(db_handler, user_id: str = None) -> Iterator[Dict[str, Any]]:
+    """Yields drivers page by page, optionally limited to one user's fleet."""
+    filters = [("userId", "==", user_id)] if user_id else []
+    fields = [name for name, _ in DRIVER_COLUMNS if name != "driverId"]
+    for doc_id, driver in db_handler.iter_documents(DRIVER_COLLECTION, filters, page_size=PAGE_SIZE, fields=fields):
+        driver.setdefault("driverId", doc_id)
+        yield driver
+
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def _cell(value: Any) -> Any:
+    """Flattens a value for CSV: nested lists and maps become JSON, datetimes ISO-8601."""
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=_json_default)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_ndjson(rows: Iterable[Dict[str, Any]], columns: List[Tuple[str, str]] = None) -> Iterator[bytes]:
+    """One JSON document per line; every document is written as stored."""
+    for row in rows:
+        yield (json.dumps(row, default=_json_default) + "\n").encode("utf-8")
+
+
+def encode_csv(rows: Iterable[Dict[str, Any]], columns: List[Tuple[str, str]]) -> Iterator[bytes]:
+    """A header line followed by one line per row, encoded as each row arrives."""
+    names = [name for name, _ in columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for row in rows:
+        writer.writerow([_cell(row.get(name)) for name in names])
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink:
+    """File-like object that collects what the Parquet writer emits until it is drained."""
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _typed(value: Any, kind: str) -> Any:
+    if value is None or value == "":
+        return None
+    try:
+        if kind == "double":
+            return float(value)
+        if kind == "bool":
+            return bool(value)
+        if kind == "timestamp":
+            return parse_timestamp(value)
+        return str(_cell(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def encode_parquet(rows: Iterable[Dict[str, Any]], columns: List[Tuple[str, str]]) -> Iterator[bytes]:
+    """
+    Columnar Parquet output. Rows are written in row groups of PARQUET_ROW_GROUP, and each
+    finished row group is sent on straight away, so only one row group is held in memory.
+    Requires pyarrow.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("Parquet export requires pyarrow (pip install pyarrow)")
+
+    types = {"string": pa.string(), "double": pa.float64(), "bool": pa.bool_(), "timestamp": pa.timestamp("us", tz="UTC")}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+
+    def flush(batch):
+        table = pa.table({name: [_typed(row.get(name), kind) for row in batch] for name, kind in columns}, schema=schema)
+        writer.write_table(table)
+        return sink.drain()
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= PARQUET_ROW_GROUP:
+            yield flush(batch)
+            batch = []
+    if batch:
+        yield flush(batch)
+    writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {"ndjson": encode_ndjson, "csv": encode_csv, "parquet": encode_parquet}
+
+
+def export(rows: Iterable[Dict[str, Any]], columns: List[Tuple[str, str]], export_format: str) -> Iterator[bytes]:
+    """Encodes rows in the requested format as a stream of byte chunks."""
+    if export_format not in ENCODERS:
+        raise ValueError(f"Invalid format. Must be one of: {', '.join(EXPORT_FORMATS)}")
+    return ENCODERS[export_format](rows, columns)
+
+
+def export_response(rows: Iterable[Dict[str, Any]], columns: List[Tuple[str, str]], export_format: str,
+                    filename: str) -> Response:
+    """
+    Streams an export as a Flask response. The first chunk is produced before the response
+    starts, so a failing query still surfaces as an error status instead of a truncated file.
+    """
+    chunks = export(rows, columns, export_format)
+    first = next(chunks, b"")
+    return Response(stream_with_context(chain([first], chunks)), mimetype=CONTENT_TYPES[export_format],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}.{export_format}"'})
+
+
+if __name__ == "__main__":
+    # Usage: python Export.py events --format csv --driver driver123 --from 2024-01-01 --to 2024-01-31 --out events.csv
+    parser = argparse.ArgumentParser(description="Stream events or drivers out of Firestore.")
+    parser.add_argument("kind", choices=["events", "drivers"])
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--driver", help="only events of this driver")
+    parser.add_argument("--user", help="only this user's drivers or events")
+    parser.add_argument("--from", dest="date_from", help="start of the range, ISO-8601 (e.g. 2024-01-01)")
+    parser.add_argument("--to", dest="date_to", help="end of the range, ISO-8601; a date includes that whole day")
+    parser.add_argument("--out", help="output file (default: stdout)")
+    args = parser.parse_args()
+
+    if args.kind == "events":
+        from Event_rest import db_handler
+        chunks = export(event_rows(db_handler, args.driver, args.user, args.date_from, args.date_to),
+                        EVENT_COLUMNS, args.format)
+    else:
+        from Driver_rest import db_handler
+        chunks = export(driver_rows(db_handler, args.user), DRIVER_COLUMNS, args.format)
+
+    out = open(args.out, "wb") if args.out else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.out:
+            out.close()
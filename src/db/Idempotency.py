@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from flask import Flask, Response, g, jsonify, request
+from Metrics import registry
+
+# Creation routes that honour an Idempotency-Key header
+IDEMPOTENT_ROUTES = {
+    ("POST", "/users"),
+    ("POST", "/drivers"),
+    ("POST", "/drivers/<driver_id>/events"),
+    ("POST", "/drivers/<driver_id>/emergency-contacts"),
+    ("POST", "/events"),
+}
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+KEY_TTL = 24 * 3600         # seconds a completed response is replayed for
+PENDING_TTL = 60            # seconds a claimed key stays locked if its request never finishes
+LOCAL_MAX_KEYS = 50000      # keys kept by the local store (least recently used evicted)
+SHARED_MAX_KEYS = 500000    # keys kept by the shared store (soonest to expire evicted)
+PRUNE_EVERY = 500           # claims between sweeps of the shared store
+SHARED_STORE_PATH = os.environ.get(
+    "DRIVESENSE_IDEMPOTENCY_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "idempotency.sqlite3"))
+
+PENDING = "pending"
+COMPLETED = "completed"
+
+idempotent_requests = registry.counter(
+    "drivesense_idempotent_requests_total",
+    "Requests carrying an Idempotency-Key, by service and outcome (new, replayed, in_progress or mismatch).",
+    ("service", "outcome"))
+
+
+class StoredResponse:
+    """What a store holds for one key: a claim in progress, or the response to replay."""
+    def __init__(self, state: str, fingerprint: str, status: int = None, body: bytes = None, content_type: str = None):
+        self.state = state
+        self.fingerprint = fingerprint
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+
+
+class LocalIdempotencyStore:
+    """Keys held in this process's memory, expiring after their TTL; least recently used keys are evicted."""
+    def __init__(self, max_keys: int = LOCAL_MAX_KEYS):
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._max_keys = max_keys
+        self._lock = threading.Lock()
+
+    def claim(self, key: str, fingerprint: str) -> Optional[StoredResponse]:
+        """
+        Claims a key for a request about to execute.
+
+        :return: None if the caller now holds the key, otherwise what is stored for it.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+            self._entries[key] = (now + PENDING_TTL, StoredResponse(PENDING, fingerprint))
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._max_keys:
+                self._entries.popitem(last=False)
+        return None
+
+    def complete(self, key: str, fingerprint: str, status: int, body: bytes, content_type: str):
+        """Stores the response of a claimed key, to be replayed for KEY_TTL seconds."""
+        with self._lock:
+            self._entries[key] = (time.time() + KEY_TTL, StoredResponse(COMPLETED, fingerprint, status, body, content_type))
+
+    def release(self, key: str):
+        """Drops a claim whose request failed, so a retry executes again."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1].state == PENDING:
+                del self._entries[key]
+
+
+class SharedIdempotencyStore:
+    """
+    Keys in a local SQLite file, so every worker process of a service on the host sees
+    the same keys (a retry may land on a different worker than the original request).
+    """
+    def __init__(self, path: str = SHARED_STORE_PATH, max_keys: int = SHARED_MAX_KEYS):
+        self._path = path
+        self._max_keys = max_keys
+        self._claims = 0
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS idempotency_keys (key TEXT PRIMARY KEY, state TEXT NOT NULL, "
+                         "fingerprint TEXT NOT NULL, status INTEGER, body BLOB, content_type TEXT, expires_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idempotency_keys_expires_at ON idempotency_keys (expires_at)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=5, isolation_level=None)
+
+    def claim(self, key: str, fingerprint: str) -> Optional[StoredResponse]:
+        """See LocalIdempotencyStore.claim."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE makes the check-and-claim atomic across processes; if it fails
+            # (the database stayed locked), there is no transaction to roll back
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT state, fingerprint, status, body, content_type FROM idempotency_keys "
+                                   "WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+                if row is None:
+                    conn.execute("INSERT OR REPLACE INTO idempotency_keys (key, state, fingerprint, expires_at) VALUES (?, ?, ?, ?)",
+                                 (key, PENDING, fingerprint, now + PENDING_TTL))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+        if row is not None:
+            return StoredResponse(row[0], row[1], row[2], row[3], row[4])
+        self._claims += 1
+        if self._claims % PRUNE_EVERY == 0:
+            self._prune(now)
+        return None
+
+    def _prune(self, now: float):
+        """Deletes expired keys, then the keys closest to expiring beyond max_keys."""
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+            excess = conn.execute("SELECT COUNT(*) FROM idempotency_keys").fetchone()[0] - self._max_keys
+            if excess > 0:
+                conn.execute("DELETE FROM idempotency_keys WHERE key IN "
+                             "(SELECT key FROM idempotency_keys ORDER BY expires_at LIMIT ?)", (excess,))
+        finally:
+            conn.close()
+
+    def complete(self, key: str, fingerprint: str, status: int, body: bytes, content_type: str):
+        """See LocalIdempotencyStore.complete."""
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR REPLACE INTO idempotency_keys (key, state, fingerprint, status, body, content_type, expires_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (key, COMPLETED, fingerprint, status, body, content_type, time.time() + KEY_TTL))
+        finally:
+            conn.close()
+
+    def release(self, key: str):
+        """See LocalIdempotencyStore.release."""
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND state = ?", (key, PENDING))
+        finally:
+            conn.close()
+
+
+def create_idempotency_store():
+    """Uses the shared store when DRIVESENSE_IDEMPOTENCY_STORE=shared, otherwise local memory."""
+    if os.environ.get("DRIVESENSE_IDEMPOTENCY_STORE", "local") == "shared":
+        return SharedIdempotencyStore()
+    return LocalIdempotencyStore()
+
+
+def _fingerprint() -> str:
+    """Hashes the request body (canonicalized if it is JSON), so a key reused for a different request is caught."""
+    body = request.get_json(silent=True)
+    payload = json.dumps(body, sort_keys=True, separators=(",", ":")).encode() if body is not None else request.get_data()
+    return hashlib.sha256(request.method.encode() + b" " + request.path.encode() + b"\n" + payload).hexdigest()
+
+
+def register_idempotency(app: Flask, service: str, store=None):
+    """
+    Makes the app's IDEMPOTENT_ROUTES safe to retry: a request sent again with the same
+    Idempotency-Key gets the original response replayed (with Idempotent-Replayed: true)
+    instead of executing again. Only successful responses are kept, so a request that
+    failed can be retried with the same key. A key reused with a different body gets 422,
+    and a retry arriving while the original is still running gets 409.
+
+    :param service: Label for metrics, and the namespace of keys in a shared store.
+    :param store: LocalIdempotencyStore or SharedIdempotencyStore; chosen by create_idempotency_store() if omitted.
+    """
+    store = store or create_idempotency_store()
+
+    @app.before_request
+    def _check_idempotency_key():
+        client_key = request.headers.get(HEADER)
+        if not client_key or request.url_rule is None or (request.method, request.url_rule.rule) not in IDEMPOTENT_ROUTES:
+            return None
+        if len(client_key) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'}), 400
+
+        key = f"{service}|{request.method} {request.path}|{client_key}"
+        fingerprint = _fingerprint()
+        try:
+            stored = store.claim(key, fingerprint)
+        except Exception as e:
+            # Fail open: the request still executes, it just can't be deduplicated
+            print(f"Idempotency store error: {e}")
+            return None
+
+        if stored is None:
+            idempotent_requests.inc(service, "new")
+            g._idempotency = (key, fingerprint)
+            return None
+        if stored.fingerprint != fingerprint:
+            idempotent_requests.inc(service, "mismatch")
+            return jsonify({'error': f'{HEADER} was already used for a different request'}), 422
+        if stored.state == PENDING:
+            idempotent_requests.inc(service, "in_progress")
+            response = jsonify({'error': 'A request with this Idempotency-Key is still in progress'})
+            response.status_code = 409
+            response.headers["Retry-After"] = "1"
+            return response
+
+        idempotent_requests.inc(service, "replayed")
+        response = Response(stored.body, status=stored.status, content_type=stored.content_type)
+        response.headers["Idempotent-Replayed"] = "true"
+        return response
+
+    @app.after_request
+    def _store_response(response):
+        claim = g.pop("_idempotency", None)
+        if claim is None:
+            return response
+        key, fingerprint = claim
+        try:
+            if 200 <= response.status_code < 300:
+                store.complete(key, fingerprint, response.status_code, response.get_data(), response.content_type)
+            else:
+                store.release(key)
+        except Exception as e:
+            print(f"Idempotency store error: {e}")
+        return response
+
+    @app.teardown_request
+    def _release_unfinished(error):
+        # after_request does not run when a handler raises, so the claim is still held
+        claim = g.pop("_idempotency", None)
+        if claim is not None:
+            try:
+                store.release(claim[0])
+            except Exception as e:
+                print(f"Idempotency store error: {e}")
@@ -0,0 +1,146 @@
+import hashlib
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from flask import Flask
+from Metrics import record_cache
+
+ALIAS_COLLECTION = "id_aliases"
+RANDOM_BYTES = 8            # leading random part: spreads IDs over the whole key space
+TIME_BYTES = 6              # trailing creation time in milliseconds, good until the year 10889
+GENERATED_ID = re.compile(r"^[0-9a-f]{%d}$" % (2 * (RANDOM_BYTES + TIME_BYTES)))
+ALIAS_CACHE_SIZE = 50000    # resolved aliases kept per collection (they never change)
+MISS_TTL = 60               # seconds an ID known to have no alias is trusted
+
+
+def new_id(now: float = None) -> str:
+    """
+    A new document ID: 16 random hex digits followed by the creation time in milliseconds
+    (12 hex digits). The random prefix scatters consecutive writes across Firestore's key
+    ranges instead of appending to one, and 64 random bits per millisecond make collisions
+    negligible.
+    """
+    millis = int((time.time() if now is None else now) * 1000)
+    return secrets.token_hex(RANDOM_BYTES) + millis.to_bytes(TIME_BYTES, "big").hex()
+
+
+def is_generated_id(doc_id: str) -> bool:
+    """True if an ID was made by new_id (rather than supplied by a client)."""
+    return bool(doc_id) and GENERATED_ID.match(doc_id) is not None
+
+
+def id_time(doc_id: str) -> Optional[datetime]:
+    """The creation time embedded in a generated ID (UTC, millisecond precision), or None for other IDs."""
+    if not is_generated_id(doc_id):
+        return None
+    millis = int(doc_id[2 * RANDOM_BYTES:], 16)
+    return datetime.fromtimestamp(millis / 1000, tz=timezone.utc)
+
+
+def id_sort_key(doc_id: str) -> Tuple[float, str]:
+    """Orders generated IDs by creation time; other IDs sort first, by value."""
+    created = id_time(doc_id)
+    return (created.timestamp() if created else 0.0, doc_id)
+
+
+def _alias_doc_id(collection: str, client_id: str) -> str:
+    # Hashed, so client IDs with timestamp prefixes don't hotspot the alias collection either
+    return hashlib.blake2b(f"{collection}:{client_id}".encode("utf-8"), digest_size=10).hexdigest()
+
+
+class IdAliases:
+    """
+    Maps IDs that clients minted themselves (e.g. 'driver_jane_doe_1700000000000') to the
+    server-generated IDs of one collection. New documents always get a generated ID; the
+    client's ID, if it sent one, is recorded as an alias in the same batch so it keeps working.
+    Documents created before IDs were generated keep their original IDs and need no alias.
+    """
+    def __init__(self, db_handler, collection: str):
+        self._db = db_handler
+        self._collection = collection
+        self._hits: "OrderedDict[str, str]" = OrderedDict()
+        self._misses: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return f"aliases.{self._collection}"
+
+    def _remember(self, client_id: str, doc_id: str):
+        with self._lock:
+            self._misses.pop(client_id, None)
+            self._hits[client_id] = doc_id
+            self._hits.move_to_end(client_id)
+            if len(self._hits) > ALIAS_CACHE_SIZE:
+                self._hits.popitem(last=False)
+
+    def lookup(self, client_id: str) -> Optional[str]:
+        """The generated ID a client ID stands for, or None if it has no alias. Errors are re-raised."""
+        now = time.monotonic()
+        with self._lock:
+            doc_id = self._hits.get(client_id)
+            cached = doc_id is not None or now - self._misses.get(client_id, float("-inf")) < MISS_TTL
+        record_cache(self.name, cached)
+        if cached:
+            return doc_id
+
+        alias = self._db.get_document(ALIAS_COLLECTION, _alias_doc_id(self._collection, client_id))
+        if alias:
+            self._remember(client_id, alias["id"])
+            return alias["id"]
+        with self._lock:
+            if len(self._misses) > ALIAS_CACHE_SIZE:
+                self._misses.clear()
+            self._misses[client_id] = now
+        return None
+
+    def resolve(self, doc_id: str) -> str:
+        """The ID to read or write for an ID given by a client: its alias target if it has one, else itself."""
+        if not doc_id or is_generated_id(doc_id):
+            return doc_id
+        return self.lookup(doc_id) or doc_id
+
+    def assign(self, client_id: str = None) -> Tuple[str, List[Tuple[str, str, str, dict]]]:
+        """
+        Picks the ID for a new document. A client ID that already has an alias (a retried
+        create) gets the same document again; a generated ID sent by the client is used as is.
+
+        :return: (doc_id, batch operations that record the alias, to commit with the document).
+        """
+        if not client_id:
+            return new_id(), []
+        if is_generated_id(client_id):
+            return client_id, []
+        existing = self.lookup(client_id)
+        if existing:
+            return existing, []
+
+        doc_id = new_id()
+        with self._lock:
+            # Not cached until the alias is read back, in case the batch recording it fails
+            self._misses.pop(client_id, None)
+        alias = {"collection": self._collection, "clientId": client_id, "id": doc_id,
+                 "createdAt": datetime.now(timezone.utc)}
+        return doc_id, [("set", ALIAS_COLLECTION, _alias_doc_id(self._collection, client_id), alias)]
+
+
+def register_id_aliases(app: Flask, aliases_by_arg: Dict[str, IdAliases]):
+    """
+    Resolves client-minted IDs in URLs before the view runs, e.g. {'driver_id': driver_ids}
+    turns /drivers/<driver_id> with an aliased ID into the driver's generated ID.
+    If the alias can't be read, the ID is passed through unchanged.
+    """
+    @app.url_value_preprocessor
+    def _resolve_aliases(endpoint, values):
+        if not values:
+            return
+        for arg, aliases in aliases_by_arg.items():
+            if values.get(arg):
+                try:
+                    values[arg] = aliases.resolve(values[arg])
+                except Exception as e:
+                    print(f"Error resolving {arg} '{values[arg]}': {e}")
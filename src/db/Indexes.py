@@ -0,0 +1,75 @@
+import threading
+from typing import Any, Dict, Optional, Set
+from Metrics import record_cache
+
+
+class FieldIndex:
+    """
+    In-process map from document ID to the value of one field, and back, for one collection
+    (e.g. user ID <-> email, driver ID -> owning userId).
+
+    It can be pre-loaded in one pass that reads only that field, and is kept up to date by
+    the writes made in this process. Other processes' writes are not seen, so a hit is a hint
+    that callers should confirm (or tolerate being stale) and a miss means "unknown", not
+    "absent".
+    """
+    def __init__(self, db_handler, collection: str, field: str):
+        self._db = db_handler
+        self._collection = collection
+        self._field = field
+        self._values: Dict[str, Any] = {}
+        self._ids: Dict[Any, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    @property
+    def name(self) -> str:
+        return f"{self._collection}.{self._field}"
+
+    def load(self) -> int:
+        """
+        Reads the field of every document, page by page. Errors are re-raised.
+
+        :return: The number of entries loaded.
+        """
+        count = 0
+        for doc_id, data in self._db.iter_documents(self._collection, [], page_size=1000, fields=[self._field]):
+            if data.get(self._field) is not None:
+                self.put(doc_id, data[self._field])
+                count += 1
+        self.loaded = True
+        print(f"Index '{self.name}' loaded with {count} entries.")
+        return count
+
+    def put(self, doc_id: str, value: Any):
+        with self._lock:
+            self._discard(doc_id)
+            self._values[doc_id] = value
+            self._ids.setdefault(value, set()).add(doc_id)
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            self._discard(doc_id)
+
+    def _discard(self, doc_id: str):
+        old = self._values.pop(doc_id, None)
+        if old is not None:
+            ids = self._ids.get(old, set())
+            ids.discard(doc_id)
+            if not ids:
+                self._ids.pop(old, None)
+
+    def get(self, doc_id: str) -> Optional[Any]:
+        """The indexed value of a document, or None if unknown."""
+        with self._lock:
+            value = self._values.get(doc_id)
+        record_cache(self.name, value is not None)
+        return value
+
+    def find(self, value: Any) -> Optional[str]:
+        """The ID of a document with this value, or None if unknown."""
+        with self._lock:
+            ids = self._ids.get(value)
+            doc_id = next(iter(ids)) if ids else None
+        record_cache(self.name, doc_id is not None)
+        return doc_id
@@ -0,0 +1,424 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from flask import Flask, jsonify, request
+
+# Local job table, shared by every backend process on this machine
+JOB_DB_PATH = os.environ.get("DRIVESENSE_JOB_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.sqlite3"))
+THREAD_WORKERS = 4      # concurrent jobs (Firestore fan-out, deletes, rebuilds)
+MAX_QUEUED = 1000       # jobs waiting for a worker before submit() starts refusing work
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once cancellation has been requested."""
+
+
+class JobQueueFull(Exception):
+    """Raised by submit() when MAX_QUEUED jobs are already waiting."""
+
+
+class RetryPolicy:
+    """How often a failed job is retried and how long to wait in between."""
+    def __init__(self, max_attempts: int = 1, backoff_seconds: float = 1.0, max_backoff_seconds: float = 60.0):
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+    def delay(self, attempt: int) -> float:
+        """Jittered exponential backoff before the given (1-based) retry attempt."""
+        delay = min(self.max_backoff_seconds, self.backoff_seconds * (2 ** (attempt - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+
+class JobType:
+    def __init__(self, name: str, handler: Callable, retry: RetryPolicy, authorize: Optional[Callable]):
+        self.name = name
+        self.handler = handler
+        self.retry = retry
+        self.authorize = authorize
+
+
+class JobContext:
+    """
+    Passed to job handlers as their first argument.
+    Handlers call report() to publish progress and check_cancelled() between steps.
+    """
+    def __init__(self, runner: "JobRunner", job_id: str):
+        self._runner = runner
+        self.job_id = job_id
+        self._progress: Dict[str, Any] = {}
+
+    def report(self, **progress):
+        """Merges the given fields into the job's progress, e.g. report(deleted=120)."""
+        self._progress.update(progress)
+        self._runner._update(self.job_id, progress=json.dumps(self._progress))
+
+    def cancelled(self) -> bool:
+        return self._runner._cancel_requested(self.job_id)
+
+    def check_cancelled(self):
+        if self.cancelled():
+            raise JobCancelled()
+
+
+class JobRunner:
+    """
+    Runs registered job types on a bounded thread pool and records every job in a local
+    SQLite table, so status survives restarts and is visible to all processes.
+    """
+    def __init__(self, db_path: str = JOB_DB_PATH, thread_workers: int = THREAD_WORKERS,
+                 max_queued: int = MAX_QUEUED):
+        self._db_path = db_path
+        self._thread_workers = thread_workers
+        self._max_queued = max_queued
+        self._types: Dict[str, JobType] = {}
+        self._futures = {}
+        self._retrying = set()  # jobs waiting on a retry timer
+        self._lock = threading.Lock()
+        self._thread_pool = None
+        self._schema_ready = False
+
+    # Job table
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if not self._schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL DEFAULT 1,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    owner_pid INTEGER,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    updated_at REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+            conn.commit()
+            self._schema_ready = True
+        return conn
+
+    def _update(self, job_id: str, expect: Dict[str, Any] = None, **fields) -> bool:
+        """
+        Updates a job's row. With expect, only if its columns still hold those values, which
+        makes the update a compare-and-set that only one process can win.
+
+        :return: Whether the row was updated.
+        """
+        fields["updated_at"] = time.time()
+        expect = expect or {}
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        conditions = "".join(f" AND {name} IS ?" for name in expect)
+        conn = self._connect()
+        try:
+            cursor = conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?{conditions}",
+                                  list(fields.values()) + [job_id] + list(expect.values()))
+            conn.commit()
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def _row(self, job_id: str) -> Optional[sqlite3.Row]:
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+
+    def _cancel_requested(self, job_id: str) -> bool:
+        row = self._row(job_id)
+        return bool(row and row["cancel_requested"])
+
+    @staticmethod
+    def _to_map(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "jobId": row["id"],
+            "type": row["type"],
+            "params": json.loads(row["params"]),
+            "status": row["status"],
+            "progress": json.loads(row["progress"]) if row["progress"] else {},
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "attempts": row["attempts"],
+            "maxAttempts": row["max_attempts"],
+            "cancelRequested": bool(row["cancel_requested"]),
+            "createdAt": row["created_at"],
+            "startedAt": row["started_at"],
+            "finishedAt": row["finished_at"],
+        }
+
+    # Public API
+
+    def register(self, name: str, handler: Callable, retry: RetryPolicy = None, authorize: Callable = None):
+        """
+        Registers a job type.
+
+        :param name: Name used when submitting the job.
+        :param handler: Called as handler(context, **params); the return value
+                        (JSON-serializable) becomes the job result.
+        :param retry: Retry policy for failures; jobs are not retried by default.
+        :param authorize: Makes the type public: clients may enqueue it through POST /jobs once
+                          authorize(params) has checked the params and that the caller may run
+                          the job with them, raising ValueError if not. Job types without one
+                          (e.g. cascade deletes, whose routes check ownership first) stay internal.
+        """
+        self._types[name] = JobType(name, handler, retry or RetryPolicy(), authorize)
+
+    def is_public(self, job_type: str) -> bool:
+        return job_type in self._types and self._types[job_type].authorize is not None
+
+    def authorize(self, job_type: str, params: Dict[str, Any]):
+        """Runs a public job type's checks on the params a client sent, raising ValueError if they fail."""
+        self._types[job_type].authorize(params)
+
+    def submit(self, job_type: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Records a job as queued and hands it to a worker pool.
+
+        :return: The job as a dictionary (see get()).
+        """
+        if job_type not in self._types:
+            raise ValueError(f"Unknown job type '{job_type}'")
+        params = params or {}
+        with self._lock:
+            if sum(1 for f in self._futures.values() if not f.done()) >= self._max_queued:
+                raise JobQueueFull("Too many jobs are waiting; try again later")
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO jobs (id, type, params, status, max_attempts, owner_pid, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, job_type, json.dumps(params), QUEUED, self._types[job_type].retry.max_attempts,
+                 os.getpid(), now, now))
+            conn.commit()
+        finally:
+            conn.close()
+        self._dispatch(job_id)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._row(job_id)
+        return self._to_map(row) if row else None
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Cancels a job. Queued jobs stop immediately; running jobs stop at their next
+        check_cancelled() call.
+        """
+        row = self._row(job_id)
+        if not row:
+            return None
+        if row["status"] in FINISHED_STATUSES:
+            return self._to_map(row)
+
+        self._update(job_id, cancel_requested=1)
+        with self._lock:
+            future = self._futures.get(job_id)
+        if row["status"] == QUEUED and (future is None or future.cancel()):
+            self._update(job_id, status=CANCELLED, finished_at=time.time())
+        return self.get(job_id)
+
+    def recover(self):
+        """
+        Requeues jobs of registered types that were left queued, or running in a process that
+        no longer exists, e.g. after a restart. Jobs this runner is still working on are left
+        alone, and a job several processes recover at once is requeued by only one of them.
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT * FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+        finally:
+            conn.close()
+
+        for row in rows:
+            if row["type"] not in self._types or self._in_hand(row["id"]) or _process_alive(row["owner_pid"]):
+                continue
+            # Only act if no other process has taken the job over since it was read
+            seen = {"status": row["status"], "owner_pid": row["owner_pid"]}
+            if row["cancel_requested"]:
+                self._update(row["id"], expect=seen, status=CANCELLED, finished_at=time.time())
+            elif row["status"] == RUNNING and row["attempts"] >= row["max_attempts"]:
+                self._update(row["id"], expect=seen, status=FAILED, error="Interrupted by a restart",
+                             finished_at=time.time())
+            elif self._update(row["id"], expect=seen, status=QUEUED, owner_pid=os.getpid()):
+                print(f"Recovering job '{row['id']}' ({row['type']}).")
+                self._dispatch(row["id"])
+
+    def _in_hand(self, job_id: str) -> bool:
+        """Whether this runner has the job queued, running or waiting to be retried."""
+        with self._lock:
+            future = self._futures.get(job_id)
+            return (future is not None and not future.done()) or job_id in self._retrying
+
+    # Execution
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(max_workers=self._thread_workers, thread_name_prefix="job")
+            return self._thread_pool
+
+    def _dispatch(self, job_id: str):
+        future = self._pool().submit(self._execute, job_id)
+        with self._lock:
+            self._retrying.discard(job_id)
+            self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._forget(job_id))
+
+    def _forget(self, job_id: str):
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def _execute(self, job_id: str):
+        row = self._row(job_id)
+        if not row or row["status"] != QUEUED:
+            return
+        if row["cancel_requested"]:
+            self._update(job_id, status=CANCELLED, finished_at=time.time())
+            return
+
+        job_type = self._types[row["type"]]
+        params = json.loads(row["params"])
+        attempt = row["attempts"] + 1
+        # Claimed only if still queued as read, so a job dispatched twice (by two processes
+        # recovering it, say) runs once
+        claimed = self._update(job_id, expect={"status": QUEUED, "attempts": row["attempts"], "cancel_requested": 0},
+                               status=RUNNING, attempts=attempt, owner_pid=os.getpid(),
+                               started_at=row["started_at"] or time.time(), error=None)
+        if not claimed:
+            # Cancelling between the read and the claim leaves the job queued for nobody
+            self._update(job_id, expect={"status": QUEUED, "cancel_requested": 1}, status=CANCELLED, finished_at=time.time())
+            return
+        try:
+            result = job_type.handler(JobContext(self, job_id), **params)
+            self._update(job_id, status=SUCCEEDED, result=json.dumps(result, default=str), finished_at=time.time())
+        except JobCancelled:
+            self._update(job_id, status=CANCELLED, finished_at=time.time())
+        except Exception as e:
+            print(f"Job '{job_id}' ({job_type.name}) failed on attempt {attempt}: {e}")
+            if attempt < job_type.retry.max_attempts and not self._cancel_requested(job_id):
+                self._update(job_id, status=QUEUED, error=str(e))
+                with self._lock:
+                    self._retrying.add(job_id)
+                timer = threading.Timer(job_type.retry.delay(attempt), self._dispatch, args=(job_id,))
+                timer.daemon = True
+                timer.start()
+            else:
+                self._update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+
+
+def _process_alive(pid: int) -> bool:
+    """Whether another process with this ID is running (this process's jobs are checked by JobRunner._in_hand)."""
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+# Shared runner for the process; rest modules register their job types on it
+job_runner = JobRunner()
+
+
+def register_job_routes(app: Flask, runner: JobRunner = job_runner):
+    """
+    Adds the job endpoints to a Flask app:
+    POST /jobs, GET /jobs/<job_id> and POST /jobs/<job_id>/cancel.
+    """
+    @app.route('/jobs', methods=['POST'])
+    def create_job():
+        """
+        Enqueues a job of a registered public type, after its checks on the params.
+        Expected JSON payload: {
+            "type": "string",
+            "params": {}
+        }
+        """
+        try:
+            data = request.get_json()
+            if not data or 'type' not in data:
+                return jsonify({'error': 'Missing required field: type'}), 400
+            if not runner.is_public(data['type']):
+                return jsonify({'error': f"Unknown job type: {data['type']}"}), 400
+            params = data.get('params', {})
+            if not isinstance(params, dict):
+                return jsonify({'error': 'params must be an object'}), 400
+            try:
+                runner.authorize(data['type'], params)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+            job = runner.submit(data['type'], params)
+            return jsonify({
+                'message': 'Job queued successfully',
+                'job': job
+            }), 202
+
+        except JobQueueFull as e:
+            return jsonify({'error': str(e)}), 503
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def get_job(job_id):
+        """
+        Reports the status, progress and result of a job.
+        """
+        try:
+            job = runner.get(job_id)
+            if not job:
+                return jsonify({'error': 'Job not found'}), 404
+
+            return jsonify({
+                'message': 'Job retrieved successfully',
+                'job': job
+            }), 200
+
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/jobs/<job_id>/cancel', methods=['POST'])
+    def cancel_job(job_id):
+        """
+        Requests cancellation of a job.
+        """
+        try:
+            job = runner.cancel(job_id)
+            if not job:
+                return jsonify({'error': 'Job not found'}), 404
+
+            return jsonify({
+                'message': 'Job cancellation requested',
+                'job': job
+            }), 200
+
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
@@ -0,0 +1,321 @@
+import argparse
+import contextlib
+import heapq
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+VITALS_ROUTE = "PUT /drivers/<driver_id>"
+EVENT_ROUTE = "POST /events"
+
+VITALS_FIELDS = ("heartRate", "bloodOxygenLevel", "vehicleSpeed")
+# Likely next statuses from each status; the device reports one of these on a status change
+TRANSITIONS = {
+    "Idle": ["Stable"],
+    "Stable": ["Mild", "Idle", "LockedIn"],
+    "LockedIn": ["Stable", "Mild"],
+    "Mild": ["Stable", "Unstable"],
+    "Unstable": ["Mild", "Severe"],
+    "Severe": ["Unstable", "Critical"],
+    "Critical": ["Severe"],
+}
+HTTP_TIMEOUT = 10.0
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class RouteStats:
+    """Outcomes and latencies of one route."""
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses: Dict[int, int] = {}
+        self.failures = 0       # requests that got no response at all
+        self._lock = threading.Lock()
+
+    def record(self, status: Optional[int], seconds: float):
+        with self._lock:
+            self.latencies.append(seconds)
+            if status is None:
+                self.failures += 1
+            else:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        with self._lock:
+            ordered = sorted(self.latencies)
+            statuses = dict(self.statuses)
+            failures = self.failures
+        total = len(ordered)
+        throttled = statuses.get(429, 0)
+        errors = failures + sum(count for status, count in statuses.items() if status >= 400 and status != 429)
+        return {
+            "requests": total,
+            "throughput": round(total / elapsed, 2) if elapsed else 0.0,
+            "errorRate": round(errors / total, 4) if total else 0.0,
+            "throttledRate": round(throttled / total, 4) if total else 0.0,
+            "statuses": {str(status): count for status, count in sorted(statuses.items())},
+            "failures": failures,
+            "latencyMs": {name: round(_percentile(ordered, fraction) * 1000, 2)
+                          for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))},
+        }
+
+
+class LoadReport:
+    """Everything measured during one run."""
+    def __init__(self, drivers: int, offered_rate: float):
+        self.drivers = drivers
+        self.offered_rate = offered_rate
+        self.routes: Dict[str, RouteStats] = {VITALS_ROUTE: RouteStats(), EVENT_ROUTE: RouteStats()}
+        self.lag = RouteStats()     # how late requests were sent compared to their schedule
+        self.elapsed = 0.0
+
+    def to_map(self) -> Dict[str, Any]:
+        total = sum(len(stats.latencies) for stats in self.routes.values())
+        return {
+            "drivers": self.drivers,
+            "seconds": round(self.elapsed, 2),
+            "offeredRate": round(self.offered_rate, 2),
+            "achievedRate": round(total / self.elapsed, 2) if self.elapsed else 0.0,
+            "scheduleLagMs": self.lag.summary(self.elapsed)["latencyMs"],
+            "routes": {route: stats.summary(self.elapsed) for route, stats in self.routes.items()},
+        }
+
+    def print_report(self):
+        report = self.to_map()
+        print(f"\n{report['drivers']} drivers for {report['seconds']}s: offered {report['offeredRate']} req/s, "
+              f"achieved {report['achievedRate']} req/s")
+        print(f"{'route':<28}{'requests':>10}{'req/s':>10}{'errors':>9}{'429s':>8}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+        for route, stats in report["routes"].items():
+            latency = stats["latencyMs"]
+            print(f"{route:<28}{stats['requests']:>10}{stats['throughput']:>10}{stats['errorRate']:>9.2%}"
+                  f"{stats['throttledRate']:>8.2%}{latency['p50']:>9}{latency['p90']:>9}{latency['p99']:>9}{latency['max']:>9}")
+        lag = report["scheduleLagMs"]
+        print(f"schedule lag (ms): p50 {lag['p50']}  p99 {lag['p99']}  max {lag['max']}"
+              " (a growing lag means the backend could not keep up)")
+
+
+class InProcessTransport:
+    """Calls the Flask apps directly, with every service sharing one LocalDatabase."""
+    def __init__(self, local_path: str = ":memory:"):
+        # Must be set before the services create their Database
+        os.environ["DRIVESENSE_LOCAL_DB"] = local_path
+        import Driver_rest
+        import Event_rest
+        self._apps = {"drivers": Driver_rest.app, "events": Event_rest.app}
+        self._outbox = Event_rest.outbox_worker
+        self._clients = threading.local()
+
+    def start(self):
+        self._outbox.start()
+
+    def stop(self):
+        self._outbox.stop()
+
+    def request(self, service: str, method: str, path: str, body: Dict[str, Any]) -> Optional[int]:
+        clients = self._clients.__dict__
+        if service not in clients:
+            clients[service] = self._apps[service].test_client()
+        return clients[service].open(path, method=method, json=body).status_code
+
+
+class HttpTransport:
+    """
+    Calls running services over HTTP. Both services must see the same data, e.g. both
+    pointed at the Firestore emulator (FIRESTORE_EMULATOR_HOST).
+    """
+    def __init__(self, drivers_url: str, events_url: str):
+        self._urls = {"drivers": drivers_url.rstrip("/"), "events": events_url.rstrip("/")}
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def request(self, service: str, method: str, path: str, body: Dict[str, Any]) -> Optional[int]:
+        data = json.dumps(body).encode("utf-8")
+        req = urllib.request.Request(self._urls[service] + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=HTTP_TIMEOUT) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except (urllib.error.URLError, OSError):
+            return None
+
+
+class SimulatedDriver:
+    """One in-vehicle device: drifting vitals and occasional status transitions."""
+    def __init__(self, driver_id: str, user_id: str, rng: random.Random):
+        self.driver_id = driver_id
+        self.user_id = user_id
+        self.status = "Stable"
+        self.vitals = {"heartRate": 75.0, "bloodOxygenLevel": 98.0, "vehicleSpeed": 50.0}
+        self._rng = rng
+        self._field = 0
+
+    def next_update(self, status_change_prob: float) -> Tuple[str, Any]:
+        """The (field, value) of the next PUT: usually the next vital, sometimes a new status."""
+        if self._rng.random() < status_change_prob:
+            self.status = self._rng.choice(TRANSITIONS[self.status])
+            return "status", self.status
+        field = VITALS_FIELDS[self._field % len(VITALS_FIELDS)]
+        self._field += 1
+        drift = {"heartRate": 3.0, "bloodOxygenLevel": 0.5, "vehicleSpeed": 8.0}[field]
+        self.vitals[field] = max(0.0, self.vitals[field] + self._rng.uniform(-drift, drift))
+        return field, round(self.vitals[field], 1)
+
+    def next_event(self) -> Dict[str, Any]:
+        now = datetime.now(timezone.utc)
+        return {
+            "eventId": uuid.uuid4().hex,
+            "driverId": self.driver_id,
+            "userId": self.user_id,     # lets the rate limiter bucket devices per user, not per address
+            "status": self.status,
+            "timeStamp": now.isoformat(),
+            "date": now.strftime("%Y-%m-%d"),
+            "videoLink": "",
+            **{field: round(value, 1) for field, value in self.vitals.items()},
+        }
+
+
+def _create_drivers(transport, count: int, drivers_per_user: int, seed: int, run_id: str) -> List[SimulatedDriver]:
+    drivers = []
+    for i in range(count):
+        driver = SimulatedDriver(f"load-{run_id}-{i}", f"load-{run_id}-user-{i // drivers_per_user}", random.Random(seed + i))
+        status = transport.request("drivers", "POST", "/drivers", {
+            "driverId": driver.driver_id, "name": f"Load driver {i}", "phoneNumber": "555-0000",
+            "userId": driver.user_id, "status": driver.status,
+        })
+        if status != 201:
+            raise Exception(f"Could not create driver {driver.driver_id} (status {status})")
+        drivers.append(driver)
+    return drivers
+
+
+def _worker(transport, drivers: List[SimulatedDriver], report: LoadReport, deadline: float, vitals_interval: float,
+            event_interval: Optional[float], status_change_prob: float, rng: random.Random):
+    """Sends each driver's requests on an open-loop schedule until the deadline."""
+    start = time.monotonic()
+    schedule = []
+    for n, driver in enumerate(drivers):
+        # Spread first requests over one interval so the drivers don't fire in lockstep
+        heapq.heappush(schedule, (start + rng.uniform(0, vitals_interval), n, "vitals", driver))
+        if event_interval:
+            heapq.heappush(schedule, (start + rng.uniform(0, event_interval), n, "event", driver))
+
+    while schedule:
+        due, n, kind, driver = heapq.heappop(schedule)
+        if due >= deadline:
+            continue
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        sent = time.monotonic()
+        report.lag.record(0, sent - due)
+
+        if kind == "vitals":
+            field, value = driver.next_update(status_change_prob)
+            route, status = VITALS_ROUTE, None
+            try:
+                status = transport.request("drivers", "PUT", f"/drivers/{driver.driver_id}",
+                                           {"userId": driver.user_id, "fieldToChange": field, "newValue": value})
+            except Exception as e:
+                print(f"Request failed: {e}")
+            interval = vitals_interval
+        else:
+            route, status = EVENT_ROUTE, None
+            try:
+                status = transport.request("events", "POST", "/events", driver.next_event())
+            except Exception as e:
+                print(f"Request failed: {e}")
+            interval = event_interval
+        report.routes[route].record(status, time.monotonic() - sent)
+        # Open loop: the next request is due one interval after this one was due, however late it ran
+        heapq.heappush(schedule, (due + interval, n, kind, driver))
+
+
+def run(transport, drivers: int = 100, vitals_rate: float = 1.0, event_rate: float = 0.05, duration: float = 30.0,
+        concurrency: int = 16, drivers_per_user: int = 5, status_change_prob: float = 0.05, seed: int = 1) -> LoadReport:
+    """
+    Simulates a fleet against the drivers and events services and measures what they sustain.
+
+    :param transport: InProcessTransport or HttpTransport.
+    :param drivers: Simulated devices; each gets its own driver document.
+    :param vitals_rate: PUT /drivers/<id> requests per second per driver.
+    :param event_rate: POST /events requests per second per driver (0 disables events).
+    :param duration: Seconds to generate load for, after the drivers are created.
+    :param concurrency: Worker threads sending requests; drivers are split between them.
+    :param drivers_per_user: Drivers per simulated user (rate limits are per user).
+    :param status_change_prob: Chance that a vitals update is a status change instead.
+    """
+    rng = random.Random(seed)
+    run_id = uuid.UUID(int=rng.getrandbits(128)).hex[:8]
+    fleet = _create_drivers(transport, drivers, drivers_per_user, seed, run_id)
+    report = LoadReport(drivers, drivers * (vitals_rate + event_rate))
+
+    transport.start()
+    started = time.monotonic()
+    deadline = started + duration
+    workers = [threading.Thread(target=_worker, daemon=True, args=(
+        transport, fleet[i::concurrency], report, deadline, 1.0 / vitals_rate,
+        1.0 / event_rate if event_rate else None, status_change_prob, random.Random(seed * 1000 + i)))
+        for i in range(min(concurrency, drivers))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    report.elapsed = time.monotonic() - started
+    transport.stop()
+    return report
+
+
+if __name__ == "__main__":
+    # Usage: python Loadgen.py --drivers 200 --duration 60
+    #        python Loadgen.py --drivers-url http://localhost:5001 --events-url http://localhost:5002
+    parser = argparse.ArgumentParser(description="Simulate a fleet of in-vehicle devices and measure the backend.")
+    parser.add_argument("--drivers", type=int, default=100, help="simulated drivers")
+    parser.add_argument("--vitals-rate", type=float, default=1.0, help="vitals updates per second per driver")
+    parser.add_argument("--event-rate", type=float, default=0.05, help="events per second per driver")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    parser.add_argument("--concurrency", type=int, default=16, help="worker threads")
+    parser.add_argument("--drivers-per-user", type=int, default=5)
+    parser.add_argument("--status-change-prob", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--local", metavar="PATH", default=":memory:",
+                        help="LocalDatabase for in-process runs (default: in memory)")
+    parser.add_argument("--drivers-url", help="drivers service to call over HTTP instead of in process")
+    parser.add_argument("--events-url", help="events service to call over HTTP instead of in process")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    if bool(args.drivers_url) != bool(args.events_url):
+        parser.error("--drivers-url and --events-url go together")
+    in_process = not args.drivers_url
+
+    # In process, the services' per-operation logging would swamp the report
+    quiet = open(os.devnull, "w") if in_process else None
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        transport = InProcessTransport(args.local) if in_process else HttpTransport(args.drivers_url, args.events_url)
+        result = run(transport, args.drivers, args.vitals_rate, args.event_rate, args.duration, args.concurrency,
+                     args.drivers_per_user, args.status_change_prob, args.seed)
+    if quiet:
+        quiet.close()
+
+    if args.json:
+        print(json.dumps(result.to_map(), indent=2))
+    else:
+        result.print_report()
@@ -0,0 +1,289 @@
+import atexit
+import copy
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+from Database import DELETE_FIELD, Database
+from Backup import decode_document, encode_document
+
+# Firestore comparison operators supported by the local client
+_OPERATORS = {
+    "==": lambda value, arg: value == arg,
+    "!=": lambda value, arg: value is not None and value != arg,
+    "<": lambda value, arg: value is not None and value < arg,
+    "<=": lambda value, arg: value is not None and value <= arg,
+    ">": lambda value, arg: value is not None and value > arg,
+    ">=": lambda value, arg: value is not None and value >= arg,
+    "in": lambda value, arg: value in arg,
+    "not-in": lambda value, arg: value is not None and value not in arg,
+    "array_contains": lambda value, arg: isinstance(value, list) and arg in value,
+    "array_contains_any": lambda value, arg: isinstance(value, list) and any(a in value for a in arg),
+}
+
+
+class NotFound(Exception):
+    """Raised when updating a document that does not exist, as Firestore does."""
+
+
+class _Snapshot:
+    def __init__(self, doc_id: str, data: Optional[Dict[str, Any]]):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def get(self, field: str) -> Any:
+        return (self._data or {}).get(field)
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data)
+
+
+class _Count:
+    def __init__(self, value: int):
+        self.value = value
+
+
+class _CountQuery:
+    def __init__(self, query: "_Query"):
+        self._query = query
+
+    def get(self, retry=None, timeout=None):
+        return [[_Count(sum(1 for _ in self._query.stream()))]]
+
+
+class _Document:
+    def __init__(self, store: "_Store", collection: str, doc_id: str):
+        self._store = store
+        self._collection = collection
+        self.id = doc_id
+
+    def get(self, retry=None, timeout=None) -> _Snapshot:
+        with self._store.lock:
+            return _Snapshot(self.id, copy.deepcopy(self._store.collection(self._collection).get(self.id)))
+
+    def set(self, data: Dict[str, Any], retry=None, timeout=None):
+        self._store.apply([("set", self._collection, self.id, data)])
+
+    def update(self, updates: Dict[str, Any], retry=None, timeout=None):
+        self._store.apply([("update", self._collection, self.id, updates)])
+
+    def delete(self, retry=None, timeout=None):
+        self._store.apply([("delete", self._collection, self.id, None)])
+
+
+class _Query:
+    """An immutable query over one collection, built the same way as a Firestore query."""
+    def __init__(self, store: "_Store", collection: str, filters=(), order=None, fields=None, limit=None, after=None):
+        self._store = store
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._order = order
+        self._fields = fields
+        self._limit = limit
+        self._after = after
+
+    def _copy(self, **changes) -> "_Query":
+        state = dict(filters=self._filters, order=self._order, fields=self._fields, limit=self._limit, after=self._after)
+        state.update(changes)
+        return _Query(self._store, self._collection, **state)
+
+    def document(self, doc_id: str) -> _Document:
+        return _Document(self._store, self._collection, doc_id)
+
+    def where(self, field: str, op: str, value: Any) -> "_Query":
+        if op not in _OPERATORS:
+            raise ValueError(f"Unsupported operator '{op}'")
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field: str, direction: str = "ASCENDING") -> "_Query":
+        return self._copy(order=(field, direction == "DESCENDING"))
+
+    def select(self, fields: List[str]) -> "_Query":
+        return self._copy(fields=list(fields))
+
+    def limit(self, count: int) -> "_Query":
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot: _Snapshot) -> "_Query":
+        return self._copy(after=snapshot)
+
+    def count(self, alias: str = None) -> _CountQuery:
+        return _CountQuery(self)
+
+    def _sort_key(self, doc_id: str, data: Dict[str, Any]):
+        return (data.get(self._order[0]), doc_id) if self._order else (doc_id,)
+
+    def stream(self, retry=None, timeout=None):
+        with self._store.lock:
+            items = [(doc_id, copy.deepcopy(data)) for doc_id, data in self._store.collection(self._collection).items()
+                     if all(_OPERATORS[op](data.get(field), value) for field, op, value in self._filters)]
+
+        descending = bool(self._order and self._order[1])
+        if self._order:
+            # Firestore leaves out documents that lack the field being ordered by
+            items = [(doc_id, data) for doc_id, data in items if self._order[0] in data]
+        items.sort(key=lambda item: self._sort_key(*item), reverse=descending)
+        if self._after is not None:
+            cursor = self._sort_key(self._after.id, self._after._data or {})
+            items = [item for item in items
+                     if (self._sort_key(*item) < cursor if descending else self._sort_key(*item) > cursor)]
+        if self._limit:
+            items = items[:self._limit]
+        for doc_id, data in items:
+            if self._fields is not None:
+                data = {field: data[field] for field in self._fields if field in data}
+            yield _Snapshot(doc_id, data)
+
+
+class _Batch:
+    def __init__(self, store: "_Store"):
+        self._store = store
+        self._operations = []
+
+    def set(self, doc_ref: _Document, data: Dict[str, Any], merge: bool = False):
+        self._operations.append(("merge" if merge else "set", doc_ref._collection, doc_ref.id, data))
+
+    def update(self, doc_ref: _Document, updates: Dict[str, Any]):
+        self._operations.append(("update", doc_ref._collection, doc_ref.id, updates))
+
+    def delete(self, doc_ref: _Document):
+        self._operations.append(("delete", doc_ref._collection, doc_ref.id, None))
+
+    def commit(self, retry=None, timeout=None):
+        self._store.apply(self._operations)
+
+
+class _Store:
+    """Every collection of the local client, guarded by one lock."""
+    def __init__(self):
+        self.collections: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.lock = threading.RLock()
+        self.dirty = False
+
+    def collection(self, name: str) -> Dict[str, Dict[str, Any]]:
+        return self.collections.setdefault(name, {})
+
+    def apply(self, operations):
+        """Applies writes atomically: every update target is checked before anything changes."""
+        with self.lock:
+            for action, collection, doc_id, _ in operations:
+                if action == "update" and doc_id not in self.collection(collection):
+                    raise NotFound(f"No document to update: {collection}/{doc_id}")
+            for action, collection, doc_id, data in operations:
+                documents = self.collection(collection)
+                if action == "set":
+                    documents[doc_id] = copy.deepcopy(data)
+                elif action == "update":
+                    for path, value in data.items():
+                        # Dotted keys update nested map fields, as in Firestore
+                        target = documents[doc_id]
+                        *parents, leaf = path.split(".")
+                        for parent in parents:
+                            target = target.setdefault(parent, {})
+                        target[leaf] = copy.deepcopy(value)
+                elif action == "merge":
+                    _merge(documents.setdefault(doc_id, {}), data)
+                elif action == "delete":
+                    documents.pop(doc_id, None)
+            self.dirty = True
+
+
+def _merge(target: Dict[str, Any], data: Dict[str, Any]):
+    """Merges data into a document as Firestore's set(..., merge=True) does: nested maps are merged, not replaced."""
+    for key, value in data.items():
+        if value is DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            _merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+class LocalClient:
+    """
+    A small in-process stand-in for the Firestore client: the subset of collections, queries,
+    cursors, count aggregations and batches that Database uses. Reads and writes accept
+    Firestore's retry and timeout arguments and ignore them.
+    """
+    def __init__(self):
+        self._store = _Store()
+
+    def collection(self, name: str) -> _Query:
+        return _Query(self._store, name)
+
+    def batch(self) -> _Batch:
+        return _Batch(self._store)
+
+
+class LocalDatabase(Database):
+    """
+    A Database backed by LocalClient instead of Firestore, for local development, load tests
+    and restoring backups without a Google Cloud project. Every Database method, hook and
+    metric works unchanged.
+
+    With a path, the data is loaded from that JSON file on start and written back by flush()
+    (also called at exit); without one, it lives only in memory.
+    """
+    def __init__(self, path: str = None):
+        super().__init__("local")
+        self._db = LocalClient()
+        self._path = path
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            for collection, documents in stored.items():
+                self._db._store.collections[collection] = {
+                    doc_id: decode_document(data) for doc_id, data in documents.items()}
+            print(f"Local database loaded from '{path}'.")
+        if path:
+            atexit.register(self.flush)
+
+    def _create_client(self):
+        # A forked child simply keeps its copy of the parent's data
+        return self._client
+
+    def _merge_data(self, data):
+        # The local client understands DELETE_FIELD itself
+        return data
+
+    def _run_transaction(self, reads, decide, timeout):
+        # Holding the store's lock from the reads to the writes leaves nothing to contend with
+        store = self._db._store
+        with store.lock:
+            documents = {(collection, doc_id): copy.deepcopy(store.collection(collection).get(doc_id))
+                         for collection, doc_id in reads}
+            operations = list(decide(documents))
+            batch = self._db.batch()
+            self._stage(batch, operations)
+            batch.commit()
+        return operations
+
+    def flush(self):
+        """Writes the data to the backing file, if there is one and anything changed."""
+        store = self._db._store
+        if not self._path or not store.dirty:
+            return
+        with store.lock:
+            snapshot = {collection: {doc_id: encode_document(data) for doc_id, data in documents.items()}
+                        for collection, documents in store.collections.items()}
+            store.dirty = False
+        temp_path = f"{self._path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(temp_path, self._path)
+        print(f"Local database saved to '{self._path}'.")
+
+
+_shared: Dict[str, LocalDatabase] = {}
+_shared_lock = threading.Lock()
+
+
+def shared_local_database(path: str) -> LocalDatabase:
+    """One LocalDatabase per path per process, so services running together see the same data."""
+    with _shared_lock:
+        if path not in _shared:
+            _shared[path] = LocalDatabase(None if path == ":memory:" else path)
+        return _shared[path]
@@ -0,0 +1,254 @@
+import threading
+import time
+from typing import Callable, Dict, List, Tuple, Sequence
+from flask import Flask, Response, g, request
+
+# Operational endpoints that are polled constantly and would drown out real traffic
+UNINSTRUMENTED_ENDPOINTS = {"metrics", "ready"}
+
+# Latency buckets in seconds, tuned for Firestore round trips (a few ms up to several seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value) -> str:
+    """Escapes a label value for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Dict[str, str] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs += [f'{n}="{_escape(v)}"' for n, v in extra.items()]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """A monotonically increasing counter, keyed by label values."""
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        key = tuple(str(v) for v in label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, *label_values) -> float:
+        with self._lock:
+            return self._values.get(tuple(str(v) for v in label_values), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """A cumulative histogram with fixed buckets, keyed by label values."""
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., sum, count]
+        self._values: Dict[LabelValues, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        key = tuple(str(v) for v in label_values)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [0] * len(self.buckets) + [0.0, 0]
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += state[i]
+                labels = _format_labels(self.label_names, key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key, {"le": "+Inf"})
+            lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {state[-1]}")
+        return lines
+
+
+class Registry:
+    """Holds every metric of the process and renders them in Prometheus text format."""
+    def __init__(self):
+        self._metrics = []
+        self._collectors: List[Callable[[], List[str]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, label_names)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, label_names, buckets)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[str]]):
+        """Registers a function that returns extra exposition lines (e.g. derived ratios) at render time."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "drivesense_http_requests_total",
+    "HTTP requests handled, by service, route, method and status code.",
+    ("service", "route", "method", "status"))
+http_errors = registry.counter(
+    "drivesense_http_request_errors_total",
+    "HTTP requests that ended with a 4xx or 5xx status.",
+    ("service", "route", "method", "status"))
+http_latency = registry.histogram(
+    "drivesense_http_request_duration_seconds",
+    "HTTP request latency in seconds.",
+    ("service", "route", "method"))
+
+storage_operations = registry.counter(
+    "drivesense_storage_operations_total",
+    "Firestore operations issued by Database, by collection, operation and outcome.",
+    ("collection", "operation", "outcome"))
+storage_latency = registry.histogram(
+    "drivesense_storage_operation_duration_seconds",
+    "Firestore operation latency in seconds.",
+    ("collection", "operation"))
+
+cache_lookups = registry.counter(
+    "drivesense_cache_lookups_total",
+    "Cache lookups, by cache name and result (hit or miss).",
+    ("cache", "result"))
+
+
+def ratio_collector(name: str, help_text: str, counter: Counter, numerator: str):
+    """
+    Builds a collector that derives a gauge from a counter labelled (group, kind): for every
+    group, the share of its total count whose kind equals numerator.
+    """
+    group_label = counter.label_names[0]
+
+    def collect():
+        with counter._lock:
+            values = dict(counter._values)
+        totals: Dict[str, float] = {}
+        for (group, _), count in values.items():
+            totals[group] = totals.get(group, 0) + count
+        if not totals:
+            return []
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for group in sorted(totals):
+            ratio = values.get((group, numerator), 0) / totals[group] if totals[group] else 0.0
+            lines.append(f'{name}{{{group_label}="{_escape(group)}"}} {_format_value(ratio)}')
+        return lines
+    return collect
+
+
+registry.add_collector(ratio_collector(
+    "drivesense_cache_hit_ratio", "Fraction of cache lookups that were hits.", cache_lookups, "hit"))
+
+
+def record_cache(cache: str, hit: bool):
+    """Records a single cache lookup so /metrics can report hit ratios."""
+    cache_lookups.inc(cache, "hit" if hit else "miss")
+
+
+class storage_timer:
+    """
+    Context manager that times one Firestore operation and records its outcome.
+
+    :param collection: The Firestore collection being accessed.
+    :param operation: One of read, write, update, delete or query.
+    """
+    def __init__(self, collection: str, operation: str):
+        self.collection = collection
+        self.operation = operation
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        outcome = "error" if exc_type else "ok"
+        storage_operations.inc(self.collection, self.operation, outcome)
+        storage_latency.observe(elapsed, self.collection, self.operation)
+        return False
+
+
+def register_metrics(app: Flask, service: str):
+    """
+    Instruments every route of a Flask app and exposes GET /metrics.
+
+    :param app: The Flask app to instrument.
+    :param service: Label identifying the app (users, drivers or events).
+    """
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = getattr(g, "_metrics_start", None)
+        if start is None or request.endpoint in UNINSTRUMENTED_ENDPOINTS:
+            return response
+
+        # Use the route template, not the raw path, to keep label cardinality bounded
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        status = str(response.status_code)
+        http_requests.inc(service, route, request.method, status)
+        http_latency.observe(time.perf_counter() - start, service, route, request.method)
+        if response.status_code >= 400:
+            http_errors.inc(service, route, request.method, status)
+        return response
+
+    @app.route('/metrics', methods=['GET'], endpoint='metrics')
+    def metrics():
+        """Exposes all collected metrics in Prometheus text format."""
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
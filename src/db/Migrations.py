@@ -0,0 +1,180 @@
+import argparse
+from datetime import datetime, timezone
+from typing import Dict
+from Event import event_occurred_at, time_fields
+
+EVENT_COLLECTION = "events"
+DRIVER_COLLECTION = "drivers"
+BATCH_SIZE = 500    # Firestore's limit on writes per batch
+PAGE_SIZE = 1000    # documents read per round trip
+
+
+def backfill_event_time_fields(db_handler, dry_run: bool = False) -> Dict[str, int]:
+    """
+    One-time migration that gives existing events the native occurredAt timestamp and
+    dateBucket that new events get on write, derived from their timeStamp and date strings
+    (ISO-8601, or the dashboard's en-US 'January 15, 2024' and '10:30 AM').
+    Only the fields needed are read, page by page, and updates are committed in batches.
+    Safe to re-run: events that already have the right values are left alone.
+
+    Embedded copies in driver documents are refreshed by running the outbox reconciliation
+    afterwards (python Outbox.py reconcile, or --reconcile here).
+
+    :return: Counts of events scanned, updated and skipped because their strings don't parse.
+    """
+    stats = {"scanned": 0, "updated": 0, "unparseable": 0}
+    pending = []
+    fields = ["timeStamp", "date", "occurredAt", "dateBucket"]
+    for doc_id, event in db_handler.iter_documents(EVENT_COLLECTION, [], page_size=PAGE_SIZE, fields=fields):
+        stats["scanned"] += 1
+        derived = time_fields(event.get("timeStamp", ""), event.get("date", ""))
+        if derived["occurredAt"] is None:
+            stats["unparseable"] += 1
+            print(f"Event '{doc_id}' has no parseable timeStamp/date: {event.get('timeStamp')!r} {event.get('date')!r}")
+            continue
+        if event.get("occurredAt") == derived["occurredAt"] and event.get("dateBucket") == derived["dateBucket"]:
+            continue
+
+        stats["updated"] += 1
+        pending.append(("update", EVENT_COLLECTION, doc_id, derived))
+        if len(pending) == BATCH_SIZE:
+            if not dry_run:
+                db_handler.batch_write(pending)
+            pending = []
+    if pending and not dry_run:
+        db_handler.batch_write(pending)
+
+    print(f"Event timestamp backfill {'(dry run) ' if dry_run else ''}finished: {stats}")
+    return stats
+
+
+def backfill_status_timestamps(db_handler, dry_run: bool = False) -> Dict[str, int]:
+    """
+    One-time migration that gives drivers saved before statusUpdatedAt existed one, so the
+    status queries (which order by it, and so leave out drivers without it) find them.
+    It is the time of the driver's latest embedded event, or failing that of its own
+    timeStamp and date; drivers with neither get the epoch, ranking them as changed
+    longest ago. Safe to re-run: drivers that have the field are left alone.
+
+    :return: Counts of drivers scanned and updated, and of those dated to the epoch.
+    """
+    stats = {"scanned": 0, "updated": 0, "undated": 0}
+    pending = []
+    fields = ["statusUpdatedAt", "events", "timeStamp", "date"]
+    for doc_id, driver in db_handler.iter_documents(DRIVER_COLLECTION, [], page_size=PAGE_SIZE, fields=fields):
+        stats["scanned"] += 1
+        if driver.get("statusUpdatedAt") is not None:
+            continue
+
+        times = [event.get("occurredAt") or event_occurred_at(event.get("timeStamp", ""), event.get("date", ""))
+                 for event in driver.get("events") or []]
+        times = [time for time in times if isinstance(time, datetime)]
+        updated_at = max(times) if times else event_occurred_at(driver.get("timeStamp", ""), driver.get("date", ""))
+        if updated_at is None:
+            stats["undated"] += 1
+            updated_at = datetime.fromtimestamp(0, timezone.utc)
+
+        stats["updated"] += 1
+        pending.append(("update", DRIVER_COLLECTION, doc_id, {"statusUpdatedAt": updated_at}))
+        if len(pending) == BATCH_SIZE:
+            if not dry_run:
+                db_handler.batch_write(pending)
+            pending = []
+    if pending and not dry_run:
+        db_handler.batch_write(pending)
+
+    print(f"Driver status timestamp backfill {'(dry run) ' if dry_run else ''}finished: {stats}")
+    return stats
+
+
+def offload_profile_pictures(db_handler, dry_run: bool = False) -> Dict[str, int]:
+    """
+    One-time migration that moves profile pictures stored inline as base64 data URLs into
+    the blob store, leaving the drivers with the picture and thumbnail URLs new drivers get.
+    Drivers without a thumbnail URL get one too. Safe to re-run.
+
+    Dashboard cards pick up the thumbnails by rebuilding them afterwards
+    (python Dashboard.py rebuild).
+
+    :return: Counts of drivers scanned, updated and skipped because their picture is unusable.
+    """
+    from Blobs import blob_store, is_data_url
+
+    stats = {"scanned": 0, "updated": 0, "invalid": 0}
+    pending = []
+    fields = ["profilePic", "profilePicThumbnail"]
+    for doc_id, driver in db_handler.iter_documents(DRIVER_COLLECTION, [], page_size=PAGE_SIZE, fields=fields):
+        stats["scanned"] += 1
+        picture = driver.get("profilePic", "")
+        if not is_data_url(picture) and "profilePicThumbnail" in driver:
+            continue
+        if dry_run:
+            # Storing the picture is itself a write, so a dry run only counts
+            stats["updated"] += 1
+            continue
+        try:
+            updates = blob_store.image_fields(picture, "profilePic")
+        except ValueError as e:
+            stats["invalid"] += 1
+            print(f"Driver '{doc_id}' has an unusable profile picture: {e}")
+            continue
+
+        stats["updated"] += 1
+        pending.append(("update", DRIVER_COLLECTION, doc_id, updates))
+        if len(pending) == BATCH_SIZE:
+            db_handler.batch_write(pending)
+            pending = []
+    if pending:
+        db_handler.batch_write(pending)
+
+    print(f"Profile picture migration {'(dry run) ' if dry_run else ''}finished: {stats}")
+    return stats
+
+
+def build_dashboards(db_handler, dry_run: bool = False) -> Dict[str, int]:
+    """
+    One-time migration that builds the dashboard document of every user whose drivers
+    predate dashboards. Until then their dashboard is read from a drivers query. Users
+    whose dashboard was already built are left alone; rebuilding those is a repair
+    (python Dashboard.py rebuild). Safe to re-run.
+
+    :return: Counts of users with drivers, and of dashboards built.
+    """
+    from Dashboard import DASHBOARD_COLLECTION, rebuild_dashboard
+
+    built = {user_id for user_id, dashboard in db_handler.iter_documents(
+        DASHBOARD_COLLECTION, [], page_size=PAGE_SIZE, fields=["rebuiltAt"]) if "rebuiltAt" in dashboard}
+    users = {driver["userId"] for _, driver in db_handler.iter_documents(
+        DRIVER_COLLECTION, [], page_size=PAGE_SIZE, fields=["userId"]) if driver.get("userId")}
+
+    stats = {"users": len(users), "built": 0}
+    for user_id in sorted(users - built):
+        stats["built"] += 1
+        if not dry_run:
+            rebuild_dashboard(db_handler, user_id)
+
+    print(f"Dashboard migration {'(dry run) ' if dry_run else ''}finished: {stats}")
+    return stats
+
+
+MIGRATIONS = {
+    "event-timestamps": backfill_event_time_fields,
+    "profile-pictures": offload_profile_pictures,
+    "status-timestamps": backfill_status_timestamps,
+    "dashboards": build_dashboards,
+}
+
+
+if __name__ == "__main__":
+    # Usage: python Migrations.py {dashboards,event-timestamps,profile-pictures,status-timestamps} [--dry-run] [--reconcile]
+    parser = argparse.ArgumentParser(description="Run a one-time data migration.")
+    parser.add_argument("migration", choices=sorted(MIGRATIONS))
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--reconcile", action="store_true", help="refresh the events embedded in drivers afterwards")
+    args = parser.parse_args()
+
+    from Event_rest import db_handler
+    MIGRATIONS[args.migration](db_handler, dry_run=args.dry_run)
+    if args.reconcile and not args.dry_run:
+        from Outbox import reconcile_all
+        reconcile_all(db_handler)
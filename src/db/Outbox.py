@@ -0,0 +1,388 @@
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+OUTBOX_COLLECTION = "outbox"
+DEAD_LETTER_COLLECTION = "outbox_dead_letters"
+DRIVER_COLLECTION = "drivers"
+EVENT_COLLECTION = "events"
+
+# Outbox record kinds, each describing one change to a driver's embedded events array
+EVENT_UPSERT = "event_upsert"
+EVENT_UPDATE = "event_update"
+EVENT_REMOVE = "event_remove"
+
+# Fields of an events-collection document that are not mirrored into the driver's array
+LINK_FIELDS = ("driverId", "userId")
+
+POLL_INTERVAL = 1.0         # seconds between outbox polls when idle
+BATCH_SIZE = 200            # outbox records claimed per poll
+SCAN_PAGES = 5              # pages of records held by other workers or backing off skipped per poll, at most
+WORKER_THREADS = 4          # drivers updated concurrently
+# Seconds between full drift checks, which read every driver and event (0 disables them;
+# python Outbox.py reconcile runs one)
+RECONCILE_INTERVAL = float(os.environ.get("DRIVESENSE_RECONCILE_SECONDS", "0"))
+LEASE_SECONDS = 60          # how long a worker's claim on records lasts before another may take them over
+MAX_ATTEMPTS = 8            # failed applications before a record is moved to the dead letters
+RETRY_DELAY = 1.0           # seconds before a failed record is retried, doubling with every attempt
+MAX_RETRY_DELAY = 300
+
+
+def event_summary(event_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns the copy of an event that is embedded in the driver document."""
+    return {k: v for k, v in event_data.items() if k not in LINK_FIELDS}
+
+
+def upsert_record(driver_id: str, event_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Outbox record that inserts (or replaces) an event in the driver's array."""
+    return {"kind": EVENT_UPSERT, "driverId": driver_id, "eventId": event_data.get("eventId"),
+            "event": event_summary(event_data)}
+
+
+def update_record(driver_id: str, event_id: str, field: str, value: Any) -> Dict[str, Any]:
+    """Outbox record that changes one field of an event in the driver's array."""
+    return {"kind": EVENT_UPDATE, "driverId": driver_id, "eventId": event_id, "field": field, "value": value}
+
+
+def remove_record(driver_id: str, event_id: str) -> Dict[str, Any]:
+    """Outbox record that removes an event from the driver's array."""
+    return {"kind": EVENT_REMOVE, "driverId": driver_id, "eventId": event_id}
+
+
+def apply_record(events: List[Dict[str, Any]], record: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Applies one outbox record to an embedded events array.
+    Every kind is idempotent, so re-applying a record after a crash is harmless.
+    """
+    event_id = record.get("eventId")
+    kind = record.get("kind")
+    if kind == EVENT_REMOVE:
+        return [e for e in events if e.get("eventId") != event_id]
+
+    for i, event in enumerate(events):
+        if event.get("eventId") == event_id:
+            if kind == EVENT_UPSERT:
+                events[i] = dict(record["event"])
+            elif kind == EVENT_UPDATE:
+                events[i][record["field"]] = record["value"]
+            return events
+
+    # Event not mirrored yet: an upsert adds it, an update has nothing to change
+    if kind == EVENT_UPSERT:
+        events.append(dict(record["event"]))
+    return events
+
+
+def outbox_operations(records: List[Dict[str, Any]]) -> List[Tuple[str, str, str, Dict[str, Any]]]:
+    """
+    Batch operations that queue outbox records, for committing together with the writes they
+    describe. Any process may queue records; the events service's worker applies them.
+    """
+    now = time.time()
+    operations = []
+    for i, record in enumerate(records):
+        # Offset records written together so they are applied in the order given
+        record = dict(record, createdAt=now + i * 1e-6)
+        operations.append(("set", OUTBOX_COLLECTION, uuid.uuid4().hex, record))
+    return operations
+
+
+class OutboxWorker:
+    """
+    Applies pending outbox records to driver documents in the background.
+    Records are claimed in batches by writing a lease on them in a transaction, so workers in
+    several processes don't apply the same records, then grouped per driver. Each driver is
+    updated in a transaction that reads it, applies its records and deletes them, so writes
+    made to the driver meanwhile are never overwritten.
+    """
+    def __init__(self, db_handler, worker_threads: int = WORKER_THREADS, batch_size: int = BATCH_SIZE,
+                 poll_interval: float = POLL_INTERVAL, reconcile_interval: float = RECONCILE_INTERVAL):
+        self._db = db_handler
+        self._batch_size = batch_size
+        self._poll_interval = poll_interval
+        self._reconcile_interval = reconcile_interval
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pool = ThreadPoolExecutor(max_workers=worker_threads, thread_name_prefix="outbox")
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def enqueue(self, primary_operations: List[Tuple[str, str, str, Dict[str, Any]]], records: List[Dict[str, Any]]):
+        """
+        Commits the primary writes together with their outbox records in a single batch,
+        then wakes the worker. Either everything is written or nothing is.
+
+        :param primary_operations: (action, collection, doc_id, data) tuples for Database.batch_write.
+        :param records: Outbox records built with upsert_record, update_record or remove_record.
+        """
+        self._db.batch_write(list(primary_operations) + outbox_operations(records))
+        self.start()
+        self._wakeup.set()
+
+    def start(self):
+        """Starts the polling thread if it is not running yet."""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="outbox-poller", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stops polling after the current batch has been applied."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        last_reconcile = time.time()
+        while not self._stopping.is_set():
+            try:
+                applied = self.process_pending()
+            except Exception as e:
+                print(f"Error processing outbox: {e}")
+                applied = 0
+
+            if self._reconcile_interval and time.time() - last_reconcile >= self._reconcile_interval:
+                last_reconcile = time.time()
+                try:
+                    reconcile_all(self._db)
+                except Exception as e:
+                    print(f"Error reconciling driver events: {e}")
+
+            # A full batch applied means there is probably more waiting, so poll again straight away
+            if applied < self._batch_size:
+                self._wakeup.wait(self._poll_interval)
+                self._wakeup.clear()
+
+    def process_pending(self) -> int:
+        """
+        Applies one batch of pending outbox records. Records another worker holds, or that are
+        backing off after a failure, are skipped along with the later records of their driver,
+        so each driver's records are still applied in order.
+
+        :return: The number of outbox records applied.
+        """
+        now = time.time()
+        pending, waiting, scanned = [], set(), 0
+        for record_id, record in self._db.iter_documents(OUTBOX_COLLECTION, [], order_by="createdAt",
+                                                         page_size=self._batch_size):
+            scanned += 1
+            if self._waiting(record, now):
+                waiting.add(record.get("driverId"))
+            elif record.get("driverId") not in waiting:
+                pending.append((record_id, record))
+            if len(pending) == self._batch_size or scanned == self._batch_size * SCAN_PAGES:
+                break
+        if not pending:
+            return 0
+
+        claimed = self._claim([record_id for record_id, _ in pending])
+        by_driver: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        for record_id, record in pending:
+            if record_id in claimed:
+                by_driver.setdefault(record.get("driverId"), []).append((record_id, record))
+
+        futures = {driver_id: self._pool.submit(self._apply_driver, driver_id, records)
+                   for driver_id, records in by_driver.items()}
+        applied = 0
+        for driver_id, future in futures.items():
+            try:
+                applied += future.result()
+            except Exception as e:
+                print(f"Error applying outbox records of driver '{driver_id}': {e}")
+                self._retry_later(by_driver[driver_id], e)
+        return applied
+
+    def _leased(self, record: Dict[str, Any], now: float = None) -> bool:
+        """Whether another worker holds a live claim on a record."""
+        return (record.get("leaseOwner") not in (None, self._owner)
+                and record.get("leaseUntil", 0) > (now if now is not None else time.time()))
+
+    def _waiting(self, record: Dict[str, Any], now: float) -> bool:
+        """Whether a record can't be claimed yet: another worker holds it, or it is backing off."""
+        return self._leased(record, now) or record.get("retryAt", 0) > now
+
+    def _claim(self, record_ids: List[str]) -> set:
+        """
+        Writes this worker's lease on the records no other worker has claimed, in one
+        transaction, so of two workers claiming the same records only one succeeds.
+
+        :return: The IDs of the records claimed.
+        """
+        if not record_ids:
+            return set()
+
+        def decide(documents):
+            now = time.time()
+            lease = {"leaseOwner": self._owner, "leaseUntil": now + LEASE_SECONDS}
+            return [("update", OUTBOX_COLLECTION, record_id, lease) for (_, record_id), record in documents.items()
+                    if record is not None and not self._waiting(record, now)]
+
+        operations = self._db.transact([(OUTBOX_COLLECTION, record_id) for record_id in record_ids], decide)
+        return {doc_id for _, _, doc_id, _ in operations}
+
+    def _owned(self, documents, records: List[Tuple[str, Dict[str, Any]]]) -> List[Tuple[str, Dict[str, Any]]]:
+        """The records of a transaction's reads still held by this worker (not applied or taken over since)."""
+        owned = [(record_id, documents[(OUTBOX_COLLECTION, record_id)]) for record_id, _ in records]
+        return [(record_id, record) for record_id, record in owned
+                if record is not None and record.get("leaseOwner") == self._owner]
+
+    def _apply_driver(self, driver_id: str, records: List[Tuple[str, Dict[str, Any]]]) -> int:
+        """
+        Applies every record for one driver in a single transaction that reads the driver and
+        its records, and writes the driver's events array and deletes the records together.
+        Records already applied (deleted) or claimed by another worker since are skipped.
+
+        :return: The number of records applied.
+        """
+        reads = [(OUTBOX_COLLECTION, record_id) for record_id, _ in records]
+        if driver_id:
+            reads.append((DRIVER_COLLECTION, driver_id))
+
+        def decide(documents):
+            owned = self._owned(documents, records)
+            if not owned:
+                return []
+            cleanup = [("delete", OUTBOX_COLLECTION, record_id, None) for record_id, _ in owned]
+            driver_data = documents.get((DRIVER_COLLECTION, driver_id)) if driver_id else None
+            if not driver_data:
+                # Driver is gone, so there is no embedded array left to keep in sync, and
+                # events logged after its deletion cascaded are orphans
+                orphans = [("delete", EVENT_COLLECTION, record["eventId"], None) for _, record in owned
+                           if driver_id and record.get("kind") == EVENT_UPSERT and record.get("eventId")]
+                return orphans + cleanup
+
+            events = list(driver_data.get("events", []))
+            for _, record in owned:
+                events = apply_record(events, record)
+            return [("update", DRIVER_COLLECTION, driver_id, {"events": events})] + cleanup
+
+        operations = self._db.transact(reads, decide)
+        return sum(1 for action, collection, _, _ in operations if action == "delete" and collection == OUTBOX_COLLECTION)
+
+    def _retry_later(self, records: List[Tuple[str, Dict[str, Any]]], error: Exception):
+        """
+        Backs off records whose application failed, with exponentially growing delays, and
+        moves those out of attempts to the dead letters, so a record that can never be applied
+        stops being retried. A dead-lettered record leaves its driver's array behind the
+        events collection until the record is requeued (python Outbox.py requeue) or the
+        driver is reconciled.
+        """
+        def decide(documents):
+            now = time.time()
+            operations = []
+            for record_id, record in self._owned(documents, records):
+                attempts = record.get("attempts", 0) + 1
+                if attempts >= MAX_ATTEMPTS:
+                    print(f"Giving up on outbox record '{record_id}' after {attempts} attempts: {error}")
+                    operations += [("set", DEAD_LETTER_COLLECTION, record_id,
+                                    dict(record, attempts=attempts, lastError=str(error), failedAt=now)),
+                                   ("delete", OUTBOX_COLLECTION, record_id, None)]
+                else:
+                    operations.append(("update", OUTBOX_COLLECTION, record_id, {
+                        "attempts": attempts, "lastError": str(error),
+                        "retryAt": now + min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)}))
+            return operations
+
+        try:
+            self._db.transact([(OUTBOX_COLLECTION, record_id) for record_id, _ in records], decide)
+        except Exception as e:
+            print(f"Error backing off outbox records: {e}")
+
+
+def reconcile_driver(db_handler, driver_id: str, driver_data: Dict[str, Any] = None) -> bool:
+    """
+    Repairs drift between the events collection and one driver's embedded events array.
+    The events collection is treated as the source of truth; drivers with outbox records
+    still pending are skipped because the worker is about to update them anyway.
+
+    :return: True if the driver's array had to be rewritten.
+    """
+    if db_handler.query_documents(OUTBOX_COLLECTION, [("driverId", "==", driver_id)], limit=1):
+        return False
+
+    if driver_data is None:
+        driver_data = db_handler.get_document(DRIVER_COLLECTION, driver_id)
+    if not driver_data:
+        return False
+
+    stored = {doc.get("eventId", doc_id): event_summary(doc)
+              for doc_id, doc in db_handler.query_documents(EVENT_COLLECTION, [("driverId", "==", driver_id)])}
+    embedded = driver_data.get("events", [])
+
+    # Keep the existing order, drop events that no longer exist, then append missing ones
+    repaired = [stored[e.get("eventId")] for e in embedded if e.get("eventId") in stored]
+    seen = {e.get("eventId") for e in repaired}
+    repaired += [summary for event_id, summary in stored.items() if event_id not in seen]
+
+    if repaired == embedded:
+        return False
+
+    def decide(documents):
+        # Leave a driver whose events changed since they were read to the next check
+        current = documents[(DRIVER_COLLECTION, driver_id)]
+        if not current or current.get("events", []) != embedded:
+            return []
+        return [("update", DRIVER_COLLECTION, driver_id, {"events": repaired})]
+
+    if not db_handler.transact([(DRIVER_COLLECTION, driver_id)], decide):
+        return False
+    print(f"Repaired events array of driver '{driver_id}' ({len(embedded)} -> {len(repaired)} events).")
+    return True
+
+
+def requeue_dead_letters(db_handler) -> int:
+    """
+    Moves dead-lettered outbox records back into the outbox with their attempts reset, once
+    whatever made them fail is fixed. They are applied after the records queued meanwhile.
+
+    :return: The number of records requeued.
+    """
+    requeued = 0
+    for record_id, record in db_handler.stream_documents(DEAD_LETTER_COLLECTION):
+        record = {k: v for k, v in record.items()
+                  if k not in ("attempts", "lastError", "failedAt", "retryAt", "leaseOwner", "leaseUntil")}
+        db_handler.batch_write([("set", OUTBOX_COLLECTION, record_id, dict(record, createdAt=time.time())),
+                                ("delete", DEAD_LETTER_COLLECTION, record_id, None)])
+        requeued += 1
+    print(f"Requeued {requeued} dead-lettered outbox record(s).")
+    return requeued
+
+
+def reconcile_all(db_handler) -> int:
+    """
+    Runs reconcile_driver over every driver.
+
+    :return: The number of drivers that were repaired.
+    """
+    repaired = 0
+    for driver_id, driver_data in db_handler.stream_documents(DRIVER_COLLECTION):
+        if reconcile_driver(db_handler, driver_id, driver_data):
+            repaired += 1
+    print(f"Reconciliation finished: {repaired} driver(s) repaired.")
+    return repaired
+
+
+if __name__ == "__main__":
+    # Usage: python Outbox.py drain | requeue | reconcile [driver_id]
+    from Event_rest import db_handler, outbox_worker
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "drain"
+    if command == "requeue":
+        requeue_dead_letters(db_handler)
+    elif command == "reconcile":
+        if len(sys.argv) > 2:
+            reconcile_driver(db_handler, sys.argv[2])
+        else:
+            reconcile_all(db_handler)
+    else:
+        while outbox_worker.process_pending():
+            pass
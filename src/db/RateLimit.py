@@ -0,0 +1,224 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+from flask import Flask, current_app, g, has_request_context, jsonify, request
+from Metrics import registry
+
+# (tokens per second, burst size); every client gets a bucket per user and one per user and route
+USER_LIMIT = (20.0, 40)
+DEFAULT_ROUTE_LIMIT = (10.0, 20)
+ROUTE_LIMITS: Dict[Tuple[str, str], Tuple[float, int]] = {
+    ("GET", "/drivers/user/<user_id>"): (2.0, 6),       # dashboard polls every 3 seconds
+    ("GET", "/drivers/<driver_id>/events"): (2.0, 6),
+    ("POST", "/events"): (5.0, 20),
+    ("PUT", "/drivers/<driver_id>"): (10.0, 30),        # live vitals updates
+    ("POST", "/drivers/<driver_id>/vitals"): (10.0, 30),
+}
+EXEMPT_ENDPOINTS = {"metrics", "ready"}
+
+MAX_IN_FLIGHT = int(os.environ.get("DRIVESENSE_MAX_IN_FLIGHT", "32"))   # concurrent storage operations
+IN_FLIGHT_WAIT = 2.0                                                    # seconds to wait for a free slot
+LOCAL_MAX_KEYS = 50000                                                  # buckets kept by the local store
+SHARED_STORE_PATH = os.environ.get(
+    "DRIVESENSE_RATE_LIMIT_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ratelimit.sqlite3"))
+
+rate_limited = registry.counter(
+    "drivesense_rate_limited_total",
+    "Requests rejected with 429, by service and reason (user, route or storage).",
+    ("service", "reason"))
+
+
+class StorageOverloaded(Exception):
+    """Raised when no storage slot frees up within IN_FLIGHT_WAIT seconds."""
+
+
+def _refill(tokens: float, updated_at: float, now: float, rate: float, burst: int) -> float:
+    return min(float(burst), tokens + (now - updated_at) * rate)
+
+
+class LocalBucketStore:
+    """Token buckets held in this process's memory; least recently used buckets are evicted."""
+    def __init__(self, max_keys: int = LOCAL_MAX_KEYS):
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._max_keys = max_keys
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: int, cost: float = 1) -> Tuple[bool, float]:
+        """
+        Takes tokens from a bucket.
+
+        :return: (allowed, seconds until enough tokens are available).
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (float(burst), now))
+            tokens = _refill(tokens, updated_at, now, rate, burst)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+
+class SharedBucketStore:
+    """
+    Token buckets in a local SQLite file, so every backend process on the host
+    (users, drivers, events, or several workers of one app) draws from the same buckets.
+    """
+    def __init__(self, path: str = SHARED_STORE_PATH):
+        self._path = path
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=5, isolation_level=None)
+
+    def take(self, key: str, rate: float, burst: int, cost: float = 1) -> Tuple[bool, float]:
+        """See LocalBucketStore.take."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE serializes the read-modify-write across processes; if it fails
+            # (the database stayed locked), there is no transaction to roll back
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = _refill(row[0], row[1], now, rate, burst) if row else float(burst)
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", (key, tokens, now))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+
+class ConcurrencyLimiter:
+    """Bounds the number of storage operations in flight in this process."""
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT, wait: float = IN_FLIGHT_WAIT):
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._wait = wait
+
+    @contextmanager
+    def slot(self):
+        if not self._slots.acquire(timeout=self._wait):
+            if has_request_context():
+                # Lets the middleware answer 429 even though the handler turned this into a 500
+                g._storage_overloaded = True
+            raise StorageOverloaded("Too many storage operations in flight")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+
+class ServiceLimiters:
+    """
+    The concurrency limiter of a Database that several services share in one process (e.g.
+    one LocalDatabase): an operation takes a slot from the limiter of the app handling the
+    current request, so each service keeps its own MAX_IN_FLIGHT. Operations made outside
+    a request (background workers) use the limiter of the first service registered.
+    """
+    EXTENSION = "drivesense.concurrency_limiter"
+
+    def __init__(self):
+        self._default: Optional[ConcurrencyLimiter] = None
+
+    def add(self, app: Flask, limiter: ConcurrencyLimiter):
+        app.extensions[self.EXTENSION] = limiter
+        if self._default is None:
+            self._default = limiter
+
+    @contextmanager
+    def slot(self):
+        limiter = current_app.extensions.get(self.EXTENSION) if has_request_context() else None
+        with (limiter or self._default).slot():
+            yield
+
+
+def create_bucket_store():
+    """Uses the shared store when DRIVESENSE_RATE_LIMIT_STORE=shared, otherwise local memory."""
+    if os.environ.get("DRIVESENSE_RATE_LIMIT_STORE", "local") == "shared":
+        return SharedBucketStore()
+    return LocalBucketStore()
+
+
+def _client_key() -> str:
+    """Identifies the caller: the userId of the request if it has one, otherwise the client address."""
+    user_id = (request.view_args or {}).get("user_id") or request.args.get("userId")
+    if not user_id and request.is_json:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            user_id = body.get("userId")
+    return f"user:{user_id}" if user_id else f"ip:{request.remote_addr}"
+
+
+def _too_many_requests(retry_after: float):
+    response = jsonify({'error': 'Too many requests, please retry later'})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def register_rate_limiting(app: Flask, db_handler, service: str, store=None, limiter: Optional[ConcurrencyLimiter] = None):
+    """
+    Puts per-user and per-route token buckets in front of an app and bounds the storage
+    operations its Database may have in flight. Rejected requests get 429 with Retry-After.
+
+    :param store: LocalBucketStore or SharedBucketStore; chosen by create_bucket_store() if omitted.
+    :param limiter: ConcurrencyLimiter for this service's requests; a new one with MAX_IN_FLIGHT
+                    slots if omitted. Services sharing db_handler each keep their own.
+    """
+    store = store or create_bucket_store()
+    limiters = db_handler.concurrency_limiter()
+    if not isinstance(limiters, ServiceLimiters):
+        limiters = ServiceLimiters()
+        db_handler.set_concurrency_limiter(limiters)
+    limiters.add(app, limiter or ConcurrencyLimiter())
+
+    @app.before_request
+    def _admit():
+        if request.method == "OPTIONS" or request.endpoint in EXEMPT_ENDPOINTS or request.url_rule is None:
+            return None
+
+        client = _client_key()
+        rule = request.url_rule.rule
+        route_rate, route_burst = ROUTE_LIMITS.get((request.method, rule), DEFAULT_ROUTE_LIMIT)
+        checks = (
+            ("user", f"{client}", USER_LIMIT[0], USER_LIMIT[1]),
+            ("route", f"{client}|{request.method} {rule}", route_rate, route_burst),
+        )
+        for reason, key, rate, burst in checks:
+            try:
+                allowed, retry_after = store.take(key, rate, burst)
+            except Exception as e:
+                # Fail open: an unavailable limiter must not take the API down with it
+                print(f"Rate limiter error: {e}")
+                return None
+            if not allowed:
+                rate_limited.inc(service, reason)
+                return _too_many_requests(retry_after)
+        return None
+
+    @app.after_request
+    def _overloaded(response):
+        if getattr(g, "_storage_overloaded", False):
+            rate_limited.inc(service, "storage")
+            return _too_many_requests(IN_FLIGHT_WAIT)
+        return response
@@ -0,0 +1,196 @@
+import copy
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Tuple
+from flask import Flask, g, has_request_context, jsonify
+from Metrics import registry, _escape
+
+# Seconds an operation may take in total, retries included, by operation
+DEADLINES = {"read": 5.0, "query": 10.0, "count": 10.0, "write": 10.0, "update": 10.0, "delete": 10.0, "batch": 20.0,
+             "transaction": 20.0}
+DEFAULT_DEADLINE = 10.0
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 0.1          # seconds before the first retry, doubled on every attempt
+BACKOFF_MAX = 2.0
+FAILURE_THRESHOLD = 5       # consecutive transient failures that open the circuit
+OPEN_SECONDS = 10.0         # how long an open circuit fails fast before letting one probe through
+STALE_CACHE_SIZE = 5000     # recent reads kept to answer from while storage is unavailable
+
+# google-api-core errors for transient conditions, matched by name so the SDK stays a lazy import.
+# Everything else (NotFound, InvalidArgument, PermissionDenied, FailedPrecondition...) fails at once.
+RETRYABLE_ERRORS = {
+    "ServiceUnavailable", "DeadlineExceeded", "GatewayTimeout", "InternalServerError",
+    "Aborted", "TooManyRequests", "ResourceExhausted", "Unknown",
+}
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+storage_retries = registry.counter(
+    "drivesense_storage_retries_total",
+    "Storage operations retried after a transient error, by collection and operation.",
+    ("collection", "operation"))
+storage_rejected = registry.counter(
+    "drivesense_storage_rejected_total",
+    "Storage operations failed fast because the circuit was open, by collection and operation.",
+    ("collection", "operation"))
+stale_reads = registry.counter(
+    "drivesense_storage_stale_reads_total",
+    "Reads answered from the stale cache because storage was unavailable, by collection.",
+    ("collection",))
+
+
+class StorageError(Exception):
+    """A storage operation failed. Raised instead of returning an empty result."""
+
+
+class StorageUnavailable(StorageError):
+    """
+    Storage is unhealthy: the client could not be created, the circuit is open, or an
+    operation kept failing with transient errors until its attempts or deadline ran out.
+    """
+    def __init__(self, message: str, retry_after: float = OPEN_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_retryable(error: Exception) -> bool:
+    """True for errors that a later attempt may not hit: transient server errors and network failures."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+
+def backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff: a random pause of up to BACKOFF_BASE * 2^attempt seconds."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Stops sending operations to storage after FAILURE_THRESHOLD consecutive transient failures.
+    While open, operations fail at once; after open_seconds a single probe is let through,
+    which closes the circuit if it succeeds and opens it again if it fails.
+    """
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD, open_seconds: float = OPEN_SECONDS):
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        _breakers.append(self)
+
+    def allow(self) -> bool:
+        """True if an operation may be sent now; in half-open state only the one probe is."""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self._open_seconds:
+                self.state, self._probing = "half_open", False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def retry_after(self) -> float:
+        """Seconds until the circuit lets a probe through (0 unless it is open)."""
+        with self._lock:
+            if self.state != "open":
+                return 0.0
+            return max(0.0, self._opened_at + self._open_seconds - time.monotonic())
+
+    def record_success(self):
+        """Storage answered (even with a non-transient error such as NotFound), so it is healthy."""
+        with self._lock:
+            if self.state != "closed":
+                print(f"Circuit '{self.name}' closed.")
+            self.state, self._failures, self._probing = "closed", 0, False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self._failures >= self._failure_threshold):
+                print(f"Circuit '{self.name}' opened after {self._failures} consecutive failure(s).")
+                self.state, self._opened_at, self._probing = "open", time.monotonic(), False
+
+    def release(self):
+        """Gives up a probe slot without a verdict (the operation never reached storage)."""
+        with self._lock:
+            self._probing = False
+
+
+_breakers = []
+
+
+def _collect_circuit_states():
+    if not _breakers:
+        return []
+    name = "drivesense_storage_circuit_state"
+    lines = [f"# HELP {name} Storage circuit state (0 closed, 1 half-open, 2 open).", f"# TYPE {name} gauge"]
+    for breaker in list(_breakers):
+        lines.append(f'{name}{{circuit="{_escape(breaker.name)}"}} {CIRCUIT_STATES[breaker.state]}')
+    return lines
+
+
+registry.add_collector(_collect_circuit_states)
+
+
+class StaleCache:
+    """
+    The last successful result of recent reads, least recently used evicted, for answering
+    reads while storage is unavailable. Values are copied in and out, so callers may mutate them.
+    """
+    def __init__(self, max_entries: int = STALE_CACHE_SIZE):
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def put(self, key: Hashable, value: Any):
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            if len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """:return: (found, a copy of the value)."""
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            self._entries.move_to_end(key)
+            value = self._entries[key]
+        return True, copy.deepcopy(value)
+
+
+def mark_stale():
+    """Flags the current request as answered (at least partly) from the stale cache."""
+    if has_request_context():
+        g._served_stale = True
+
+
+def mark_unavailable(error: StorageUnavailable):
+    """Lets the middleware answer 503 even though the handler turned the error into a 500."""
+    if has_request_context():
+        g._storage_unavailable = error
+
+
+def register_resilience(app: Flask):
+    """
+    Answers 503 with Retry-After when a request failed because storage was unavailable,
+    and adds X-Served-Stale: true to responses built from stale cached reads.
+    """
+    @app.after_request
+    def _storage_status(response):
+        error = getattr(g, "_storage_unavailable", None)
+        if error is not None and response.status_code >= 500:
+            response = jsonify({'error': 'Storage temporarily unavailable, please retry later'})
+            response.status_code = 503
+            response.headers["Retry-After"] = str(max(1, math.ceil(error.retry_after)))
+        elif getattr(g, "_served_stale", False):
+            response.headers["X-Served-Stale"] = "true"
+        return response
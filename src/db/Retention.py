@@ -0,0 +1,416 @@
+import argparse
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from Backup import decode_document, encode_document
+from Metrics import registry
+from Outbox import outbox_operations, remove_record
+
+EVENT_COLLECTION = "events"
+ARCHIVE_COLLECTION = "event_archives"
+ROLLUP_COLLECTION = "event_rollups"
+
+HOT_DAYS = int(os.environ.get("DRIVESENSE_EVENT_HOT_DAYS", "90"))   # days events stay in the events collection
+# Per-status overrides of HOT_DAYS, e.g. "Severe=365,Critical=365" (at most 10: Firestore's limit on not-in)
+HOT_DAYS_BY_STATUS = os.environ.get("DRIVESENSE_EVENT_HOT_DAYS_BY_STATUS", "")
+# Days a month's archives are kept after the month ends (0 keeps them forever); rollups are always kept
+ARCHIVE_DAYS = int(os.environ.get("DRIVESENSE_EVENT_ARCHIVE_DAYS", "0"))
+RETENTION_INTERVAL = float(os.environ.get("DRIVESENSE_RETENTION_SECONDS", "3600"))  # 0 disables the worker
+PAGE_SIZE = 1000            # old events read per round trip
+ARCHIVE_PAGE_SIZE = 20      # archive parts (up to MAX_PART_BYTES each) read per round trip
+EVENTS_PER_BATCH = 200      # each event costs a delete and an outbox record, within Firestore's 500 writes
+MAX_EVENTS_PER_RUN = 50000  # events compacted per run; the rest wait for the next one
+MAX_PART_BYTES = 900 * 1024     # compressed events per archive document (Firestore's limit is 1 MiB)
+VITALS_FIELDS = ("heartRate", "bloodOxygenLevel", "vehicleSpeed")
+
+_EPOCH = datetime.min.replace(tzinfo=timezone.utc)
+
+retention_events = registry.counter(
+    "drivesense_retention_events_total",
+    "Events handled by retention, by outcome (archived, or expired when their month's archive is already gone).",
+    ("outcome",))
+
+
+def _parse_status_days(text: str) -> Dict[str, int]:
+    days = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        status, _, value = item.partition("=")
+        days[status.strip()] = int(value)
+    return days
+
+
+class RetentionPolicy:
+    """
+    How long events stay hot (full documents in the events collection and in their driver's
+    events array) before being compacted into monthly archives, per event status, and how
+    long archives are kept after that.
+    """
+    def __init__(self, hot_days: int = HOT_DAYS, hot_days_by_status: Dict[str, int] = None,
+                 archive_days: int = ARCHIVE_DAYS):
+        self.hot_days = hot_days
+        self.hot_days_by_status = dict(hot_days_by_status or {})
+        self.archive_days = archive_days
+
+    def hot_days_for(self, status: str) -> int:
+        return self.hot_days_by_status.get(status, self.hot_days)
+
+    def cutoff(self, status: str, now: datetime) -> datetime:
+        """Events with this status that occurred before the cutoff are due for archiving."""
+        return now - timedelta(days=self.hot_days_for(status))
+
+    def horizon(self, now: datetime = None) -> datetime:
+        """Everything that occurred since the horizon is still hot, whatever its status."""
+        now = now or datetime.now(timezone.utc)
+        return now - timedelta(days=min([self.hot_days, *self.hot_days_by_status.values()]))
+
+    def expired_before(self, now: datetime) -> Optional[str]:
+        """The first month ('YYYY-MM') whose archives are kept, or None if they are kept forever."""
+        if self.archive_days <= 0:
+            return None
+        return month_of(now - timedelta(days=self.archive_days))
+
+    def to_map(self) -> Dict[str, Any]:
+        return {"hotDays": self.hot_days, "hotDaysByStatus": self.hot_days_by_status, "archiveDays": self.archive_days}
+
+
+default_policy = RetentionPolicy(HOT_DAYS, _parse_status_days(HOT_DAYS_BY_STATUS), ARCHIVE_DAYS)
+
+
+def month_of(when: datetime) -> str:
+    return when.strftime("%Y-%m")
+
+
+def _occurred_at(event: Dict[str, Any]) -> datetime:
+    return event.get("occurredAt") or _EPOCH
+
+
+def encode_events(events: List[Dict[str, Any]]) -> bytes:
+    """Gzip-compressed NDJSON of events; the same events always give the same bytes."""
+    lines = "\n".join(json.dumps(encode_document(event), sort_keys=True, default=str) for event in events)
+    return gzip.compress(lines.encode("utf-8"), mtime=0)
+
+
+def decode_events(data: bytes) -> List[Dict[str, Any]]:
+    text = gzip.decompress(data).decode("utf-8")
+    return [decode_document(json.loads(line)) for line in text.split("\n") if line]
+
+
+def rollup(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Counts per status, time span and min/max/average vitals of a set of events."""
+    by_status: Dict[str, int] = {}
+    for event in events:
+        by_status[str(event.get("status"))] = by_status.get(str(event.get("status")), 0) + 1
+    summary = {
+        "count": len(events),
+        "byStatus": by_status,
+        "firstAt": min((e["occurredAt"] for e in events if e.get("occurredAt")), default=None),
+        "lastAt": max((e["occurredAt"] for e in events if e.get("occurredAt")), default=None),
+    }
+    for field in VITALS_FIELDS:
+        values = [e[field] for e in events if isinstance(e.get(field), (int, float)) and not isinstance(e.get(field), bool)]
+        summary[field] = {"min": min(values), "max": max(values), "avg": sum(values) / len(values)} if values else None
+    return summary
+
+
+def _split(events: List[Dict[str, Any]]) -> List[Tuple[List[Dict[str, Any]], bytes]]:
+    """Cuts time-ordered events into consecutive runs that compress to at most MAX_PART_BYTES."""
+    data = encode_events(events)
+    if len(data) <= MAX_PART_BYTES or len(events) == 1:
+        return [(events, data)]
+    middle = len(events) // 2
+    return _split(events[:middle]) + _split(events[middle:])
+
+
+def archive_parts(driver_id: str, month: str, events: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    The archive documents holding a driver's events of one month. Parts are named after a
+    hash of their content, so compacting the same events twice writes the same documents,
+    and a run only deletes the parts it read and rewrote: runs that overlap (e.g. from two
+    processes) can leave overlapping parts, which readers de-duplicate, but never lose events.
+    """
+    parts = {}
+    for part_events, data in _split(sorted(events, key=_occurred_at)):
+        part_id = f"{driver_id}_{month}_{hashlib.sha256(data).hexdigest()[:16]}"
+        parts[part_id] = {
+            "driverId": driver_id,
+            "userId": part_events[0].get("userId"),
+            "month": month,
+            "count": len(part_events),
+            "firstAt": part_events[0].get("occurredAt"),
+            "lastAt": part_events[-1].get("occurredAt"),
+            "data": data,
+        }
+    return parts
+
+
+def _compact_group(db_handler, driver_id: str, month: str, hot: List[Tuple[str, Dict[str, Any]]],
+                   archived_at: datetime) -> int:
+    """
+    Moves one driver's due events of one month into its archive, EVENTS_PER_BATCH at a time.
+    Each batch rewrites the month's archive parts and rollup, deletes the hot copies and queues
+    their removal from the driver's events array, atomically.
+    """
+    existing = db_handler.query_documents(ARCHIVE_COLLECTION, [("driverId", "==", driver_id), ("month", "==", month)])
+    part_ids = {part_id for part_id, _ in existing}
+    archived: Dict[str, Dict[str, Any]] = {}
+    for _, part in existing:
+        for event in decode_events(part["data"]):
+            archived[event.get("eventId")] = event
+
+    moved = 0
+    for start in range(0, len(hot), EVENTS_PER_BATCH):
+        chunk = hot[start:start + EVENTS_PER_BATCH]
+        for doc_id, event in chunk:
+            archived[event.get("eventId") or doc_id] = event
+        parts = archive_parts(driver_id, month, list(archived.values()))
+        summary = rollup(list(archived.values()))
+        operations = [("set", ARCHIVE_COLLECTION, part_id, part) for part_id, part in parts.items() if part_id not in part_ids]
+        operations += [("delete", ARCHIVE_COLLECTION, part_id, None) for part_id in part_ids - set(parts)]
+        operations.append(("set", ROLLUP_COLLECTION, f"{driver_id}_{month}", dict(
+            summary, driverId=driver_id, userId=chunk[0][1].get("userId"), month=month, updatedAt=archived_at)))
+        operations += [("delete", EVENT_COLLECTION, doc_id, None) for doc_id, _ in chunk]
+        operations += outbox_operations([remove_record(driver_id, event.get("eventId") or doc_id) for doc_id, event in chunk])
+        db_handler.batch_write(operations)
+        part_ids = set(parts)
+        moved += len(chunk)
+        retention_events.inc("archived", amount=len(chunk))
+    return moved
+
+
+def _expire_group(db_handler, driver_id: str, hot: List[Tuple[str, Dict[str, Any]]]) -> int:
+    """Deletes due events of a month whose archive has already expired (e.g. backdated events)."""
+    for start in range(0, len(hot), EVENTS_PER_BATCH):
+        chunk = hot[start:start + EVENTS_PER_BATCH]
+        db_handler.batch_write([("delete", EVENT_COLLECTION, doc_id, None) for doc_id, _ in chunk]
+                               + outbox_operations([remove_record(driver_id, event.get("eventId") or doc_id)
+                                                    for doc_id, event in chunk]))
+        retention_events.inc("expired", amount=len(chunk))
+    return len(hot)
+
+
+def _due_queries(policy: RetentionPolicy, now: datetime) -> List[List[Tuple[str, str, Any]]]:
+    """
+    Filters finding the events due for archiving: one query per status with its own hot
+    period, and one for every other status. Each only reads events past their own cutoff,
+    so events a longer period still holds are never read.
+    """
+    queries = [[("status", "==", status), ("occurredAt", "<", policy.cutoff(status, now))]
+               for status in sorted(policy.hot_days_by_status)]
+    others = [("status", "not-in", sorted(policy.hot_days_by_status))] if policy.hot_days_by_status else []
+    queries.append(others + [("occurredAt", "<", now - timedelta(days=policy.hot_days))])
+    return queries
+
+
+def compact_events(db_handler, policy: RetentionPolicy = default_policy, now: datetime = None,
+                   max_events: int = MAX_EVENTS_PER_RUN, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Moves events past their policy's hot period out of the events collection (and their
+    drivers' events arrays) into compressed per-driver, per-month archives with a rollup of
+    each month. Due events are read in time order, a status class at a time, a page at a
+    time, and compacted page by page; at most max_events of them per run. Safe to re-run,
+    and to run from several processes at once.
+
+    :return: Counts of events scanned, archived, expired (their month's archive is gone),
+             and skipped for lack of a driverId.
+    """
+    now = now or datetime.now(timezone.utc)
+    expired_before = policy.expired_before(now)
+    stats = {"scanned": 0, "archived": 0, "expired": 0, "unlinked": 0}
+    groups: Dict[Tuple[str, str], List[Tuple[str, Dict[str, Any]]]] = {}
+    due = 0
+
+    def flush():
+        for (driver_id, month), hot in groups.items():
+            if expired_before and month < expired_before:
+                stats["expired"] += len(hot) if dry_run else _expire_group(db_handler, driver_id, hot)
+            else:
+                stats["archived"] += len(hot) if dry_run else _compact_group(db_handler, driver_id, month, hot, now)
+        groups.clear()
+
+    for filters in _due_queries(policy, now):
+        if due == max_events:
+            break
+        for doc_id, event in db_handler.iter_documents(EVENT_COLLECTION, filters, order_by="occurredAt",
+                                                       page_size=PAGE_SIZE):
+            stats["scanned"] += 1
+            if not event.get("driverId"):
+                stats["unlinked"] += 1
+                continue
+            event.setdefault("eventId", doc_id)
+            groups.setdefault((event["driverId"], month_of(event["occurredAt"])), []).append((doc_id, event))
+            due += 1
+            if due % PAGE_SIZE == 0:
+                flush()
+            if due == max_events:
+                break
+        flush()
+
+    print(f"Event compaction {'(dry run) ' if dry_run else ''}finished: {stats}")
+    return stats
+
+
+def expire_archives(db_handler, policy: RetentionPolicy = default_policy, now: datetime = None,
+                    dry_run: bool = False) -> int:
+    """
+    Deletes archives of months older than the policy's archive period. Their rollups are kept.
+
+    :return: The number of archive documents deleted.
+    """
+    expired_before = policy.expired_before(now or datetime.now(timezone.utc))
+    if not expired_before:
+        return 0
+    deleted = 0
+    while True:
+        page = db_handler.query_documents(ARCHIVE_COLLECTION, [("month", "<", expired_before)],
+                                          limit=EVENTS_PER_BATCH, fields=[])
+        if not page:
+            break
+        deleted += len(page)
+        if dry_run:
+            break
+        db_handler.batch_write([("delete", ARCHIVE_COLLECTION, part_id, None) for part_id, _ in page])
+        if len(page) < EVENTS_PER_BATCH:
+            break
+    print(f"Archive expiry {'(dry run) ' if dry_run else ''}finished: {deleted} archive(s) before {expired_before}.")
+    return deleted
+
+
+def archived_events(db_handler, driver_id: str = None, user_id: str = None, start: datetime = None,
+                    end: datetime = None) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the archived events of a driver (or of all a user's drivers) that occurred in
+    [start, end), in time order. Archives are read and decompressed a month at a time.
+    """
+    filters = [("driverId", "==", driver_id)] if driver_id else [("userId", "==", user_id)]
+    if start:
+        filters.append(("month", ">=", month_of(start)))
+    if end:
+        filters.append(("month", "<=", month_of(end)))
+
+    def in_month(events: Dict[str, Dict[str, Any]]):
+        return sorted((event for event in events.values()
+                       if (not start or _occurred_at(event) >= start) and (not end or _occurred_at(event) < end)),
+                      key=_occurred_at)
+
+    month, events = None, {}
+    for _, part in db_handler.iter_documents(ARCHIVE_COLLECTION, filters, order_by="month", page_size=ARCHIVE_PAGE_SIZE):
+        if part["month"] != month:
+            yield from in_month(events)
+            month, events = part["month"], {}
+        # Parts written concurrently may overlap until the month is next compacted
+        for event in decode_events(part["data"]):
+            events[event.get("eventId")] = event
+    yield from in_month(events)
+
+
+def reaches_archive(start: datetime = None, policy: RetentionPolicy = default_policy) -> bool:
+    """True when a range starting at start (None for all history) may include archived events."""
+    return start is None or start < policy.horizon()
+
+
+def with_archived(db_handler, hot: List[Dict[str, Any]], driver_id: str, start: datetime = None, end: datetime = None,
+                  descending: bool = False, limit: int = None, policy: RetentionPolicy = default_policy) -> List[Dict[str, Any]]:
+    """
+    Completes a driver's hot events in [start, end) with the archived ones, so callers don't
+    need to know where events live. Archives are only read when the range reaches back past
+    the policy's horizon; a newest-first query whose limit is filled by hot events since the
+    horizon doesn't read them either.
+
+    :return: The events in time order (newest first if descending), at most limit of them.
+    """
+    horizon = policy.horizon()
+    if start is not None and start >= horizon:
+        return hot
+    if descending and limit and len(hot) >= limit and _occurred_at(hot[limit - 1]) >= horizon:
+        return hot
+    archived = list(archived_events(db_handler, driver_id=driver_id, start=start, end=end))
+    if not archived:
+        return hot
+    seen = {event.get("eventId") for event in hot}
+    events = sorted(hot + [event for event in archived if event.get("eventId") not in seen],
+                    key=_occurred_at, reverse=descending)
+    return events[:limit] if limit else events
+
+
+def merge_archived_rows(rows: Iterable[Dict[str, Any]], archived: Iterable[Dict[str, Any]], ordered: bool) -> Iterator[Dict[str, Any]]:
+    """Streams archived events with hot ones, by occurredAt if both streams are in time order."""
+    if ordered:
+        return heapq.merge(archived, rows, key=_occurred_at)
+    return (row for stream in (archived, rows) for row in stream)
+
+
+def get_rollups(db_handler, driver_id: str, month_from: str = None, month_to: str = None) -> List[Dict[str, Any]]:
+    """A driver's monthly rollups of archived events, oldest month first."""
+    filters = [("driverId", "==", driver_id)]
+    if month_from:
+        filters.append(("month", ">=", month_from))
+    if month_to:
+        filters.append(("month", "<=", month_to))
+    return [rollup_data for _, rollup_data in db_handler.query_documents(ROLLUP_COLLECTION, filters, order_by="month")]
+
+
+class RetentionWorker:
+    """
+    Runs compaction and archive expiry every interval seconds in the background. Several
+    processes may run one: overlapping runs repeat work without losing events, and a rollup
+    that missed another run's events is corrected by the month's next compaction.
+    """
+    def __init__(self, db_handler, policy: RetentionPolicy = default_policy, interval: float = RETENTION_INTERVAL):
+        self._db = db_handler
+        self._policy = policy
+        self._interval = interval
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Starts the worker thread if it is enabled and not running yet."""
+        if self._interval <= 0:
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def run_once(self) -> Dict[str, int]:
+        stats = compact_events(self._db, self._policy)
+        stats["archivesExpired"] = expire_archives(self._db, self._policy)
+        return stats
+
+    def _run(self):
+        # Spread the first run out, so processes started together don't all compact at once
+        delay = random.uniform(0.1, 0.5) * self._interval
+        while not self._stopping.wait(delay):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error running event retention: {e}")
+            delay = self._interval
+
+
+if __name__ == "__main__":
+    # Usage: python Retention.py compact|expire [--dry-run]
+    parser = argparse.ArgumentParser(description="Archive old events and expire old archives.")
+    parser.add_argument("command", choices=["compact", "expire"])
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+
+    from Event_rest import db_handler
+    print(f"Retention policy: {default_policy.to_map()}")
+    if args.command == "compact":
+        compact_events(db_handler, dry_run=args.dry_run)
+    else:
+        expire_archives(db_handler, dry_run=args.dry_run)
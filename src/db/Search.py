@@ -0,0 +1,293 @@
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from Metrics import record_cache, registry
+from SingleFlight import SingleFlight
+
+DRIVER_COLLECTION = "drivers"
+# Driver fields searched, and how much a match in each counts towards a result's score
+SEARCH_FIELDS = ("name", "phone_number", "productId", "emergency_contacts")
+FIELD_WEIGHTS = {"name": 4, "productId": 3, "phone_number": 2, "emergency_contacts": 1}
+# How much each kind of match of a query term counts, times the field's weight
+EXACT, PREFIX, SUBSTRING = 3, 2, 1
+NGRAM = 3                   # length of the n-grams behind substring matches
+MAX_INDEXES = 1000          # users whose index is kept in memory, least recently searched dropped first
+INDEX_MAX_AGE = 300         # seconds before an index is rebuilt, picking up writes made by other processes
+PAGE_SIZE = 1000            # drivers read per round trip while building an index
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+search_latency = registry.histogram(
+    "drivesense_search_duration_seconds",
+    "Time spent matching and ranking a driver search in the in-memory index (builds excluded).",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05))
+
+_SEPARATORS = re.compile(r"[^0-9a-z]+")
+_PHONE_PUNCTUATION = re.compile(r"[\s\-().+/]")
+
+
+def normalize(text: Any) -> str:
+    """Lower-cases text and strips accents, so 'José' and 'jose' match."""
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def words(text: Any) -> List[str]:
+    return [word for word in _SEPARATORS.split(normalize(text)) if word]
+
+
+def query_terms(query: str) -> List[str]:
+    """
+    The terms of a search query. A query that is a phone number once punctuation is removed
+    ('(555) 010-2233') is a single term, so its digits must appear together.
+    """
+    digits = _PHONE_PUNCTUATION.sub("", query)
+    if digits.isdigit():
+        return [digits]
+    return words(query)
+
+
+def driver_terms(driver_data: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """The (term, field) pairs a driver is found by."""
+    terms = [(word, "name") for word in words(driver_data.get("name") or "")]
+    phone = re.sub(r"\D", "", str(driver_data.get("phone_number") or ""))
+    if phone:
+        terms.append((phone, "phone_number"))
+    if driver_data.get("productId") not in (None, "", 0):
+        terms += [(word, "productId") for word in words(driver_data["productId"])]
+    for contact in driver_data.get("emergency_contacts") or []:
+        if isinstance(contact, dict):
+            terms += [(word, "emergency_contacts") for word in words(contact.get("name") or "")]
+    return terms
+
+
+class _Node:
+    __slots__ = ("children", "prefixes", "exact")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # driver ID -> score of its best term starting here (as a prefix) / ending here (exact)
+        self.prefixes: Dict[str, int] = {}
+        self.exact: Dict[str, int] = {}
+
+
+class UserIndex:
+    """
+    The search index of one user's drivers: a prefix trie over every term, whose nodes know
+    which drivers have a term through them (so a prefix lookup costs its length, not the
+    fleet size), and an n-gram index for matches in the middle of a term (the last digits
+    of a phone number, say). Not thread-safe; SearchIndex serializes access.
+    """
+    def __init__(self):
+        self._root = _Node()
+        # n-gram -> driver ID -> weight of its best field with a term containing the n-gram
+        self._ngrams: Dict[str, Dict[str, int]] = {}
+        self._terms: Dict[str, List[Tuple[str, int]]] = {}
+        self._summaries: Dict[str, Dict[str, Any]] = {}
+        self._sort_keys: Dict[str, Tuple[str, str]] = {}
+        self.built_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._summaries)
+
+    def add(self, driver_id: str, driver_data: Dict[str, Any]):
+        self.remove(driver_id)
+        terms: Dict[str, int] = {}
+        for term, field in driver_terms(driver_data):
+            terms[term] = max(terms.get(term, 0), FIELD_WEIGHTS[field])
+        self._terms[driver_id] = list(terms.items())
+        self._summaries[driver_id] = {"driverId": driver_id, "name": driver_data.get("name"),
+                                      "phone_number": driver_data.get("phone_number"),
+                                      "productId": driver_data.get("productId")}
+        self._sort_keys[driver_id] = (normalize(driver_data.get("name") or ""), driver_id)
+        for term, weight in terms.items():
+            node = self._root
+            for char in term:
+                node = node.children.setdefault(char, _Node())
+                node.prefixes[driver_id] = max(node.prefixes.get(driver_id, 0), weight * PREFIX)
+            node.exact[driver_id] = max(node.exact.get(driver_id, 0), weight * EXACT)
+            for gram in self._grams(term):
+                drivers = self._ngrams.setdefault(gram, {})
+                drivers[driver_id] = max(drivers.get(driver_id, 0), weight)
+
+    def remove(self, driver_id: str):
+        terms = self._terms.pop(driver_id, None)
+        if terms is None:
+            return
+        del self._summaries[driver_id]
+        del self._sort_keys[driver_id]
+        for term, _ in terms:
+            self._remove_term(self._root, term, 0, driver_id)
+            for gram in self._grams(term):
+                drivers = self._ngrams.get(gram)
+                if drivers is not None:
+                    drivers.pop(driver_id, None)
+                    if not drivers:
+                        del self._ngrams[gram]
+
+    def _remove_term(self, node: _Node, term: str, depth: int, driver_id: str):
+        if depth == len(term):
+            node.exact.pop(driver_id, None)
+            return
+        child = node.children.get(term[depth])
+        if child is None:
+            return
+        child.prefixes.pop(driver_id, None)
+        self._remove_term(child, term, depth + 1, driver_id)
+        if not child.prefixes:
+            del node.children[term[depth]]
+
+    @staticmethod
+    def _grams(term: str) -> Iterable[str]:
+        return {term[i:i + NGRAM] for i in range(len(term) - NGRAM + 1)}
+
+    def _matches(self, term: str) -> Dict[str, int]:
+        """Drivers matching one query term, with the score of their best match."""
+        scores: Dict[str, int] = {}
+        node = self._root
+        for char in term:
+            node = node.children.get(char)
+            if node is None:
+                break
+        else:
+            scores = dict(node.prefixes)
+            for driver_id, score in node.exact.items():
+                if score > scores[driver_id]:
+                    scores[driver_id] = score
+
+        if len(term) >= NGRAM:
+            grams = sorted((self._ngrams.get(gram, {}) for gram in self._grams(term)), key=len)
+            rarest, others = grams[0], grams[1:]
+            for driver_id, weight in rarest.items():
+                # The rarest n-gram's weight caps what a substring match can score, which
+                # rules out most drivers already matched by prefix without a closer look
+                if weight * SUBSTRING <= scores.get(driver_id, 0) or not all(driver_id in other for other in others):
+                    continue
+                # Sharing every n-gram doesn't guarantee the term is a substring, so check
+                best = max((text_weight for text, text_weight in self._terms[driver_id] if term in text), default=0)
+                if best * SUBSTRING > scores.get(driver_id, 0):
+                    scores[driver_id] = best * SUBSTRING
+        return scores
+
+    def search(self, terms: List[str], limit: int) -> List[Dict[str, Any]]:
+        """Drivers matching every term, best first (ties by name), with their score."""
+        totals: Optional[Dict[str, int]] = None
+        for term in sorted(terms, key=len, reverse=True):
+            matches = self._matches(term)
+            if totals is None:
+                totals = matches
+            else:
+                if len(matches) < len(totals):
+                    totals, matches = matches, totals
+                totals = {driver_id: score + matches[driver_id] for driver_id, score in totals.items() if driver_id in matches}
+            if not totals:
+                return []
+        # Scores are small integers, so finding the lowest score that makes the cut first
+        # leaves only that many drivers (plus ties) to order by name
+        threshold = heapq.nlargest(limit, totals.values())[-1]
+        ranked = [(-score, self._sort_keys[driver_id]) for driver_id, score in totals.items() if score >= threshold]
+        ranked = heapq.nsmallest(limit, ranked) if len(ranked) > limit else sorted(ranked)
+        return [dict(self._summaries[driver_id], score=-score) for score, (_, driver_id) in ranked]
+
+
+class SearchIndex:
+    """
+    In-memory search over each user's drivers by name, phone number, product ID and
+    emergency contact names. A user's index is built from storage on their first search
+    and kept current by the driver write paths of this process calling update() and
+    remove(); writes made by other processes (e.g. a user deletion's cascade) show up
+    when the index is rebuilt after INDEX_MAX_AGE seconds.
+    """
+    def __init__(self, db_handler, max_indexes: int = MAX_INDEXES, max_age: float = INDEX_MAX_AGE):
+        self._db = db_handler
+        self._max_indexes = max_indexes
+        self._max_age = max_age
+        self._indexes: "OrderedDict[str, UserIndex]" = OrderedDict()
+        # Changes made while a user's index is being built, replayed onto it once built
+        self._building: Dict[str, List[Tuple[str, Optional[Dict[str, Any]]]]] = {}
+        self._lock = threading.Lock()
+        self._builds = SingleFlight("search_index")
+
+    def update(self, user_id: str, driver_id: str, driver_data: Dict[str, Any], changed: Iterable[str] = None):
+        """
+        Indexes a driver's current data. Cheap to call on every write: nothing happens when
+        none of the changed fields are searched, or the user's index hasn't been built.
+        """
+        if changed is not None and not set(changed) & set(SEARCH_FIELDS):
+            return
+        self._apply(user_id, driver_id, driver_data)
+
+    def remove(self, user_id: str, driver_id: str):
+        self._apply(user_id, driver_id, None)
+
+    def _apply(self, user_id: str, driver_id: str, driver_data: Optional[Dict[str, Any]]):
+        if not user_id:
+            return
+        with self._lock:
+            if user_id in self._building:
+                self._building[user_id].append((driver_id, driver_data))
+            index = self._indexes.get(user_id)
+            if index is None:
+                return
+            if driver_data is None:
+                index.remove(driver_id)
+            else:
+                index.add(driver_id, driver_data)
+
+    def _build(self, user_id: str) -> UserIndex:
+        with self._lock:
+            self._building[user_id] = []
+        index = UserIndex()
+        try:
+            for driver_id, driver_data in self._db.iter_documents(
+                    DRIVER_COLLECTION, [("userId", "==", user_id)], page_size=PAGE_SIZE, fields=list(SEARCH_FIELDS)):
+                index.add(driver_id, driver_data)
+        except Exception:
+            with self._lock:
+                self._building.pop(user_id, None)
+            raise
+        with self._lock:
+            for driver_id, driver_data in self._building.pop(user_id):
+                if driver_data is None:
+                    index.remove(driver_id)
+                else:
+                    index.add(driver_id, driver_data)
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self._max_indexes:
+                self._indexes.popitem(last=False)
+        print(f"Built search index of {len(index)} driver(s) for user '{user_id}'.")
+        return index
+
+    def _index(self, user_id: str) -> UserIndex:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            fresh = index is not None and time.monotonic() - index.built_at < self._max_age
+            if fresh:
+                self._indexes.move_to_end(user_id)
+        record_cache("search.index", fresh)
+        if fresh:
+            return index
+        return self._builds.do(user_id, lambda: self._build(user_id))
+
+    def search(self, user_id: str, query: str, limit: int = DEFAULT_LIMIT) -> List[Dict[str, Any]]:
+        """
+        A user's drivers matching every term of a query, ranked by score: each term scores
+        its best match, worth more in the name than in the product ID, phone number or
+        contact names, and more as a whole word than as a prefix or a substring.
+
+        :return: Summaries (driverId, name, phone_number, productId) with their score.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+        index = self._index(user_id)
+        start = time.perf_counter()
+        with self._lock:
+            results = index.search(terms, max(1, min(limit, MAX_LIMIT)))
+        search_latency.observe(time.perf_counter() - start)
+        return results
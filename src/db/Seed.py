@@ -0,0 +1,285 @@
+import argparse
+import hashlib
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Tuple
+from Outbox import event_summary
+
+USER_COLLECTION = "users"
+DRIVER_COLLECTION = "drivers"
+EVENT_COLLECTION = "events"
+
+BATCH_SIZE = 500                # Firestore's limit on writes per batch
+DEFAULT_PARALLELISM = 8         # batches committed concurrently
+MAX_ATTEMPTS = 4                # tries per batch before it counts as failed
+EMBEDDED_EVENTS = 100           # newest events copied into each driver document (keeps it far below 1 MiB)
+DEFAULT_END = "2024-06-30"      # fixed, so a seed always produces the same timestamps
+DEFAULT_PASSWORD = "drivesense"
+
+# Firestore's 500/50/5 rule: start new collections at 500 writes/s, grow 50% every 5 minutes
+RAMP_START_RATE = 500.0
+RAMP_GROWTH = 1.5
+RAMP_STEP_SECONDS = 300
+
+STATUS_WEIGHTS = {"Stable": 50, "Mild": 20, "Idle": 10, "LockedIn": 8, "Unstable": 7, "Severe": 4, "Critical": 1}
+# (mean heart rate, mean blood oxygen) per status
+STATUS_VITALS = {
+    "Idle": (66, 98), "Stable": (74, 98), "LockedIn": (78, 97), "Mild": (86, 96),
+    "Unstable": (98, 94), "Severe": (114, 91), "Critical": (132, 87),
+}
+# Relative event volume per hour of day (UTC): commute peaks, quiet nights
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 9, 10, 6, 5, 5, 6, 5, 5, 6, 9, 10, 8, 5, 4, 3, 2, 1]
+FIRST_NAMES = ["Alex", "Sam", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn",
+               "Drew", "Rowan", "Parker", "Reese", "Skyler", "Hayden", "Emerson", "Finley", "Kai", "Noor"]
+LAST_NAMES = ["Smith", "Garcia", "Chen", "Okafor", "Novak", "Silva", "Khan", "Mueller", "Rossi", "Tanaka",
+              "Haddad", "Kowalski", "Murphy", "Nguyen", "Larsen", "Dubois", "Moreau", "Patel", "Ivanova", "Cohen"]
+
+
+def scattered_id(*parts) -> str:
+    """A deterministic ID spread evenly over the key space, so bulk writes don't hotspot one tablet."""
+    return hashlib.blake2b(":".join(str(p) for p in parts).encode("utf-8"), digest_size=10).hexdigest()
+
+
+class SeedPlan:
+    """
+    The shape of the dataset, fixed by the seed before any document is generated: how many
+    drivers each user has (Pareto, so a few fleets are huge) and how many events each driver
+    has (log-normal, scaled to the requested total).
+    """
+    def __init__(self, seed: int, users: int, events: int, max_fleet: int = 200):
+        rng = random.Random(f"{seed}:plan")
+        self.seed = seed
+        self.fleets: List[int] = [min(max_fleet, int(rng.paretovariate(1.3))) for _ in range(users)]
+        weights = [[rng.lognormvariate(0, 1.2) for _ in range(fleet)] for fleet in self.fleets]
+        total_weight = sum(sum(w) for w in weights) or 1.0
+        self.event_counts: List[List[int]] = [[int(round(events * w / total_weight)) for w in fleet] for fleet in weights]
+
+    @property
+    def drivers(self) -> int:
+        return sum(self.fleets)
+
+    @property
+    def events(self) -> int:
+        return sum(sum(counts) for counts in self.event_counts)
+
+
+def _phone(rng: random.Random) -> str:
+    return f"555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}"
+
+
+def _event_times(rng: random.Random, count: int, end: datetime, days: int) -> List[datetime]:
+    """Event times over the window, weighted by hour of day and lighter on weekends, oldest first."""
+    # Drivers join at different times; most of their history is recent
+    active_days = max(1, min(days, int(rng.expovariate(1 / (days / 2))) + 1))
+    times = []
+    while len(times) < count:
+        day = end - timedelta(days=rng.randrange(active_days) + 1)
+        if day.weekday() >= 5 and rng.random() < 0.5:
+            continue
+        hour = rng.choices(range(24), weights=HOUR_WEIGHTS)[0]
+        times.append(day.replace(hour=hour, minute=rng.randrange(60), second=rng.randrange(60)))
+    times.sort()
+    return times
+
+
+def _event(rng: random.Random, event_id: str, driver_id: str, user_id: str, at: datetime, status: str) -> Dict[str, Any]:
+    heart_rate, oxygen = STATUS_VITALS[status]
+    time_stamp = at.strftime("%Y-%m-%dT%H:%M:%SZ")
+    date = at.strftime("%Y-%m-%d")
+    return {
+        "eventId": event_id,
+        "status": status,
+        "timeStamp": time_stamp,
+        "date": date,
+        "heartRate": round(rng.gauss(heart_rate, 6), 1),
+        "bloodOxygenLevel": round(min(100.0, rng.gauss(oxygen, 1.5)), 1),
+        "vehicleSpeed": 0.0 if status == "Idle" else round(rng.lognormvariate(4.0, 0.35), 1),
+        "videoLink": f"https://videos.drivesense.example/{event_id}.mp4",
+        "occurredAt": at,
+        "dateBucket": date,
+        "driverId": driver_id,
+        "userId": user_id,
+    }
+
+
+def generate(plan: SeedPlan, end: datetime, days: int, prefix: str = "seed") -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+    """
+    Yields (collection, doc_id, data) for every document of the dataset, one user at a time.
+    Each user draws from its own random stream, so the output depends only on the plan.
+    """
+    password = hashlib.sha256(DEFAULT_PASSWORD.encode()).hexdigest()   # same scheme as User_rest.hash_password
+    statuses, status_weights = list(STATUS_WEIGHTS), list(STATUS_WEIGHTS.values())
+    for u, fleet in enumerate(plan.fleets):
+        rng = random.Random(f"{plan.seed}:user:{u}")
+        user_id = f"{prefix}-{scattered_id(plan.seed, 'user', u)}"
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        yield USER_COLLECTION, user_id, {
+            "userId": user_id,
+            "name": f"{first} {last}",
+            "email": f"{first.lower()}.{last.lower()}.{u}@{prefix}.example",
+            "phoneNumber": _phone(rng),
+            "password": password,
+        }
+
+        for d in range(fleet):
+            driver_id = f"{prefix}-{scattered_id(plan.seed, 'driver', u, d)}"
+            events = []
+            for at in _event_times(rng, plan.event_counts[u][d], end, days):
+                event_id = scattered_id(plan.seed, "event", u, d, len(events))
+                events.append(_event(rng, event_id, driver_id, user_id, at, rng.choices(statuses, weights=status_weights)[0]))
+            for event in events:
+                yield EVENT_COLLECTION, event["eventId"], event
+
+            latest = events[-1] if events else _event(rng, "none", driver_id, user_id, end, "Idle")
+            yield DRIVER_COLLECTION, driver_id, {
+                "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                "phone_number": _phone(rng),
+                "profilePic": "",
+                "productId": rng.randint(1000, 9999),
+                "userId": user_id,
+                "emergency_contacts": [{"name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", "phone_number": _phone(rng)}
+                                       for _ in range(rng.randint(1, 3))],
+                "events": [event_summary(event) for event in events[-EMBEDDED_EVENTS:]],
+                "timeStamp": latest["timeStamp"],
+                "date": latest["date"],
+                "heartRate": latest["heartRate"],
+                "bloodOxygenLevel": latest["bloodOxygenLevel"],
+                "vehicleSpeed": latest["vehicleSpeed"],
+                "videoLink": latest["videoLink"] if events else "",
+                "driving": latest["status"] != "Idle",
+                "status": latest["status"],
+                "statusUpdatedAt": latest["occurredAt"],
+            }
+
+
+class _Throttle:
+    """Caps writes per second, optionally growing the cap by the 500/50/5 rule."""
+    def __init__(self, ramp: bool):
+        self._ramp = ramp
+        self._start = time.monotonic()
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def _rate(self, elapsed: float) -> float:
+        return RAMP_START_RATE * RAMP_GROWTH ** int(elapsed // RAMP_STEP_SECONDS)
+
+    def wait(self, writes: int):
+        if not self._ramp:
+            return
+        with self._lock:
+            self._written += writes
+            elapsed = time.monotonic() - self._start
+            ahead = self._written / self._rate(elapsed) - elapsed
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+class _BulkWriter:
+    """Commits batches concurrently with retries, keeping a bounded number in flight."""
+    def __init__(self, db_handler, parallelism: int, ramp: bool):
+        self._db = db_handler
+        self._pool = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="seed")
+        self._in_flight = threading.BoundedSemaphore(parallelism * 2)
+        self._throttle = _Throttle(ramp)
+        self.written: Dict[str, int] = {}
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def _commit(self, operations):
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                self._db.batch_write(operations)
+                with self._lock:
+                    for _, collection, _, _ in operations:
+                        self.written[collection] = self.written.get(collection, 0) + 1
+                return
+            except Exception as e:
+                if attempt == MAX_ATTEMPTS:
+                    print(f"Giving up on a batch of {len(operations)} writes: {e}")
+                    with self._lock:
+                        self.failed += len(operations)
+                    return
+                time.sleep((2 ** attempt) * 0.1 * random.uniform(0.5, 1.5))
+
+    def submit(self, operations):
+        self._throttle.wait(len(operations))
+        self._in_flight.acquire()
+        future = self._pool.submit(self._commit, operations)
+        future.add_done_callback(lambda _: self._in_flight.release())
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+def seed(db_handler, users: int = 1000, events: int = 1000000, days: int = 180, seed_value: int = 42,
+         end: str = DEFAULT_END, max_fleet: int = 200, parallelism: int = DEFAULT_PARALLELISM, ramp: bool = False,
+         prefix: str = "seed", progress_every: int = 100000) -> Dict[str, Any]:
+    """
+    Generates a synthetic dataset and writes it with bulk batch writes. The same arguments
+    always produce the same documents (IDs included), so re-seeding overwrites rather than
+    duplicates.
+
+    :param users: Number of users; their fleet sizes are skewed (a few users own most drivers).
+    :param events: Approximate total number of events, spread unevenly over the drivers.
+    :param days: Length of the event history, ending at `end` ('YYYY-MM-DD').
+    :param ramp: Respect Firestore's 500/50/5 ramp-up rule (use against a fresh production database).
+    :return: Documents written per collection, failures, and the elapsed time.
+    """
+    plan = SeedPlan(seed_value, users, events, max_fleet)
+    end_at = datetime.strptime(end, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    print(f"Seeding {users} users, {plan.drivers} drivers and {plan.events} events (seed {seed_value}).")
+
+    writer = _BulkWriter(db_handler, parallelism, ramp)
+    started = time.monotonic()
+    batch, generated = [], 0
+    try:
+        for collection, doc_id, data in generate(plan, end_at, days, prefix):
+            batch.append(("set", collection, doc_id, data))
+            generated += 1
+            if len(batch) == BATCH_SIZE:
+                writer.submit(batch)
+                batch = []
+            if progress_every and generated % progress_every == 0:
+                print(f"{generated} documents generated ({generated / (time.monotonic() - started):.0f}/s).")
+        if batch:
+            writer.submit(batch)
+    finally:
+        writer.close()
+
+    if hasattr(db_handler, "flush"):
+        db_handler.flush()
+    result = {"written": writer.written, "failed": writer.failed, "seconds": round(time.monotonic() - started, 1)}
+    print(f"Seeding finished: {result}")
+    return result
+
+
+if __name__ == "__main__":
+    # Usage: python Seed.py --users 2000 --events 1000000 --local bench.json
+    #        FIRESTORE_EMULATOR_HOST=localhost:8080 python Seed.py --events 1000000
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic dataset for benchmarks.")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=1000000, help="approximate total events")
+    parser.add_argument("--days", type=int, default=180, help="length of the event history")
+    parser.add_argument("--end", default=DEFAULT_END, help="last day of the history (YYYY-MM-DD)")
+    parser.add_argument("--max-fleet", type=int, default=200, help="largest fleet a user can have")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--prefix", default="seed", help="prefix of generated user and driver IDs")
+    parser.add_argument("--parallelism", type=int, default=DEFAULT_PARALLELISM, help="batches written concurrently")
+    parser.add_argument("--local", metavar="PATH", help="write to a LocalDatabase (':memory:' or a file) instead of Firestore")
+    parser.add_argument("--ramp", action="store_true", help="follow the 500/50/5 ramp-up rule (production Firestore)")
+    args = parser.parse_args()
+
+    if args.local:
+        from LocalDatabase import LocalDatabase
+        db_handler = LocalDatabase(None if args.local == ":memory:" else args.local)
+    else:
+        from Driver_rest import db_handler
+        if not args.ramp and not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+            print("Writing to Firestore without --ramp; a fresh database may throttle or hotspot.")
+
+    seed(db_handler, args.users, args.events, args.days, args.seed, args.end, args.max_fleet, args.parallelism,
+         args.ramp, args.prefix)
@@ -0,0 +1,60 @@
+import threading
+from typing import Any, Callable, Dict, Hashable
+from Metrics import registry, ratio_collector
+
+coalesced_calls = registry.counter(
+    "drivesense_singleflight_calls_total",
+    "Reads issued through single-flight groups, by group and role (leader ran the call, follower shared it).",
+    ("group", "role"))
+registry.add_collector(ratio_collector(
+    "drivesense_singleflight_coalesced_ratio",
+    "Fraction of single-flight reads that shared another caller's in-flight call.",
+    coalesced_calls, "follower"))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls into one: the first caller for a key (the leader)
+    runs the function, and everyone who asks for the same key while it is running waits for
+    and shares its result. Nothing is cached once the call finishes.
+
+    Every caller receives the same result object, so callers must not mutate it.
+    """
+    def __init__(self, group: str):
+        self._group = group
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            coalesced_calls.inc(self._group, "follower")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        coalesced_calls.inc(self._group, "leader")
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
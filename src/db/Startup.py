@@ -0,0 +1,124 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List
+from flask import Flask, jsonify
+
+WARMUP_ENABLED = os.environ.get("DRIVESENSE_WARMUP", "1") == "1"
+# Pre-loading indexes reads one field of every user or driver, so it is opt-in
+WARMUP_INDEXES = os.environ.get("DRIVESENSE_WARMUP_INDEXES", "0") == "1"
+STARTUP_BUDGET = float(os.environ.get("DRIVESENSE_STARTUP_BUDGET", "1.0"))     # seconds to import a service
+SERVICES = ["User_rest", "Driver_rest", "Event_rest"]
+RETRY_SECONDS = 30      # wait before warming up again after a failure
+
+
+class WarmUp:
+    """
+    Prepares one process of a service in the background: creates the storage client, opens
+    its channel with a cheap read and, if enabled, pre-loads the service's indexes.
+    A forked child starts over, since nothing it inherited is usable.
+    """
+    def __init__(self, db_handler, indexes: List = None):
+        self._db = db_handler
+        self._indexes = indexes or []
+        self._pid = None
+        self._lock = threading.Lock()
+        self.state = "pending"
+        self.error = None
+        self.timings: Dict[str, float] = {}
+        self._failed_at = 0.0
+
+    def _started(self) -> bool:
+        if self._pid != os.getpid():
+            return False
+        return self.state != "failed" or time.monotonic() - self._failed_at < RETRY_SECONDS
+
+    def start(self):
+        """Starts warming up this process, unless it already has (failed attempts are retried)."""
+        if self._started():
+            return
+        with self._lock:
+            if self._started():
+                return
+            self._pid = os.getpid()
+            self.state, self.error, self.timings = "running", None, {}
+        threading.Thread(target=self._run, name="warm-up", daemon=True).start()
+
+    def _run(self):
+        try:
+            self.timings["storage"] = round(self._db.warm_up(), 3)
+            if WARMUP_INDEXES:
+                for index in self._indexes:
+                    start = time.perf_counter()
+                    index.load()
+                    self.timings[index.name] = round(time.perf_counter() - start, 3)
+            self.state = "ready"
+            print(f"Warm-up finished: {self.timings}")
+        except Exception as e:
+            self._failed_at = time.monotonic()
+            self.state = "failed"
+            self.error = str(e)
+            print(f"Warm-up failed: {e}")
+
+    def to_map(self) -> Dict[str, Any]:
+        return {"state": self.state, "error": self.error, "seconds": self.timings}
+
+
+def register_readiness(app: Flask, db_handler, indexes: List = None) -> WarmUp:
+    """
+    Adds GET /ready, which answers 503 until this process can serve traffic and 200 after.
+    With DRIVESENSE_WARMUP=1 (the default) the process warms up in the background from its
+    first request (or when warm_up.start() is called at startup) and is ready once that
+    finishes; otherwise it is ready as soon as its storage client can be created.
+
+    :param indexes: FieldIndex objects to pre-load when DRIVESENSE_WARMUP_INDEXES=1.
+    :return: The WarmUp, so the service can start it eagerly.
+    """
+    warm_up = WarmUp(db_handler, indexes)
+
+    @app.before_request
+    def _start_warm_up():
+        if WARMUP_ENABLED:
+            warm_up.start()
+
+    @app.route('/ready', methods=['GET'], endpoint='ready')
+    def ready():
+        """Readiness probe for load balancers and orchestrators."""
+        if WARMUP_ENABLED:
+            is_ready = warm_up.state == "ready"
+            body = {'ready': is_ready, 'warmUp': warm_up.to_map()}
+        else:
+            is_ready = db_handler._db is not None
+            error = db_handler.connection_error()
+            body = {'ready': is_ready, 'error': str(error) if error else None}
+        return jsonify(body), 200 if is_ready else 503
+
+    return warm_up
+
+
+def measure_import(service: str) -> Dict[str, Any]:
+    """Imports a service in a fresh interpreter and reports how long it took."""
+    code = ("import time; start = time.perf_counter(); import {0}; "
+            "print(time.perf_counter() - start, {0}.db_handler.is_connected())").format(service)
+    result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"Importing {service} failed: {result.stderr.strip().splitlines()[-1:]}")
+    seconds, connected = result.stdout.strip().splitlines()[-1].split()
+    return {"service": service, "seconds": round(float(seconds), 3), "connectedOnImport": connected == "True"}
+
+
+if __name__ == "__main__":
+    # Usage: python Startup.py [budget_seconds]
+    # Fails if importing any service takes longer than the budget or touches storage.
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else STARTUP_BUDGET
+    failed = False
+    for service in SERVICES:
+        measured = measure_import(service)
+        over = measured["seconds"] > budget
+        failed = failed or over or measured["connectedOnImport"]
+        print(f"{service}: {measured['seconds']}s (budget {budget}s)"
+              f"{' OVER BUDGET' if over else ''}{' CONNECTED ON IMPORT' if measured['connectedOnImport'] else ''}")
+    sys.exit(1 if failed else 0)
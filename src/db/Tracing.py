@@ -0,0 +1,128 @@
+import json
+import os
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from flask import Flask, current_app, g, request
+
+# Send "X-Debug-Trace: 1" to get a storage trace back in the X-Storage-Trace response header
+TRACE_REQUEST_HEADER = "X-Debug-Trace"
+TRACE_RESPONSE_HEADER = "X-Storage-Trace"
+# Fraction of ordinary requests whose trace is written to the log (0 disables sampling)
+TRACE_SAMPLE_RATE = float(os.environ.get("DRIVESENSE_TRACE_SAMPLE_RATE", "0"))
+# The debug header is honoured when the app runs in debug mode or when this is set
+TRACE_HEADER_ENABLED = os.environ.get("DRIVESENSE_TRACE_HEADER", "0") == "1"
+
+_current_trace: ContextVar[Optional["RequestTrace"]] = ContextVar("drivesense_request_trace", default=None)
+
+
+def _payload_size(payload: Any) -> int:
+    """Approximates the wire size of a document (or list of documents) in bytes."""
+    if payload is None:
+        return 0
+    try:
+        return len(json.dumps(payload, default=str, separators=(",", ":")))
+    except Exception:
+        return 0
+
+
+class RequestTrace:
+    """The ordered list of storage operations issued while handling one HTTP request."""
+    def __init__(self, method: str, path: str):
+        self._method = method
+        self._path = path
+        self._start = time.perf_counter()
+        self._operations: List[Dict[str, Any]] = []
+        self._reads: Dict[str, int] = {}
+
+    def record(self, operation: str, collection: str, target: str, seconds: float, payload: Any, error: Exception):
+        entry = {
+            "op": operation,
+            "collection": collection,
+            "target": target,
+            "ms": round(seconds * 1000, 2),
+            "bytes": _payload_size(payload),
+            # Offset from the start of the request, so gaps between round trips are visible
+            "atMs": round((time.perf_counter() - self._start) * 1000 - seconds * 1000, 2),
+        }
+        if error is not None:
+            entry["error"] = str(error)
+        if operation in ("read", "query"):
+            key = f"{collection}/{target}"
+            self._reads[key] = self._reads.get(key, 0) + 1
+            if self._reads[key] > 1:
+                entry["duplicate"] = True
+        self._operations.append(entry)
+
+    def duplicate_reads(self) -> Dict[str, int]:
+        return {key: count for key, count in self._reads.items() if count > 1}
+
+    def summary(self) -> Dict[str, Any]:
+        """Compact form that fits in a response header."""
+        return {
+            "ops": len(self._operations),
+            "storageMs": round(sum(op["ms"] for op in self._operations), 2),
+            "bytes": sum(op["bytes"] for op in self._operations),
+            "sequence": [f"{op['op']}:{op['collection']}/{op['target']}" for op in self._operations],
+            "duplicateReads": self.duplicate_reads(),
+        }
+
+    def to_map(self) -> Dict[str, Any]:
+        return {
+            "method": self._method,
+            "path": self._path,
+            "totalMs": round((time.perf_counter() - self._start) * 1000, 2),
+            "operations": self._operations,
+            "duplicateReads": self.duplicate_reads(),
+        }
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def _record_operation(operation, collection, target, seconds, payload, error):
+    """Database operation hook; a no-op unless the current request is being traced."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.record(operation, collection, target, seconds, payload, error)
+
+
+def register_tracing(app: Flask, db_handler):
+    """
+    Enables opt-in, per-request tracing of the storage operations issued by db_handler.
+    A request is traced when it sends the debug header (debug mode or DRIVESENSE_TRACE_HEADER=1)
+    or when it is picked by DRIVESENSE_TRACE_SAMPLE_RATE; sampled traces are logged.
+
+    :param app: The Flask app whose requests are traced.
+    :param db_handler: The Database instance used by the app.
+    """
+    db_handler.add_operation_hook(_record_operation)
+
+    @app.before_request
+    def _start_trace():
+        wants_header = request.headers.get(TRACE_REQUEST_HEADER) == "1" and (current_app.debug or TRACE_HEADER_ENABLED)
+        sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+        if wants_header or sampled:
+            g._trace_header = wants_header
+            g._trace_sampled = sampled
+            g._trace_token = _current_trace.set(RequestTrace(request.method, request.path))
+
+    @app.after_request
+    def _finish_trace(response):
+        token = getattr(g, "_trace_token", None)
+        if token is None:
+            return response
+
+        trace = _current_trace.get()
+        _current_trace.reset(token)
+        g._trace_token = None
+        if trace is None:
+            return response
+
+        if g._trace_header:
+            response.headers[TRACE_RESPONSE_HEADER] = json.dumps(trace.summary(), separators=(",", ":"))
+        if g._trace_sampled or trace.duplicate_reads():
+            print(f"Storage trace: {json.dumps(trace.to_map(), separators=(',', ':'))}")
+        return response
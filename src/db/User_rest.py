@@ -1,23 +1,65 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from Database import Database
+from Database import connect
 from User import User
+from Metrics import register_metrics
+from Tracing import register_tracing
+from RateLimit import register_rate_limiting
+from Cascade import cascade_delete_user, user_deletion_is_large
+from Dashboard import DASHBOARD_COLLECTION, new_dashboard
+from Jobs import job_runner, register_job_routes, RetryPolicy
+from Indexes import FieldIndex
+from Startup import register_readiness
+from Resilience import register_resilience
+from Idempotency import register_idempotency
+from Batch import register_batch
 import json
 import hashlib
 
 app = Flask(__name__)
 CORS(app) 
+register_metrics(app, "users")
 
 PROJECT_ID = "drivesense-c1d4c"
 CREDENTIALS_FILE = "src/db/database_key.json"
 USER_COLLECTION = "users"
 
-db_handler = Database(PROJECT_ID, credentials_path=CREDENTIALS_FILE)
+db_handler = connect(PROJECT_ID, credentials_path=CREDENTIALS_FILE)
+register_tracing(app, db_handler)
+register_rate_limiting(app, db_handler, "users")
+register_resilience(app)
+register_idempotency(app, "users")
+register_batch(app, "users")
+register_job_routes(app)
+# Email -> user ID, so sign-up and login don't have to scan the users collection
+email_index = FieldIndex(db_handler, USER_COLLECTION, "email")
+warm_up = register_readiness(app, db_handler, [email_index])
 
 def hash_password(password):
     """Hash a password for storing."""
     return hashlib.sha256(password.encode()).hexdigest()
 
+def find_user_by_email(email):
+    """
+    Finds the user with an email address.
+    Checks the email index first (confirming the hit with a read), then falls back to an
+    indexed equality query, since other processes may have added the user.
+    Returns (user_id, user_data), or (None, None) if no user has that email.
+    """
+    user_id = email_index.find(email)
+    if user_id:
+        user_data = db_handler.get_document(USER_COLLECTION, user_id)
+        if user_data and user_data.get('email') == email:
+            return user_id, user_data
+        email_index.remove(user_id)
+    
+    results = db_handler.query_documents(USER_COLLECTION, [('email', '==', email)], limit=1)
+    if not results:
+        return None, None
+    user_id, user_data = results[0]
+    email_index.put(user_id, email)
+    return user_id, user_data
+
 def create_new_user(user_id, name, email, phone_number, password):
     """
     Creates a new user in the database.
@@ -26,17 +68,18 @@ def create_new_user(user_id, name, email, phone_number, password):
     """
     try:
         # Check if email already exists
-        all_users = db_handler._db.collection(USER_COLLECTION).stream()
-        for doc in all_users:
-            user_data = doc.to_dict()
-            if user_data.get('email') == email:
-                raise Exception("Email already exists")
+        existing_id, _ = find_user_by_email(email)
+        if existing_id:
+            raise Exception("Email already exists")
         
         user = User(user_id, name, email, phone_number)
         user_data = user.to_map()
         # Add hashed password to user data
         user_data['password'] = hash_password(password)
-        db_handler.set_document(USER_COLLECTION, user_id, user_data)
+        # A new user starts with an empty dashboard that driver writes then keep up to date
+        db_handler.batch_write([("set", USER_COLLECTION, user_id, user_data),
+                                ("set", DASHBOARD_COLLECTION, user_id, new_dashboard(user_id))])
+        email_index.put(user_id, email)
         
         # Return user data without password
         return_data = user_data.copy()
@@ -51,22 +94,18 @@ def authenticate_user(email, password):
     Returns user data if successful, None otherwise.
     """
     try:
-        # Get all users and find by email
-        all_users = db_handler._db.collection(USER_COLLECTION).stream()
-        
-        for doc in all_users:
-            user_data = doc.to_dict()
-            if user_data.get('email') == email:
-                # Check password
-                if user_data.get('password') == hash_password(password):
-                    # Return user data without password
-                    return_data = user_data.copy()
-                    return_data.pop('password', None)
-                    return return_data
-                else:
-                    raise Exception("Invalid password")
-        
-        raise Exception("User not found")
+        _, user_data = find_user_by_email(email)
+        if not user_data:
+            raise Exception("User not found")
+        
+        # Check password
+        if user_data.get('password') != hash_password(password):
+            raise Exception("Invalid password")
+        
+        # Return user data without password
+        return_data = user_data.copy()
+        return_data.pop('password', None)
+        return return_data
     except Exception as e:
         raise Exception(f"Authentication failed: {str(e)}")
 
@@ -83,6 +122,8 @@ def edit_user_field(field_to_change, new_value, user_id):
         
         update_fields = {field_to_change: new_value}
         db_handler.update_document(USER_COLLECTION, user_id, update_fields)
+        if field_to_change == 'email':
+            email_index.put(user_id, new_value)
         
         return update_fields
     except Exception as e:
@@ -90,19 +131,39 @@ def edit_user_field(field_to_change, new_value, user_id):
 
 def remove_user(user_id):
     """
-    Removes a user from the database.
+    Removes a user from the database, together with the user's drivers and their events.
+    Users with many drivers or events are deleted by a background job, which is
+    returned; otherwise the deletion finishes here and None is returned.
     """
     try:
         existing_user = db_handler.get_document(USER_COLLECTION, user_id)
         if not existing_user:
             raise Exception("User not found")
         
-        db_handler._db.collection(USER_COLLECTION).document(user_id).delete()
+        email_index.remove(user_id)
+        if user_deletion_is_large(db_handler, user_id):
+            return job_runner.submit("delete_user", {"userId": user_id})
         
-        return True
+        deletion = cascade_delete_user(db_handler, user_id)
+        if deletion.status == "failed":
+            raise Exception(deletion.error)
+        
+        return None
     except Exception as e:
         raise Exception(f"Failed to delete user: {str(e)}")
 
+def delete_user_job(job, userId):
+    """
+    Background job that cascades a user deletion, reporting progress to the job.
+    """
+    deletion = cascade_delete_user(db_handler, userId, job)
+    if deletion.status == "failed":
+        raise Exception(deletion.error)
+    return deletion.to_map()
+
+# Cascades are idempotent, so a failed run can safely be retried
+job_runner.register("delete_user", delete_user_job, RetryPolicy(max_attempts=3, backoff_seconds=5))
+
 def get_user_by_id(user_id):
     """
     Retrieves a user from the database.
@@ -218,7 +279,14 @@ def delete_user(user_id):
     Removes a user from the database.
     """
     try:
-        remove_user(user_id)
+        job = remove_user(user_id)
+        
+        if job:
+            return jsonify({
+                'message': 'User deletion started',
+                'deletedUserId': user_id,
+                'job': job
+            }), 202
         
         return jsonify({
             'message': 'User deleted successfully',
@@ -261,15 +329,13 @@ def verify_email():
         email = data['email']
         
         # Search for user by email
-        all_users = db_handler._db.collection(USER_COLLECTION).stream()
+        _, user_data = find_user_by_email(email)
         
-        for doc in all_users:
-            user_data = doc.to_dict()
-            if user_data.get('email') == email:
-                return jsonify({
-                    'message': 'Email verified',
-                    'userName': user_data.get('name', 'User')
-                }), 200
+        if user_data:
+            return jsonify({
+                'message': 'Email verified',
+                'userName': user_data.get('name', 'User')
+            }), 200
         
         # Email not found
         return jsonify({'error': 'Email not found'}), 404
@@ -300,16 +366,8 @@ def request_reset():
         email = data['email']
         
         # Search for user by email
-        all_users = db_handler._db.collection(USER_COLLECTION).stream()
-        user_id = None
-        user_name = None
-        
-        for doc in all_users:
-            user_data = doc.to_dict()
-            if user_data.get('email') == email:
-                user_id = user_data.get('userId')
-                user_name = user_data.get('name', 'User')
-                break
+        user_id, user_data = find_user_by_email(email)
+        user_name = user_data.get('name', 'User') if user_data else None
         
         if not user_id:
             return jsonify({'error': 'Email not found'}), 404
@@ -377,4 +435,7 @@ def reset_password():
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    # Resume jobs interrupted by a previous run before serving requests
+    job_runner.recover()
+    warm_up.start()
     app.run(debug=True, port=5000)
\ No newline at end of file
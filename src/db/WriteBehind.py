@@ -0,0 +1,210 @@
+import atexit
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from Metrics import registry
+from Resilience import StorageUnavailable
+
+FLUSH_INTERVAL = float(os.environ.get("DRIVESENSE_WRITE_BEHIND_SECONDS", "1.0"))   # 0 writes through
+MAX_PENDING = 10000         # buffered documents that trigger an early flush
+BATCH_LIMIT = 500           # Firestore's limit on writes per batch
+
+write_behind_updates = registry.counter(
+    "drivesense_write_behind_updates_total",
+    "Field updates handled by write-behind buffers, by collection and stage (received or written).",
+    ("collection", "stage"))
+
+
+class WriteBehindBuffer:
+    """
+    Coalesces frequent field updates to the documents of one collection in memory and writes
+    them out every flush_interval seconds as batched updates, so a document gets at most one
+    write per interval however often its fields change (Firestore sustains about one write
+    per second per document). Later values of a field replace earlier ones.
+
+    Readers apply pending() or overlay() so this process serves the latest values; other
+    processes see them once flushed. Whatever is pending is flushed at interpreter exit.
+
+    related_operations(doc_id, updates, context) may return further batch operations that
+    must be committed with a document's updates (e.g. keeping a materialized view in step);
+    context is whatever the last put() for the document passed.
+    """
+    def __init__(self, db_handler, collection: str, flush_interval: float = FLUSH_INTERVAL,
+                 max_pending: int = MAX_PENDING, related_operations: Optional[Callable[[str, Dict[str, Any], Any], List]] = None):
+        self._db = db_handler
+        self._collection = collection
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._related_operations = related_operations
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._contexts: Dict[str, Any] = {}
+        # Updates taken by the flush in progress, still served to readers until written
+        self._flushing: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        atexit.register(self.flush)
+        _buffers.append(self)
+
+    @property
+    def collection(self) -> str:
+        return self._collection
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def put(self, doc_id: str, updates: Dict[str, Any], context: Any = None):
+        """Buffers field updates for a document (or writes them at once when the interval is 0)."""
+        if not updates:
+            return
+        write_behind_updates.inc(self._collection, "received", amount=len(updates))
+        if self._flush_interval <= 0:
+            self._db.batch_write(self._operations(doc_id, updates, context))
+            write_behind_updates.inc(self._collection, "written", amount=len(updates))
+            return
+
+        with self._lock:
+            self._pending.setdefault(doc_id, {}).update(updates)
+            self._contexts[doc_id] = context
+            full = len(self._pending) >= self._max_pending
+        self._start()
+        if full:
+            self._wakeup.set()
+
+    def pending(self, doc_id: str) -> Dict[str, Any]:
+        """The buffered fields of a document that have not been written yet."""
+        with self._lock:
+            return {**self._flushing.get(doc_id, {}), **self._pending.get(doc_id, {})}
+
+    def overlay(self, doc_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Applies a document's buffered fields to data read from storage (in place) and returns it."""
+        if data:
+            data.update(self.pending(doc_id))
+        return data
+
+    def take(self, doc_id: str) -> Dict[str, Any]:
+        """Removes and returns a document's buffered fields, for a caller that writes them itself."""
+        with self._lock:
+            self._contexts.pop(doc_id, None)
+            return self._pending.pop(doc_id, {})
+
+    def discard(self, doc_id: str, fields: Iterable[str]):
+        """Drops buffered values of fields that are being written directly, so the flush can't revert them."""
+        with self._lock:
+            pending = self._pending.get(doc_id)
+            if pending is None:
+                return
+            for field in fields:
+                pending.pop(field, None)
+            if not pending:
+                del self._pending[doc_id]
+                self._contexts.pop(doc_id, None)
+
+    def _start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name=f"write-behind-{self._collection}", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing write-behind buffer for '{self._collection}': {e}")
+
+    def flush(self) -> int:
+        """
+        Writes every buffered document, up to BATCH_LIMIT per batch. Updates that fail are put
+        back (unless newer values arrived meanwhile) to be retried on the next flush; those for
+        documents that no longer exist are dropped.
+
+        :return: The number of documents written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+                contexts, self._contexts = self._contexts, {}
+            try:
+                return self._flush_items([(doc_id, updates, contexts.get(doc_id))
+                                          for doc_id, updates in self._flushing.items()])
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+    def _operations(self, doc_id: str, updates: Dict[str, Any], context: Any) -> List:
+        operations = [("update", self._collection, doc_id, updates)]
+        if self._related_operations:
+            operations += self._related_operations(doc_id, updates, context)
+        return operations
+
+    def _flush_items(self, items: List) -> int:
+        written = 0
+        chunk, operations = [], []
+        for item in items + [None]:
+            item_operations = self._operations(*item) if item else []
+            if chunk and (item is None or len(operations) + len(item_operations) > BATCH_LIMIT):
+                written += self._flush_chunk(chunk, operations)
+                chunk, operations = [], []
+            if item:
+                chunk.append(item)
+                operations += item_operations
+        return written
+
+    def _flush_chunk(self, chunk: List, operations: List) -> int:
+        try:
+            self._db.batch_write(operations)
+            return self._written(chunk)
+        except StorageUnavailable as e:
+            print(f"Write-behind flush for '{self._collection}' deferred: {e}")
+            for item in chunk:
+                self._requeue(*item)
+            return 0
+        except Exception as e:
+            # Most likely a document was deleted; write the rest one by one
+            print(f"Batched write-behind flush failed, writing documents one by one: {e}")
+            return self._flush_each(chunk)
+
+    def _flush_each(self, chunk: List) -> int:
+        written = 0
+        for doc_id, updates, context in chunk:
+            try:
+                self._db.batch_write(self._operations(doc_id, updates, context))
+                written += self._written([(doc_id, updates, context)])
+            except Exception as e:
+                if type(e).__name__ == "NotFound":
+                    continue
+                self._requeue(doc_id, updates, context)
+        return written
+
+    def _written(self, chunk: List) -> int:
+        write_behind_updates.inc(self._collection, "written", amount=sum(len(updates) for _, updates, _ in chunk))
+        return len(chunk)
+
+    def _requeue(self, doc_id: str, updates: Dict[str, Any], context: Any):
+        with self._lock:
+            newer = self._pending.get(doc_id, {})
+            self._pending[doc_id] = {**updates, **newer}
+            self._contexts.setdefault(doc_id, context)
+
+
+_buffers: List[WriteBehindBuffer] = []
+
+
+def _collect_pending_documents():
+    if not _buffers:
+        return []
+    name = "drivesense_write_behind_pending_documents"
+    lines = [f"# HELP {name} Documents with buffered updates not yet written, by collection.", f"# TYPE {name} gauge"]
+    for buffer in list(_buffers):
+        lines.append(f'{name}{{collection="{buffer.collection}"}} {len(buffer)}')
+    return lines
+
+
+registry.add_collector(_collect_pending_documents)
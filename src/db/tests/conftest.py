@@ -0,0 +1,85 @@
+"""
+Shared fixtures. The services run against an in-memory LocalDatabase, with background
+warm-up, write-behind and retention disabled, and the job table and blob store in a
+temporary directory.
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+_TEMP_DIR = tempfile.mkdtemp(prefix="drivesense-tests-")
+os.environ["DRIVESENSE_LOCAL_DB"] = ":memory:"
+os.environ["DRIVESENSE_WARMUP"] = "0"
+os.environ["DRIVESENSE_WRITE_BEHIND_SECONDS"] = "0"
+os.environ["DRIVESENSE_RETENTION_SECONDS"] = "0"
+os.environ["DRIVESENSE_JOB_DB"] = os.path.join(_TEMP_DIR, "jobs.sqlite3")
+os.environ["DRIVESENSE_BLOB_DIR"] = os.path.join(_TEMP_DIR, "blobs")
+os.environ.setdefault("DRIVESENSE_RATE_LIMIT_STORE", "local")
+os.environ.setdefault("DRIVESENSE_IDEMPOTENCY_STORE", "local")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """A fresh, empty LocalDatabase."""
+    from LocalDatabase import LocalDatabase
+    return LocalDatabase()
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limits(monkeypatch):
+    """Tests send bursts no real client would; rate limiting has its own tests."""
+    import RateLimit
+    monkeypatch.setattr(RateLimit, "USER_LIMIT", (1e6, 1000000))
+    monkeypatch.setattr(RateLimit, "DEFAULT_ROUTE_LIMIT", (1e6, 1000000))
+    monkeypatch.setattr(RateLimit, "ROUTE_LIMITS", {})
+
+
+class Services:
+    """Test clients of the three services, which share one in-memory database."""
+    def __init__(self):
+        import Driver_rest
+        import Event_rest
+        import User_rest
+        self.drivers_module, self.events_module, self.users_module = Driver_rest, Event_rest, User_rest
+        self.db = Driver_rest.db_handler
+        self.drivers = Driver_rest.app.test_client()
+        self.events = Event_rest.app.test_client()
+        self.users = User_rest.app.test_client()
+
+    def create_driver(self, user_id: str, name: str = "Ann Lee", **fields) -> str:
+        body = {"userId": user_id, "name": name, "phoneNumber": "555-0100", "productId": 1234,
+                "profilePic": "", "emergency_contacts": [], **fields}
+        response = self.drivers.post("/drivers", json=body)
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()["driver"]["driverId"]
+
+    def create_event(self, driver_id: str, time_stamp: str = "2024-01-15T10:30:00Z", date: str = "2024-01-15",
+                     **fields) -> dict:
+        body = {"driverId": driver_id, "status": "Mild", "timeStamp": time_stamp, "date": date,
+                "videoLink": "", **fields}
+        response = self.events.post("/events", json=body)
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()["event"]
+
+    def drain_outbox(self):
+        while self.events_module.outbox_worker.process_pending():
+            pass
+
+
+@pytest.fixture
+def services():
+    """The services, with their database emptied."""
+    services = Services()
+    services.db._db._store.collections.clear()
+    return services
+
+
+@pytest.fixture
+def user_id():
+    """A user ID no other test uses, so per-user caches and buckets start empty."""
+    return f"user-{uuid.uuid4().hex[:12]}"
@@ -0,0 +1,112 @@
+import statistics
+import pytest
+from Anomaly import AnomalyDetector, RollingStats
+
+
+def test_rolling_stats_match_the_window():
+    stats = RollingStats(window=4)
+    values = [70, 72, 90, 65, 88, 101]
+    for value in values:
+        stats.add(value)
+
+    assert stats.count == 4
+    assert stats.mean == pytest.approx(statistics.mean(values[-4:]))
+    assert stats.std == pytest.approx(statistics.stdev(values[-4:]))
+
+
+def test_ewma_weights_the_newest_sample():
+    stats = RollingStats()
+    stats.add(100, alpha=0.5)
+    stats.add(50, alpha=0.5)
+
+    assert stats.ewma == 75
+
+
+def test_escalation_waits_for_its_dwell():
+    detector = AnomalyDetector(escalate_dwell=5, recover_dwell=30)
+
+    assert detector.observe("d", {"heartRate": 130}, "Stable", now=0) is None
+    assert detector.observe("d", {"heartRate": 130}, "Stable", now=4) is None
+    transition = detector.observe("d", {"heartRate": 130}, "Stable", now=5)
+
+    assert transition["fromStatus"] == "Stable" and transition["toStatus"] == "Unstable"
+    assert transition["reasons"] == ["heartRate averaging 130.0"]
+
+
+def test_critical_is_applied_at_once():
+    detector = AnomalyDetector()
+
+    transition = detector.observe("d", {"bloodOxygenLevel": 80}, "Mild", now=0)
+
+    assert transition["toStatus"] == "Critical"
+
+
+def test_recovery_waits_longer_and_a_blip_resets_it():
+    detector = AnomalyDetector(escalate_dwell=5, recover_dwell=30)
+    detector.observe("d", {"vehicleSpeed": 120}, "Mild", now=0)
+
+    assert detector.observe("d", {"vehicleSpeed": 60}, "Mild", now=1) is None
+    assert detector.observe("d", {"vehicleSpeed": 300}, "Mild", now=20) is None     # back above the limit
+    for now in range(21, 60):
+        transition = detector.observe("d", {"vehicleSpeed": 60}, "Mild", now=now)
+        if transition:
+            break
+    assert transition["toStatus"] == "Stable"
+    assert now >= 50
+
+
+def test_erratic_readings_call_for_unstable():
+    detector = AnomalyDetector(escalate_dwell=0)
+    transition = None
+    for n in range(12):
+        transition = detector.observe("d", {"heartRate": 50 if n % 2 else 95}, "Stable", now=n) or transition
+
+    assert transition["toStatus"] == "Unstable"
+    assert "varying" in transition["reasons"][0]
+
+
+def test_manual_statuses_and_missing_readings_are_left_alone():
+    detector = AnomalyDetector(escalate_dwell=0)
+
+    assert detector.observe("d", {"heartRate": 200}, "Idle", now=0) is None
+    assert detector.observe("e", {"heartRate": 0, "bloodOxygenLevel": 0, "note": "x"}, "Stable", now=0) is None
+    assert detector.smoothed("e") == {}
+
+
+def test_least_recently_updated_drivers_are_evicted():
+    detector = AnomalyDetector(max_drivers=2)
+    for driver_id in ("a", "b", "c"):
+        detector.observe(driver_id, {"heartRate": 70}, "Stable")
+
+    assert len(detector) == 2
+    assert detector.smoothed("a") == {}
+    detector.forget("b")
+    assert len(detector) == 1
+
+
+def test_critical_vitals_update_the_driver_log_an_event_and_alert(services, user_id):
+    driver_id = services.create_driver(user_id, status="Stable")
+
+    response = services.drivers.post(f"/drivers/{driver_id}/vitals",
+                                     json={"userId": user_id, "heartRate": 30, "bloodOxygenLevel": 97})
+    services.drain_outbox()
+
+    assert response.status_code == 200
+    assert response.get_json()["updatedFields"]["status"] == "Critical"
+    driver = services.db.get_document("drivers", driver_id)
+    assert driver["status"] == "Critical" and driver["heartRate"] == 30
+    assert [event["status"] for event in driver["events"]] == ["Critical"]
+    alerts = services.drivers.get(f"/alerts/{user_id}").get_json()["alerts"]
+    assert [alert["toStatus"] for alert in alerts] == ["Critical"]
+
+
+@pytest.mark.parametrize("body, error", [
+    ({"heartRate": 70}, "Missing required field: userId"),
+    ({"userId": "u"}, "At least one reading is required"),
+    ({"userId": "u", "heartRate": "fast"}, "Readings must be numbers"),
+])
+def test_vitals_validation(services, body, error):
+    response = services.drivers.post("/drivers/any/vitals", json=body)
+
+    assert response.status_code == 400
+    assert response.get_json()["error"].startswith(error)
@@ -0,0 +1,178 @@
+import gzip
+import hashlib
+import json
+import os
+import runpy
+import sys
+from datetime import datetime, timezone
+import pytest
+import Backup
+from Backup import backup, restore
+from LocalDatabase import LocalDatabase
+
+BACKUP_SCRIPT = Backup.__file__
+AT = datetime(2024, 1, 15, 10, 30, tzinfo=timezone.utc)
+
+
+def _fill(db):
+    for user_id in ("ann", "bob"):
+        db.set_document("users", user_id, {"name": user_id})
+        db.set_document("dashboards", user_id, {"cards": {}})
+        db.set_document("drivers", f"{user_id}-driver", {"userId": user_id, "statusUpdatedAt": AT, "pic": b"\x00\x01"})
+        db.set_document("events", f"{user_id}-event", {"userId": user_id, "driverId": f"{user_id}-driver", "occurredAt": AT})
+        db.set_document("outbox", f"{user_id}-record", {"driverId": f"{user_id}-driver"})
+        db.set_document("id_aliases", f"{user_id}-alias", {"id": f"{user_id}-driver"})
+
+
+def _documents(db):
+    return {collection: dict(documents) for collection, documents in db._db._store.collections.items() if documents}
+
+
+def test_backup_and_restore_roundtrip(db, tmp_path):
+    _fill(db)
+    manifest = backup(db, str(tmp_path))
+    target = LocalDatabase()
+
+    summary = restore(target, str(tmp_path))
+
+    assert set(manifest["collections"]) == set(Backup.COLLECTIONS)
+    assert manifest["collections"]["drivers"]["documents"] == 2
+    assert summary["drivers"] == {"restored": 2, "failed": 0}
+    assert _documents(target) == _documents(db)
+    assert target.get_document("drivers", "ann-driver")["statusUpdatedAt"] == AT
+
+
+def test_backup_is_split_into_parts(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(Backup, "PART_SIZE", 1)
+    _fill(db)
+
+    manifest = backup(db, str(tmp_path), ["events"])
+    target = LocalDatabase()
+    restore(target, str(tmp_path))
+
+    assert [part["documents"] for part in manifest["collections"]["events"]["files"]] == [1, 1]
+    assert set(target._db._store.collections["events"]) == {"ann-event", "bob-event"}
+
+
+def test_restore_of_one_user(db, tmp_path):
+    _fill(db)
+    backup(db, str(tmp_path))
+    target = LocalDatabase()
+
+    restore(target, str(tmp_path), user_id="ann")
+
+    restored = {collection: sorted(documents) for collection, documents in _documents(target).items()}
+    assert restored == {"users": ["ann"], "dashboards": ["ann"], "drivers": ["ann-driver"], "events": ["ann-event"],
+                        "outbox": ["ann-record"], "id_aliases": ["ann-alias"]}
+
+
+def test_damaged_backup_writes_nothing(db, tmp_path):
+    _fill(db)
+    manifest = backup(db, str(tmp_path))
+    # Corrupt the last collection, so everything before it would have been restored already
+    damaged = manifest["collections"][Backup.COLLECTIONS[-1]]["files"][0]["name"]
+    with gzip.open(tmp_path / damaged, "ab") as f:
+        f.write(b'{"id": "extra", "data": {}}\n')
+    target = LocalDatabase()
+
+    with pytest.raises(Exception, match="does not match the manifest"):
+        restore(target, str(tmp_path))
+    assert _documents(target) == {}
+
+
+def _put_blob(blob_dir, data, ext="png"):
+    name = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+    os.makedirs(blob_dir / name[:2], exist_ok=True)
+    (blob_dir / name[:2] / name).write_bytes(data)
+    return name
+
+
+def _blob_names(blob_dir):
+    return sorted(name for shard in blob_dir.iterdir() for name in os.listdir(shard)) if blob_dir.exists() else []
+
+
+def test_pictures_are_backed_up_and_restored_with_the_drivers(db, tmp_path):
+    blobs = tmp_path / "blobs"
+    ann_pic, bob_pic = _put_blob(blobs, b"ann"), _put_blob(blobs, b"bob", "jpg")
+    _fill(db)
+    db.update_document("drivers", "ann-driver", {"profilePic": f"http://cdn/blobs/{ann_pic}",
+                                                 "profilePicThumbnail": f"http://cdn/blobs/{ann_pic}"})
+    db.update_document("drivers", "bob-driver", {"profilePic": f"http://cdn/blobs/{bob_pic}"})
+    manifest = backup(db, str(tmp_path / "backup"), blob_dir=str(blobs))
+
+    assert sorted(entry["name"] for entry in manifest["blobs"]["files"]) == sorted([ann_pic, bob_pic])
+    summary = restore(LocalDatabase(), str(tmp_path / "backup"), blob_dir=str(tmp_path / "all"))
+    assert summary["blobs"] == {"restored": 2, "failed": 0}
+    assert (tmp_path / "all" / ann_pic[:2] / ann_pic).read_bytes() == b"ann"
+
+    # One user's restore brings back only the pictures their drivers refer to
+    summary = restore(LocalDatabase(), str(tmp_path / "backup"), user_id="ann", blob_dir=str(tmp_path / "ann"))
+    assert summary["blobs"] == {"restored": 1, "failed": 0}
+    assert _blob_names(tmp_path / "ann") == [ann_pic]
+
+
+def test_damaged_picture_writes_nothing(db, tmp_path):
+    blobs = tmp_path / "blobs"
+    name = _put_blob(blobs, b"picture")
+    _fill(db)
+    backup(db, str(tmp_path / "backup"), blob_dir=str(blobs))
+    (tmp_path / "backup" / Backup.BLOBS_DIR / name[:2] / name).write_bytes(b"truncated")
+    target = LocalDatabase()
+
+    with pytest.raises(Exception, match="does not match the manifest"):
+        restore(target, str(tmp_path / "backup"), blob_dir=str(tmp_path / "restored"))
+    assert _documents(target) == {} and _blob_names(tmp_path / "restored") == []
+
+
+def test_backups_without_pictures_restore_the_documents(db, tmp_path):
+    _fill(db)
+    manifest = backup(db, str(tmp_path / "backup"), blob_dir=str(tmp_path / "missing"))
+
+    assert manifest["blobs"] == {"files": []}
+    assert "blobs" not in restore(LocalDatabase(), str(tmp_path / "backup"), ["users"])
+
+
+def test_incomplete_backup_is_refused(tmp_path):
+    with pytest.raises(Exception, match="missing or incomplete"):
+        restore(LocalDatabase(), str(tmp_path))
+
+
+def test_unknown_collection_is_refused(db, tmp_path):
+    backup(db, str(tmp_path), ["users"])
+
+    with pytest.raises(Exception, match="not in the backup"):
+        restore(LocalDatabase(), str(tmp_path), ["drivers"])
+
+
+def _run_cli(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", [BACKUP_SCRIPT, *args])
+    runpy.run_path(BACKUP_SCRIPT, run_name="__main__")
+
+
+def test_cli_restore_exits_nonzero_when_documents_fail(db, tmp_path, monkeypatch):
+    _fill(db)
+    backup(db, str(tmp_path / "backup"))
+    local_file = str(tmp_path / "local.json")
+
+    def unavailable(self, operations):
+        raise RuntimeError("storage unavailable")
+
+    monkeypatch.setattr(LocalDatabase, "batch_write", unavailable)
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    with pytest.raises(SystemExit) as exit_info:
+        _run_cli(monkeypatch, "restore", str(tmp_path / "backup"), "--local", local_file)
+
+    assert exit_info.value.code == 1
+
+
+def test_cli_restore_into_a_local_file(db, tmp_path, monkeypatch):
+    _fill(db)
+    backup(db, str(tmp_path / "backup"))
+    local_file = str(tmp_path / "local.json")
+
+    _run_cli(monkeypatch, "restore", str(tmp_path / "backup"), "--local", local_file, "--user", "bob")
+
+    with open(local_file, encoding="utf-8") as f:
+        stored = json.load(f)
+    assert sorted(stored["drivers"]) == ["bob-driver"]
+    assert os.path.exists(tmp_path / "backup" / Backup.MANIFEST_FILE)
@@ -0,0 +1,134 @@
+import threading
+import pytest
+from werkzeug.serving import make_server
+import Batch
+
+UNREACHABLE = "http://127.0.0.1:9"
+
+
+@pytest.fixture
+def servers(services, monkeypatch):
+    """The users and events services listening on local ports, as the drivers service's batches see them."""
+    running = []
+    urls = {"drivers": UNREACHABLE}
+    for name, module in (("users", services.users_module), ("events", services.events_module)):
+        server = make_server("127.0.0.1", 0, module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        running.append(server)
+        urls[name] = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(Batch, "SERVICE_URLS", urls)
+    monkeypatch.setattr(Batch, "_remote_maps", {})
+    yield urls
+    for server in running:
+        server.shutdown()
+        server.server_close()
+
+
+def _batch(services, *requests):
+    response = services.drivers.post("/batch", json={"requests": list(requests)})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()["responses"]
+
+
+def test_sub_requests_run_in_order(services, servers, user_id):
+    driver_id = services.create_driver(user_id, status="Mild")
+
+    responses = _batch(services,
+                       {"method": "GET", "path": f"/drivers/{driver_id}?userId={user_id}"},
+                       {"method": "PUT", "path": f"/drivers/{driver_id}",
+                        "body": {"fieldToChange": "status", "newValue": "Severe", "userId": user_id}},
+                       {"method": "GET", "path": f"/drivers/{driver_id}?userId={user_id}"})
+
+    assert [response["status"] for response in responses] == [200, 200, 200]
+    assert responses[0]["body"]["driver"]["status"] == "Mild"
+    assert responses[2]["body"]["driver"]["status"] == "Severe"
+
+
+def test_other_services_routes_are_forwarded(services, servers, user_id):
+    driver_id = services.create_driver(user_id)
+
+    responses = _batch(services,
+                       {"method": "POST", "path": "/events", "body": {
+                           "driverId": driver_id, "status": "Mild", "timeStamp": "2024-01-15T10:30:00Z",
+                           "date": "2024-01-15", "videoLink": ""}},
+                       {"method": "GET", "path": f"/users/{user_id}"})
+
+    created, missing_user = responses
+    assert created["status"] == 201
+    assert "Date" not in created["headers"] and "Server" not in created["headers"]
+    assert services.db.get_document("events", created["body"]["event"]["eventId"])["driverId"] == driver_id
+    assert missing_user["status"] in (404, 500)
+    assert "error" in missing_user["body"]
+
+
+def test_unreachable_service_is_a_502(services, servers, monkeypatch):
+    monkeypatch.setitem(Batch.SERVICE_URLS, "users", UNREACHABLE)
+
+    unmatched, = _batch(services, {"method": "GET", "path": "/users/u1"})
+
+    assert unmatched["status"] == 502
+    assert "users service couldn't be reached" in unmatched["body"]["error"]
+
+
+def test_routes_of_unreachable_services_are_fetched_again(services, servers, monkeypatch):
+    users_url = servers["users"]
+    monkeypatch.setitem(Batch.SERVICE_URLS, "users", UNREACHABLE)
+    _batch(services, {"method": "GET", "path": "/users/u1"})
+    monkeypatch.setitem(Batch.SERVICE_URLS, "users", users_url)
+
+    found, = _batch(services, {"method": "GET", "path": "/users/u1"})
+
+    assert found["status"] != 502
+
+
+def test_unknown_routes_and_methods(services, servers, user_id):
+    unknown, wrong_method = _batch(services, {"method": "GET", "path": "/nowhere"},
+                                   {"method": "DELETE", "path": f"/fleet/{user_id}/summary"})
+
+    assert unknown["status"] == 404
+    assert wrong_method["status"] == 405
+
+
+@pytest.mark.parametrize("method, path", [
+    ("POST", "/batch"),
+    ("GET", "/batch/routes"),
+    ("GET", "/export/drivers?userId=u1"),
+    ("GET", "/export/events?userId=u1"),
+    ("GET", "/alerts/u1/stream"),
+])
+def test_excluded_routes_are_refused(services, servers, method, path):
+    refused, = _batch(services, {"method": method, "path": path})
+
+    assert refused["status"] == 400
+    assert "can't be part of a batch" in refused["body"]["error"]
+
+
+@pytest.mark.parametrize("body", [
+    {},
+    {"requests": []},
+    {"requests": [{"path": "drivers"}]},
+    {"requests": [{"path": "/drivers", "headers": []}]},
+    {"requests": [{"path": "/nowhere"}] * (Batch.MAX_SUB_REQUESTS + 1)},
+])
+def test_invalid_batches_are_refused(services, body):
+    assert services.drivers.post("/batch", json=body).status_code == 400
+
+
+def test_batch_routes_lists_the_services_routes(services):
+    listed = services.events.get("/batch/routes").get_json()
+
+    assert listed["service"] == "events"
+    assert {"rule": "/events", "methods": ["OPTIONS", "POST"]} in listed["routes"]
+
+
+def test_forwarded_writes_are_seen_by_later_reads(services, servers, user_id):
+    services.db.set_document("users", user_id, {"userId": user_id, "email": f"{user_id}@example.com"})
+    driver_id = services.create_driver(user_id)
+    read = {"method": "GET", "path": f"/drivers/{driver_id}?userId={user_id}"}
+
+    before, deleted, after = _batch(services, read, {"method": "DELETE", "path": f"/users/{user_id}"}, read)
+
+    assert (before["status"], deleted["status"]) == (200, 200)
+    # The cascade ran in the users service, so the driver the first read cached is gone
+    assert after["status"] != 200
+    assert "not found" in after["body"]["error"].lower()
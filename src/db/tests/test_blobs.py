@@ -0,0 +1,115 @@
+import base64
+import hashlib
+import os
+import pytest
+import Blobs
+from Blobs import BlobStore, is_data_url
+from Migrations import offload_profile_pictures
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32       # enough to be recognized; not decodable
+PNG_NAME = f"{hashlib.sha256(PNG).hexdigest()}.png"
+
+
+def _data_url(data: bytes, declared: str = "image/png") -> str:
+    return f"data:{declared};base64,{base64.b64encode(data).decode()}"
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = BlobStore(str(tmp_path))
+    monkeypatch.setattr(store, "_pillow", False)
+    return store
+
+
+def test_images_are_stored_once_under_their_hash(store):
+    assert store.put_image(PNG) == PNG_NAME
+    assert store.put_image(PNG) == PNG_NAME
+
+    path = store.path(PNG_NAME)
+    assert path.endswith(os.path.join(PNG_NAME[:2], PNG_NAME))
+    assert open(path, "rb").read() == PNG
+    assert os.listdir(os.path.dirname(path)) == [PNG_NAME]
+
+
+def test_only_images_within_the_size_limit_are_accepted(store, monkeypatch):
+    with pytest.raises(ValueError, match="PNG, JPEG, GIF or WebP"):
+        store.put_image(b"<svg></svg>")
+    monkeypatch.setattr(Blobs, "MAX_IMAGE_BYTES", 10)
+    with pytest.raises(ValueError, match="at most"):
+        store.put_image(PNG)
+
+
+def test_image_fields(store):
+    # The declared type of a data URL doesn't matter, the content does
+    fields = store.image_fields(_data_url(PNG, "image/jpeg"), "profilePic")
+
+    assert fields == {"profilePic": Blobs.BLOB_URL_PREFIX + PNG_NAME, "profilePicThumbnail": Blobs.BLOB_URL_PREFIX + PNG_NAME}
+    assert store.image_fields("https://example.com/a.png", "profilePic") == {
+        "profilePic": "https://example.com/a.png", "profilePicThumbnail": "https://example.com/a.png"}
+    with pytest.raises(ValueError, match="not valid base64"):
+        store.image_fields("data:image/png;base64,***", "profilePic")
+
+
+def test_is_data_url():
+    assert is_data_url("data:image/png;base64,AAAA")
+    assert not is_data_url("https://example.com/a.png")
+    assert not is_data_url(None)
+
+
+def test_unknown_blob_names_are_not_found(store):
+    assert store.open("../../etc/passwd") is None
+    assert store.open(f"{'0' * 64}.png") is None
+    assert store.open(f"{'0' * 64}-{Blobs.THUMBNAIL_SIZE}.png") is None
+
+
+def test_thumbnails_are_generated_in_the_background(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    from io import BytesIO
+    out = BytesIO()
+    Image.new("RGB", (512, 256), "red").save(out, "PNG")
+    store = BlobStore(str(tmp_path))
+
+    name = store.put_image(out.getvalue())
+    path = store.open(store.thumbnail_name(name))
+
+    with Image.open(path) as thumbnail:
+        assert thumbnail.size == (128, 64)
+
+
+def test_driver_pictures_are_served_from_the_blob_route(services, user_id):
+    driver_id = services.create_driver(user_id, profilePic=_data_url(PNG))
+    driver = services.db.get_document("drivers", driver_id)
+    name = driver["profilePic"].rsplit("/", 1)[1]
+
+    response = services.drivers.get(f"/blobs/{name}")
+
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+    assert response.get_data() == PNG
+    assert response.cache_control.immutable and response.cache_control.public
+    assert services.drivers.get(f"/blobs/{name}", headers={"If-None-Match": f'"{name}"'}).status_code == 304
+    assert services.drivers.get(f"/blobs/{'0' * 64}.png").status_code == 404
+
+
+def test_invalid_picture_is_refused(services, user_id):
+    response = services.drivers.post("/drivers", json={"userId": user_id, "name": "Ann", "phoneNumber": "555-0100",
+                                                       "profilePic": _data_url(b"not an image")})
+
+    assert response.status_code == 400
+    assert "PNG, JPEG, GIF or WebP" in response.get_json()["error"]
+
+
+def test_profile_picture_migration(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(Blobs, "blob_store", BlobStore(str(tmp_path)))
+    monkeypatch.setattr(Blobs.blob_store, "_pillow", False)
+    db.set_document("drivers", "inline", {"profilePic": _data_url(PNG)})
+    db.set_document("drivers", "url", {"profilePic": "https://example.com/a.png"})
+    db.set_document("drivers", "done", {"profilePic": "https://example.com/b.png", "profilePicThumbnail": "x"})
+    db.set_document("drivers", "broken", {"profilePic": _data_url(b"nope")})
+
+    assert offload_profile_pictures(db) == {"scanned": 4, "updated": 2, "invalid": 1}
+
+    assert db.get_document("drivers", "inline")["profilePic"].endswith(PNG_NAME)
+    assert db.get_document("drivers", "url")["profilePicThumbnail"] == "https://example.com/a.png"
+    assert db.get_document("drivers", "done")["profilePicThumbnail"] == "x"
+    assert offload_profile_pictures(db)["updated"] == 0
@@ -0,0 +1,100 @@
+import Cascade
+from Cascade import cascade_delete_driver, cascade_delete_user, driver_deletion_is_large, user_deletion_is_large
+
+
+def _seed(db, user_id="u1", driver_id="d1", events=3):
+    db.set_document("users", user_id, {"userId": user_id})
+    db.set_document("drivers", driver_id, {"userId": user_id, "events": [{"eventId": f"{driver_id}-unlinked"}]})
+    db.set_document("events", f"{driver_id}-unlinked", {"status": "Mild"})
+    for i in range(events):
+        db.set_document("events", f"{driver_id}-e{i}", {"driverId": driver_id, "userId": user_id})
+    db.set_document("event_archives", f"{driver_id}-a", {"driverId": driver_id, "userId": user_id})
+    db.set_document("event_rollups", f"{driver_id}-r", {"driverId": driver_id, "userId": user_id})
+    db.set_document("dashboards", user_id, {"userId": user_id, "drivers": {driver_id: {"name": "Ann"}}})
+
+
+def test_driver_cascade_deletes_its_events_archives_and_card(db):
+    _seed(db)
+    _seed(db, "u2", "d2")
+    driver_data = db.get_document("drivers", "d1")
+
+    deletion = cascade_delete_driver(db, "d1", driver_data)
+
+    assert deletion.to_map()["status"] == "completed"
+    assert deletion.deleted == 3 + 1 + 1 + 1 + 1
+    assert not db.get_document("drivers", "d1")
+    assert [doc_id for doc_id, _ in db.query_documents("events", [])] == ["d2-e0", "d2-e1", "d2-e2", "d2-unlinked"]
+    assert db.get_document("dashboards", "u1")["drivers"] == {}
+    assert db.get_document("event_archives", "d2-a")
+
+
+def test_cascade_pages_through_many_events(db, monkeypatch):
+    monkeypatch.setattr(Cascade, "BATCH_SIZE", 3)
+    monkeypatch.setattr(Cascade, "PARALLEL_BATCHES", 2)
+    _seed(db, events=20)
+
+    deletion = cascade_delete_driver(db, "d1", db.get_document("drivers", "d1"))
+
+    assert deletion.status == "completed"
+    assert db.query_documents("events", []) == []
+
+
+def test_failed_batches_leave_the_driver_for_a_retry(db, monkeypatch):
+    monkeypatch.setattr(Cascade, "MAX_ATTEMPTS", 1)
+    _seed(db)
+    batch_write = db.batch_write
+
+    def failing_batch_write(operations):
+        if any(collection == "events" for _, collection, _, _ in operations):
+            raise RuntimeError("unavailable")
+        batch_write(operations)
+
+    monkeypatch.setattr(db, "batch_write", failing_batch_write)
+    deletion = cascade_delete_driver(db, "d1", db.get_document("drivers", "d1"))
+
+    assert deletion.status == "failed"
+    assert deletion.failed == 4
+    assert db.get_document("drivers", "d1")
+
+    monkeypatch.setattr(db, "batch_write", batch_write)
+    assert cascade_delete_driver(db, "d1", db.get_document("drivers", "d1")).status == "completed"
+
+
+def test_user_cascade_deletes_everything_the_user_owns(db):
+    _seed(db, "u1", "d1")
+    db.set_document("drivers", "d3", {"userId": "u1", "events": []})
+    db.set_document("events", "orphan", {"userId": "u1", "driverId": "gone"})
+    _seed(db, "u2", "d2")
+
+    deletion = cascade_delete_user(db, "u1")
+
+    assert deletion.status == "completed"
+    assert not db.get_document("users", "u1")
+    assert not db.get_document("dashboards", "u1")
+    assert db.query_documents("drivers", [("userId", "==", "u1")]) == []
+    assert db.query_documents("events", [("userId", "==", "u1")]) == []
+    assert db.get_document("users", "u2") and db.get_document("drivers", "d2")
+
+
+def test_large_deletions_are_detected(db, monkeypatch):
+    monkeypatch.setattr(Cascade, "SYNC_LIMIT", 5)
+    _seed(db, events=3)
+    assert not driver_deletion_is_large(db, "d1")
+    assert not user_deletion_is_large(db, "u1")
+
+    for i in range(3, 6):
+        db.set_document("events", f"d1-e{i}", {"driverId": "d1", "userId": "u1"})
+    assert driver_deletion_is_large(db, "d1")
+    assert user_deletion_is_large(db, "u1")
+
+
+def test_delete_endpoint_cascades(services, user_id):
+    driver_id = services.create_driver(user_id)
+    event = services.create_event(driver_id)
+    services.drain_outbox()
+
+    response = services.drivers.delete(f"/drivers/{driver_id}", json={"userId": user_id})
+
+    assert response.status_code == 200, response.get_json()
+    assert not services.db.get_document("drivers", driver_id)
+    assert not services.db.get_document("events", event["eventId"])
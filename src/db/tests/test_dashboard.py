@@ -0,0 +1,74 @@
+from Dashboard import card_operations, driver_card, new_dashboard, read_dashboard
+from Migrations import build_dashboards
+
+
+def _create_user(services, user_id):
+    response = services.users.post("/users", json={"userId": user_id, "name": "Dana", "email": f"{user_id}@example.com",
+                                                   "phoneNumber": "555-0199", "password": "secret"})
+    assert response.status_code == 201, response.get_json()
+
+
+def _dashboard(services, user_id):
+    response = services.drivers.get(f"/drivers/user/{user_id}/dashboard")
+    assert response.status_code == 200
+    return {card["driverId"]: card for card in response.get_json()["drivers"]}
+
+
+def test_driver_writes_keep_the_dashboard_current(services, user_id):
+    _create_user(services, user_id)
+    driver_id = services.create_driver(user_id, status="Mild")
+    services.drivers.put(f"/drivers/{driver_id}", json={"fieldToChange": "status", "newValue": "Severe",
+                                                        "userId": user_id})
+    event = services.create_event(driver_id, status="Severe")
+
+    card = _dashboard(services, user_id)[driver_id]
+
+    assert card["name"] == "Ann Lee" and card["status"] == "Severe" and card["driving"] is True
+    assert card["lastEvent"]["eventId"] == event["eventId"]
+    assert "rebuiltAt" in services.db.get_document("dashboards", user_id)
+
+
+def test_deleted_driver_leaves_the_dashboard(services, user_id):
+    _create_user(services, user_id)
+    kept = services.create_driver(user_id, "Kept")
+    removed = services.create_driver(user_id, "Removed")
+
+    response = services.drivers.delete(f"/drivers/{removed}", json={"userId": user_id})
+
+    assert response.status_code in (200, 202)
+    assert list(_dashboard(services, user_id)) == [kept]
+
+
+def test_dashboard_of_a_user_predating_dashboards_is_not_written_on_get(db):
+    db.set_document("drivers", "d2", {"userId": "legacy", "name": "Zed"})
+    db.set_document("drivers", "d1", {"userId": "legacy", "name": "Amy", "events": [{"eventId": "e1", "status": "Mild"}]})
+    # A card written since dashboards exist, which says nothing of the other drivers
+    db.batch_write(card_operations("legacy", "d1", {"name": "Amy"}))
+
+    cards = read_dashboard(db, "legacy")
+
+    assert [card["driverId"] for card in cards] == ["d1", "d2"]
+    assert cards[0]["lastEvent"] == {"eventId": "e1", "status": "Mild", "timeStamp": None}
+    assert "rebuiltAt" not in db.get_document("dashboards", "legacy")
+    assert read_dashboard(db, "nobody") == []
+    assert db.get_document("dashboards", "nobody") == {}
+
+
+def test_dashboards_migration_builds_only_missing_dashboards(db):
+    db.set_document("drivers", "d1", {"userId": "legacy", "name": "Amy"})
+    db.set_document("drivers", "d2", {"userId": "current", "name": "Bob"})
+    built = new_dashboard("current")
+    db.set_document("dashboards", "current", built)
+
+    assert build_dashboards(db, dry_run=True) == {"users": 2, "built": 1}
+    assert db.get_document("dashboards", "legacy") == {}
+    build_dashboards(db)
+
+    assert list(db.get_document("dashboards", "legacy")["drivers"]) == ["d1"]
+    assert db.get_document("dashboards", "current")["drivers"] == {}
+    assert build_dashboards(db)["built"] == 0
+
+
+def test_cards_leave_out_inline_pictures():
+    assert "profilePicThumbnail" not in driver_card({"name": "Amy", "profilePic": "data:image/png;base64,AAAA"})
+    assert driver_card({"profilePic": "https://example.com/a.png"})["profilePicThumbnail"] == "https://example.com/a.png"
@@ -0,0 +1,86 @@
+from datetime import datetime, timezone
+import pytest
+from Event import event_occurred_at, parse_legacy_timestamp, parse_timestamp, time_fields
+from Migrations import backfill_event_time_fields
+
+
+def _utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("time_stamp, date, expected", [
+    ("2024-01-15T10:30:00Z", "2024-01-15", _utc(2024, 1, 15, 10, 30)),
+    ("2024-01-15T12:30:00+02:00", "", _utc(2024, 1, 15, 10, 30)),
+    ("10:30:00", "2024-01-15", _utc(2024, 1, 15, 10, 30)),
+    ("", "2024-01-15", _utc(2024, 1, 15)),
+    # What the dashboard sends: toLocaleTimeString() and toLocaleDateString('en-US', ...)
+    ("10:30 AM", "January 15, 2024", _utc(2024, 1, 15, 10, 30)),
+    ("2:05:09 PM", "Jan 15, 2024", _utc(2024, 1, 15, 14, 5, 9)),
+    ("10:30 pm", "1/15/2024", _utc(2024, 1, 15, 22, 30)),
+    ("", "January 15, 2024", _utc(2024, 1, 15)),
+    ("whenever", "January 15, 2024", _utc(2024, 1, 15)),
+    ("10:30 AM", "", None),
+    ("soon", "someday", None),
+])
+def test_event_occurred_at(time_stamp, date, expected):
+    assert event_occurred_at(time_stamp, date) == expected
+
+
+def test_parse_timestamp_rejects_en_us_strings():
+    with pytest.raises(ValueError):
+        parse_timestamp("January 15, 2024")
+
+
+def test_parse_legacy_timestamp_rejects_other_strings():
+    with pytest.raises(ValueError, match="Unrecognized date/time"):
+        parse_legacy_timestamp("15.01.2024", "10:30")
+
+
+def test_time_fields():
+    assert time_fields("11:59 PM", "December 31, 2023") == {"occurredAt": _utc(2023, 12, 31, 23, 59),
+                                                            "dateBucket": "2023-12-31"}
+    assert time_fields("", "") == {"occurredAt": None, "dateBucket": None}
+
+
+def test_event_posted_by_the_dashboard_is_stored_with_its_time(services, user_id):
+    driver_id = services.create_driver(user_id)
+
+    event = services.create_event(driver_id, "10:30 AM", "January 15, 2024")
+
+    stored = services.db.get_document("events", event["eventId"])
+    assert stored["timeStamp"] == "10:30 AM"
+    assert stored["occurredAt"] == _utc(2024, 1, 15, 10, 30)
+    assert stored["dateBucket"] == "2024-01-15"
+    in_window = services.events.get(f"/drivers/{driver_id}/events?from=2024-01-15&to=2024-01-16").get_json()
+    assert [found["eventId"] for found in in_window["events"]] == [event["eventId"]]
+
+
+def test_event_with_unparseable_time_is_rejected(services, user_id):
+    driver_id = services.create_driver(user_id)
+
+    response = services.events.post("/events", json={"driverId": driver_id, "status": "Mild", "timeStamp": "soon",
+                                                     "date": "someday", "videoLink": ""})
+
+    assert response.status_code == 400
+    assert "en-US (e.g. 10:30 AM and January 15, 2024)" in response.get_json()["error"]
+
+
+def test_window_query_rejects_non_iso_bounds(services, user_id):
+    driver_id = services.create_driver(user_id)
+
+    assert services.events.get(f"/drivers/{driver_id}/events?from=January 15, 2024").status_code == 400
+
+
+def test_event_time_backfill_converts_legacy_strings(db):
+    db.set_document("events", "legacy", {"timeStamp": "10:30 AM", "date": "January 15, 2024"})
+    db.set_document("events", "iso", {"timeStamp": "2024-01-16T08:00:00Z", "date": "2024-01-16",
+                                      "occurredAt": _utc(2024, 1, 16, 8), "dateBucket": "2024-01-16"})
+    db.set_document("events", "garbled", {"timeStamp": "soon", "date": "someday"})
+
+    assert backfill_event_time_fields(db, dry_run=True) == {"scanned": 3, "updated": 1, "unparseable": 1}
+    assert "occurredAt" not in db.get_document("events", "legacy")
+    backfill_event_time_fields(db)
+
+    assert db.get_document("events", "legacy")["occurredAt"] == _utc(2024, 1, 15, 10, 30)
+    assert db.get_document("events", "legacy")["dateBucket"] == "2024-01-15"
+    assert backfill_event_time_fields(db)["updated"] == 0
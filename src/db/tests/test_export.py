@@ -0,0 +1,86 @@
+import csv
+import io
+import json
+import pytest
+from Export import DRIVER_COLUMNS, encode_csv
+
+
+def _events(services, user_id):
+    driver_id = services.create_driver(user_id)
+    for day in ("2024-01-14", "2024-01-15", "2024-01-16"):
+        services.create_event(driver_id, f"{day}T10:30:00Z", day)
+    return driver_id
+
+
+def test_events_export_as_ndjson_within_an_inclusive_date_range(services, user_id):
+    driver_id = _events(services, user_id)
+
+    response = services.events.get(f"/export/events?driverId={driver_id}&from=2024-01-15&to=2024-01-16")
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert response.headers["Content-Disposition"] == f'attachment; filename="events-{driver_id}.ndjson"'
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [row["date"] for row in rows] == ["2024-01-15", "2024-01-16"]
+    assert all(row["driverId"] == driver_id for row in rows)
+
+
+def test_events_export_as_csv(services, user_id):
+    _events(services, user_id)
+
+    response = services.events.get(f"/export/events?userId={user_id}&format=csv")
+
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert response.mimetype == "text/csv"
+    assert sorted(row["date"] for row in rows) == ["2024-01-14", "2024-01-15", "2024-01-16"]
+    assert rows[0]["occurredAt"].startswith("2024-01-1")
+
+
+def test_drivers_export_as_parquet(services, user_id):
+    pq = pytest.importorskip("pyarrow.parquet")
+    services.create_driver(user_id, "Ann Lee", emergency_contacts=[{"name": "Bo", "phone_number": "555-0101"}])
+    services.create_driver("someone-else", "Other")
+
+    response = services.drivers.get(f"/export/drivers?userId={user_id}&format=parquet")
+
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.get_data()))
+    assert table.column_names == [name for name, _ in DRIVER_COLUMNS]
+    assert table.column("name").to_pylist() == ["Ann Lee"]
+
+
+@pytest.mark.parametrize("query, error", [
+    ("", "driverId or userId is required"),
+    ("userId=u&format=xml", "Invalid format"),
+    ("userId=u&from=last-week", "from and to must be ISO-8601"),
+])
+def test_events_export_rejects_bad_requests(services, query, error):
+    response = services.events.get(f"/export/events?{query}")
+
+    assert response.status_code == 400
+    assert response.get_json()["error"].startswith(error)
+
+
+def test_drivers_export_requires_a_user(services):
+    assert services.drivers.get("/export/drivers").status_code == 400
+
+
+def test_failing_query_is_an_error_not_a_truncated_file(services, user_id, monkeypatch):
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("storage unavailable")
+        yield
+
+    monkeypatch.setattr(services.db, "iter_documents", unavailable)
+
+    response = services.drivers.get(f"/export/drivers?userId={user_id}")
+
+    assert response.status_code == 500
+    assert response.get_json()["error"] == "storage unavailable"
+
+
+def test_csv_flattens_nested_values():
+    rows = [{"driverId": "d1", "emergency_contacts": [{"name": "Bo"}]}]
+
+    lines = b"".join(encode_csv(rows, DRIVER_COLUMNS)).decode().splitlines()
+
+    assert lines[1].startswith('d1,') and '"[{""name"": ""Bo""}]"' in lines[1]
@@ -0,0 +1,40 @@
+def test_empty_fleet(services, user_id):
+    response = services.drivers.get(f"/fleet/{user_id}/summary")
+
+    assert response.status_code == 200
+    summary = response.get_json()["summary"]
+    assert summary["total"] == 0
+    assert set(summary["statusCounts"].values()) == {0}
+    assert summary["vitals"]["heartRate"] == {"max": None, "min": None}
+
+
+def test_summary_counts_statuses_and_finds_vitals_extremes(services, user_id):
+    slow = services.create_driver(user_id, "Slow", status="Mild", heartRate=70, vehicleSpeed=30)
+    fast = services.create_driver(user_id, "Fast", status="Critical", heartRate=120, vehicleSpeed=90)
+    services.create_driver(user_id, "Parked", status="Idle", heartRate=200, vehicleSpeed=0)
+    services.create_driver("someone-else", "Other", status="Mild", heartRate=300)
+
+    summary = services.drivers.get(f"/fleet/{user_id}/summary").get_json()["summary"]
+
+    assert summary["total"] == 3
+    assert summary["driving"] == 2
+    assert summary["notDriving"] == 1
+    assert summary["statusCounts"]["Mild"] == 1
+    assert summary["statusCounts"]["Critical"] == 1
+    assert summary["statusCounts"]["Idle"] == 1
+    # The idle driver's readings are stale and don't count
+    assert summary["vitals"]["heartRate"]["max"] == {"driverId": fast, "name": "Fast", "value": 120}
+    assert summary["vitals"]["heartRate"]["min"] == {"driverId": slow, "name": "Slow", "value": 70}
+    assert summary["vitals"]["vehicleSpeed"]["min"]["driverId"] == slow
+
+
+def test_summary_storage_failure_is_a_500(services, user_id, monkeypatch):
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("storage unavailable")
+
+    monkeypatch.setattr(services.db, "count_documents", unavailable)
+
+    response = services.drivers.get(f"/fleet/{user_id}/summary")
+
+    assert response.status_code == 500
+    assert response.get_json()["error"].startswith("Failed to summarize fleet")
@@ -0,0 +1,112 @@
+import hashlib
+import sqlite3
+import pytest
+from flask import Flask
+import Idempotency
+from Idempotency import (COMPLETED, PENDING, LocalIdempotencyStore, SharedIdempotencyStore,
+                         register_idempotency)
+
+
+@pytest.fixture(params=["local", "shared"])
+def store(request, tmp_path):
+    if request.param == "local":
+        return LocalIdempotencyStore()
+    return SharedIdempotencyStore(str(tmp_path / "keys.sqlite3"))
+
+
+def test_store_claims_completes_and_releases(store):
+    assert store.claim("k", "fp") is None
+    assert store.claim("k", "fp").state == PENDING
+
+    store.complete("k", "fp", 201, b'{"ok": true}', "application/json")
+    stored = store.claim("k", "fp")
+    assert (stored.state, stored.status, stored.body) == (COMPLETED, 201, b'{"ok": true}')
+
+    store.release("k")                  # completed responses are kept
+    assert store.claim("k", "fp").state == COMPLETED
+    assert store.claim("other", "fp") is None
+    store.release("other")
+    assert store.claim("other", "fp") is None
+
+
+def test_expired_claims_can_be_taken_again(store, monkeypatch):
+    monkeypatch.setattr(Idempotency, "PENDING_TTL", -1)
+    store.claim("k", "fp")
+
+    assert store.claim("k", "fp") is None
+
+
+def test_shared_store_prunes_down_to_its_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(Idempotency, "PRUNE_EVERY", 3)
+    store = SharedIdempotencyStore(str(tmp_path / "keys.sqlite3"), max_keys=2)
+    for key in ("a", "b", "c"):
+        store.claim(key, "fp")
+
+    assert store.claim("a", "fp") is None       # the soonest to expire was pruned
+    assert store.claim("c", "fp").state == PENDING
+
+
+def test_shared_store_reports_a_locked_database_without_rolling_back(tmp_path, monkeypatch):
+    path = str(tmp_path / "keys.sqlite3")
+    store = SharedIdempotencyStore(path)
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE")
+    monkeypatch.setattr(store, "_connect", lambda: sqlite3.connect(path, timeout=0.05, isolation_level=None))
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            store.claim("k", "fp")
+    finally:
+        holder.execute("ROLLBACK")
+        holder.close()
+
+
+def _post_driver(services, user_id, key, name="Ann Lee"):
+    body = {"userId": user_id, "name": name, "phoneNumber": "555-0100"}
+    # The services' stores outlive a test, so keys are made unique per test
+    return services.drivers.post("/drivers", json=body, headers={"Idempotency-Key": f"{user_id}-{key}"})
+
+
+def test_retried_creation_is_replayed(services, user_id):
+    first = _post_driver(services, user_id, "key-1")
+    retry = _post_driver(services, user_id, "key-1")
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.get_json() == first.get_json()
+    assert len(services.db.query_documents("drivers", [("userId", "==", user_id)])) == 1
+    assert _post_driver(services, user_id, "key-2").status_code == 201
+
+
+def test_key_reused_for_a_different_request_is_refused(services, user_id):
+    _post_driver(services, user_id, "key-1")
+
+    assert _post_driver(services, user_id, "key-1", name="Bob Roe").status_code == 422
+
+
+def test_failed_request_can_be_retried_with_its_key(services, user_id):
+    key = {"Idempotency-Key": f"{user_id}-key-1"}
+    failed = services.drivers.post("/drivers", json={"userId": user_id, "name": "Ann"}, headers=key)
+    assert failed.status_code == 400
+
+    fixed = services.drivers.post("/drivers", json={"userId": user_id, "name": "Ann", "phoneNumber": "555-0100"},
+                                  headers=key)
+    assert fixed.status_code == 201
+    assert "Idempotent-Replayed" not in fixed.headers
+
+
+def test_retry_during_the_original_gets_409():
+    store = LocalIdempotencyStore()
+    app = Flask("idempotent")
+    app.add_url_rule("/events", "events", lambda: ("created", 201), methods=["POST"])
+    register_idempotency(app, "test", store)
+    # What the original request's claim looks like while it runs
+    store.claim("test|POST /events|key-1", hashlib.sha256(b"POST /events\n").hexdigest())
+
+    response = app.test_client().post("/events", headers={"Idempotency-Key": "key-1"})
+
+    assert response.status_code == 409
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_overlong_keys_are_refused(services, user_id):
+    assert _post_driver(services, user_id, "k" * 256).status_code == 400
@@ -0,0 +1,70 @@
+from datetime import datetime, timezone
+from Ids import ALIAS_COLLECTION, IdAliases, id_sort_key, id_time, is_generated_id, new_id
+
+
+def test_generated_ids_carry_their_creation_time():
+    doc_id = new_id(now=1705314600.123)
+
+    assert is_generated_id(doc_id)
+    assert len(doc_id) == 28
+    assert id_time(doc_id) == datetime(2024, 1, 15, 10, 30, 0, 123000, tzinfo=timezone.utc)
+    assert new_id(now=1705314600.123) != doc_id       # the random part differs
+
+
+def test_client_ids_are_not_generated_ids():
+    assert not is_generated_id("driver_jane_doe_1700000000000")
+    assert not is_generated_id("")
+    assert id_time("driver_jane") is None
+
+
+def test_ids_sort_by_creation_time():
+    later, earlier = new_id(now=2000), new_id(now=1000)
+
+    assert sorted(["legacy", later, earlier], key=id_sort_key) == ["legacy", earlier, later]
+
+
+def test_assign_records_an_alias_for_client_ids(db):
+    aliases = IdAliases(db, "drivers")
+
+    doc_id, operations = aliases.assign("driver_jane_1")
+    assert is_generated_id(doc_id)
+    assert [(action, collection) for action, collection, _, _ in operations] == [("set", ALIAS_COLLECTION)]
+    db.batch_write(operations)
+
+    assert aliases.assign("driver_jane_1") == (doc_id, [])
+    assert aliases.resolve("driver_jane_1") == doc_id
+    assert aliases.resolve(doc_id) == doc_id
+
+
+def test_assign_without_a_client_id_or_with_a_generated_one(db):
+    aliases = IdAliases(db, "drivers")
+    generated = new_id()
+
+    assert aliases.assign(generated) == (generated, [])
+    doc_id, operations = aliases.assign(None)
+    assert is_generated_id(doc_id) and operations == []
+
+
+def test_aliases_are_per_collection(db):
+    drivers, events = IdAliases(db, "drivers"), IdAliases(db, "events")
+    doc_id, operations = drivers.assign("shared_name")
+    db.batch_write(operations)
+
+    assert events.resolve("shared_name") == "shared_name"
+    assert drivers.resolve("shared_name") == doc_id
+
+
+def test_client_minted_driver_id_keeps_working(services, user_id):
+    client_id = f"driver_{user_id}_1700000000000"
+
+    driver_id = services.create_driver(user_id, driverId=client_id)
+    retried = services.create_driver(user_id, driverId=client_id)
+
+    assert is_generated_id(driver_id)
+    assert retried == driver_id
+    response = services.drivers.get(f"/drivers/{client_id}?userId={user_id}")
+    assert response.status_code == 200
+    assert response.get_json()["driver"]["name"] == "Ann Lee"
+    assert services.db.get_document("drivers", client_id) == {}
+    event = services.create_event(client_id)
+    assert event["driverId"] == driver_id
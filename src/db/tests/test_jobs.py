@@ -0,0 +1,181 @@
+import json
+import threading
+import time
+import pytest
+from Jobs import CANCELLED, FAILED, QUEUED, RUNNING, SUCCEEDED, JobRunner, RetryPolicy
+
+DEAD_PID = 2 ** 22 + 1     # above Linux's pid_max, so never a running process
+
+
+def _wait(runner, job_id, statuses=(SUCCEEDED, FAILED, CANCELLED), timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = runner.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job stayed {runner.get(job_id)['status']}")
+
+
+def _insert(runner, job_type, status, owner_pid, attempts=0, max_attempts=1, params=None):
+    now = time.time()
+    conn = runner._connect()
+    try:
+        conn.execute("INSERT INTO jobs (id, type, params, status, attempts, max_attempts, owner_pid, created_at, updated_at) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (f"job-{now}", job_type, json.dumps(params or {}), status, attempts, max_attempts, owner_pid, now, now))
+        conn.commit()
+    finally:
+        conn.close()
+    return f"job-{now}"
+
+
+@pytest.fixture
+def runner(tmp_path):
+    return JobRunner(str(tmp_path / "jobs.sqlite3"))
+
+
+def test_job_runs_and_reports_progress(runner):
+    def handler(job, count):
+        job.report(done=count)
+        return {"count": count}
+
+    runner.register("count", handler)
+    job = _wait(runner, runner.submit("count", {"count": 3})["jobId"])
+
+    assert job["status"] == SUCCEEDED
+    assert job["progress"] == {"done": 3}
+    assert job["result"] == {"count": 3}
+
+
+def test_failed_job_is_retried(runner):
+    attempts = []
+
+    def flaky(job):
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise RuntimeError("transient")
+        return "ok"
+
+    runner.register("flaky", flaky, retry=RetryPolicy(max_attempts=2, backoff_seconds=0.01))
+    job = _wait(runner, runner.submit("flaky")["jobId"])
+
+    assert job["status"] == SUCCEEDED
+    assert job["attempts"] == 2
+
+
+def test_job_fails_once_out_of_attempts(runner):
+    def broken(job):
+        raise RuntimeError("broken")
+
+    runner.register("broken", broken)
+    job = _wait(runner, runner.submit("broken")["jobId"])
+
+    assert job["status"] == FAILED
+    assert job["error"] == "broken"
+
+
+def test_running_job_stops_when_cancelled(runner):
+    started = threading.Event()
+
+    def long_job(job):
+        started.set()
+        while True:
+            job.check_cancelled()
+            time.sleep(0.01)
+
+    runner.register("long", long_job)
+    job_id = runner.submit("long")["jobId"]
+    assert started.wait(5)
+    runner.cancel(job_id)
+
+    assert _wait(runner, job_id)["status"] == CANCELLED
+
+
+def test_job_dispatched_twice_runs_once(runner):
+    runs = []
+    runner.register("slow", lambda job: runs.append(1) or time.sleep(0.2))
+    job_id = _insert(runner, "slow", QUEUED, DEAD_PID)
+
+    threads = [threading.Thread(target=runner._execute, args=(job_id,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert runs == [1]
+    assert runner.get(job_id)["status"] == SUCCEEDED
+
+
+def test_recover_leaves_jobs_this_runner_is_running_alone(runner):
+    release = threading.Event()
+    runs = []
+    runner.register("blocking", lambda job: runs.append(1) or release.wait(5))
+    job_id = runner.submit("blocking")["jobId"]
+    _wait(runner, job_id, statuses=(RUNNING,))
+
+    runner.recover()
+    release.set()
+
+    assert _wait(runner, job_id)["status"] == SUCCEEDED
+    assert runs == [1]
+
+
+def test_jobs_of_dead_processes_are_recovered_once(tmp_path):
+    runs = []
+    runners = [JobRunner(str(tmp_path / "jobs.sqlite3")) for _ in range(2)]
+    for runner in runners:
+        runner.register("work", lambda job: runs.append(1) or time.sleep(0.1))
+    job_id = _insert(runners[0], "work", RUNNING, DEAD_PID, attempts=1, max_attempts=2)
+
+    for runner in runners:
+        runner.recover()
+
+    assert _wait(runners[0], job_id)["status"] == SUCCEEDED
+    time.sleep(0.2)
+    assert runs == [1]
+
+
+def test_interrupted_job_out_of_attempts_fails_on_recovery(runner):
+    runner.register("work", lambda job: None)
+    job_id = _insert(runner, "work", RUNNING, DEAD_PID, attempts=1, max_attempts=1)
+
+    runner.recover()
+
+    job = runner.get(job_id)
+    assert job["status"] == FAILED
+    assert job["error"] == "Interrupted by a restart"
+
+
+def test_job_routes(services):
+    response = services.drivers.post("/jobs", json={"type": "no-such-type"})
+    assert response.status_code == 400
+    # Internal job types can't be enqueued by clients
+    assert services.drivers.post("/jobs", json={"type": "delete_driver", "params": {"driverId": "d1"}}).status_code == 400
+    assert services.drivers.get("/jobs/missing").status_code == 404
+
+
+def test_public_job_is_enqueued_and_polled_to_completion(services, user_id):
+    services.create_driver(user_id)
+    services.create_driver(user_id, name="Bo Chen")
+    services.db.delete_document("dashboards", user_id)
+
+    response = services.drivers.post("/jobs", json={"type": "rebuild_dashboard", "params": {"userId": user_id}})
+    assert response.status_code == 202
+    job_id = response.get_json()["job"]["jobId"]
+
+    deadline = time.monotonic() + 5
+    while (job := services.drivers.get(f"/jobs/{job_id}").get_json()["job"])["status"] not in (SUCCEEDED, FAILED):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert job["status"] == SUCCEEDED
+    assert job["result"] == {"drivers": 2}
+    assert "rebuiltAt" in services.db.get_document("dashboards", user_id)
+
+
+@pytest.mark.parametrize("params", [{}, {"userId": ""}, {"userId": "u1", "extra": 1}, ["u1"]])
+def test_public_job_params_are_checked_before_queueing(services, params):
+    response = services.drivers.post("/jobs", json={"type": "rebuild_dashboard", "params": params})
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
@@ -0,0 +1,57 @@
+import random
+from Loadgen import (EVENT_ROUTE, TRANSITIONS, VITALS_ROUTE, HttpTransport, InProcessTransport, RouteStats,
+                     SimulatedDriver, run)
+
+
+def test_route_stats_summary():
+    stats = RouteStats()
+    for status, seconds in ((200, 0.01), (200, 0.02), (429, 0.03), (500, 0.04), (None, 0.05)):
+        stats.record(status, seconds)
+
+    summary = stats.summary(elapsed=2.0)
+
+    assert summary["requests"] == 5
+    assert summary["throughput"] == 2.5
+    assert summary["errorRate"] == 0.4          # the 500 and the request without a response
+    assert summary["throttledRate"] == 0.2
+    assert summary["statuses"] == {"200": 2, "429": 1, "500": 1}
+    assert summary["latencyMs"]["p50"] == 30.0
+    assert summary["latencyMs"]["max"] == 50.0
+
+
+def test_empty_route_stats():
+    assert RouteStats().summary(elapsed=0)["latencyMs"]["p99"] == 0.0
+
+
+def test_simulated_driver_follows_the_status_transitions():
+    driver = SimulatedDriver("driver", "user", random.Random(3))
+    previous = driver.status
+    for _ in range(200):
+        field, value = driver.next_update(status_change_prob=0.5)
+        if field == "status":
+            assert value in TRANSITIONS[previous]
+            previous = value
+        else:
+            assert value >= 0
+
+    event = driver.next_event()
+    assert event["status"] == driver.status and event["userId"] == "user"
+
+
+def test_in_process_run(services):
+    report = run(InProcessTransport(), drivers=4, vitals_rate=20.0, event_rate=5.0, duration=0.5, concurrency=2,
+                 drivers_per_user=2, seed=7)
+
+    result = report.to_map()
+    assert result["drivers"] == 4
+    assert result["offeredRate"] == 100.0
+    vitals, events = result["routes"][VITALS_ROUTE], result["routes"][EVENT_ROUTE]
+    assert vitals["requests"] > 0 and events["requests"] > 0
+    assert vitals["errorRate"] == 0.0 and events["errorRate"] == 0.0
+    assert len(services.db.query_documents("drivers", [])) == 4
+
+
+def test_http_transport_reports_unreachable_services_as_failures():
+    transport = HttpTransport("http://127.0.0.1:9", "http://127.0.0.1:9")
+
+    assert transport.request("drivers", "PUT", "/drivers/x", {}) is None
@@ -0,0 +1,59 @@
+from Metrics import Counter, Histogram, Registry, http_errors, http_requests, ratio_collector, storage_operations
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.5, "/a")
+    histogram.observe(5.0, "/a")
+
+    lines = histogram.render()
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{route="/a"} 3' in lines
+    assert 'latency_seconds_sum{route="/a"} 5.55' in lines
+
+
+def test_counter_escapes_label_values():
+    counter = Counter("things_total", "Things.", ("name",))
+    counter.inc('say "hi"\n')
+    assert 'things_total{name="say \\"hi\\"\\n"} 1' in counter.render()
+
+
+def test_ratio_collector_reports_hit_share_per_cache():
+    registry = Registry()
+    lookups = registry.counter("lookups_total", "Lookups.", ("cache", "result"))
+    registry.add_collector(ratio_collector("hit_ratio", "Hits.", lookups, "hit"))
+    lookups.inc("a", "hit", amount=3)
+    lookups.inc("a", "miss")
+
+    assert 'hit_ratio{cache="a"} 0.75' in registry.render()
+
+
+def test_requests_are_counted_by_route_template(services, user_id):
+    before = http_requests.get("drivers", "/drivers/user/<user_id>", "GET", "200")
+    services.drivers.get(f"/drivers/user/{user_id}")
+    assert http_requests.get("drivers", "/drivers/user/<user_id>", "GET", "200") == before + 1
+
+
+def test_errors_are_counted(services):
+    before = http_errors.get("drivers", "unmatched", "GET", "404")
+    services.drivers.get("/no/such/route")
+    assert http_errors.get("drivers", "unmatched", "GET", "404") == before + 1
+
+
+def test_storage_operations_are_counted(db):
+    before = storage_operations.get("things", "write", "ok")
+    db.set_document("things", "t1", {"a": 1})
+    assert storage_operations.get("things", "write", "ok") == before + 1
+
+
+def test_metrics_endpoint_is_not_instrumented(services):
+    before = http_requests.get("drivers", "/metrics", "GET", "200")
+    response = services.drivers.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert "drivesense_http_requests_total" in response.get_data(as_text=True)
+    assert http_requests.get("drivers", "/metrics", "GET", "200") == before
@@ -0,0 +1,173 @@
+import time
+import Outbox
+from Outbox import (DEAD_LETTER_COLLECTION, MAX_ATTEMPTS, OUTBOX_COLLECTION, OutboxWorker, apply_record,
+                    outbox_operations, reconcile_driver, remove_record, requeue_dead_letters, update_record,
+                    upsert_record)
+
+
+def _event(event_id, **fields):
+    return dict({"eventId": event_id, "status": "Mild", "driverId": "d1", "userId": "u1"}, **fields)
+
+
+def test_records_are_idempotent():
+    events = apply_record([], upsert_record("d1", _event("e1")))
+    events = apply_record(events, upsert_record("d1", _event("e1")))
+    assert events == [{"eventId": "e1", "status": "Mild"}]
+
+    events = apply_record(events, update_record("d1", "e1", "status", "Severe"))
+    events = apply_record(events, update_record("d1", "e2", "status", "Severe"))
+    assert events == [{"eventId": "e1", "status": "Severe"}]
+
+    events = apply_record(events, remove_record("d1", "e1"))
+    assert apply_record(events, remove_record("d1", "e1")) == []
+
+
+def _queue(db, *records):
+    db.batch_write(outbox_operations(list(records)))
+
+
+def test_worker_applies_records_and_deletes_them(db):
+    db.set_document("drivers", "d1", {"userId": "u1", "events": [], "name": "Ann"})
+    _queue(db, upsert_record("d1", _event("e1")), update_record("d1", "e1", "status", "Severe"))
+
+    assert OutboxWorker(db).process_pending() == 2
+
+    assert db.get_document("drivers", "d1")["events"] == [{"eventId": "e1", "status": "Severe"}]
+    assert db.get_document("drivers", "d1")["name"] == "Ann"
+    assert db.query_documents(OUTBOX_COLLECTION, []) == []
+
+
+def test_records_leased_by_another_worker_are_left_alone(db, monkeypatch):
+    db.set_document("drivers", "d1", {"userId": "u1", "events": []})
+    _queue(db, upsert_record("d1", _event("e1")))
+    (record_id, _), = db.query_documents(OUTBOX_COLLECTION, [])
+    db.update_document(OUTBOX_COLLECTION, record_id, {"leaseOwner": "other", "leaseUntil": time.time() + 60})
+
+    OutboxWorker(db).process_pending()
+    assert db.get_document("drivers", "d1")["events"] == []
+
+    # Once the lease runs out, another worker takes the records over
+    monkeypatch.setattr(Outbox.time, "time", lambda: 10 ** 12)
+    OutboxWorker(db).process_pending()
+    assert db.get_document("drivers", "d1")["events"] == [{"eventId": "e1", "status": "Mild"}]
+
+
+def test_records_held_elsewhere_are_not_counted_and_do_not_block_others(db):
+    db.set_document("drivers", "d1", {"userId": "u1", "events": []})
+    db.set_document("drivers", "d2", {"userId": "u1", "events": []})
+    _queue(db, upsert_record("d1", _event("e1")), upsert_record("d1", _event("e2")))
+    _queue(db, upsert_record("d2", _event("e3", driverId="d2")))
+    first, _, _ = [record_id for record_id, _ in db.query_documents(OUTBOX_COLLECTION, [], order_by="createdAt")]
+    db.update_document(OUTBOX_COLLECTION, first, {"leaseOwner": "other", "leaseUntil": time.time() + 60})
+
+    # Only d2's record is applied: d1's second record waits behind the one held elsewhere
+    assert OutboxWorker(db, batch_size=1).process_pending() == 1
+    assert OutboxWorker(db).process_pending() == 0
+    assert db.get_document("drivers", "d1")["events"] == []
+    assert [e["eventId"] for e in db.get_document("drivers", "d2")["events"]] == ["e3"]
+
+
+def test_records_that_keep_failing_back_off_then_are_dead_lettered(db, monkeypatch):
+    db.set_document("drivers", "d1", {"userId": "u1", "events": [{"eventId": "e1"}]})
+    _queue(db, {"kind": "event_update", "driverId": "d1", "eventId": "e1"})      # no field or value: can't be applied
+    worker = OutboxWorker(db)
+    clock = [time.time()]
+    monkeypatch.setattr(Outbox.time, "time", lambda: clock[0])
+
+    assert worker.process_pending() == 0
+    (record_id, record), = db.query_documents(OUTBOX_COLLECTION, [])
+    assert record["attempts"] == 1 and record["retryAt"] > clock[0]
+    assert worker.process_pending() == 0                    # backing off, so not even tried
+    assert db.query_documents(OUTBOX_COLLECTION, [])[0][1]["attempts"] == 1
+
+    for _ in range(MAX_ATTEMPTS - 1):
+        clock[0] += Outbox.MAX_RETRY_DELAY
+        worker.process_pending()
+    assert db.query_documents(OUTBOX_COLLECTION, []) == []
+    dead = db.get_document(DEAD_LETTER_COLLECTION, record_id)
+    assert dead["attempts"] == MAX_ATTEMPTS and dead["lastError"] == "'value'"
+
+    assert requeue_dead_letters(db) == 1
+    (_, requeued), = db.query_documents(OUTBOX_COLLECTION, [])
+    assert "attempts" not in requeued and requeued["eventId"] == "e1"
+    assert db.query_documents(DEAD_LETTER_COLLECTION, []) == []
+
+
+def test_records_applied_meanwhile_are_not_applied_twice(db):
+    db.set_document("drivers", "d1", {"userId": "u1", "events": []})
+    _queue(db, upsert_record("d1", _event("e1")))
+    first, second = OutboxWorker(db), OutboxWorker(db)
+    pending = db.query_documents(OUTBOX_COLLECTION, [])
+    claimed = first._claim([record_id for record_id, _ in pending])
+    assert second._claim([record_id for record_id, _ in pending]) == set()
+
+    # A write made to the driver after the records were read survives their application
+    db.update_document("drivers", "d1", {"name": "Ann"})
+    first._apply_driver("d1", [(record_id, record) for record_id, record in pending if record_id in claimed])
+    second._apply_driver("d1", pending)
+
+    driver = db.get_document("drivers", "d1")
+    assert driver["events"] == [{"eventId": "e1", "status": "Mild"}]
+    assert driver["name"] == "Ann"
+
+
+def test_events_of_a_deleted_driver_are_deleted(db):
+    db.set_document("events", "e1", _event("e1"))
+    _queue(db, upsert_record("d1", _event("e1")))
+
+    OutboxWorker(db).process_pending()
+
+    assert not db.get_document("events", "e1")
+    assert db.query_documents(OUTBOX_COLLECTION, []) == []
+
+
+def test_reconcile_repairs_drift_from_the_events_collection(db):
+    db.set_document("drivers", "d1", {"userId": "u1", "events": [{"eventId": "gone"}, {"eventId": "e1", "status": "Old"}]})
+    db.set_document("events", "e1", _event("e1"))
+    db.set_document("events", "e2", _event("e2"))
+
+    assert reconcile_driver(db, "d1") is True
+    assert db.get_document("drivers", "d1")["events"] == [{"eventId": "e1", "status": "Mild"}, {"eventId": "e2", "status": "Mild"}]
+    assert reconcile_driver(db, "d1") is False
+
+
+def test_reconcile_skips_drivers_with_pending_records(db):
+    db.set_document("drivers", "d1", {"userId": "u1", "events": []})
+    db.set_document("events", "e1", _event("e1"))
+    _queue(db, upsert_record("d1", _event("e1")))
+    assert reconcile_driver(db, "d1") is False
+
+
+def test_new_event_reaches_the_driver_through_the_outbox(services, user_id):
+    driver_id = services.create_driver(user_id)
+    event = services.create_event(driver_id)
+
+    services.drain_outbox()
+
+    driver = services.db.get_document("drivers", driver_id)
+    assert [e["eventId"] for e in driver["events"]] == [event["eventId"]]
+    assert services.db.get_document("events", event["eventId"])["driverId"] == driver_id
+
+
+def test_drivers_service_event_and_contact_writes_keep_other_fields(services, user_id):
+    driver_id = services.create_driver(user_id)
+    response = services.drivers.post(f"/drivers/{driver_id}/events", json={
+        "userId": user_id, "status": "Mild", "timeStamp": "2024-01-15T10:30:00Z", "date": "2024-01-15", "videoLink": ""})
+    assert response.status_code == 201
+    response = services.drivers.post(f"/drivers/{driver_id}/emergency-contacts", json={
+        "userId": user_id, "name": "Bob", "phoneNumber": "555-0101"})
+    assert response.status_code == 201
+
+    driver = services.db.get_document("drivers", driver_id)
+    assert len(driver["events"]) == 1
+    assert driver["emergency_contacts"] == [{"name": "Bob", "phone_number": "555-0101"}]
+    assert driver["name"] == "Ann Lee"
+
+
+def test_drivers_service_rejects_events_for_someone_elses_driver(services, user_id):
+    driver_id = services.create_driver(user_id)
+    response = services.drivers.post(f"/drivers/{driver_id}/events", json={
+        "userId": "someone-else", "status": "Mild", "timeStamp": "2024-01-15T10:30:00Z", "date": "2024-01-15", "videoLink": ""})
+    assert response.status_code == 500
+    assert "Unauthorized" in response.get_json()["error"]
+    assert services.db.get_document("drivers", driver_id)["events"] == []
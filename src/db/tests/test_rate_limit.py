@@ -0,0 +1,124 @@
+import sqlite3
+import pytest
+from flask import Flask, jsonify
+import RateLimit
+from RateLimit import (ConcurrencyLimiter, LocalBucketStore, ServiceLimiters, SharedBucketStore, StorageOverloaded,
+                       register_rate_limiting)
+
+
+def _app(db, name="limited", **kwargs):
+    app = Flask(name)
+
+    @app.route("/items/<user_id>")
+    def items(user_id):
+        return jsonify({"userId": user_id})
+
+    @app.route("/metrics")
+    def metrics():
+        return "ok"
+
+    register_rate_limiting(app, db, name, store=LocalBucketStore(), **kwargs)
+    return app.test_client()
+
+
+@pytest.mark.parametrize("make_store", [LocalBucketStore, lambda: None], ids=["local", "shared"])
+def test_bucket_empties_and_refills(make_store, tmp_path):
+    store = make_store() or SharedBucketStore(str(tmp_path / "buckets.sqlite3"))
+
+    assert store.take("k", rate=1.0, burst=2) == (True, 0.0)
+    assert store.take("k", rate=1.0, burst=2) == (True, 0.0)
+    allowed, retry_after = store.take("k", rate=1.0, burst=2)
+
+    assert not allowed
+    assert 0 < retry_after <= 1.0
+    assert store.take("other", rate=1.0, burst=2)[0]
+
+
+def test_local_store_evicts_least_recently_used_bucket():
+    store = LocalBucketStore(max_keys=2)
+    store.take("a", rate=0.001, burst=1)
+    store.take("b", rate=0.001, burst=1)
+    store.take("c", rate=0.001, burst=1)
+
+    assert store.take("a", rate=0.001, burst=1)[0]
+    assert not store.take("c", rate=0.001, burst=1)[0]
+
+
+def test_shared_store_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "buckets.sqlite3")
+    SharedBucketStore(path).take("k", rate=0.001, burst=1)
+
+    assert not SharedBucketStore(path).take("k", rate=0.001, burst=1)[0]
+
+
+def test_shared_store_reports_a_locked_database_without_rolling_back(tmp_path, monkeypatch):
+    path = str(tmp_path / "buckets.sqlite3")
+    store = SharedBucketStore(path)
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE")
+    monkeypatch.setattr(store, "_connect", lambda: sqlite3.connect(path, timeout=0.05, isolation_level=None))
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            store.take("k", rate=1.0, burst=1)
+    finally:
+        holder.execute("ROLLBACK")
+        holder.close()
+
+
+def test_user_over_the_limit_gets_429_with_retry_after(db, monkeypatch, user_id):
+    monkeypatch.setattr(RateLimit, "USER_LIMIT", (0.5, 2))
+    client = _app(db)
+
+    assert [client.get(f"/items/{user_id}").status_code for _ in range(3)] == [200, 200, 429]
+    response = client.get(f"/items/{user_id}")
+    assert response.headers["Retry-After"] == "2"
+    assert client.get("/items/someone-else").status_code == 200
+    assert client.get("/metrics").status_code == 200
+
+
+def test_limiter_errors_fail_open(db, user_id):
+    class Broken:
+        def take(self, *args, **kwargs):
+            raise sqlite3.OperationalError("disk I/O error")
+
+    app = Flask("broken")
+    app.add_url_rule("/items/<user_id>", "items", lambda user_id: "ok")
+    register_rate_limiting(app, db, "broken", store=Broken())
+
+    assert app.test_client().get(f"/items/{user_id}").status_code == 200
+
+
+def test_services_sharing_a_database_keep_their_own_limiter(db):
+    first, second = Flask("first"), Flask("second")
+    register_rate_limiting(first, db, "first", limiter=ConcurrencyLimiter(max_in_flight=1, wait=0.01))
+    register_rate_limiting(second, db, "second", limiter=ConcurrencyLimiter(max_in_flight=1, wait=0.01))
+    limiters = db.concurrency_limiter()
+    assert isinstance(limiters, ServiceLimiters)
+
+    with first.test_request_context(), limiters.slot():
+        with pytest.raises(StorageOverloaded):
+            with limiters.slot():
+                pass
+        with second.test_request_context(), limiters.slot():
+            pass
+
+
+def test_storage_overload_is_answered_with_429(db, user_id):
+    app = Flask("overloaded")
+    limiter = ConcurrencyLimiter(max_in_flight=1, wait=0.01)
+    register_rate_limiting(app, db, "overloaded", limiter=limiter)
+
+    @app.route("/items/<user_id>")
+    def items(user_id):
+        try:
+            with db.concurrency_limiter().slot():
+                pass
+        except StorageOverloaded:
+            return jsonify({"error": "failed"}), 500
+        return "ok"
+
+    client = app.test_client()
+    with limiter.slot():
+        response = client.get(f"/items/{user_id}")
+    assert response.status_code == 429
+    assert client.get(f"/items/{user_id}").status_code == 200
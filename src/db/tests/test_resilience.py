@@ -0,0 +1,158 @@
+import pytest
+import Database
+import Resilience
+from Resilience import CircuitBreaker, StaleCache, StorageUnavailable, is_retryable
+
+
+class ServiceUnavailable(Exception):
+    """Named like google-api-core's, which is all is_retryable looks at."""
+
+
+class NotFound(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(Database, "backoff", lambda attempt: 0.0)
+
+
+def _failing(db, monkeypatch, error, times=None):
+    """Makes the next `times` (default: all) storage calls of db raise error."""
+    client = db._db
+    real = client.collection
+    calls = []
+
+    def collection(name):
+        calls.append(name)
+        if times is None or len(calls) <= times:
+            raise error
+        return real(name)
+
+    monkeypatch.setattr(client, "collection", collection)
+    return calls
+
+
+def test_is_retryable():
+    assert is_retryable(ServiceUnavailable("503"))
+    assert is_retryable(ConnectionError())
+    assert is_retryable(TimeoutError())
+    assert not is_retryable(NotFound("404"))
+    assert not is_retryable(ValueError())
+
+
+def test_breaker_opens_probes_and_closes(monkeypatch):
+    breaker = CircuitBreaker("test", failure_threshold=2, open_seconds=60)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert 0 < breaker.retry_after() <= 60
+
+    breaker._opened_at -= 60
+    assert breaker.allow()              # the one probe
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_failed_probe_opens_the_breaker_again():
+    breaker = CircuitBreaker("test", failure_threshold=1, open_seconds=0)
+    breaker.record_failure()
+    assert breaker.allow()
+
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+
+
+def test_stale_cache_copies_values_and_evicts_the_oldest():
+    cache = StaleCache(max_entries=2)
+    value = {"events": [1]}
+    cache.put("a", value)
+    value["events"].append(2)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    found, cached = cache.get("a")
+    assert found and cached == {"events": [1]}
+    cached["events"].append(3)
+    assert cache.get("a")[1] == {"events": [1]}
+    assert cache.get("b") == (False, None)
+
+
+def test_transient_errors_are_retried(db, monkeypatch):
+    db.set_document("drivers", "d1", {"name": "Ann"})
+    calls = _failing(db, monkeypatch, ServiceUnavailable("blip"), times=2)
+
+    assert db.get_document("drivers", "d1") == {"name": "Ann"}
+    assert len(calls) == 3
+
+
+def test_other_errors_fail_at_once(db, monkeypatch):
+    calls = _failing(db, monkeypatch, NotFound("no such database"))
+
+    with pytest.raises(NotFound):
+        db.get_document("drivers", "d1")
+    assert len(calls) == 1
+    assert db._breaker.state == "closed"
+
+
+def test_persistent_failures_open_the_circuit(db, monkeypatch):
+    calls = _failing(db, monkeypatch, ServiceUnavailable("down"))
+
+    with pytest.raises(StorageUnavailable):
+        db.get_document("drivers", "d1")
+    assert len(calls) == Resilience.MAX_ATTEMPTS
+
+    for _ in range(Resilience.FAILURE_THRESHOLD):
+        with pytest.raises(StorageUnavailable):
+            db.get_document("drivers", "d1")
+    assert db._breaker.state == "open"
+    attempted = len(calls)
+    with pytest.raises(StorageUnavailable, match="circuit is open"):
+        db.get_document("drivers", "d1")
+    assert len(calls) == attempted
+
+
+def test_stale_reads_are_served_while_storage_is_down(db, monkeypatch):
+    db.set_document("drivers", "d1", {"name": "Ann"})
+    assert db.get_document("drivers", "d1", allow_stale=True) == {"name": "Ann"}
+    _failing(db, monkeypatch, ServiceUnavailable("down"))
+
+    assert db.get_document("drivers", "d1", allow_stale=True) == {"name": "Ann"}
+    with pytest.raises(StorageUnavailable):
+        db.get_document("drivers", "d2", allow_stale=True)
+
+
+@pytest.fixture
+def isolated_breaker(services, monkeypatch):
+    """The services share one Database; keep this test's failures away from the others."""
+    monkeypatch.setattr(services.db, "_breaker", CircuitBreaker("test"))
+    monkeypatch.setattr(services.db, "_stale", StaleCache())
+
+
+def test_unavailable_storage_is_a_503(services, user_id, monkeypatch, isolated_breaker):
+    _failing(services.db, monkeypatch, ServiceUnavailable("down"))
+
+    response = services.drivers.get(f"/drivers/user/{user_id}/status")
+
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_stale_responses_are_flagged(services, user_id, monkeypatch, isolated_breaker):
+    services.create_driver(user_id)
+    fresh = services.drivers.get(f"/fleet/{user_id}/summary")
+    assert "X-Served-Stale" not in fresh.headers
+    _failing(services.db, monkeypatch, ServiceUnavailable("down"))
+
+    stale = services.drivers.get(f"/fleet/{user_id}/summary")
+
+    assert stale.status_code == 200
+    assert stale.headers["X-Served-Stale"] == "true"
+    assert stale.get_json()["summary"]["total"] == 1
@@ -0,0 +1,258 @@
+from datetime import datetime, timedelta, timezone
+import Retention
+from Retention import (ARCHIVE_COLLECTION, EVENT_COLLECTION, RetentionPolicy, RetentionWorker,
+                       archive_parts, archived_events, compact_events, decode_events, encode_events, expire_archives,
+                       get_rollups, merge_archived_rows, reaches_archive, rollup, with_archived)
+
+NOW = datetime(2024, 6, 1, tzinfo=timezone.utc)
+POLICY = RetentionPolicy(hot_days=30, hot_days_by_status={"Critical": 365})
+
+
+def at(month, day, hour=12):
+    return datetime(2024, month, day, hour, tzinfo=timezone.utc)
+
+
+def add_event(db, event_id, occurred_at, driver_id="d1", status="Mild", **fields):
+    db.set_document(EVENT_COLLECTION, event_id, {"eventId": event_id, "driverId": driver_id, "userId": "u1",
+                                                 "status": status, "occurredAt": occurred_at, **fields})
+
+
+def ids(events):
+    return [event["eventId"] for event in events]
+
+
+def test_policy_periods():
+    policy = RetentionPolicy(hot_days=30, hot_days_by_status={"Critical": 365, "Normal": 7}, archive_days=60)
+
+    assert policy.cutoff("Mild", NOW) == NOW - timedelta(days=30)
+    assert policy.cutoff("Critical", NOW) == NOW - timedelta(days=365)
+    assert policy.horizon(NOW) == NOW - timedelta(days=7)
+    assert policy.expired_before(NOW) == "2024-04"
+    assert RetentionPolicy(archive_days=0).expired_before(NOW) is None
+
+
+def test_encoded_events_roundtrip_and_are_deterministic():
+    events = [{"eventId": "e1", "occurredAt": at(1, 2), "heartRate": 80}]
+
+    assert decode_events(encode_events(events)) == events
+    assert encode_events(events) == encode_events([dict(events[0])])
+    parts = archive_parts("d1", "2024-01", events)
+    assert list(parts) == list(archive_parts("d1", "2024-01", events))
+    assert next(iter(parts)).startswith("d1_2024-01_")
+
+
+def test_rollup_summarizes_events():
+    summary = rollup([
+        {"status": "Mild", "occurredAt": at(1, 3), "heartRate": 80, "vehicleSpeed": True},
+        {"status": "Mild", "occurredAt": at(1, 1), "heartRate": 100},
+        {"status": "Severe", "occurredAt": at(1, 2), "heartRate": "fast"},
+    ])
+
+    assert summary["count"] == 3
+    assert summary["byStatus"] == {"Mild": 2, "Severe": 1}
+    assert (summary["firstAt"], summary["lastAt"]) == (at(1, 1), at(1, 3))
+    assert summary["heartRate"] == {"min": 80, "max": 100, "avg": 90}
+    assert summary["vehicleSpeed"] is None and summary["bloodOxygenLevel"] is None
+
+
+def test_compaction_moves_due_events_into_monthly_archives(db):
+    add_event(db, "e1", at(1, 5), heartRate=80)
+    add_event(db, "e2", at(1, 20), heartRate=100)
+    add_event(db, "e3", at(2, 10))
+    add_event(db, "e4", at(5, 20))                            # within 30 days
+    add_event(db, "e5", at(3, 1), status="Critical")          # Critical stays a year
+    add_event(db, "e6", at(1, 6), driver_id=None)
+
+    stats = compact_events(db, POLICY, now=NOW)
+
+    assert stats == {"scanned": 4, "archived": 3, "expired": 0, "unlinked": 1}
+    assert sorted(doc_id for doc_id, _ in db.stream_documents(EVENT_COLLECTION)) == ["e4", "e5", "e6"]
+    assert ids(archived_events(db, driver_id="d1")) == ["e1", "e2", "e3"]
+    rollups = get_rollups(db, "d1")
+    assert [(r["month"], r["count"], r["userId"]) for r in rollups] == [("2024-01", 2, "u1"), ("2024-02", 1, "u1")]
+    assert rollups[0]["heartRate"]["avg"] == 90
+    removals = [record for _, record in db.stream_documents("outbox")]
+    assert sorted(record["eventId"] for record in removals) == ["e1", "e2", "e3"]
+
+    # Nothing is due any more, so a second run changes nothing
+    assert compact_events(db, POLICY, now=NOW)["archived"] == 0
+
+
+def test_compaction_merges_into_an_existing_month(db):
+    add_event(db, "e1", at(1, 5))
+    compact_events(db, POLICY, now=NOW)
+    add_event(db, "e2", at(1, 2))                             # a backdated event
+
+    compact_events(db, POLICY, now=NOW)
+
+    assert ids(archived_events(db, driver_id="d1")) == ["e2", "e1"]
+    assert len(db.query_documents(ARCHIVE_COLLECTION, [("month", "==", "2024-01")])) == 1
+    assert get_rollups(db, "d1")[0]["count"] == 2
+
+
+def test_dry_run_and_max_events(db):
+    add_event(db, "e1", at(1, 5))
+    add_event(db, "e2", at(1, 6))
+
+    assert compact_events(db, POLICY, now=NOW, dry_run=True)["archived"] == 2
+    assert len(db.query_documents(EVENT_COLLECTION, [])) == 2
+
+    assert compact_events(db, POLICY, now=NOW, max_events=1)["archived"] == 1
+    assert ids(archived_events(db, driver_id="d1")) == ["e1"]
+
+
+def test_events_held_by_a_longer_period_do_not_use_up_the_budget(db):
+    for i in range(5):
+        add_event(db, f"held{i}", at(1, 1 + i), status="Critical")
+    add_event(db, "due", at(2, 1))
+
+    stats = compact_events(db, POLICY, now=NOW, max_events=2)
+
+    assert (stats["scanned"], stats["archived"]) == (1, 1)
+    assert ids(archived_events(db, driver_id="d1")) == ["due"]
+    assert len(db.query_documents(EVENT_COLLECTION, [("status", "==", "Critical")])) == 5
+
+
+def test_each_status_is_archived_after_its_own_period(db):
+    policy = RetentionPolicy(hot_days=30, hot_days_by_status={"Critical": 365, "Normal": 7})
+    add_event(db, "normal", at(5, 20), status="Normal")        # 12 days old
+    add_event(db, "mild", at(5, 20))
+    add_event(db, "critical", datetime(2023, 5, 1, tzinfo=timezone.utc), status="Critical")
+
+    assert compact_events(db, policy, now=NOW)["archived"] == 2
+    assert sorted(ids(archived_events(db, driver_id="d1"))) == ["critical", "normal"]
+    assert [doc_id for doc_id, _ in db.stream_documents(EVENT_COLLECTION)] == ["mild"]
+
+
+def test_expired_archives_are_deleted_but_rollups_kept(db):
+    policy = RetentionPolicy(hot_days=30, archive_days=60)
+    add_event(db, "e1", at(3, 5))
+    add_event(db, "e2", at(4, 5))
+    compact_events(db, RetentionPolicy(hot_days=30), now=NOW)
+
+    assert expire_archives(db, policy, now=NOW, dry_run=True) == 1
+    assert expire_archives(db, policy, now=NOW) == 1
+    assert ids(archived_events(db, driver_id="d1")) == ["e2"]
+    assert [r["month"] for r in get_rollups(db, "d1")] == ["2024-03", "2024-04"]
+    assert expire_archives(db, RetentionPolicy(archive_days=0), now=NOW) == 0
+
+
+def test_events_of_an_expired_month_are_deleted_without_archiving(db):
+    add_event(db, "e1", at(1, 5))
+
+    stats = compact_events(db, RetentionPolicy(hot_days=30, archive_days=60), now=NOW)
+
+    assert (stats["expired"], stats["archived"]) == (1, 0)
+    assert db.query_documents(EVENT_COLLECTION, []) == []
+    assert list(archived_events(db, driver_id="d1")) == []
+    assert [record["eventId"] for _, record in db.stream_documents("outbox")] == ["e1"]
+
+
+def test_archived_events_by_range_user_and_overlapping_parts(db):
+    for event_id, occurred_at in [("e1", at(1, 5)), ("e2", at(2, 5)), ("e3", at(3, 5))]:
+        add_event(db, event_id, occurred_at)
+    add_event(db, "e4", at(2, 6), driver_id="d2")
+    compact_events(db, POLICY, now=NOW)
+    # A part left by an overlapping run, holding an event also in the month's main part
+    event = next(archived_events(db, driver_id="d1", start=at(2, 1), end=at(3, 1)))
+    for part_id, part in archive_parts("d1", "2024-02", [dict(event, eventId="e2")]).items():
+        db.set_document(ARCHIVE_COLLECTION, part_id + "x", part)
+
+    assert ids(archived_events(db, driver_id="d1", start=at(2, 1), end=at(3, 5, 12))) == ["e2"]
+    assert ids(archived_events(db, driver_id="d1", start=at(1, 5, 13))) == ["e2", "e3"]
+    assert ids(archived_events(db, user_id="u1", start=at(2, 1), end=at(3, 1))) == ["e2", "e4"]
+
+
+def test_with_archived_completes_hot_events(db):
+    add_event(db, "e1", at(1, 5))
+    compact_events(db, POLICY, now=NOW)
+    recent = datetime.now(timezone.utc)
+    hot = [{"eventId": "e2", "occurredAt": recent}]
+
+    assert ids(with_archived(db, hot, "d1")) == ["e1", "e2"]
+    assert ids(with_archived(db, hot, "d1", descending=True)) == ["e2", "e1"]
+    # A range inside the hot period, or a newest-first page filled by hot events, skips the archives
+    assert with_archived(db, hot, "d1", start=recent - timedelta(days=1)) is hot
+    assert with_archived(db, hot, "d1", descending=True, limit=1) is hot
+    assert ids(with_archived(db, [], "d2")) == []
+
+
+def test_merge_archived_rows_and_reaches_archive():
+    archived = [{"eventId": "a", "occurredAt": at(1, 1)}, {"eventId": "c", "occurredAt": at(1, 3)}]
+    rows = [{"eventId": "b", "occurredAt": at(1, 2)}, {"eventId": "d"}]
+
+    assert ids(merge_archived_rows(rows[:1], archived, ordered=True)) == ["a", "b", "c"]
+    assert ids(merge_archived_rows(rows, archived, ordered=False)) == ["a", "c", "b", "d"]
+    assert reaches_archive(None)
+    assert reaches_archive(datetime.now(timezone.utc) - timedelta(days=400))
+    assert not reaches_archive(datetime.now(timezone.utc))
+
+
+def test_worker_runs_compaction_and_expiry(db):
+    add_event(db, "e1", at(1, 5))
+    worker = RetentionWorker(db, RetentionPolicy(hot_days=30), interval=0)
+
+    worker.start()      # disabled
+    assert worker._thread is None
+    stats = worker.run_once()
+
+    assert (stats["archived"], stats["archivesExpired"]) == (1, 0)
+
+
+def test_archived_events_are_still_served(services, user_id):
+    driver_id = services.create_driver(user_id)
+    old = services.create_event(driver_id, "2024-01-15T10:30:00Z", "2024-01-15", heartRate=90)
+    services.drain_outbox()
+    driver_url = f"/drivers/{driver_id}?userId={user_id}"
+    assert ids(services.drivers.get(driver_url).get_json()["driver"]["events"]) == [old["eventId"]]
+
+    compact_events(services.db, RetentionPolicy(hot_days=30))
+    services.drain_outbox()
+
+    assert services.db.get_document(EVENT_COLLECTION, old["eventId"]) == {}
+    driver = services.drivers.get(driver_url).get_json()["driver"]
+    assert driver["events"] == []
+    body = services.events.get(f"/drivers/{driver_id}/events?archived=true").get_json()
+    assert ids(body["events"]) == [old["eventId"]]
+    body = services.events.get(f"/drivers/{driver_id}/events?from=2024-01-01&to=2024-02-01").get_json()
+    assert ids(body["events"]) == [old["eventId"]]
+    exported = services.events.get(f"/export/events?driverId={driver_id}").get_data(as_text=True)
+    assert old["eventId"] in exported
+
+
+def test_listing_a_drivers_events_reads_archives_only_when_asked(services, user_id, monkeypatch):
+    driver_id = services.create_driver(user_id)
+    services.create_event(driver_id, "2024-01-15T10:30:00Z", "2024-01-15")
+    today = datetime.now(timezone.utc)
+    recent = services.create_event(driver_id, today.strftime("%Y-%m-%dT%H:%M:%SZ"), today.strftime("%Y-%m-%d"))
+    compact_events(services.db, RetentionPolicy(hot_days=30))
+
+    def read_archives(*args, **kwargs):
+        raise AssertionError("archives read")
+    with monkeypatch.context() as patch:
+        patch.setattr(Retention, "archived_events", read_archives)
+        for query in ("", "?order=desc&limit=10", f"?to={(today + timedelta(days=1)).strftime('%Y-%m-%d')}",
+                      f"?from={today.strftime('%Y-%m-%d')}"):
+            response = services.events.get(f"/drivers/{driver_id}/events{query}")
+            assert response.status_code == 200, response.get_json()
+            assert ids(response.get_json()["events"]) == [recent["eventId"]]
+
+    body = services.events.get(f"/drivers/{driver_id}/events?archived=true&order=desc").get_json()
+    assert len(body["events"]) == 2 and body["events"][0]["eventId"] == recent["eventId"]
+
+
+def test_rollups_endpoint(services, user_id):
+    driver_id = services.create_driver(user_id)
+    services.create_event(driver_id, "2024-01-15T10:30:00Z", "2024-01-15", heartRate=90)
+    services.create_event(driver_id, "2024-03-15T10:30:00Z", "2024-03-15", status="Severe")
+    compact_events(services.db, RetentionPolicy(hot_days=30))
+
+    body = services.events.get(f"/drivers/{driver_id}/events/rollups").get_json()
+    assert [(r["month"], r["count"]) for r in body["rollups"]] == [("2024-01", 1), ("2024-03", 1)]
+    assert body["rollups"][0]["heartRate"]["max"] == 90
+    body = services.events.get(f"/drivers/{driver_id}/events/rollups?from=2024-02&to=2024-06").get_json()
+    assert body["count"] == 1 and body["rollups"][0]["byStatus"] == {"Severe": 1}
+
+    response = services.events.get(f"/drivers/{driver_id}/events/rollups?from=2024-1")
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "from and to must be months (YYYY-MM)"
@@ -0,0 +1,201 @@
+import pytest
+from Search import EXACT, FIELD_WEIGHTS, PREFIX, SUBSTRING, SearchIndex, UserIndex, normalize, query_terms
+
+
+def driver(name, phone="", product_id=None, contacts=()):
+    return {"name": name, "phone_number": phone, "productId": product_id,
+            "emergency_contacts": [{"name": contact} for contact in contacts]}
+
+
+def names(results):
+    return [result["name"] for result in results]
+
+
+def test_query_terms():
+    assert query_terms("(555) 010-2233") == ["5550102233"]
+    assert query_terms("+1 555 0102") == ["15550102"]
+    assert query_terms("Jane  O'Doe") == ["jane", "o", "doe"]
+    assert query_terms("  ") == []
+
+
+def test_normalize_strips_accents_and_case():
+    assert normalize("José ÅSTRÖM") == "jose astrom"
+
+
+def test_name_matches_rank_exact_then_prefix_then_substring():
+    index = UserIndex()
+    index.add("d1", driver("Annabel Cole"))
+    index.add("d2", driver("Ann Lee"))
+    index.add("d3", driver("Joanna Hart"))
+    index.add("d4", driver("Bob Stone"))
+
+    results = index.search(["ann"], limit=10)
+
+    assert names(results) == ["Ann Lee", "Annabel Cole", "Joanna Hart"]
+    name = FIELD_WEIGHTS["name"]
+    assert [result["score"] for result in results] == [name * EXACT, name * PREFIX, name * SUBSTRING]
+
+
+def test_other_fields_are_searched_with_lower_weights():
+    index = UserIndex()
+    index.add("d1", driver("Ann Lee", phone="(555) 010-2233", product_id=98765))
+    index.add("d2", driver("Bob Stone", contacts=["Carla Reyes"]))
+
+    assert index.search(["98765"], 10)[0]["score"] == FIELD_WEIGHTS["productId"] * EXACT
+    # The end of a phone number is found through the n-gram index
+    assert index.search(["2233"], 10) == [
+        {"driverId": "d1", "name": "Ann Lee", "phone_number": "(555) 010-2233", "productId": 98765,
+         "score": FIELD_WEIGHTS["phone_number"] * SUBSTRING}]
+    assert names(index.search(["carla"], 10)) == ["Bob Stone"]
+    assert index.search(["xyz"], 10) == []
+
+
+def test_every_term_must_match():
+    index = UserIndex()
+    index.add("d1", driver("Jane Doe"))
+    index.add("d2", driver("Jane Smith"))
+    index.add("d3", driver("John Doe"))
+
+    assert names(index.search(["jane", "doe"], 10)) == ["Jane Doe"]
+    assert index.search(["jane", "nobody"], 10) == []
+
+
+def test_limit_keeps_the_best_and_orders_ties_by_name():
+    index = UserIndex()
+    for driver_id, name in [("d1", "Sam Young"), ("d2", "Sam Adams"), ("d3", "Samantha Bell"), ("d4", "Sam Cruz")]:
+        index.add(driver_id, driver(name))
+
+    assert names(index.search(["sam"], 2)) == ["Sam Adams", "Sam Cruz"]
+    assert names(index.search(["sam"], 10)) == ["Sam Adams", "Sam Cruz", "Sam Young", "Samantha Bell"]
+
+
+def test_re_adding_and_removing_drivers():
+    index = UserIndex()
+    index.add("d1", driver("Ann Lee"))
+    index.add("d1", driver("Bea Lee"))
+
+    assert index.search(["ann"], 10) == []
+    assert names(index.search(["bea"], 10)) == ["Bea Lee"]
+    index.remove("d1")
+    assert index.search(["lee"], 10) == [] and len(index) == 0
+    index.remove("d1")      # removing twice is harmless
+
+
+def add_driver(db, user_id, driver_id, name):
+    db.set_document("drivers", driver_id, {"userId": user_id, **driver(name)})
+
+
+def test_search_index_builds_from_storage_and_follows_updates(db):
+    add_driver(db, "u1", "d1", "Ann Lee")
+    add_driver(db, "u2", "d2", "Ann Other")
+    search_index = SearchIndex(db)
+
+    assert [result["driverId"] for result in search_index.search("u1", "ann")] == ["d1"]
+
+    search_index.update("u1", "d3", driver("Annie Park"))
+    search_index.update("u1", "d1", {"status": "Critical"}, changed=["status"])     # not searched, ignored
+    assert names(search_index.search("u1", "ann")) == ["Ann Lee", "Annie Park"]
+    search_index.remove("u1", "d1")
+    assert names(search_index.search("u1", "ann")) == ["Annie Park"]
+    assert search_index.search("u1", "   ") == []
+
+
+def test_changes_made_during_a_build_are_replayed(db):
+    add_driver(db, "u1", "d1", "Ann Lee")
+    add_driver(db, "u1", "d2", "Ann Gray")
+
+    class Interleaved:
+        """Makes driver writes while the index is being read from storage."""
+        def iter_documents(self, *args, **kwargs):
+            search_index.remove("u1", "d2")
+            search_index.update("u1", "d3", driver("Ann Moss"))
+            return db.iter_documents(*args, **kwargs)
+
+    search_index = SearchIndex(Interleaved())
+
+    assert names(search_index.search("u1", "ann")) == ["Ann Lee", "Ann Moss"]
+
+
+def test_failed_build_is_retried(db, monkeypatch):
+    add_driver(db, "u1", "d1", "Ann Lee")
+    search_index = SearchIndex(db)
+    read = db.iter_documents
+    monkeypatch.setattr(db, "iter_documents", lambda *args, **kwargs: (_ for _ in ()).throw(Exception("unavailable")))
+
+    with pytest.raises(Exception, match="unavailable"):
+        search_index.search("u1", "ann")
+    monkeypatch.setattr(db, "iter_documents", read)
+    assert names(search_index.search("u1", "ann")) == ["Ann Lee"]
+
+
+def test_least_recently_searched_index_is_dropped(db):
+    add_driver(db, "u1", "d1", "Ann Lee")
+    add_driver(db, "u2", "d2", "Ann Gray")
+    search_index = SearchIndex(db, max_indexes=1)
+    search_index.search("u1", "ann")
+    search_index.search("u2", "ann")
+
+    # u1's index was dropped, so this write by another process shows up on its rebuild
+    add_driver(db, "u1", "d3", "Ann Moss")
+    assert names(search_index.search("u1", "ann")) == ["Ann Lee", "Ann Moss"]
+    # u2's index was dropped in turn, so updates to it are ignored until it is rebuilt
+    search_index.update("u2", "d4", driver("Ann Ward"))
+    assert names(search_index.search("u2", "ann")) == ["Ann Gray"]
+
+
+def test_old_indexes_are_rebuilt(db):
+    add_driver(db, "u1", "d1", "Ann Lee")
+    search_index, stale_index = SearchIndex(db, max_age=0), SearchIndex(db)
+    search_index.search("u1", "ann")
+    stale_index.search("u1", "ann")
+
+    add_driver(db, "u1", "d2", "Ann Gray")
+
+    assert names(search_index.search("u1", "ann")) == ["Ann Gray", "Ann Lee"]
+    assert names(stale_index.search("u1", "ann")) == ["Ann Lee"]
+
+
+def test_search_endpoint(services, user_id):
+    jane = services.create_driver(user_id, name="Jane Doe", phoneNumber="(555) 010-2233")
+    services.create_driver(user_id, name="Janet Smith")
+    services.create_driver(f"{user_id}-other", name="Jane Other")
+
+    response = services.drivers.get(f"/drivers/user/{user_id}/search", query_string={"q": "jane"})
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert body["query"] == "jane" and body["count"] == 2
+    assert names(body["drivers"]) == ["Jane Doe", "Janet Smith"]
+
+    body = services.drivers.get(f"/drivers/user/{user_id}/search", query_string={"q": "010 2233"}).get_json()
+    assert [result["driverId"] for result in body["drivers"]] == [jane]
+
+    body = services.drivers.get(f"/drivers/user/{user_id}/search", query_string={"q": "jan", "limit": 1}).get_json()
+    assert names(body["drivers"]) == ["Jane Doe"]
+
+
+def test_search_endpoint_follows_driver_writes(services, user_id):
+    driver_id = services.create_driver(user_id, name="Jane Doe")
+    services.drivers.get(f"/drivers/user/{user_id}/search", query_string={"q": "jane"})
+
+    response = services.drivers.put(f"/drivers/{driver_id}",
+                                    json={"userId": user_id, "fieldToChange": "name", "newValue": "Mary Doe"})
+    assert response.status_code == 200
+    body = services.drivers.get(f"/drivers/user/{user_id}/search", query_string={"q": "mary"}).get_json()
+    assert names(body["drivers"]) == ["Mary Doe"]
+
+    assert services.drivers.delete(f"/drivers/{driver_id}", json={"userId": user_id}).status_code == 200
+    body = services.drivers.get(f"/drivers/user/{user_id}/search", query_string={"q": "doe"}).get_json()
+    assert body["drivers"] == []
+
+
+@pytest.mark.parametrize("query_string, error", [
+    ({}, "Missing required query parameter: q"),
+    ({"q": "  "}, "Missing required query parameter: q"),
+    ({"q": "jane", "limit": "ten"}, "limit must be an integer"),
+])
+def test_search_endpoint_rejects_bad_queries(services, user_id, query_string, error):
+    response = services.drivers.get(f"/drivers/user/{user_id}/search", query_string=query_string)
+
+    assert response.status_code == 400
+    assert response.get_json()["error"] == error
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta, timezone
+import Seed
+from LocalDatabase import LocalDatabase
+from Seed import EMBEDDED_EVENTS, SeedPlan, generate, seed
+
+END = datetime(2024, 6, 30, tzinfo=timezone.utc)
+
+
+def test_plan_is_fixed_by_the_seed():
+    plan = SeedPlan(7, users=50, events=5000)
+
+    assert plan.fleets == SeedPlan(7, users=50, events=5000).fleets
+    assert plan.fleets != SeedPlan(8, users=50, events=5000).fleets
+    assert len(plan.fleets) == 50
+    assert max(plan.fleets) <= 200
+    assert abs(plan.events - 5000) <= plan.drivers     # per-driver rounding
+
+
+def test_generated_documents_are_deterministic_and_consistent():
+    plan = SeedPlan(3, users=5, events=400)
+    documents = list(generate(plan, END, days=30))
+
+    assert documents == list(generate(SeedPlan(3, users=5, events=400), END, days=30))
+    by_collection = {}
+    for collection, doc_id, data in documents:
+        by_collection.setdefault(collection, {})[doc_id] = data
+    assert len(by_collection["users"]) == 5
+    assert len(by_collection["drivers"]) == plan.drivers
+    assert len(by_collection["events"]) == plan.events
+    for driver_id, driver in by_collection["drivers"].items():
+        own = sorted((event for event in by_collection["events"].values() if event["driverId"] == driver_id),
+                     key=lambda event: event["occurredAt"])
+        assert driver["userId"] in by_collection["users"]
+        assert len(driver["events"]) == min(len(own), EMBEDDED_EVENTS)
+        if own:
+            assert driver["status"] == own[-1]["status"]
+            assert driver["statusUpdatedAt"] == own[-1]["occurredAt"]
+            assert END - timedelta(days=30) <= own[0]["occurredAt"] and own[-1]["occurredAt"] < END
+
+
+def test_seed_writes_every_document(db):
+    result = seed(db, users=4, events=300, days=30, seed_value=5, parallelism=2)
+    plan = SeedPlan(5, users=4, events=300)
+
+    assert result["failed"] == 0
+    assert result["written"] == {"users": 4, "drivers": plan.drivers, "events": plan.events}
+    assert len(db.query_documents("events", [])) == plan.events
+
+
+def test_reseeding_overwrites_instead_of_duplicating(db):
+    seed(db, users=3, events=100, days=30, seed_value=5)
+    seed(db, users=3, events=100, days=30, seed_value=5)
+
+    assert len(db.query_documents("drivers", [])) == SeedPlan(5, users=3, events=100).drivers
+
+
+def test_failed_batches_are_counted(monkeypatch):
+    def unavailable(self, operations):
+        raise RuntimeError("storage unavailable")
+
+    monkeypatch.setattr(Seed, "MAX_ATTEMPTS", 1)
+    monkeypatch.setattr(LocalDatabase, "batch_write", unavailable)
+
+    result = seed(LocalDatabase(), users=2, events=20, days=10, seed_value=5)
+
+    assert result["written"] == {}
+    assert result["failed"] == 2 + SeedPlan(5, users=2, events=20).drivers + SeedPlan(5, users=2, events=20).events
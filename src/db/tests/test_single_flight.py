@@ -0,0 +1,87 @@
+import threading
+import time
+import pytest
+from SingleFlight import SingleFlight
+
+
+def _concurrently(flight, key, fn, callers=5):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_concurrent_callers_share_one_call():
+    flight, release, calls = SingleFlight("test"), threading.Event(), []
+
+    def read():
+        calls.append(1)
+        release.wait(5)
+        return {"value": 1}
+
+    threads, results, errors = _concurrently(flight, "key", read)
+    time.sleep(0.1)     # every caller is waiting on the leader by now
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert errors == []
+    assert len(results) == 5 and all(result is results[0] for result in results)
+
+
+def test_followers_get_the_leaders_error():
+    flight, release = SingleFlight("test"), threading.Event()
+
+    def read():
+        release.wait(5)
+        raise RuntimeError("storage down")
+
+    threads, results, errors = _concurrently(flight, "key", read, callers=3)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == []
+    assert len(errors) == 3 and all(str(error) == "storage down" for error in errors)
+
+
+def test_results_are_not_cached_once_the_call_finishes():
+    flight, values = SingleFlight("test"), iter([1, 2])
+
+    assert flight.do("key", lambda: next(values)) == 1
+    assert flight.do("key", lambda: next(values)) == 2
+    assert flight._calls == {}
+
+
+def test_different_keys_do_not_share():
+    flight = SingleFlight("test")
+
+    assert flight.do("a", lambda: "a") == "a"
+    assert flight.do("b", lambda: "b") == "b"
+
+
+def test_failed_call_does_not_stick():
+    flight = SingleFlight("test")
+    with pytest.raises(ValueError):
+        flight.do("key", lambda: (_ for _ in ()).throw(ValueError("bad")))
+
+    assert flight.do("key", lambda: "ok") == "ok"
+
+
+def test_driver_list_reads_are_coalesced(services, user_id):
+    services.create_driver(user_id)
+
+    response = services.drivers.get(f"/drivers/user/{user_id}")
+
+    assert response.status_code == 200
+    assert [driver["name"] for driver in response.get_json()["drivers"]] == ["Ann Lee"]
+    assert services.drivers_module.drivers_by_user_flight._calls == {}
@@ -0,0 +1,126 @@
+import time
+from flask import Flask
+import Startup
+from Startup import WarmUp, measure_import, register_readiness
+
+
+class _Storage:
+    """Stands in for a Database whose warm-up can be made to fail."""
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+        self._db = object()
+
+    def warm_up(self):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return 0.01
+
+    def connection_error(self):
+        return self.error
+
+
+class _Index:
+    name = "owners"
+
+    def __init__(self):
+        self.loaded = False
+
+    def load(self):
+        self.loaded = True
+
+
+def _settle(warm_up):
+    deadline = time.monotonic() + 5
+    while warm_up.state == "running" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return warm_up.state
+
+
+def test_warm_up_loads_indexes_when_enabled(monkeypatch):
+    monkeypatch.setattr(Startup, "WARMUP_INDEXES", True)
+    index = _Index()
+    warm_up = WarmUp(_Storage(), [index])
+
+    warm_up.start()
+
+    assert _settle(warm_up) == "ready"
+    assert index.loaded
+    assert set(warm_up.to_map()["seconds"]) == {"storage", "owners"}
+
+
+def test_warm_up_runs_once_per_process():
+    storage = _Storage()
+    warm_up = WarmUp(storage)
+    warm_up.start()
+    _settle(warm_up)
+    warm_up.start()
+
+    assert storage.calls == 1
+
+
+def test_failed_warm_up_is_retried_after_a_while(monkeypatch):
+    storage = _Storage(RuntimeError("no credentials"))
+    warm_up = WarmUp(storage)
+    warm_up.start()
+
+    assert _settle(warm_up) == "failed"
+    assert warm_up.to_map()["error"] == "no credentials"
+    warm_up.start()
+    assert storage.calls == 1
+
+    monkeypatch.setattr(Startup, "RETRY_SECONDS", 0)
+    storage.error = None
+    warm_up.start()
+    assert _settle(warm_up) == "ready"
+
+
+def test_ready_answers_503_until_warmed_up(monkeypatch):
+    monkeypatch.setattr(Startup, "WARMUP_ENABLED", True)
+    app = Flask("warming")
+    warm_up = register_readiness(app, _Storage())
+    client = app.test_client()
+
+    assert warm_up.state == "pending"
+    first = client.get("/ready")                # the first request starts the warm-up
+    assert first.status_code == 503 or first.get_json()["ready"]
+    _settle(warm_up)
+    response = client.get("/ready")
+
+    assert response.status_code == 200
+    assert response.get_json()["warmUp"]["state"] == "ready"
+
+
+def test_ready_without_warm_up_reports_connection_errors():
+    app = Flask("cold")
+    storage = _Storage(RuntimeError("no credentials"))
+    storage._db = None
+    register_readiness(app, storage)
+
+    response = app.test_client().get("/ready")
+
+    assert response.status_code == 503
+    assert response.get_json() == {"ready": False, "error": "no credentials"}
+
+
+def test_importing_a_service_does_not_touch_storage(monkeypatch):
+    # Against Firestore, whose client is created lazily (a LocalDatabase has nothing to connect to)
+    monkeypatch.delenv("DRIVESENSE_LOCAL_DB")
+    measured = measure_import("Event_rest")
+
+    assert measured["service"] == "Event_rest"
+    assert measured["connectedOnImport"] is False
+
+
+def test_event_for_a_deleted_driver_is_refused(services, user_id):
+    driver_id = services.create_driver(user_id)
+    services.create_event(driver_id)            # the driver's owner is now in driver_owners
+    services.db.delete_document("drivers", driver_id)
+
+    response = services.events.post("/events", json={"driverId": driver_id, "status": "Mild", "videoLink": "",
+                                                     "timeStamp": "2024-01-15T11:00:00Z", "date": "2024-01-15"})
+
+    assert response.status_code == 500
+    assert "Driver not found" in response.get_json()["error"]
+    assert services.events_module.driver_owners.get(driver_id) is None
@@ -0,0 +1,120 @@
+from datetime import datetime, timezone
+from Alerts import AlertFeed
+from Migrations import backfill_status_timestamps
+
+
+def _set_status(services, driver_id, user_id, status):
+    response = services.drivers.put(f"/drivers/{driver_id}",
+                                    json={"fieldToChange": "status", "newValue": status, "userId": user_id})
+    assert response.status_code == 200, response.get_json()
+
+
+def test_status_query_returns_most_recently_changed_first(services, user_id):
+    first = services.create_driver(user_id, "First")
+    second = services.create_driver(user_id, "Second")
+    services.create_driver(user_id, "Calm", status="Mild")
+    _set_status(services, first, user_id, "Severe")
+    _set_status(services, second, user_id, "Critical")
+
+    response = services.drivers.get(f"/drivers/user/{user_id}/status")
+
+    assert response.status_code == 200
+    assert [driver["driverId"] for driver in response.get_json()["drivers"]] == [second, first]
+    only_severe = services.drivers.get(f"/drivers/user/{user_id}/status?status=Severe").get_json()
+    assert [driver["driverId"] for driver in only_severe["drivers"]] == [first]
+
+
+def test_status_query_rejects_unknown_statuses(services, user_id):
+    response = services.drivers.get(f"/drivers/user/{user_id}/status?status=Severe,Asleep")
+
+    assert response.status_code == 400
+
+
+def test_escalations_raise_alerts(services, user_id):
+    driver_id = services.create_driver(user_id, "Ann Lee", status="Mild")
+    _set_status(services, driver_id, user_id, "Severe")
+    _set_status(services, driver_id, user_id, "Critical")    # already elevated: no new alert
+    _set_status(services, driver_id, user_id, "Stable")
+
+    alerts = services.drivers.get(f"/alerts/{user_id}").get_json()["alerts"]
+
+    assert [(alert["fromStatus"], alert["toStatus"]) for alert in alerts] == [("Mild", "Severe")]
+    assert alerts[0]["driverId"] == driver_id
+    assert alerts[0]["name"] == "Ann Lee"
+
+
+def test_alert_stream_sends_alerts_as_server_sent_events(db):
+    feed = AlertFeed(db)
+    stream = feed.stream("user")
+    assert next(stream) == ": connected\n\n"
+    feed.publish("user", "driver", "Ann", "Mild", "Critical")
+
+    message = next(stream)
+
+    assert message.startswith("id: ") and "event: alert\n" in message and '"toStatus": "Critical"' in message
+    stream.close()
+    assert feed._subscribers == {}
+
+
+def test_alert_stream_sees_alerts_published_by_other_processes(db, monkeypatch):
+    import Alerts
+    monkeypatch.setattr(Alerts, "POLL_SECONDS", 0.01)
+    feed = AlertFeed(db)
+    feed.publish("user", "driver", "Ann", "Mild", "Severe")     # before connecting: not sent
+    stream = feed.stream("user")
+    assert next(stream) == ": connected\n\n"
+
+    # Another instance shares the alerts collection but not this feed's subscribers
+    AlertFeed(db).publish("user", "driver", "Ann", "Severe", "Critical")
+    AlertFeed(db).publish("other-user", "driver", "Bob", "Mild", "Severe")
+
+    message = next(stream)
+    assert '"toStatus": "Critical"' in message
+    stream.close()
+
+
+def _alert_ids(messages):
+    return [message.split("\n", 1)[0][len("id: "):] for message in messages]
+
+
+def test_alert_stream_resumes_after_the_last_event_id(db):
+    feed = AlertFeed(db)
+    published = [feed.publish("user", "driver", "Ann", "Mild", status)["alertId"]
+                 for status in ("Severe", "Critical", "Severe")]
+    stream = feed.stream("user", last_event_id=published[0])
+    assert next(stream) == ": connected\n\n"
+
+    assert _alert_ids([next(stream), next(stream)]) == published[1:]
+    stream.close()
+
+
+def test_alert_stream_endpoint_honours_last_event_id(services, user_id):
+    feed = services.drivers_module.alert_feed
+    first, second = (feed.publish(user_id, "driver", "Ann", "Mild", status)["alertId"] for status in ("Severe", "Critical"))
+
+    response = services.drivers.get(f"/alerts/{user_id}/stream", headers={"Last-Event-ID": first})
+    chunks = response.response
+    assert next(chunks) == b": connected\n\n"
+
+    assert _alert_ids([next(chunks).decode()]) == [second]
+    response.close()
+
+
+def test_status_timestamp_backfill(db):
+    db.set_document("drivers", "with-events", {"events": [
+        {"timeStamp": "2024-01-15T10:30:00Z", "date": "2024-01-15"},
+        {"timeStamp": "10:30 AM", "date": "March 2, 2024"}]})
+    db.set_document("drivers", "own-time", {"timeStamp": "2024-02-01T08:00:00Z", "date": "2024-02-01"})
+    db.set_document("drivers", "undated", {"timeStamp": "", "date": ""})
+    already = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    db.set_document("drivers", "done", {"statusUpdatedAt": already})
+
+    assert backfill_status_timestamps(db, dry_run=True) == {"scanned": 4, "updated": 3, "undated": 1}
+    assert db.get_document("drivers", "undated").get("statusUpdatedAt") is None
+    backfill_status_timestamps(db)
+
+    assert db.get_document("drivers", "with-events")["statusUpdatedAt"] == datetime(2024, 3, 2, 10, 30, tzinfo=timezone.utc)
+    assert db.get_document("drivers", "own-time")["statusUpdatedAt"] == datetime(2024, 2, 1, 8, 0, tzinfo=timezone.utc)
+    assert db.get_document("drivers", "undated")["statusUpdatedAt"] == datetime.fromtimestamp(0, timezone.utc)
+    assert db.get_document("drivers", "done")["statusUpdatedAt"] == already
+    assert backfill_status_timestamps(db)["updated"] == 0
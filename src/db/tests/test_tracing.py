@@ -0,0 +1,41 @@
+import json
+import Tracing
+from Tracing import TRACE_REQUEST_HEADER, TRACE_RESPONSE_HEADER, RequestTrace
+
+
+def test_repeated_reads_are_flagged_as_duplicates():
+    trace = RequestTrace("GET", "/drivers/d1")
+    trace.record("read", "drivers", "d1", 0.001, {"name": "Ann"}, None)
+    trace.record("query", "events", "driverId==d1", 0.002, [], None)
+    trace.record("read", "drivers", "d1", 0.001, {"name": "Ann"}, None)
+
+    summary = trace.summary()
+    assert summary["ops"] == 3
+    assert summary["sequence"] == ["read:drivers/d1", "query:events/driverId==d1", "read:drivers/d1"]
+    assert summary["duplicateReads"] == {"drivers/d1": 2}
+    assert trace.to_map()["operations"][2]["duplicate"] is True
+
+
+def test_failed_operations_keep_their_error():
+    trace = RequestTrace("GET", "/x")
+    trace.record("write", "drivers", "d1", 0.01, None, RuntimeError("boom"))
+    assert trace.to_map()["operations"][0]["error"] == "boom"
+
+
+def test_debug_header_is_ignored_unless_enabled(services, user_id):
+    driver_id = services.create_driver(user_id)
+    response = services.drivers.get(f"/drivers/{driver_id}?userId={user_id}", headers={TRACE_REQUEST_HEADER: "1"})
+    assert TRACE_RESPONSE_HEADER not in response.headers
+
+
+def test_debug_header_returns_the_storage_trace(services, user_id, monkeypatch):
+    monkeypatch.setattr(Tracing, "TRACE_HEADER_ENABLED", True)
+    driver_id = services.create_driver(user_id)
+
+    response = services.drivers.get(f"/drivers/{driver_id}?userId={user_id}", headers={TRACE_REQUEST_HEADER: "1"})
+
+    assert response.status_code == 200
+    summary = json.loads(response.headers[TRACE_RESPONSE_HEADER])
+    assert f"read:drivers/{driver_id}" in summary["sequence"]
+    assert summary["ops"] == len(summary["sequence"])
+    assert Tracing.current_trace() is None
@@ -0,0 +1,113 @@
+import pytest
+import WriteBehind
+from Resilience import StorageUnavailable
+from WriteBehind import WriteBehindBuffer
+
+
+@pytest.fixture
+def buffer(db):
+    """A buffer that only writes when flushed by the test."""
+    for doc_id in ("a", "b"):
+        db.set_document("drivers", doc_id, {"heartRate": 0, "status": "Stable"})
+    return WriteBehindBuffer(db, "drivers", flush_interval=3600)
+
+
+def test_updates_are_coalesced_into_one_write(db, buffer):
+    writes = []
+    real = db.batch_write
+    db.batch_write = lambda operations: writes.append(operations) or real(operations)
+    for value in (70, 75, 80):
+        buffer.put("a", {"heartRate": value})
+    buffer.put("b", {"heartRate": 60})
+
+    assert db.get_document("drivers", "a")["heartRate"] == 0
+    assert buffer.overlay("a", db.get_document("drivers", "a"))["heartRate"] == 80
+    assert buffer.flush() == 2
+
+    assert len(writes) == 1
+    assert db.get_document("drivers", "a")["heartRate"] == 80
+    assert len(buffer) == 0 and buffer.pending("a") == {}
+
+
+def test_zero_interval_writes_through(db):
+    db.set_document("drivers", "a", {"heartRate": 0})
+    WriteBehindBuffer(db, "drivers", flush_interval=0).put("a", {"heartRate": 90})
+
+    assert db.get_document("drivers", "a")["heartRate"] == 90
+
+
+def test_take_and_discard(buffer):
+    buffer.put("a", {"heartRate": 70, "vehicleSpeed": 50})
+    buffer.discard("a", ["vehicleSpeed"])
+
+    assert buffer.take("a") == {"heartRate": 70}
+    buffer.put("b", {"heartRate": 70})
+    buffer.discard("b", ["heartRate"])
+    assert len(buffer) == 0
+
+
+def test_batches_are_split_at_the_limit(db, buffer, monkeypatch):
+    monkeypatch.setattr(WriteBehind, "BATCH_LIMIT", 2)
+    sizes = []
+    real = db.batch_write
+    db.batch_write = lambda operations: sizes.append(len(operations)) or real(operations)
+    for n in range(5):
+        db.set_document("drivers", f"d{n}", {})
+        buffer.put(f"d{n}", {"heartRate": n})
+
+    assert buffer.flush() == 5
+    assert sizes == [2, 2, 1]
+
+
+def test_deleted_documents_are_dropped(db, buffer):
+    buffer.put("a", {"heartRate": 70})
+    buffer.put("b", {"heartRate": 80})
+    db.delete_document("drivers", "a")
+
+    assert buffer.flush() == 1
+    assert db.get_document("drivers", "b")["heartRate"] == 80
+    assert db.get_document("drivers", "a") == {}
+    assert len(buffer) == 0
+
+
+def test_unavailable_storage_requeues_without_reverting_newer_values(db, buffer):
+    buffer.put("a", {"heartRate": 70, "vehicleSpeed": 50})
+    real = db.batch_write
+
+    def unavailable(operations):
+        buffer.put("a", {"heartRate": 75})      # arrives while the flush is failing
+        raise StorageUnavailable("down")
+
+    db.batch_write = unavailable
+    assert buffer.flush() == 0
+    assert buffer.pending("a") == {"heartRate": 75, "vehicleSpeed": 50}
+
+    db.batch_write = real
+    assert buffer.flush() == 1
+    assert db.get_document("drivers", "a")["heartRate"] == 75
+
+
+def test_related_operations_are_committed_with_the_update(db):
+    db.set_document("drivers", "a", {})
+    buffer = WriteBehindBuffer(db, "drivers", flush_interval=3600, related_operations=lambda doc_id, updates, user_id: [
+        ("merge", "dashboards", user_id, {"cards": {doc_id: updates}})])
+    buffer.put("a", {"heartRate": 70}, "user-1")
+    buffer.flush()
+
+    assert db.get_document("dashboards", "user-1") == {"cards": {"a": {"heartRate": 70}}}
+
+
+def test_live_vitals_are_served_before_they_are_written(services, user_id, monkeypatch):
+    live_writes = services.drivers_module.live_writes
+    monkeypatch.setattr(live_writes, "_flush_interval", 3600)
+    driver_id = services.create_driver(user_id)
+
+    response = services.drivers.put(f"/drivers/{driver_id}",
+                                    json={"fieldToChange": "vehicleSpeed", "newValue": 88, "userId": user_id})
+
+    assert response.status_code == 200
+    assert services.db.get_document("drivers", driver_id)["vehicleSpeed"] == 0
+    served = services.drivers.get(f"/drivers/{driver_id}?userId={user_id}").get_json()["driver"]
+    assert served["vehicleSpeed"] == 88
+    live_writes.flush()
+    assert services.db.get_document("drivers", driver_id)["vehicleSpeed"] == 88